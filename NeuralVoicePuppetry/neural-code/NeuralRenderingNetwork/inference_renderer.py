@@ -68,7 +68,13 @@ class InferenceManager:
 
     def get_codedict(self, frame_id):
 
-        codedict = torch.load(os.path.join(self.opt.dataroot, 'DECA_codedicts', f'codedict_{frame_id}.pt'))
+        data = self.dataset_target.data
+        if 'codedict' not in data:
+            # Targets tracked before the codes were written into their h5 file
+            return torch.load(os.path.join(self.opt.dataroot, 'DECA_codedicts', f'codedict_{frame_id}.pt'))
+
+        codedict = {key: torch.from_numpy(data['codedict'][key][frame_id][None]).cuda() for key in data['codedict'].keys()}
+        codedict['images'] = torch.from_numpy(data['frame'][frame_id][None].astype(np.float32) / 255.).permute(0, 3, 1, 2).cuda()
 
         return codedict
 
@@ -136,7 +142,7 @@ class InferenceManager:
 
         if self.opt.deca_details:
             uv, deca_details = self.deca.render_uv_details(codedict, exp, new_pose)
-            mask = self.deca.render_mask(uv)
+            mask = self.deca.render_mask(uv)[0]
             mask = self.preprocess_mask(mask.cpu().detach().numpy())
             uv = self.preprocess_uv(uv[0].cpu().numpy())
             deca_details = self.preprocess_deca_details(deca_details[0].permute(1, 2, 0).cpu().detach().numpy())
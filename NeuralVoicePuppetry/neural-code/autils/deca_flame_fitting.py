@@ -39,10 +39,10 @@ def warp_back(image, oldimage, tform):
 
 
 class DECA_tracker:
-    def __init__(self, video_path, target_dir=None):
+    def __init__(self, video_path, target_dir=None, detector_device='cuda'):
 
         # load test images
-        self.testdata = datasets.TestData(video_path, iscrop=True, face_detector='fan', target_dir=target_dir)
+        self.testdata = datasets.TestData(video_path, iscrop=True, face_detector='fan', target_dir=target_dir, detector_device=detector_device)
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
         # run DECA
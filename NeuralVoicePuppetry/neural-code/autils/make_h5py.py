@@ -19,6 +19,19 @@ def remove_folders(folders):
             pass
     return
 
+def add_frame_dataset(f, name, dataset_size, shape, load):
+    """ Adds the per-frame files read by load(i) as dataset name, unless the h5 file already contains it """
+    if name in f:
+        return
+
+    try:
+        f.create_dataset(name, (dataset_size,) + shape)
+        for i in tqdm(range(dataset_size)):
+            f[name][i] = load(i)
+
+    except FileNotFoundError:
+        pass
+
 def create_h5py_dataset(target_dir, clean=False):
 
     ds_path = os.path.join(target_dir, 'audio_feature')
@@ -28,16 +41,18 @@ def create_h5py_dataset(target_dir, clean=False):
     mask_path = os.path.join(target_dir, 'mask_mouth')
     deca_details_path = os.path.join(target_dir, 'deca_details')
 
+    # The tracking writes its datasets directly into the h5 file, only the missing datasets are added from per-frame files
     h5py_out_file = os.path.join(target_dir, f'{target_dir.split("/")[-1]}.h5')
-    if os.path.isfile(h5py_out_file):
+    f = h5py.File(h5py_out_file, 'a')
+
+    if "dsf" in f:
         print('H5py file already exists.')
+        f.close()
         if clean:
             folders = [ds_path, expr_path, frames_path, uv_path, mask_path, deca_details_path]
             remove_folders(folders)
         return
 
-    f = h5py.File(h5py_out_file, 'w')
-
     dataset_size = len(os.listdir(ds_path)) - 1
     print(f'Dataset size: {dataset_size}')
     
@@ -50,56 +65,22 @@ def create_h5py_dataset(target_dir, clean=False):
     grp = f.create_dataset("dsf", dsf_data.shape, data=dsf_data)
 
     # Load expression data
-    try:
-        ep_data = []
-        for i in tqdm(range(dataset_size)):
-            ep_data.append(np.load(os.path.join(expr_path, f'expr_{i}.npy')))
-
-        ep_data = np.array(ep_data)
-        grp = f.create_dataset("ep", ep_data.shape, data=ep_data)
-
-    except FileNotFoundError:
-        pass
-
-    try:
-        frame_data = []
-        grp = f.create_dataset("frame", (dataset_size, 224, 224, 3))
-        for i in tqdm(range(dataset_size)):
-            im = np.asarray(Image.open(os.path.join(frames_path, '%04d.jpg' % i)))
-            f["frame"][i] = im
-
-    except FileNotFoundError:
-        pass
-
-    try:
-        uv_data = []
-        grp = f.create_dataset("uv", (dataset_size, 224, 224, 2))
-        for i in tqdm(range(dataset_size)):
-            im = np.asarray(np.load(os.path.join(uv_path, f'uv_{i}.npy')))
-            f["uv"][i] = im
-
-    except FileNotFoundError:
-        pass
-
-    try:
-        mask_data = []
-        grp = f.create_dataset("mask", (dataset_size, 224, 224))
-        for i in tqdm(range(dataset_size)):
-            im = np.asarray(np.load(os.path.join(mask_path, f'mask_{i}.npy')))
-            f["mask"][i] = im
+    if "ep" not in f:
+        try:
+            ep_data = []
+            for i in tqdm(range(dataset_size)):
+                ep_data.append(np.load(os.path.join(expr_path, f'expr_{i}.npy')))
 
-    except FileNotFoundError:
-        pass
+            ep_data = np.array(ep_data)
+            grp = f.create_dataset("ep", ep_data.shape, data=ep_data)
 
-    try:
-        deca_details_data = []
-        grp = f.create_dataset("deca_details", (dataset_size, 224, 224, 3))
-        for i in tqdm(range(dataset_size)):
-            im = np.asarray(np.load(os.path.join(deca_details_path, f'deca_details_{i}.npy')))
-            f["deca_details"][i] = im
+        except FileNotFoundError:
+            pass
 
-    except FileNotFoundError:
-        pass
+    add_frame_dataset(f, "frame", dataset_size, (224, 224, 3), lambda i: np.asarray(Image.open(os.path.join(frames_path, '%04d.jpg' % i))))
+    add_frame_dataset(f, "uv", dataset_size, (224, 224, 2), lambda i: np.load(os.path.join(uv_path, f'uv_{i}.npy')))
+    add_frame_dataset(f, "mask", dataset_size, (224, 224), lambda i: np.load(os.path.join(mask_path, f'mask_{i}.npy')))
+    add_frame_dataset(f, "deca_details", dataset_size, (224, 224, 3), lambda i: np.load(os.path.join(deca_details_path, f'deca_details_{i}.npy')))
 
     f.close()
 
@@ -84,6 +84,8 @@ class PreprocessingOptions(Options):
         parser.add_argument('--skip_h5py', action='store_true', help='True to skip h5py creation')
         parser.add_argument('--target_fps', type=int, default=25, help='Fps of target video')
         parser.add_argument('--clean', action='store_true', help='True to clean all datset folders and leave only h5py')
+        parser.add_argument('--deca_batch_size', type=int, default=32, help='Frames encoded at once by the DECA tracking')
+        parser.add_argument('--deca_workers', type=int, default=4, help='DataLoader processes cropping the faces for the DECA tracking, 0 crops in the main process')
 
         return parser
 
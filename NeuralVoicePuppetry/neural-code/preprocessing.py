@@ -4,7 +4,6 @@ import os
 import numpy as np
 import h5py
 import torch
-from PIL import Image
 from tqdm import tqdm
 
 from autils.make_h5py import create_h5py_dataset
@@ -44,7 +43,14 @@ def deepspeech_preprocessing(name, target_dir, folder_videos, video_name, target
     from autils.deepspeech_features import extract_ds
     print(f'\n\nExtracting DeepSpeech features for {name}..\n\n')
 
-    if not os.path.isfile(os.path.join(target_dir, target_dir.split("/")[-1] + '.h5')):
+    # The h5 file may already contain the tracking, but not yet the features
+    h5_path = os.path.join(target_dir, target_dir.split("/")[-1] + '.h5')
+    done = False
+    if os.path.isfile(h5_path):
+        with h5py.File(h5_path, 'r') as data:
+            done = "dsf" in data.keys()
+
+    if not done:
         extract_ds(folder_videos=folder_videos,
                    file_id=video_name.split("/")[-1][:-4],
                    target_base=target_base,
@@ -56,93 +62,83 @@ def deepspeech_preprocessing(name, target_dir, folder_videos, video_name, target
         print('Already done.')
 
 
-def video_tracking(tracker, target_dir):
-
-    exp_dir = os.path.join(target_dir, 'expressions')
-    os.makedirs(exp_dir, exist_ok=True)
+def collate_crops(items):
+    """ Collates the face crops of TestData items & the parameters of their crop transforms, dropping the full resolution images """
+    return torch.stack([item['image'] for item in items]), np.stack([item['tform'].params for item in items])
 
-    h5_path = os.path.join(target_dir, target_dir.split("/")[-1] + '.h5')
-    if os.path.isfile(h5_path):
-        data = h5py.File(h5_path, 'r')
-        if "ep" in data.keys():
-            print('Already done.')
-            return
 
-    codedict_dir = os.path.join(target_dir, 'DECA_codedicts')
-    os.makedirs(codedict_dir, exist_ok=True)
+def write_frames(data, name, start, values, num_frames, dtype=np.float32):
+    """ Writes the values of the frames from start on into the dataset name of the h5 file, which is created on the first batch """
+    if name not in data:
+        data.create_dataset(name, (num_frames,) + values.shape[1:], dtype=dtype)
 
-    uv_dir = os.path.join(target_dir, 'uv')
-    os.makedirs(uv_dir, exist_ok=True)
+    data[name][start:start + len(values)] = values
 
-    frames_dir = os.path.join(target_dir, 'frames')
-    os.makedirs(frames_dir, exist_ok=True)
 
-    deca_details_dir = os.path.join(target_dir, 'deca_details')
-    os.makedirs(deca_details_dir, exist_ok=True)
+def video_tracking(tracker, target_dir, batch_size=32, num_workers=4):
 
-    mask_dir = os.path.join(target_dir, 'mask_mouth')
-    os.makedirs(mask_dir, exist_ok=True)
+    h5_path = os.path.join(target_dir, target_dir.split("/")[-1] + '.h5')
+    if os.path.isfile(h5_path):
+        with h5py.File(h5_path, 'r') as data:
+            if "ep" in data.keys():
+                print('Already done.')
+                return
 
     tforms_file = os.path.join(target_dir, 'tform.npy')
 
-    expressions = []
-    tforms = []
+    num_frames = len(tracker.testdata)
+    loader = torch.utils.data.DataLoader(tracker.testdata, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_crops,
+                                         pin_memory=True)
 
-    # Load video
-    for i in tqdm(range(len(tracker.testdata))):
-        images = tracker.testdata[i]['image'].to(tracker.device)[None, ...]
-        tform = tracker.testdata[i]['tform']
-        tform = np.array(tform.params)
-        # og_image = tracker.testdata[i]['original_image'].cpu()
-        name = tracker.testdata[i]['imagename']
+    expressions = np.empty((num_frames, 53), dtype=np.float32)
+    tforms = np.empty((num_frames, 3, 3))
 
-        # save image and tfrom
-        to_save = images[0].permute(1, 2, 0).cpu().numpy()
-        to_save = to_save * 255.
-        to_save = to_save.astype(np.uint8)
+    # The tracking is written in bulk into the h5 file of the target, "ep" is written last & marks it as complete
+    with h5py.File(h5_path, 'a') as data:
+        for name in ['frame', 'uv', 'mask', 'deca_details', 'codedict']:
+            if name in data:
+                del data[name]  # Left by an interrupted tracking
 
-        filename = os.path.join(frames_dir, '%04d.jpg' % i)
-        img = Image.fromarray(to_save)
-        img.save(filename)
+        start = 0
+        for images, tform in tqdm(loader):
+            end = start + len(images)
+            images = images.to(tracker.device, non_blocking=True)
 
-        tforms.append(tform)
+            # save crops and tforms
+            to_save = images.permute(0, 2, 3, 1).cpu().numpy()
+            to_save = to_save * 255.
+            write_frames(data, 'frame', start, to_save.astype(np.uint8), num_frames, dtype=np.uint8)
 
-        # call deca
-        codedict, opdict, mask = tracker(images)
+            tforms[start:end] = tform
 
-        # Save codedict
-        pt_file = os.path.join(codedict_dir, f'codedict_{i}.pt')
-        torch.save(codedict, pt_file)
+            # call deca
+            codedict, opdict, mask = tracker(images)
 
-        # Save expressions
-        expression_params = codedict['exp'].cpu().numpy()[0]
-        pose_params = codedict['pose'].cpu().numpy()[0, 3:]
-        new_expr = np.concatenate((expression_params, pose_params), axis=0)
+            # Save codedict, its images are the saved crops
+            for key, code in codedict.items():
+                if key != 'images':
+                    write_frames(data, 'codedict/' + key, start, code.cpu().numpy(), num_frames)
 
-        exp_file = os.path.join(exp_dir, f'expr_{i}.npy')
-        np.save(exp_file, new_expr)
+            # Save expressions
+            expression_params = codedict['exp'].cpu().numpy()
+            pose_params = codedict['pose'].cpu().numpy()[:, 3:]
+            expressions[start:end] = np.concatenate((expression_params, pose_params), axis=1)
 
-        # Save uv
-        uv_img = opdict['grid'].cpu()[0]
-        npy_file = os.path.join(uv_dir, f'uv_{i}.npy')
-        np.save(npy_file, uv_img)
+            # Save uv, mask and deca details
+            write_frames(data, 'uv', start, opdict['grid'].cpu().numpy(), num_frames)
+            write_frames(data, 'mask', start, mask.cpu().numpy(), num_frames)
+            write_frames(data, 'deca_details', start, opdict['detail_normal_images'].permute(0, 2, 3, 1).cpu().numpy(), num_frames)
 
-        # Save mask
-        mask_img = mask.cpu()
-        npy_file = os.path.join(mask_dir, f'mask_{i}.npy')
-        np.save(npy_file, mask_img)
+            start = end
 
-        # Save deca details
-        deca_details_img = opdict['detail_normal_images'][0].permute(1, 2, 0).cpu().numpy()
-        npy_file = os.path.join(deca_details_dir, f'deca_details_{i}.npy')
-        np.save(npy_file, deca_details_img)
+        data.create_dataset("ep", expressions.shape, data=expressions)
 
-    tforms = np.array(tforms)
     print(tforms.shape)
     np.save(tforms_file, tforms)
 
 
-def preprocess_video(name, folder_videos, target_base, video_name, preprocess_ds, preprocess_tracking, skip_h5py, type, target_fps, clean):
+def preprocess_video(name, folder_videos, target_base, video_name, preprocess_ds, preprocess_tracking, skip_h5py, type, target_fps, clean,
+                     deca_batch_size=32, deca_workers=4):
     print('Video name: ', video_name)
     target_dir = os.path.join(target_base, name)
     print('target_dir: ', target_dir)
@@ -160,14 +156,15 @@ def preprocess_video(name, folder_videos, target_base, video_name, preprocess_ds
         from autils.deca_flame_fitting import DECA_tracker
 
         print(f'\n\nExtracting Tracking information for {name}..\n\n')
+        detector_device = 'cpu' if deca_workers > 0 else 'cuda'  # The DataLoader workers crop the faces
         if os.path.isdir(frames_folder):
 
-            tracker = DECA_tracker(frames_folder)
+            tracker = DECA_tracker(frames_folder, detector_device=detector_device)
 
         else:
-            tracker = DECA_tracker(folder_videos + '/' + target_file_name + '.mp4', target_dir=frames_folder)
+            tracker = DECA_tracker(folder_videos + '/' + target_file_name + '.mp4', target_dir=frames_folder, detector_device=detector_device)
 
-        video_tracking(tracker, target_dir)
+        video_tracking(tracker, target_dir, batch_size=deca_batch_size, num_workers=deca_workers)
 
     if skip_h5py:
         return
@@ -206,4 +203,5 @@ if __name__ == '__main__':
 
     else:
         preprocess_video(file_name, folder_videos, target_base, full_path,
-                         preprocess_ds, preprocess_tracking, skip_h5py, 'video', target_fps, clean)
+                         preprocess_ds, preprocess_tracking, skip_h5py, 'video', target_fps, clean,
+                         deca_batch_size=opt.deca_batch_size, deca_workers=opt.deca_workers)
@@ -70,9 +70,10 @@ def video2sequence_lossless(video_path, target_dir):
 
 
 class TestData(Dataset):
-    def __init__(self, testpath, iscrop=True, crop_size=224, scale=1.25, face_detector='mtcnn', target_dir=None):
+    def __init__(self, testpath, iscrop=True, crop_size=224, scale=1.25, face_detector='mtcnn', target_dir=None, detector_device='cuda'):
         '''
             testpath: folder, imagepath_list, image path, video path
+            detector_device: device of the face detector, which is only loaded once an image needs it. Use cpu within DataLoader workers
         '''
         print('testpath: ', testpath)
         if isinstance(testpath, list):
@@ -92,13 +93,19 @@ class TestData(Dataset):
         self.scale = scale
         self.iscrop = iscrop
         self.resolution_inp = crop_size
-        if face_detector == 'fan':
-            self.face_detector = detectors.FAN()
-        # elif face_detector == 'mtcnn':
-        #     self.face_detector = detectors.MTCNN()
-        else:
+        if face_detector not in ['fan']:
             print(f'please check the detector: {face_detector}')
             exit()
+        self.detector_device = detector_device
+        self._face_detector = None
+
+    @property
+    def face_detector(self):
+        if self._face_detector is None:
+            self._face_detector = detectors.FAN(device=self.detector_device)
+        # elif face_detector == 'mtcnn':
+        #     self._face_detector = detectors.MTCNN()
+        return self._face_detector
 
     def __len__(self):
         return len(self.imagepath_list)
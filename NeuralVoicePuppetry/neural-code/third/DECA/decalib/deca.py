@@ -415,14 +415,14 @@ class DECA(object):
 
         trans = transforms.ToTensor()
         tmp = trans(image)
-        image_tensor = trans(image).cuda().unsqueeze(0)
+        image_tensor = trans(image).cuda().unsqueeze(0).expand(grid.shape[0], -1, -1, -1)
         mask_1 = (grid[:, :, :, 0:1] != 0.0) & (grid[:, :, :, 1:2] != 0.0)
         mask_1 = mask_1.permute(0, 3, 1, 2)
 
         mask = F.grid_sample(image_tensor, grid, align_corners=False, padding_mode='zeros')
         mask = mask_1 * mask
 
-        return mask[0,0,:,:]
+        return mask[:,0,:,:]
 
     def visualize(self, visdict, size=None):
         grids = {}
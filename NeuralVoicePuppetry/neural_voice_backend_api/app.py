@@ -4,15 +4,16 @@
 import logging
 from enum import Enum
 from http import HTTPStatus
-from typing import Union, List
+from typing import Union, List, Optional
 
 from fastapi import UploadFile, HTTPException, Query, Depends
 from fastapi.responses import FileResponse
 from mtc_api_utils.api import BaseApi
 from mtc_api_utils.api_types import FirebaseUser
 from mtc_api_utils.clients.firebase_client import firebase_user_auth
+from starlette.concurrency import run_in_threadpool
 
-from avatar_backend_api.api_types import ApiRoute, AvatarModelRequest
+from avatar_backend_api.api_types import ApiRoute, AvatarModel, BackendQueueStatus, AvatarModelRequest
 from avatar_backend_api.background_tools.inference_queue import InferenceQueueTask
 from avatar_backend_api.clients.io_client import IoClient, IoClientException
 from avatar_backend_api.models.mock_avatar_model import MockAvatarModel
@@ -32,6 +33,10 @@ inference_queue = NeuralVoiceInferenceQueue(
     io_client=io_client,
     audio_input_dir=NeuralVoiceConfig.audio_input_dir,
     video_output_dir=NeuralVoiceConfig.video_output_dir,
+    avatar_model=AvatarModel.neural_voice,
+    avatar_api_url=NeuralVoiceConfig.avatar_api_url,
+    num_workers=NeuralVoiceConfig.inference_workers,
+    journal_dir=NeuralVoiceConfig.queue_journal_dir,
 )
 
 app = BaseApi(is_ready=neural_voice_model.is_ready, config=NeuralVoiceConfig)
@@ -87,9 +92,15 @@ async def get_video(video_id: str = Query(alias="videoId")):
 async def post_audio(
         audio: UploadFile,
         request_metadata: AvatarModelRequest = Depends(),
+        user_email: Optional[str] = Query(alias="userEmail", default=None),
+        priority: int = Query(default=0),
 ) -> AvatarModelRequest:
     print(f"Processing {request_metadata.video_id}")
 
+    if inference_queue.queue.contains(video_id=request_metadata.video_id):
+        print(f"Ignoring duplicate request for video_id={request_metadata.video_id}")
+        return request_metadata
+
     if not request_metadata.video_id:
         print(f"Creating {request_metadata.video_id=}")
         request_metadata.video_id = audio.filename
@@ -99,12 +110,24 @@ async def post_audio(
     inference_queue.add_task(
         task=InferenceQueueTask(
             request=request_metadata,
+            user=FirebaseUser(email=user_email, roles=[]) if user_email else None,
+            priority=priority,
         ),
     )
 
     return request_metadata
 
 
+@app.get(
+    path=ApiRoute.queue_status.value,
+    response_model=BackendQueueStatus,
+    tags=tags,
+    dependencies=[Depends(user_auth.with_roles(NeuralVoiceConfig.required_roles))],
+)
+async def queue_status() -> BackendQueueStatus:
+    return inference_queue.status()
+
+
 @app.delete(
     path=ApiRoute.video.value,
     response_model=str,
@@ -112,9 +135,13 @@ async def post_audio(
     tags=tags,
 )
 async def delete_video(video_id: str = Query(alias="videoId"), user: FirebaseUser = Depends(user_auth)) -> str:
+    # Deleting a video which is still queued or being processed cancels its task
+    if await run_in_threadpool(inference_queue.cancel, video_id=video_id):
+        return f"The task with {video_id=} was cancelled successfully"
+
     try:
         io_client.video.delete_file(video_id=video_id)
-    except FileNotFoundError:
+    except IoClientException:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"No files with {video_id=} found")
 
     return f"The files with {video_id=} were removed successfully"
@@ -22,5 +22,6 @@ class NeuralVoiceConfig(AvatarConfig):
     output_data_path: str = os.path.join(data_base_dir, "output_data")
     features_dir: str = os.path.join(output_data_path, "features")
     video_output_dir: str = os.path.join(output_data_path, "videos")
+    queue_journal_dir: str = os.path.join(data_base_dir, "queue")
     checkpoints_dir: str = os.path.join(output_data_path, "checkpoints")
     mappings_dir = os.path.join(output_data_path, "mappings")
@@ -26,3 +26,14 @@ class NeuralVoiceInferenceQueue(InferenceQueue):
                 filename=f"{task.request.video_id}_to_{task.request.avatar.name}{VIDEO_EXTENSION}",
                 new_filename=task.request.video_id + VIDEO_EXTENSION,
             )
+
+    def cleanup(self, task: InferenceQueueTask) -> None:
+        super().cleanup(task=task)
+
+        # Features extracted from the audio by the first pipeline stage, see full_pipeline_nvp.sh
+        features_path = os.path.join(NeuralVoiceConfig.features_dir, task.request.video_id)
+        shutil.rmtree(path=features_path, ignore_errors=True)
+
+        partial_video_path = os.path.join(NeuralVoiceConfig.video_output_dir, f"{task.request.video_id}_to_{task.request.avatar.name}{VIDEO_EXTENSION}")
+        if os.path.isfile(partial_video_path):
+            os.remove(partial_video_path)
@@ -2,7 +2,6 @@
 # © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
 import glob
 import os
-import subprocess
 from typing import Dict
 
 from avatar_backend_api.api_types import InferenceQueueTask
@@ -44,11 +43,10 @@ class NeuralVoiceModel(AvatarBaseModel):
         """ Takes an audio_name, which represents a filename without extension, and an avatar, runs the inference and returns the path to the resulting outpout video file"""
 
         # Run inference script
-        subprocess.run(
+        self.run_pipeline(
+            task=task,
             args=["bash", "full_pipeline_nvp.sh", task.request.video_id, task.request.avatar.name, NeuralVoiceConfig.data_base_dir],
-            cwd=NeuralVoiceConfig.neural_code_base_dir,  # Working directory from which to run the shell command
-            universal_newlines=True,  # Decode output
-            check=True,  # Throw exception if return code != 0
+            cwd=NeuralVoiceConfig.neural_code_base_dir,
         )
         print(f"Inference completed for {task.request.video_id} - {task.request.avatar.value}")
 
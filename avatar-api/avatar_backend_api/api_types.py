@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import Optional, List, Dict
 from uuid import uuid4
 
 from mtc_api_utils.api_types import ApiType, FirebaseUser
@@ -19,7 +19,11 @@ class ApiRoute(Enum):
     video_ids = f"{video}/ids"
 
     inference = "/api/inference"
+    inference_completed = f"{inference}/completed"
     avatars = "/api/avatars"
+    result_cache_stats = "/api/cache/stats"
+    queue_status = "/api/queue"
+    readiness = "/api/readiness"  # Served by the BaseApi of every model backend
 
     @staticmethod
     def video_url(backend_url: str, video_id: str) -> str:
@@ -30,6 +34,19 @@ class StrEnum(str, Enum):
     value: str
 
 
+# Paginated listings return the cursor of the next page in this header, which is omitted on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# The model backends authenticate their calls to the avatar API with the shared BACKEND_SERVICE_TOKEN in this header
+BACKEND_TOKEN_HEADER = "X-Backend-Token"
+
+
+class VideoStatus(StrEnum):
+    processing = "processing"
+    completed = "completed"
+    cancelled = "cancelled"
+
+
 class BaseAvatar(StrEnum):
     Jennifer_355_9415 = "jennifer"
     Arthur_A2226 = "arthur"
@@ -59,9 +76,36 @@ class AvatarRequest(AvatarModelRequest):
 
 class VideoMetadata(AvatarRequest):
     inference_completed: bool = Field(alias="inferenceCompleted", default=False)
+    cancelled: bool = Field(default=False, description="Set if the video was deleted while it was still being processed")
+    cache_key: Optional[str] = Field(alias="cacheKey", default=None)  # Identifies the video in the result cache
+    estimated_completion_time: Optional[float] = Field(alias="estimatedCompletionTime", default=None, description="Unix timestamp, refreshed while processing")
+
+
+class InferenceCompletedNotification(ApiType):
+    """ Sent by the model backends to the avatar API once the video for video_id is ready to be retrieved """
+    video_id: str = Field(alias="videoId")
+    avatar_model: AvatarModel = Field(alias="avatarModel", example=AvatarModel.motion_gan)
+
+
+class StageTiming(ApiType):
+    """ Rolling statistics of the duration of a single processing stage """
+    samples: int
+    mean_seconds: float = Field(alias="meanSeconds")
+    seconds_per_audio_second: Optional[float] = Field(alias="secondsPerAudioSecond", default=None)
+
+
+class BackendQueueStatus(ApiType):
+    """ Exposed by the model backends, in order to dispatch requests to the least loaded replica and to estimate completion times """
+    ready: bool
+    queue_depth: int = Field(alias="queueDepth", description="Number of tasks which are queued or being processed")
+    warm_avatars: List[str] = Field(alias="warmAvatars", default=[], description="Avatars which have recently been processed by the backend")
+    workers: int = 1
+    stage_timings: Dict[str, StageTiming] = Field(alias="stageTimings", default={})
+    estimated_seconds_remaining: Dict[str, float] = Field(alias="estimatedSecondsRemaining", default={}, description="Maps the video_ids of all tracked tasks to their ETA")
 
 
 @dataclass
 class InferenceQueueTask:
     request: AvatarModelRequest
     user: Optional[FirebaseUser] = None
+    priority: int = 0  # Tasks with a higher priority are processed first
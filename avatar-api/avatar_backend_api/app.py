@@ -1,75 +1,158 @@
+import hmac
 from http import HTTPStatus
-from typing import List, Dict
+from typing import List, Dict, Optional
 from uuid import uuid4
 
+import httpx
 import uvicorn
-from fastapi import UploadFile, Depends, Query, HTTPException
-from mtc_api_utils.api import BaseApi, RequireReadinessDependency
+from fastapi import UploadFile, Depends, Query, HTTPException, Response, Header
+from mtc_api_utils.api import BaseApi
 from mtc_api_utils.api_types import FirebaseUser
 from mtc_api_utils.clients.firebase_client import firebase_user_auth
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import FileResponse
 
-from avatar_backend_api.api_types import ApiRoute, VideoMetadata, AvatarRequest, AvatarModel
+from avatar_backend_api.api_types import ApiRoute, VideoMetadata, AvatarRequest, AvatarModel, InferenceCompletedNotification, Avatar, VideoStatus, NEXT_CURSOR_HEADER, \
+    BACKEND_TOKEN_HEADER
 from avatar_backend_api.background_tools.model_result_poll_worker import ModelResultPollWorker
+from avatar_backend_api.background_tools.readiness_cache import ModelReadinessCache
 from avatar_backend_api.clients.avatar_client import AvatarModelClient
-from avatar_backend_api.clients.db_client import AvatarDbClient
-from avatar_backend_api.clients.io_client import IoClient, IoClientException
+from avatar_backend_api.clients.backend_pool import BackendPool
+from avatar_backend_api.clients.db_client import create_db_client
+from avatar_backend_api.clients.io_client import IoClient, IoClientException, audio_duration_seconds
 from avatar_backend_api.clients.mock_avatar_model_client import MockAvatarModelClient
+from avatar_backend_api.clients.result_cache import ResultCache, ResultCacheStats, hash_audio
 from avatar_backend_api.config import AvatarConfig
 
 AvatarConfig.print_config()
 
 user_auth = firebase_user_auth(config=AvatarConfig)
 
-db_client = AvatarDbClient()
+MOCK_POLL_INTERVAL_SECONDS = 5
+
+db_client = create_db_client()
 io_client = IoClient(user_dir_mode=True)
 
-model_clients: Dict[AvatarModel, AvatarModelClient] = {
-    AvatarModel.neural_voice:
-        AvatarModelClient(backend_url=AvatarConfig.neural_voice_backend_url)
-        if not AvatarConfig.mockBackend
-        else MockAvatarModelClient(backend_url=""),
-    AvatarModel.motion_gan:
-        AvatarModelClient(backend_url=AvatarConfig.motion_gan_backend_url)
-        if not AvatarConfig.mockBackend
-        else MockAvatarModelClient(backend_url=""),
+
+def create_backend_pool(backend_urls: List[str]) -> BackendPool:
+    if AvatarConfig.mockBackend:
+        return BackendPool(replicas=[MockAvatarModelClient(backend_url="")])
+
+    return BackendPool(replicas=[AvatarModelClient(backend_url=backend_url) for backend_url in backend_urls])
+
+
+model_clients: Dict[AvatarModel, BackendPool] = {
+    AvatarModel.neural_voice: create_backend_pool(backend_urls=AvatarConfig.neural_voice_backend_urls),
+    AvatarModel.motion_gan: create_backend_pool(backend_urls=AvatarConfig.motion_gan_backend_urls),
+}
+
+# Identifies the model version which produced a cached video
+checkpoint_versions: Dict[AvatarModel, str] = {
+    AvatarModel.neural_voice: AvatarConfig.neural_voice_checkpoint_version,
+    AvatarModel.motion_gan: AvatarConfig.motion_gan_checkpoint_version,
 }
 
+result_cache: Optional[ResultCache] = ResultCache() if AvatarConfig.result_cache_enabled else None
+
 model_poll_worker = ModelResultPollWorker(
     io_client=io_client,
     db_client=db_client,
     model_clients=model_clients,
+    result_cache=result_cache,
+    # The mocked backends are not able to send completion notifications
+    poll_interval_seconds=AvatarConfig.result_poll_interval_seconds if not AvatarConfig.mockBackend else MOCK_POLL_INTERVAL_SECONDS,
+)
+
+
+# Only the enabled models are taken into account for the readiness of the API
+readiness_cache = ModelReadinessCache(
+    model_clients={model: client for model, client in model_clients.items() if model.value in AvatarConfig.avatar_models},
 )
 
+app = BaseApi(is_ready=readiness_cache.is_ready, config=AvatarConfig, global_readiness_middleware_enabled=False)
+
+
+def require_model_readiness(request_metadata: AvatarRequest = Depends()) -> None:
+    """ Only requires the readiness of the requested model, such that a single unavailable model does not block the others """
+    if not readiness_cache.is_ready(model=request_metadata.avatar_model):
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail=f"The model={request_metadata.avatar_model.value} is currently not available, please try again later",
+        )
 
-def backend_is_ready() -> bool:
-    # Only turn ready if both models are ready
-    for model, client in model_clients.items():
-        if model.value in AvatarConfig.avatar_models:
-            _, is_ready = client.get_readiness()
-            if not is_ready:
-                return False
 
-    return True
+def require_backend_token(backend_token: str = Header(default="", alias=BACKEND_TOKEN_HEADER)) -> None:
+    """ Restricts a route to the model backends, which send the shared BACKEND_SERVICE_TOKEN """
+    if not AvatarConfig.backend_service_token or not hmac.compare_digest(backend_token, AvatarConfig.backend_service_token):
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail=f"This route requires a valid {BACKEND_TOKEN_HEADER} header")
 
 
-app = BaseApi(is_ready=backend_is_ready, config=AvatarConfig, global_readiness_middleware_enabled=False)
+@app.on_event("startup")
+async def start_background_workers() -> None:
+    readiness_cache.start()
+    model_poll_worker.start()
+
+
+@app.on_event("shutdown")
+async def close_model_clients() -> None:
+    await readiness_cache.stop()
+
+    for client in model_clients.values():
+        await client.aclose()
+
+
+class VideoListQuery:
+    """ Query parameters shared by the paginated video listings """
+
+    def __init__(
+            self,
+            limit: int = Query(default=AvatarConfig.max_page_size, ge=1, le=AvatarConfig.max_page_size),
+            cursor: Optional[str] = Query(default=None, description=f"Taken from the {NEXT_CURSOR_HEADER} header of the previous page"),
+            status: Optional[VideoStatus] = Query(default=None),
+            avatar: Optional[Avatar] = Query(default=None),
+            avatar_model: Optional[AvatarModel] = Query(alias="avatarModel", default=None),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.status = status
+        self.avatar = avatar
+        self.avatar_model = avatar_model
+
+    def list_videos_page(self, user: FirebaseUser, response: Response) -> List[VideoMetadata]:
+        videos, next_cursor = db_client.list_videos_page(
+            user=user,
+            limit=self.limit,
+            cursor=self.cursor,
+            inference_completed=None if self.status in (None, VideoStatus.cancelled) else self.status == VideoStatus.completed,
+            cancelled=None if self.status is None else self.status == VideoStatus.cancelled,
+            avatar=None if self.avatar is None else self.avatar.value,
+            avatar_model=self.avatar_model,
+        )
+
+        if next_cursor is not None:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        return videos
 
 
 @app.get(
     path=ApiRoute.video_ids.value,
     response_model=List[str],
 )
-async def list_video_ids(user: FirebaseUser = Depends(user_auth)) -> List[str]:
-    return [path.split("/")[-1].split(".")[0] for path in io_client.video.list_videos(user=user)]
+async def list_video_ids(response: Response, query: VideoListQuery = Depends(), user: FirebaseUser = Depends(user_auth)) -> List[str]:
+    # Only completed videos are listed by default, since only those are available for download
+    if query.status is None:
+        query.status = VideoStatus.completed
+
+    return [video.video_id for video in query.list_videos_page(user=user, response=response)]
 
 
 @app.get(
     path=ApiRoute.list_videos.value,
     response_model=List[VideoMetadata],
 )
-async def list_videos(user: FirebaseUser = Depends(user_auth)) -> List[VideoMetadata]:
-    return db_client.list_videos(user=user)
+async def list_videos(response: Response, query: VideoListQuery = Depends(), user: FirebaseUser = Depends(user_auth)) -> List[VideoMetadata]:
+    return query.list_videos_page(user=user, response=response)
 
 
 @app.get(
@@ -98,7 +181,7 @@ async def get_video(video_id: str = Query(alias="videoId")):  # user: FirebaseUs
     path=ApiRoute.inference.value,
     status_code=HTTPStatus.ACCEPTED,
     response_model=AvatarRequest,
-    dependencies=[Depends(RequireReadinessDependency(base_api=app))],
+    dependencies=[Depends(require_model_readiness)],
 
 )
 async def inference(
@@ -117,19 +200,99 @@ async def inference(
     metadata = request_metadata.to_metadata()
     filename = f"{request_metadata.video_id}.{audio.filename.split('.')[-1]}"
 
-    model_clients[request_metadata.avatar_model].post_audio(audio=(filename, audio.file.read()), metadata=metadata)
+    if result_cache is not None:
+        metadata.cache_key = ResultCache.cache_key(
+            audio_hash=await run_in_threadpool(hash_audio, audio.file),
+            avatar=metadata.avatar.value,
+            avatar_model=metadata.avatar_model,
+            checkpoint_version=checkpoint_versions[metadata.avatar_model],
+        )
+
+        # Linking the cached video would replace the finished video of an existing request with the same video_id
+        if db_client.video_exists(video_id=metadata.video_id, user=user):
+            raise HTTPException(status_code=HTTPStatus.CONFLICT, detail=f"An inference request with id {metadata.video_id} already exists")
+
+        video_path = io_client.video.video_path(video_id=metadata.video_id, user=user)
+        if await run_in_threadpool(result_cache.link_cached_video, key=metadata.cache_key, target_path=video_path):
+            print(f"Serving video_id={metadata.video_id} from the result cache")
+
+            metadata.inference_completed = True
+            try:
+                db_client.insert_video(video_metadata=metadata, user=user)
+            except Exception:
+                io_client.video.delete_file(video_id=metadata.video_id, user=user)
+                raise
+
+            return metadata
+
+    # Raises if the model is at capacity, before anything has been uploaded to the backend
+    backend_pool = model_clients[metadata.avatar_model]
+    replica = backend_pool.select_replica(avatar=metadata.avatar.value)
+
+    audio_seconds = await run_in_threadpool(audio_duration_seconds, audio.file)
+    metadata.estimated_completion_time = backend_pool.estimate_completion_time(replica=replica, audio_seconds=audio_seconds)
+
+    await backend_pool.post_audio(audio=(filename, audio.file), metadata=metadata, user_email=user.email, replica=replica)
     db_client.insert_video(video_metadata=metadata, user=user)
 
     return metadata
 
 
+@app.post(
+    path=ApiRoute.inference_completed.value,
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=str,
+    dependencies=[Depends(require_backend_token)],
+)
+async def inference_completed(notification: InferenceCompletedNotification) -> str:
+    """ Called by the model backends once a video is ready. The notification only triggers the retrieval, the video itself is always fetched from the model backend """
+    if notification.avatar_model not in model_clients:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"Unknown avatar_model={notification.avatar_model.value}")
+
+    model_poll_worker.submit_retrieval(video_id=notification.video_id, avatar_model=notification.avatar_model)
+
+    return f"Scheduled retrieval of video_id={notification.video_id}"
+
+
+@app.get(
+    path=ApiRoute.result_cache_stats.value,
+    response_model=ResultCacheStats,
+    dependencies=[Depends(user_auth)],
+)
+async def result_cache_stats() -> ResultCacheStats:
+    if result_cache is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="The result cache is disabled")
+
+    return result_cache.stats()
+
+
 @app.delete(
     path=ApiRoute.video.value,
     response_model=str,
 )
 async def delete_video(video_id: str = Query(alias="videoId"), user: FirebaseUser = Depends(user_auth)) -> str:
+    video_metadata = db_client.get_video(video_id=video_id, user=user)
+
+    # Deleting a video which is still being processed cancels it on the model backend. The metadata is kept & marked as cancelled,
+    # such that clients are able to tell the cancellation apart from a lost video. Deleting it once more removes it entirely
+    if not video_metadata.inference_completed and not video_metadata.cancelled:
+        try:
+            await model_clients[video_metadata.avatar_model].delete_video(video_id=video_id)
+
+        except (HTTPException, httpx.HTTPError) as e:
+            print(f"Unable to cancel video_id={video_id} on model={video_metadata.avatar_model.value}: {e}")
+
+        video_metadata.cancelled = True
+        video_metadata.estimated_completion_time = None
+        db_client.upsert_video(video_metadata=video_metadata, user=user)
+
+        return f"Successfully cancelled processing of video with video_id={video_id}"
+
     db_client.delete_video(video_id=video_id, user=user)
 
+    if video_metadata.cancelled:
+        return f"Successfully removed cancelled video with video_id={video_id}"
+
     try:
         io_client.video.delete_file(video_id=video_id, user=user)
 
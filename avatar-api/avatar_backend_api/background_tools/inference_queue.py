@@ -1,15 +1,30 @@
+import heapq
 import os
-from queue import SimpleQueue
-from threading import Thread
-from time import sleep
+import shutil
+from collections import OrderedDict
+from functools import partial
+from threading import Thread, Lock
+from time import sleep, time
+from typing import Optional, List, Dict, Tuple, Set
 
-from avatar_backend_api.api_types import InferenceQueueTask
-from avatar_backend_api.clients.io_client import IoClient
+import requests
+
+from avatar_backend_api.api_types import InferenceQueueTask, AvatarModel, ApiRoute, InferenceCompletedNotification, BackendQueueStatus, StageTiming, \
+    BACKEND_TOKEN_HEADER
+from avatar_backend_api.background_tools.stage_statistics import StageStatistics, estimate_task_seconds
+from avatar_backend_api.background_tools.task_queue import InferenceTaskQueue
+from avatar_backend_api.clients.io_client import IoClient, IoClientException
 from avatar_backend_api.config import AvatarConfig
 from avatar_backend_api.models.avatar_base_model import AvatarBaseModel
 
+NOTIFICATION_TIMEOUT_SECONDS = 10
+MODEL_READINESS_POLL_SECONDS = 1
+MAX_WARM_AVATARS = 4  # Number of recently processed avatars reported as warm, such that the API prefers this backend for them
+
 
 class InferenceQueue:
+    """ Processes inference tasks with num_workers worker threads, see InferenceTaskQueue for the order in which tasks are processed """
+
     def __init__(
             self,
             model: AvatarBaseModel,
@@ -17,32 +32,222 @@ class InferenceQueue:
             audio_input_dir: str = AvatarConfig.audio_input_dir,
             video_output_dir: str = AvatarConfig.video_output_dir,
             daemon_worker: bool = True,
+            avatar_model: Optional[AvatarModel] = None,
+            avatar_api_url: Optional[str] = None,
+            backend_service_token: str = AvatarConfig.backend_service_token,
+            num_workers: int = AvatarConfig.inference_workers,
+            journal_dir: Optional[str] = None,
     ):
-        self.queue: SimpleQueue[InferenceQueueTask] = SimpleQueue()
+        # Without a journal_dir, queued tasks are only kept in memory
+        self.queue = InferenceTaskQueue(journal_dir=journal_dir)
 
         self.model = model
         self.io_client = io_client
 
+        # If all are set, the avatar API is notified as soon as a video is ready
+        self.avatar_model = avatar_model
+        self.avatar_api_url = avatar_api_url
+        self.backend_service_token = backend_service_token
+
+        self.stage_statistics = StageStatistics()
+
+        self._warm_avatars: OrderedDict[str, None] = OrderedDict()
+        self._running_tasks: Dict[str, Tuple[float, Optional[float]]] = {}  # Maps video_ids to their start time & audio duration
+        self._cancelled_video_ids: Set[str] = set()  # Running tasks which have been cancelled
+        self._state_lock = Lock()
+
         self.audio_input_dir = audio_input_dir
         self.video_output_dir = video_output_dir
-        self._worker_thread = Thread(target=self._worker, daemon=daemon_worker)
+        self._worker_threads: List[Thread] = [Thread(target=self._worker, daemon=daemon_worker) for _ in range(num_workers)]
 
         os.makedirs(self.audio_input_dir, exist_ok=True)
         os.makedirs(self.video_output_dir, exist_ok=True)
 
-        self._worker_thread.start()
+        for worker_thread in self._worker_threads:
+            worker_thread.start()
 
     def post_processing(self, task: InferenceQueueTask) -> None:
         pass
 
-    def add_task(self, task: InferenceQueueTask) -> None:
-        self.queue.put(task)
+    def cleanup(self, task: InferenceQueueTask) -> None:
+        """ Removes the input audio & any partial outputs of a cancelled task. Subclasses extend this with the outputs of their pipeline stages """
+        user = task.user if self.io_client.user_dir_mode else None
+
+        # Every audio file is stored in a directory of its own, which also holds the audio features extracted by the pipelines
+        shutil.rmtree(path=os.path.join(self.io_client.audio.user_dir(user=user), task.request.video_id), ignore_errors=True)
+
+        try:
+            self.io_client.video.delete_file(video_id=task.request.video_id, user=user)
+        except IoClientException:
+            pass
+
+    def notify_completion(self, task: InferenceQueueTask) -> None:
+        """ Notifies the avatar API that the video is ready. Failures are only logged, since the API regularly polls for missed videos """
+        if not self.avatar_api_url or not self.backend_service_token or self.avatar_model is None:
+            return
+
+        notification = InferenceCompletedNotification(video_id=task.request.video_id, avatar_model=self.avatar_model)
+
+        try:
+            resp = requests.post(
+                url=self.avatar_api_url + ApiRoute.inference_completed.value,
+                json=notification.json_dict,
+                headers={BACKEND_TOKEN_HEADER: self.backend_service_token},
+                timeout=NOTIFICATION_TIMEOUT_SECONDS,
+            )
+            resp.raise_for_status()
+
+        except requests.RequestException as e:
+            print(f"Unable to notify the avatar API about video_id={task.request.video_id}: {e}")
+
+    def add_task(self, task: InferenceQueueTask) -> bool:
+        """ Returns False if the task was ignored, since a task with the same video_id is already queued or being processed """
+        is_added = self.queue.put(task)
+
+        if not is_added:
+            print(f"Ignoring duplicate task for video_id={task.request.video_id}")
+
+        return is_added
+
+    def cancel(self, video_id: str) -> bool:
+        """ Cancels the task with video_id and returns True, or returns False if no such task is queued or being processed.
+
+        Queued tasks are removed right away. Running tasks have their pipeline terminated, after which the worker cleans up their partial outputs
+        and skips the post processing & the completion notification. Blocks until the pipeline has been terminated.
+        """
+        task = self.queue.remove(video_id=video_id)
+
+        if task is not None:
+            print(f"Removed queued task for video_id={video_id}")
+            self.cleanup(task=task)
+            return True
+
+        with self._state_lock:
+            if video_id not in self._running_tasks:
+                return False
+
+            self._cancelled_video_ids.add(video_id)
+
+        self.model.cancel(video_id=video_id)
+
+        return True
+
+    def status(self) -> BackendQueueStatus:
+        with self._state_lock:
+            warm_avatars = list(self._warm_avatars.keys())
+            running_tasks = dict(self._running_tasks)
+
+        stage_timings = self.stage_statistics.timings()
+
+        return BackendQueueStatus(
+            ready=self.model.is_ready(),
+            queue_depth=self.queue.qsize(),
+            warm_avatars=warm_avatars,
+            workers=len(self._worker_threads),
+            stage_timings=stage_timings,
+            estimated_seconds_remaining=self._estimate_seconds_remaining(stage_timings=stage_timings, running_tasks=running_tasks),
+        )
+
+    def _estimate_seconds_remaining(self, stage_timings: Dict[str, StageTiming], running_tasks: Dict[str, Tuple[float, Optional[float]]]) -> Dict[str, float]:
+        """ Simulates the workers processing the queue, starting with the remaining time of the running tasks """
+        mean_task_seconds = estimate_task_seconds(timings=stage_timings)
+        if mean_task_seconds is None:
+            return {}
+
+        now = time()
+        estimates = {
+            video_id: max(estimate_task_seconds(timings=stage_timings, audio_seconds=audio_seconds) - (now - start_time), 0.0)
+            for video_id, (start_time, audio_seconds) in running_tasks.items()
+        }
+
+        # Every entry represents the time at which a worker becomes available
+        available_workers = list(estimates.values()) + [0.0] * max(len(self._worker_threads) - len(estimates), 0)
+        heapq.heapify(available_workers)
+
+        for task in self.queue.pending_tasks():
+            completion = heapq.heappop(available_workers) + mean_task_seconds
+            estimates[task.request.video_id] = completion
+            heapq.heappush(available_workers, completion)
+
+        return estimates
+
+    def _audio_seconds(self, task: InferenceQueueTask) -> Optional[float]:
+        try:
+            return self.io_client.audio.duration_seconds(video_id=task.request.video_id, user=task.user if self.io_client.user_dir_mode else None)
+        except IoClientException:
+            return None
+
+    def _register_running(self, task: InferenceQueueTask) -> None:
+        # The audio duration is only determined afterwards, since reading it requires I/O
+        with self._state_lock:
+            self._running_tasks[task.request.video_id] = (time(), None)
+
+    def _mark_warm(self, avatar: str) -> None:
+        with self._state_lock:
+            self._warm_avatars[avatar] = None
+            self._warm_avatars.move_to_end(avatar)
+
+            while len(self._warm_avatars) > MAX_WARM_AVATARS:
+                self._warm_avatars.popitem(last=False)
+
+    def _is_cancelled(self, video_id: str) -> bool:
+        with self._state_lock:
+            return video_id in self._cancelled_video_ids
+
+    def _cleanup_cancelled(self, task: InferenceQueueTask) -> None:
+        print(f"Inference cancelled for video_id={task.request.video_id}, cleaning up its partial outputs")
+
+        try:
+            self.cleanup(task=task)
+        except Exception as e:
+            print(f"Unable to clean up after the cancelled task for video_id={task.request.video_id}: {e}")
 
     def _worker(self):
+        # The model is only initialized once, hence waiting for it is the only polling required
+        while not self.model.is_ready():
+            sleep(MODEL_READINESS_POLL_SECONDS)
+
         while True:
-            if self.model.is_ready() and not self.queue.empty():
-                task = self.queue.get()
-                self.model.inference(task=task)
-                self.post_processing(task=task)
-            else:
-                sleep(1)
+            # The task is registered as running while the queue is still locked, hence cancel either removes it from the queue or finds it running
+            task = self.queue.get(on_dequeue=self._register_running)
+
+            try:
+                audio_seconds = self._audio_seconds(task=task)
+
+                with self._state_lock:
+                    start_time, _ = self._running_tasks[task.request.video_id]
+                    self._running_tasks[task.request.video_id] = (start_time, audio_seconds)
+
+                if self._is_cancelled(video_id=task.request.video_id):
+                    self._cleanup_cancelled(task=task)
+                    continue
+
+                # Cancelled tasks end early, hence their durations would distort the estimates
+                is_cancelled = partial(self._is_cancelled, video_id=task.request.video_id)
+
+                with self.stage_statistics.measure(stage="inference", audio_seconds=audio_seconds, discard=is_cancelled):
+                    self.model.inference(task=task)
+
+                self._mark_warm(avatar=task.request.avatar.value)
+
+                if self._is_cancelled(video_id=task.request.video_id):
+                    self._cleanup_cancelled(task=task)
+                    continue
+
+                with self.stage_statistics.measure(stage="post_processing", audio_seconds=audio_seconds, discard=is_cancelled):
+                    self.post_processing(task=task)
+
+                self.notify_completion(task=task)
+
+            except Exception as e:
+                if self._is_cancelled(video_id=task.request.video_id):
+                    self._cleanup_cancelled(task=task)
+                else:
+                    print(f"Inference failed for video_id={task.request.video_id}: {e}")
+
+            finally:
+                with self._state_lock:
+                    self._running_tasks.pop(task.request.video_id, None)
+                    self._cancelled_video_ids.discard(task.request.video_id)
+
+                self.queue.task_done(task=task)
@@ -1,54 +1,128 @@
-from threading import Thread
-from time import sleep
-from typing import Dict, Callable
+import asyncio
+from typing import Dict, Callable, Tuple, Optional, Any
 
 from mtc_api_utils.api_types import FirebaseUser
+from starlette.concurrency import run_in_threadpool
 
 from avatar_backend_api.api_types import AvatarModel
-from avatar_backend_api.clients.avatar_client import AvatarModelClient
-from avatar_backend_api.clients.db_client import AvatarDbClient, AvatarDbException
+from avatar_backend_api.clients.backend_pool import ModelClient
+from avatar_backend_api.clients.db_client import BaseAvatarDbClient, AvatarDbException
 from avatar_backend_api.clients.io_client import IoClient
+from avatar_backend_api.clients.result_cache import ResultCache
+from avatar_backend_api.config import AvatarConfig
+
+ETA_UPDATE_THRESHOLD_SECONDS = 30
 
 
 class ModelResultPollWorker:
+    """ Retrieves finished videos from the model backends.
+
+    Model backends notify the API once a video is ready, which results in a call to submit_retrieval. The retrievals are executed concurrently
+    on the event loop, bounded by max_retrieval_workers. Polling the model backends remains as a low frequency fallback, in order to reconcile
+    missed notifications. While polling, the estimated completion times of the videos being processed are refreshed as well. The polling is only started by calling start from within the running event loop, e.g. on app startup.
+    """
 
     def __init__(
             self,
             io_client: IoClient,
-            db_client: AvatarDbClient,
-            model_clients: Dict[AvatarModel, AvatarModelClient],
-            daemon_worker: bool = True,
+            db_client: BaseAvatarDbClient,
+            model_clients: Dict[AvatarModel, ModelClient],
+            poll_interval_seconds: int = AvatarConfig.result_poll_interval_seconds,
+            max_retrieval_workers: int = AvatarConfig.result_retrieval_workers,
+            result_cache: Optional[ResultCache] = None,
     ):
         self.io_client = io_client
         self.model_clients = model_clients
         self.db_client = db_client
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_retrieval_workers = max_retrieval_workers
+        self.result_cache = result_cache
 
-        self._worker_thread = Thread(target=self._worker, daemon=daemon_worker)
-        self._worker_thread.start()
+        # Asyncio primitives are bound to an event loop, hence they are only created once the worker is used within the running loop
+        self._retrieval_semaphore: Optional[asyncio.Semaphore] = None
+        self._pending_retrievals: Dict[Tuple[str, AvatarModel], asyncio.Task] = {}
+        self._worker_task: Optional[asyncio.Task] = None
 
-    def _worker(self):
+    def start(self) -> None:
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def _worker(self):
         """
-        Continuously polls processed videos from model backends, retrieves them and performs cleanup.
+        Periodically polls processed videos from model backends, retrieves them and performs cleanup.
 
         Methods are separated mostly for testing purposes
         """
         while True:
-            self._poll_models(perform_on_available_video=self._retrieve_video_from_model)
-            sleep(5)
+            await self._poll_models(perform_on_available_video=self.submit_retrieval)
+            await asyncio.sleep(self.poll_interval_seconds)
 
-    def _poll_models(self, perform_on_available_video: Callable[[str, AvatarModel], None]):
-        """ GET available videos from Model, then GET video & store video file + metadata in backend API"""
+    def submit_retrieval(self, video_id: str, avatar_model: AvatarModel) -> Optional[asyncio.Task]:
+        """ Schedules the retrieval of a finished video. Returns None if a retrieval for the same video is already pending """
+        key = (video_id, avatar_model)
 
-        for model, client in self.model_clients.items():
-            if client.get_readiness()[1]:
-                video_ids = client.list_video_ids()
-                for video_id in video_ids:
+        if key in self._pending_retrievals:
+            return None
+
+        if self._retrieval_semaphore is None:
+            self._retrieval_semaphore = asyncio.Semaphore(self.max_retrieval_workers)
+
+        task = asyncio.create_task(self._retrieve_pending_video(video_id=video_id, avatar_model=avatar_model))
+        self._pending_retrievals[key] = task
+
+        return task
+
+    async def _retrieve_pending_video(self, video_id: str, avatar_model: AvatarModel) -> None:
+        try:
+            async with self._retrieval_semaphore:
+                await self._retrieve_video_from_model(video_id=video_id, avatar_model=avatar_model)
+
+        except Exception as e:
+            print(f"Unable to retrieve video_id={video_id} from model={avatar_model.value}: {e}")
+
+        finally:
+            self._pending_retrievals.pop((video_id, avatar_model), None)
+
+    async def _poll_models(self, perform_on_available_video: Callable[[str, AvatarModel], Any]):
+        """ GET available videos from all Models concurrently, then perform_on_available_video for every available video """
+
+        async def poll_model(model: AvatarModel, client: ModelClient) -> None:
+            if await client.readiness():
+                video_ids = await client.list_video_ids()
+                if len(video_ids) > 0:
                     print(f"Retrieving the following videos from model={model}: {video_ids}")
+
+                for video_id in video_ids:
                     perform_on_available_video(video_id, model)
 
-    def _retrieve_video_from_model(self, video_id: str, avatar_model: AvatarModel) -> None:
-        status, video_bytes = self.model_clients[avatar_model].get_video(video_id=video_id)
+                self._refresh_estimated_completion_times(estimated_completion_times=await client.estimated_completion_times())
+
+        results = await asyncio.gather(
+            *(poll_model(model=model, client=client) for model, client in self.model_clients.items()),
+            return_exceptions=True,
+        )
 
+        for model, result in zip(self.model_clients.keys(), results):
+            if isinstance(result, Exception):
+                print(f"Polling model={model.value} failed: {result}")
+
+    def _refresh_estimated_completion_times(self, estimated_completion_times: Dict[str, float]) -> None:
+        """ Stores the latest completion estimates of the videos being processed, unless they only changed marginally """
+        for video_id, estimated_completion_time in estimated_completion_times.items():
+            try:
+                user = FirebaseUser(email=self.db_client.get_user_from_id(video_id=video_id), roles=[])
+                video_metadata = self.db_client.get_video(video_id=video_id, user=user)
+
+            except AvatarDbException:
+                continue
+
+            if video_metadata.inference_completed or video_metadata.cancelled:
+                continue
+
+            if video_metadata.estimated_completion_time is None or abs(video_metadata.estimated_completion_time - estimated_completion_time) > ETA_UPDATE_THRESHOLD_SECONDS:
+                video_metadata.estimated_completion_time = estimated_completion_time
+                self.db_client.upsert_video(video_metadata=video_metadata, user=user)
+
+    async def _retrieve_video_from_model(self, video_id: str, avatar_model: AvatarModel) -> None:
         try:
             user = FirebaseUser(
                 email=self.db_client.get_user_from_id(video_id=video_id),
@@ -60,10 +134,35 @@ class ModelResultPollWorker:
             return
 
         video_metadata = self.db_client.get_video(video_id=video_id, user=user)
-        video_metadata.inference_completed = True
 
-        self.io_client.video.save_to_disk(video_bytes=video_bytes, video_id=video_id, user=user)
+        # The backend may have finished the video before the cancellation reached it
+        if video_metadata.cancelled:
+            print(f"Discarding cancelled video_id={video_id} on model={avatar_model.value}")
+            await self.model_clients[avatar_model].delete_video(video_id=video_id)
+            return
+
+        # The video is written to disk while being downloaded
+        async with self.model_clients[avatar_model].stream_video(video_id=video_id) as video_chunks:
+            video_path = await self.io_client.video.save_to_disk_async(video_chunks=video_chunks, video_id=video_id, user=user)
+
+        # The video may have been cancelled or deleted during the download, which must neither be undone nor cached
+        try:
+            video_metadata = self.db_client.get_video(video_id=video_id, user=user)
+
+        except AvatarDbException:
+            video_metadata = None
+
+        if video_metadata is None or video_metadata.cancelled:
+            print(f"Discarding video_id={video_id} on model={avatar_model.value}, which has been cancelled during its retrieval")
+            self.io_client.video.delete_file(video_id=video_id, user=user)
+            await self.model_clients[avatar_model].delete_video(video_id=video_id)
+            return
+
+        video_metadata.inference_completed = True
         self.db_client.upsert_video(video_metadata=video_metadata, user=user)
 
+        if self.result_cache is not None and video_metadata.cache_key is not None:
+            await run_in_threadpool(self.result_cache.store, key=video_metadata.cache_key, video_path=video_path)
+
         print(f"Deleting video from model")
-        self.model_clients[avatar_model].delete_video(video_id=video_id)
+        await self.model_clients[avatar_model].delete_video(video_id=video_id)
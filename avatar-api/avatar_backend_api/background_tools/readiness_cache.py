@@ -0,0 +1,79 @@
+import asyncio
+import random
+from typing import Dict, List, Optional
+
+from avatar_backend_api.api_types import AvatarModel
+from avatar_backend_api.clients.backend_pool import ModelClient
+from avatar_backend_api.config import AvatarConfig
+
+
+class ModelReadinessCache:
+    """ Keeps track of the readiness of every model backend, such that requests never have to wait for a readiness call.
+
+    Every model is refreshed by its own background task on the event loop. Ready backends are checked every refresh_interval_seconds,
+    unhealthy ones with an exponential backoff capped at max_backoff_seconds. All delays are randomized by +- jitter_fraction,
+    in order to avoid synchronized bursts of readiness calls. The refresh is only started by calling start from within the running event loop.
+    """
+
+    def __init__(
+            self,
+            model_clients: Dict[AvatarModel, ModelClient],
+            refresh_interval_seconds: float = AvatarConfig.readiness_refresh_interval_seconds,
+            max_backoff_seconds: float = AvatarConfig.readiness_max_backoff_seconds,
+            jitter_fraction: float = AvatarConfig.readiness_jitter_fraction,
+    ):
+        self.model_clients = model_clients
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.jitter_fraction = jitter_fraction
+
+        # Backends are considered unavailable until their first readiness check succeeded
+        self._readiness: Dict[AvatarModel, bool] = {model: False for model in model_clients}
+        self._failures: Dict[AvatarModel, int] = {model: 0 for model in model_clients}
+        self._refresh_tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._refresh_tasks = [asyncio.create_task(self._refresh_worker(model=model)) for model in self.model_clients]
+
+    async def stop(self) -> None:
+        for task in self._refresh_tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        self._refresh_tasks = []
+
+    def is_ready(self, model: Optional[AvatarModel] = None) -> bool:
+        """ Returns the cached readiness of model, or whether all models are ready if model is None """
+        if model is None:
+            return all(self._readiness.values())
+
+        return self._readiness.get(model, False)
+
+    async def refresh(self, model: AvatarModel) -> bool:
+        try:
+            is_ready = await self.model_clients[model].readiness()
+
+        except Exception as e:
+            print(f"Readiness check of model={model.value} failed: {e}")
+            is_ready = False
+
+        if is_ready != self._readiness[model]:
+            print(f"Model={model.value} is now {'ready' if is_ready else 'unavailable'}")
+
+        self._readiness[model] = is_ready
+        self._failures[model] = 0 if is_ready else self._failures[model] + 1
+
+        return is_ready
+
+    def next_delay(self, model: AvatarModel) -> float:
+        delay = self.refresh_interval_seconds
+
+        if self._failures[model] > 0:
+            delay = min(self.refresh_interval_seconds * 2 ** (self._failures[model] - 1), self.max_backoff_seconds)
+
+        return delay * random.uniform(1 - self.jitter_fraction, 1 + self.jitter_fraction)
+
+    async def _refresh_worker(self, model: AvatarModel) -> None:
+        while True:
+            await self.refresh(model=model)
+            await asyncio.sleep(self.next_delay(model=model))
@@ -0,0 +1,68 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Deque, Dict, Optional, Tuple, Iterator, Callable
+
+from avatar_backend_api.api_types import StageTiming
+from avatar_backend_api.config import AvatarConfig
+
+
+class StageStatistics:
+    """ Thread-safe rolling statistics over the durations of the most recent window_size runs of every processing stage.
+
+    Where the audio duration is known, the stage durations are also related to it, since most stages scale with the number of frames to render.
+    """
+
+    def __init__(self, window_size: int = AvatarConfig.stage_statistics_window):
+        self.window_size = window_size
+
+        self._lock = Lock()
+        self._durations: Dict[str, Deque[Tuple[float, Optional[float]]]] = {}
+
+    def record(self, stage: str, duration_seconds: float, audio_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._durations.setdefault(stage, deque(maxlen=self.window_size)).append((duration_seconds, audio_seconds))
+
+    @contextmanager
+    def measure(self, stage: str, audio_seconds: Optional[float] = None, discard: Optional[Callable[[], bool]] = None) -> Iterator[None]:
+        """ Records the duration of the wrapped block, unless it raises or discard returns True once it has completed, e.g. since it was cancelled """
+        start = perf_counter()
+        yield
+
+        if discard is None or not discard():
+            self.record(stage=stage, duration_seconds=perf_counter() - start, audio_seconds=audio_seconds)
+
+    def timings(self) -> Dict[str, StageTiming]:
+        with self._lock:
+            durations = {stage: list(stage_durations) for stage, stage_durations in self._durations.items()}
+
+        timings = {}
+        for stage, stage_durations in durations.items():
+            with_audio = [(duration, audio_seconds) for duration, audio_seconds in stage_durations if audio_seconds]
+
+            timings[stage] = StageTiming(
+                samples=len(stage_durations),
+                mean_seconds=sum(duration for duration, _ in stage_durations) / len(stage_durations),
+                seconds_per_audio_second=(
+                    sum(duration for duration, _ in with_audio) / sum(audio_seconds for _, audio_seconds in with_audio)
+                    if with_audio else None
+                ),
+            )
+
+        return timings
+
+
+def estimate_task_seconds(timings: Dict[str, StageTiming], audio_seconds: Optional[float] = None) -> Optional[float]:
+    """ Estimates the processing time of a task as the sum of all stage durations, scaled by the audio duration where possible.
+    Returns None if no timings have been recorded yet.
+    """
+    if not timings:
+        return None
+
+    return sum(
+        timing.seconds_per_audio_second * audio_seconds
+        if audio_seconds and timing.seconds_per_audio_second is not None
+        else timing.mean_seconds
+        for timing in timings.values()
+    )
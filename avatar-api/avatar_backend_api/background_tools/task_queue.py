@@ -0,0 +1,208 @@
+import json
+import os
+from collections import OrderedDict, deque
+from itertools import count, zip_longest
+from threading import Condition
+from typing import Deque, Dict, Optional, Set, Any, List, Callable
+
+from mtc_api_utils.api_types import FirebaseUser
+
+from avatar_backend_api.api_types import InferenceQueueTask, AvatarModelRequest
+
+JOURNAL_EXTENSION = ".json"
+
+
+class InferenceTaskQueue:
+    """ Thread-safe priority queue for inference tasks.
+
+    - Tasks with a higher priority are always served first.
+    - Within a priority, users are served round-robin and the tasks of every single user in FIFO order,
+      such that a user submitting many tasks does not starve the others.
+    - A task is tracked from put until either task_done or remove. While tracked, further tasks with the same video_id are rejected.
+    - If journal_dir is set, every tracked task is persisted as a json file, which is removed once the task is no longer tracked.
+      Tasks found in the journal are enqueued again on creation, such that queued work survives restarts.
+    """
+
+    def __init__(self, journal_dir: Optional[str] = None):
+        self.journal_dir = journal_dir
+
+        self._condition = Condition()
+        self._levels: Dict[int, OrderedDict[str, Deque[InferenceQueueTask]]] = {}
+        self._pending_count = 0
+        self._tracked_video_ids: Set[str] = set()
+        self._journal_paths: Dict[str, str] = {}
+        self._sequence = count()
+
+        if self.journal_dir is not None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._restore_journal()
+
+    def put(self, task: InferenceQueueTask) -> bool:
+        """ Enqueues the task and returns True, or returns False if a task with the same video_id is already queued or being processed """
+        with self._condition:
+            if task.request.video_id in self._tracked_video_ids:
+                return False
+
+            self._journal(task=task)
+            self._enqueue(task=task)
+            self._condition.notify()
+
+        return True
+
+    def get(self, timeout: Optional[float] = None, on_dequeue: Optional[Callable[[InferenceQueueTask], None]] = None) -> Optional[InferenceQueueTask]:
+        """ Blocks until a task is available and returns it. Returns None if no task became available within timeout seconds.
+
+        on_dequeue is called with the task before the queue is unlocked, such that callers can claim the task before remove could observe it as missing.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending_count > 0, timeout=timeout):
+                return None
+
+            priority = max(self._levels.keys())
+            users = self._levels[priority]
+
+            user_key, user_tasks = next(iter(users.items()))
+            task = user_tasks.popleft()
+
+            # The user is moved to the back of the line, or removed if it has no more tasks
+            if user_tasks:
+                users.move_to_end(user_key)
+            else:
+                del users[user_key]
+                if not users:
+                    del self._levels[priority]
+
+            self._pending_count -= 1
+
+            if on_dequeue is not None:
+                on_dequeue(task)
+
+            return task
+
+    def task_done(self, task: InferenceQueueTask) -> None:
+        """ Marks a task returned by get as processed, which removes it from the journal """
+        with self._condition:
+            self._untrack(video_id=task.request.video_id)
+
+    def remove(self, video_id: str) -> Optional[InferenceQueueTask]:
+        """ Removes the queued task with video_id and returns it. Returns None if there is no such task, or if it has already been handed to a worker """
+        with self._condition:
+            for priority, users in self._levels.items():
+                for user_key, user_tasks in users.items():
+                    for task in user_tasks:
+                        if task.request.video_id != video_id:
+                            continue
+
+                        user_tasks.remove(task)
+                        if not user_tasks:
+                            del users[user_key]
+                            if not users:
+                                del self._levels[priority]
+
+                        self._pending_count -= 1
+                        self._untrack(video_id=video_id)
+
+                        return task
+
+            return None
+
+    def contains(self, video_id: str) -> bool:
+        """ Returns True if a task with video_id is either queued or being processed """
+        with self._condition:
+            return video_id in self._tracked_video_ids
+
+    def qsize(self) -> int:
+        """ Returns the number of tasks which are either queued or being processed """
+        with self._condition:
+            return len(self._tracked_video_ids)
+
+    def pending(self) -> int:
+        """ Returns the number of queued tasks, which have not yet been handed to a worker """
+        with self._condition:
+            return self._pending_count
+
+    def pending_tasks(self) -> List[InferenceQueueTask]:
+        """ Returns the queued tasks in the order in which get would return them, provided no further tasks are added """
+        with self._condition:
+            ordered_tasks = []
+
+            for priority in sorted(self._levels.keys(), reverse=True):
+                for round_robin_tasks in zip_longest(*self._levels[priority].values()):
+                    ordered_tasks.extend(task for task in round_robin_tasks if task is not None)
+
+            return ordered_tasks
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def _enqueue(self, task: InferenceQueueTask) -> None:
+        user_key = task.user.email if task.user is not None else ""
+
+        self._levels.setdefault(task.priority, OrderedDict()).setdefault(user_key, deque()).append(task)
+        self._tracked_video_ids.add(task.request.video_id)
+        self._pending_count += 1
+
+    def _untrack(self, video_id: str) -> None:
+        self._tracked_video_ids.discard(video_id)
+
+        journal_path = self._journal_paths.pop(video_id, None)
+        if journal_path is not None and os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+    def _journal(self, task: InferenceQueueTask) -> None:
+        if self.journal_dir is None:
+            return
+
+        journal_path = os.path.join(self.journal_dir, f"{next(self._sequence):012d}{JOURNAL_EXTENSION}")
+        tmp_path = journal_path + ".tmp"
+
+        with open(tmp_path, "w") as journal_file:
+            json.dump(_task_to_dict(task=task), journal_file)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        os.replace(tmp_path, journal_path)
+        self._journal_paths[task.request.video_id] = journal_path
+
+    def _restore_journal(self) -> None:
+        # The file names are zero padded sequence numbers, hence sorting them restores the submission order
+        journal_files = sorted(filename for filename in os.listdir(self.journal_dir) if filename.endswith(JOURNAL_EXTENSION))
+
+        for filename in journal_files:
+            journal_path = os.path.join(self.journal_dir, filename)
+
+            try:
+                with open(journal_path, "r") as journal_file:
+                    task = _task_from_dict(json.load(journal_file))
+
+            except (ValueError, KeyError) as e:
+                print(f"Discarding corrupt journal entry {journal_path}: {e}")
+                os.remove(journal_path)
+                continue
+
+            if task.request.video_id in self._tracked_video_ids:
+                os.remove(journal_path)
+                continue
+
+            self._journal_paths[task.request.video_id] = journal_path
+            self._enqueue(task=task)
+
+        if journal_files:
+            self._sequence = count(int(journal_files[-1][:-len(JOURNAL_EXTENSION)]) + 1)
+            print(f"Restored {self._pending_count} queued tasks from {self.journal_dir}")
+
+
+def _task_to_dict(task: InferenceQueueTask) -> Dict[str, Any]:
+    return {
+        "request": task.request.json_dict,
+        "user": task.user.json_dict if task.user is not None else None,
+        "priority": task.priority,
+    }
+
+
+def _task_from_dict(task_dict: Dict[str, Any]) -> InferenceQueueTask:
+    return InferenceQueueTask(
+        request=AvatarModelRequest.parse_obj(task_dict["request"]),
+        user=FirebaseUser.parse_obj(task_dict["user"]) if task_dict["user"] is not None else None,
+        priority=task_dict["priority"],
+    )
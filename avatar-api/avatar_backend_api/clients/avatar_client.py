@@ -1,49 +1,119 @@
-from typing import List, BinaryIO, Tuple, Union
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from time import time
+from typing import List, BinaryIO, Tuple, Union, AsyncIterator, Optional, Dict
 
-import requests
+import httpx
+from mtc_api_utils.api_types import ApiStatus
 from mtc_api_utils.clients.api_client import ApiClient
 
-from avatar_backend_api.api_types import ApiRoute, AvatarModelRequest
+from avatar_backend_api.api_types import ApiRoute, AvatarModelRequest, BackendQueueStatus
+from avatar_backend_api.clients.io_client import CHUNK_SIZE_BYTES
+from avatar_backend_api.config import AvatarConfig
 
 
 class AvatarModelClient(ApiClient):
-    def list_video_ids(self) -> List[str]:
-        resp = requests.get(
-            url=self._backend_url + ApiRoute.video_ids.value,
+    """ Client for the model backends.
+
+    The model requests are sent through an asyncio-native httpx client, which keeps a pool of keep-alive connections to the backend,
+    such that the event loop is never blocked by a slow backend. The synchronous methods inherited from the ApiClient remain available.
+    """
+
+    def __init__(
+            self,
+            backend_url: str,
+            timeout_seconds: float = AvatarConfig.model_client_timeout_seconds,
+            retries: int = AvatarConfig.model_client_retries,
+            max_connections: int = AvatarConfig.model_client_max_connections,
+    ):
+        super().__init__(backend_url=backend_url)
+        self.backend_url = backend_url
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+        self.async_client = httpx.AsyncClient(
+            base_url=backend_url,
+            timeout=httpx.Timeout(timeout_seconds, connect=min(timeout_seconds, 5.0)),
+            limits=limits,
+            # Retries failed connection attempts, which is safe for all requests, since they never reached the backend
+            transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits),
         )
+
+    async def readiness(self) -> bool:
+        try:
+            resp = await self.async_client.get(url=ApiRoute.readiness.value)
+
+        except httpx.HTTPError:
+            return False
+
+        return resp.status_code == HTTPStatus.OK and ApiStatus.parse_obj(resp.json()).readiness
+
+    async def queue_status(self) -> BackendQueueStatus:
+        resp = await self.async_client.get(url=ApiRoute.queue_status.value)
         resp.raise_for_status()
 
-        return resp.json()
+        return BackendQueueStatus.parse_obj(resp.json())
 
-    def get_video(self, video_id: str) -> Tuple[int, bytes]:
-        resp = requests.get(
-            url=self._backend_url + ApiRoute.video.value,
-            params={"videoId": video_id},
+    async def estimated_completion_times(self) -> Dict[str, float]:
+        """ Maps the video_ids of all tasks tracked by the backend to their expected completion timestamp """
+        status = await self.queue_status()
+        now = time()
+
+        return {video_id: now + seconds_remaining for video_id, seconds_remaining in status.estimated_seconds_remaining.items()}
+
+    async def list_video_ids(self) -> List[str]:
+        resp = await self.async_client.get(
+            url=ApiRoute.video_ids.value,
         )
+        resp.raise_for_status()
 
-        if resp.status_code >= 300:
-            resp.raise_for_status()
+        return resp.json()
+
+    @asynccontextmanager
+    async def stream_video(self, video_id: str) -> AsyncIterator[AsyncIterator[bytes]]:
+        """ Yields an iterator over the chunks of the video, which are only downloaded while being consumed """
+        async with self.async_client.stream(
+                method="GET",
+                url=ApiRoute.video.value,
+                params={"videoId": video_id},
+        ) as resp:
+            if resp.status_code >= 300:
+                resp.raise_for_status()
 
-        return resp.status_code, resp.content
+            yield resp.aiter_bytes(chunk_size=CHUNK_SIZE_BYTES)
 
-    def post_audio(self, audio: Union[BinaryIO, Tuple[str, bytes]], metadata: AvatarModelRequest) -> AvatarModelRequest:
-        resp = requests.post(
-            url=self._backend_url + ApiRoute.inference.value,
-            params=metadata.json_dict,
+    async def post_audio(
+            self,
+            audio: Union[BinaryIO, Tuple[str, Union[bytes, BinaryIO]]],
+            metadata: AvatarModelRequest,
+            user_email: Optional[str] = None,
+            priority: int = 0,
+    ) -> AvatarModelRequest:
+        """ The user_email is used by the model backend to schedule the requests of different users fairly """
+        params = {**metadata.json_dict, "priority": priority}
+        if user_email:
+            params["userEmail"] = user_email
+
+        # File objects are streamed in chunks by the multipart encoder, rather than being loaded into memory
+        resp = await self.async_client.post(
+            url=ApiRoute.inference.value,
+            params=params,
             files={"audio": audio},
         )
 
         if resp.status_code >= 300:
-            print(f"resp.reason={resp.reason}")
+            print(f"resp.reason_phrase={resp.reason_phrase}")
             print(f"resp.text={resp.text}")
-            print(f"resp.raw={resp.raw}")
 
         resp.raise_for_status()
 
         return metadata
 
-    def delete_video(self, video_id: str) -> str:
-        resp = requests.delete(ApiRoute.video_url(backend_url=self._backend_url, video_id=video_id))
+    async def delete_video(self, video_id: str) -> str:
+        resp = await self.async_client.delete(url=ApiRoute.video.value, params={"videoId": video_id})
         resp.raise_for_status()
 
         return resp.text
+
+    async def aclose(self) -> None:
+        await self.async_client.aclose()
@@ -0,0 +1,225 @@
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from time import time
+from typing import List, Dict, Optional, BinaryIO, Tuple, Union, AsyncIterator, Set
+
+from fastapi import HTTPException
+
+from avatar_backend_api.api_types import AvatarModelRequest, StageTiming
+from avatar_backend_api.background_tools.stage_statistics import estimate_task_seconds
+from avatar_backend_api.clients.avatar_client import AvatarModelClient
+from avatar_backend_api.config import AvatarConfig
+
+
+class BackendReplica:
+    """ The last known state of a single model backend replica """
+
+    def __init__(self, client: AvatarModelClient, name: str):
+        self.client = client
+        self.name = name
+
+        self.healthy = False
+        self.consecutive_failures = 0
+        self.queue_depth = 0
+        self.warm_avatars: Set[str] = set()
+        self.workers = 1
+        self.stage_timings: Dict[str, StageTiming] = {}
+        self.estimated_seconds_remaining: Dict[str, float] = {}
+        self.refreshed_at = time()
+
+    def load(self, avatar: str, cold_avatar_penalty: int) -> int:
+        return self.queue_depth + (0 if avatar in self.warm_avatars else cold_avatar_penalty)
+
+    def estimate_seconds(self, audio_seconds: Optional[float], default_task_seconds: float) -> float:
+        """ Estimates the time until a new task would be completed, based on the queue depth and the recorded stage timings """
+        mean_task_seconds = estimate_task_seconds(timings=self.stage_timings) or default_task_seconds
+        task_seconds = estimate_task_seconds(timings=self.stage_timings, audio_seconds=audio_seconds) or default_task_seconds
+
+        return self.queue_depth / self.workers * mean_task_seconds + task_seconds
+
+    def seconds_until_available(self, default_task_seconds: float) -> float:
+        """ Estimates the time until the replica completes its next task """
+        if self.estimated_seconds_remaining:
+            return max(min(self.estimated_seconds_remaining.values()) - (time() - self.refreshed_at), 1.0)
+
+        return (estimate_task_seconds(timings=self.stage_timings) or default_task_seconds) / self.workers
+
+
+class BackendPool:
+    """ Dispatches the requests for a single model to a pool of backend replicas.
+
+    Offers the same methods as the AvatarModelClient, hence it can be used in place of a single client.
+    Every request is sent to the healthy replica with the lowest load, which is its queue depth plus a penalty if it has not recently
+    processed the requested avatar. Once all replicas hold max_queue_depth tasks, requests are rejected with a Retry-After header. Replicas are ejected from dispatching after ejection_threshold failed status checks in a row
+    and readmitted with the first successful one. Results are always retrieved from the replica which produced them.
+    """
+
+    def __init__(
+            self,
+            replicas: List[AvatarModelClient],
+            ejection_threshold: int = AvatarConfig.backend_ejection_threshold,
+            cold_avatar_penalty: int = AvatarConfig.backend_cold_avatar_penalty,
+            max_queue_depth: int = AvatarConfig.max_queue_depth,
+            default_task_seconds: float = AvatarConfig.default_task_seconds,
+    ):
+        if len(replicas) == 0:
+            raise ValueError("A backend pool requires at least one replica")
+
+        self.replicas = [BackendReplica(client=client, name=client.backend_url or f"replica-{index}") for index, client in enumerate(replicas)]
+        self.ejection_threshold = ejection_threshold
+        self.cold_avatar_penalty = cold_avatar_penalty
+        self.max_queue_depth = max_queue_depth
+        self.default_task_seconds = default_task_seconds
+
+        # Maps video_ids to the replica processing them. Lost on restart, in which case it is rebuilt by listing the replicas' completed videos
+        self._video_replicas: Dict[str, BackendReplica] = {}
+
+    def healthy_replicas(self) -> List[BackendReplica]:
+        return [replica for replica in self.replicas if replica.healthy]
+
+    async def refresh(self) -> None:
+        """ Updates the health, queue depth & warm avatars of all replicas """
+        await asyncio.gather(*(self._refresh_replica(replica=replica) for replica in self.replicas))
+
+    async def _refresh_replica(self, replica: BackendReplica) -> None:
+        try:
+            status = await replica.client.queue_status()
+
+        except Exception as e:
+            replica.consecutive_failures += 1
+
+            if replica.healthy and replica.consecutive_failures >= self.ejection_threshold:
+                replica.healthy = False
+                print(f"Ejecting replica={replica.name} after {replica.consecutive_failures} failed status checks: {e}")
+
+            return
+
+        if status.ready and not replica.healthy:
+            print(f"Admitting replica={replica.name}")
+
+        replica.healthy = status.ready
+        replica.consecutive_failures = 0
+        replica.queue_depth = status.queue_depth
+        replica.warm_avatars = set(status.warm_avatars)
+        replica.workers = max(status.workers, 1)
+        replica.stage_timings = status.stage_timings
+        replica.estimated_seconds_remaining = status.estimated_seconds_remaining
+        replica.refreshed_at = time()
+
+    def select_replica(self, avatar: str) -> BackendReplica:
+        """ Returns the replica a request for avatar should be dispatched to, or raises if no replica is able to accept it """
+        healthy_replicas = self.healthy_replicas()
+
+        if not healthy_replicas:
+            raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="There is no healthy backend replica available")
+
+        available_replicas = [replica for replica in healthy_replicas if replica.queue_depth < self.max_queue_depth]
+
+        if not available_replicas:
+            retry_after = min(replica.seconds_until_available(default_task_seconds=self.default_task_seconds) for replica in healthy_replicas)
+
+            raise HTTPException(
+                status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                detail=f"All backend replicas are at their maximum queue depth of {self.max_queue_depth}, please try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        # min returns the first of several equally loaded replicas, which keeps the dispatch deterministic
+        return min(available_replicas, key=lambda replica: replica.load(avatar=avatar, cold_avatar_penalty=self.cold_avatar_penalty))
+
+    def estimate_completion_time(self, replica: BackendReplica, audio_seconds: Optional[float] = None) -> float:
+        """ Returns the unix timestamp at which a new task dispatched to replica is expected to be completed """
+        return time() + replica.estimate_seconds(audio_seconds=audio_seconds, default_task_seconds=self.default_task_seconds)
+
+    async def estimated_completion_times(self) -> Dict[str, float]:
+        """ Maps the video_ids of all tasks tracked by the replicas to their expected completion timestamp, as of the last refresh """
+        return {
+            video_id: replica.refreshed_at + seconds_remaining
+            for replica in self.healthy_replicas()
+            for video_id, seconds_remaining in replica.estimated_seconds_remaining.items()
+        }
+
+    async def _replica_for(self, video_id: str) -> BackendReplica:
+        if video_id not in self._video_replicas:
+            await self.list_video_ids()
+
+        try:
+            return self._video_replicas[video_id]
+        except KeyError:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"No backend replica holds video_id={video_id}")
+
+    async def readiness(self) -> bool:
+        await self.refresh()
+        return len(self.healthy_replicas()) > 0
+
+    async def list_video_ids(self) -> List[str]:
+        replicas = self.healthy_replicas()
+        results = await asyncio.gather(*(replica.client.list_video_ids() for replica in replicas), return_exceptions=True)
+
+        video_ids: List[str] = []
+        for replica, result in zip(replicas, results):
+            if isinstance(result, Exception):
+                print(f"Unable to list the videos of replica={replica.name}: {result}")
+                continue
+
+            for video_id in result:
+                self._video_replicas[video_id] = replica
+                video_ids.append(video_id)
+
+        return video_ids
+
+    @asynccontextmanager
+    async def stream_video(self, video_id: str) -> AsyncIterator[AsyncIterator[bytes]]:
+        replica = await self._replica_for(video_id=video_id)
+
+        async with replica.client.stream_video(video_id=video_id) as video_chunks:
+            yield video_chunks
+
+    async def post_audio(
+            self,
+            audio: Union[BinaryIO, Tuple[str, Union[bytes, BinaryIO]]],
+            metadata: AvatarModelRequest,
+            user_email: Optional[str] = None,
+            priority: int = 0,
+            replica: Optional[BackendReplica] = None,
+    ) -> AvatarModelRequest:
+        """ Dispatches the request to replica, which is selected by select_replica if omitted """
+        replica = replica or self.select_replica(avatar=metadata.avatar.value)
+        print(f"Dispatching video_id={metadata.video_id} to replica={replica.name} with queue_depth={replica.queue_depth}")
+
+        result = await replica.client.post_audio(audio=audio, metadata=metadata, user_email=user_email, priority=priority)
+
+        # Anticipate the new state of the replica until its next status refresh, such that consecutive requests are spread
+        replica.queue_depth += 1
+        replica.warm_avatars.add(metadata.avatar.value)
+        self._video_replicas[metadata.video_id] = replica
+
+        return result
+
+    async def delete_video(self, video_id: str) -> str:
+        if video_id not in self._video_replicas:
+            await self.list_video_ids()
+
+        replica = self._video_replicas.pop(video_id, None)
+        if replica is not None:
+            return await replica.client.delete_video(video_id=video_id)
+
+        # The replicas only list their completed videos, hence after a restart the replica processing video_id is unknown.
+        # Its task is cancelled by sending the deletion to all replicas, of which only the one tracking video_id accepts it
+        results = await asyncio.gather(*(replica.client.delete_video(video_id=video_id) for replica in self.replicas), return_exceptions=True)
+
+        accepted = [result for result in results if not isinstance(result, Exception)]
+        if not accepted:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"No backend replica holds video_id={video_id}")
+
+        return accepted[0]
+
+    async def aclose(self) -> None:
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+
+# Either a single backend or a pool of replicas, both offer the same methods
+ModelClient = Union[AvatarModelClient, BackendPool]
@@ -1,13 +1,18 @@
+import json
 import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from enum import Enum
 from http import HTTPStatus
-from typing import List
+from typing import List, Optional, Iterable, Tuple, Dict, Any
 
 from fastapi import HTTPException
 from mtc_api_utils.api_types import FirebaseUser
 from tinydb import TinyDB, where
 from tinydb.table import Table
 
-from avatar_backend_api.api_types import VideoMetadata
+from avatar_backend_api.api_types import VideoMetadata, AvatarModel
 from avatar_backend_api.config import AvatarConfig
 
 
@@ -15,24 +20,137 @@ class AvatarDbException(HTTPException):
     pass
 
 
-class AvatarDbClient:
+class DbBackend(Enum):
+    value: str
+    tinydb = "tinydb"
+    sqlite = "sqlite"
+
+
+class BaseAvatarDbClient(ABC):
+    """ Stores VideoMetadata documents per user. Every video_id is expected to be unique across all users. """
+
     db_filepath: str
-    db: TinyDB
 
-    def __init__(self, db_filepath: str = AvatarConfig.db_filepath):
+    def __init__(self, db_filepath: str):
         os.makedirs(
             name=os.path.dirname(db_filepath),
             exist_ok=True,
         )
 
         self.db_filepath = db_filepath
+
+    @abstractmethod
+    def list_videos(self, user: FirebaseUser, limit: Optional[int] = None, offset: int = 0) -> List[VideoMetadata]:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def list_videos_page(
+            self,
+            user: FirebaseUser,
+            limit: int,
+            cursor: Optional[str] = None,
+            inference_completed: Optional[bool] = None,
+            cancelled: Optional[bool] = None,
+            avatar: Optional[str] = None,
+            avatar_model: Optional[AvatarModel] = None,
+    ) -> Tuple[List[VideoMetadata], Optional[str]]:
+        """ Returns up to limit videos of the user matching all given filters, in insertion order and starting after cursor.
+        Also returns the cursor of the next page, which is None once the last page has been reached.
+        """
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def video_exists(self, video_id: str, user: FirebaseUser) -> bool:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def get_video(self, video_id: str, user: FirebaseUser) -> VideoMetadata:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def insert_video(self, video_metadata: VideoMetadata, user: FirebaseUser) -> VideoMetadata:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def upsert_video(self, video_metadata: VideoMetadata, user: FirebaseUser) -> VideoMetadata:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def delete_video(self, video_id: str, user: FirebaseUser) -> VideoMetadata:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def get_user_from_id(self, video_id: str) -> str:
+        raise Exception("Not implemented")
+
+    @abstractmethod
+    def clear(self) -> None:
+        """ Removes all documents of all users """
+        raise Exception("Not implemented")
+
+    @staticmethod
+    def _parse_cursor(cursor: Optional[str]) -> int:
+        if cursor is None:
+            return 0
+
+        try:
+            return int(cursor)
+        except ValueError:
+            raise AvatarDbException(status_code=HTTPStatus.BAD_REQUEST, detail=f"Invalid cursor={cursor}")
+
+    @staticmethod
+    def _not_found(video_id: str) -> AvatarDbException:
+        return AvatarDbException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with id: {video_id} does not exist")
+
+    @staticmethod
+    def _conflict(video_id: str) -> AvatarDbException:
+        return AvatarDbException(HTTPStatus.CONFLICT, detail=f"An inference request with id {video_id} already exists")
+
+
+class AvatarDbClient(BaseAvatarDbClient):
+    """ TinyDB backend, storing one table per user inside a single json file. Kept for small deployments & migration purposes. """
+
+    db: TinyDB
+
+    def __init__(self, db_filepath: str = AvatarConfig.db_filepath):
+        super().__init__(db_filepath=db_filepath)
         self.db = TinyDB(db_filepath)
 
     def _user_table(self, user: FirebaseUser) -> Table:
         return self.db.table(name=user.email)
 
-    def list_videos(self, user: FirebaseUser) -> List[VideoMetadata]:
-        return [VideoMetadata.parse_obj(doc) for doc in self._user_table(user=user).all()]
+    def list_videos(self, user: FirebaseUser, limit: Optional[int] = None, offset: int = 0) -> List[VideoMetadata]:
+        docs = self._user_table(user=user).all()
+        docs = docs[offset:] if limit is None else docs[offset:offset + limit]
+
+        return [VideoMetadata.parse_obj(doc) for doc in docs]
+
+    def list_videos_page(
+            self,
+            user: FirebaseUser,
+            limit: int,
+            cursor: Optional[str] = None,
+            inference_completed: Optional[bool] = None,
+            cancelled: Optional[bool] = None,
+            avatar: Optional[str] = None,
+            avatar_model: Optional[AvatarModel] = None,
+    ) -> Tuple[List[VideoMetadata], Optional[str]]:
+        # TinyDB has no indices, hence all documents of the user are scanned. The cursor is the doc_id of the last returned document
+        last_doc_id = self._parse_cursor(cursor=cursor)
+
+        docs = [
+            doc for doc in self._user_table(user=user).all()
+            if doc.doc_id > last_doc_id
+            and (inference_completed is None or doc.get("inferenceCompleted", False) == inference_completed)
+            and (cancelled is None or doc.get("cancelled", False) == cancelled)
+            and (avatar is None or doc.get("avatar") == avatar)
+            and (avatar_model is None or doc.get("avatarModel") == avatar_model.value)
+        ]
+
+        page = docs[:limit]
+        next_cursor = str(page[-1].doc_id) if len(docs) > limit else None
+
+        return [VideoMetadata.parse_obj(doc) for doc in page], next_cursor
 
     def video_exists(self, video_id: str, user: FirebaseUser) -> bool:
         return self._user_table(user=user).count(self.video_query(video_id=video_id)) == 1
@@ -41,13 +159,13 @@ class AvatarDbClient:
         result = self._user_table(user=user).get(self.video_query(video_id=video_id))
 
         if result is None:
-            raise AvatarDbException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with id: {video_id} does not exist")
+            raise self._not_found(video_id=video_id)
         else:
             return VideoMetadata.parse_obj(result)
 
     def insert_video(self, video_metadata: VideoMetadata, user: FirebaseUser) -> VideoMetadata:
         if self._user_table(user=user).count(cond=self.video_query(video_id=video_metadata.video_id)) != 0:
-            raise AvatarDbException(HTTPStatus.CONFLICT, detail=f"An inference request with id {video_metadata.video_id} already exists")
+            raise self._conflict(video_id=video_metadata.video_id)
 
         self._user_table(user=user).insert(document=video_metadata.json_dict)
         print(f"Inserting new video_metadata for user={user} with video_id={video_metadata.video_id}")
@@ -76,8 +194,235 @@ class AvatarDbClient:
             if self.db.table(name=user_email).contains(self.video_query(video_id=video_id)):
                 return user_email
 
-        raise AvatarDbException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with id: {video_id} does not exist in db. Existing users & video_ids: {[(email, self._user_table(user=FirebaseUser(email=email, roles=[])).all()) for email in self.db.tables()]}")
+        raise AvatarDbException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with id: {video_id} does not exist in db")
+
+    def clear(self) -> None:
+        self.db.drop_tables()
+
+    def iter_documents(self) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """ Yields (user_email, document) pairs for every stored document """
+        for user_email in self.db.tables():
+            for doc in self.db.table(name=user_email).all():
+                yield user_email, dict(doc)
 
     @staticmethod
     def video_query(video_id: str):
         return where("videoId") == video_id
+
+
+class SqliteAvatarDbClient(BaseAvatarDbClient):
+    """ SQLite backend in WAL mode. The video_id is the primary key, which turns owner lookups into a single index access,
+    while a secondary index on the user email serves the per-user listings in insertion order.
+
+    Every thread gets its own connection, such that readers do not block each other.
+    """
+
+    def __init__(self, db_filepath: str = AvatarConfig.sqlite_db_filepath):
+        super().__init__(db_filepath=db_filepath)
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        with self._connection() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    user_email TEXT NOT NULL,
+                    avatar TEXT,
+                    avatar_model TEXT,
+                    inference_completed INTEGER NOT NULL DEFAULT 0,
+                    document TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS videos_user_email_idx ON videos (user_email);
+                """
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.db_filepath, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def _row(video_id: str, user_email: str, document: Dict[str, Any]) -> Tuple[str, str, Optional[str], Optional[str], int, str]:
+        return (
+            video_id,
+            user_email,
+            document.get("avatar"),
+            document.get("avatarModel"),
+            int(bool(document.get("inferenceCompleted", False))),
+            json.dumps(document),
+        )
+
+    def list_videos(self, user: FirebaseUser, limit: Optional[int] = None, offset: int = 0) -> List[VideoMetadata]:
+        rows = self._connection().execute(
+            "SELECT document FROM videos WHERE user_email = ? ORDER BY rowid LIMIT ? OFFSET ?",
+            (user.email, -1 if limit is None else limit, offset),
+        )
+
+        return [VideoMetadata.parse_obj(json.loads(document)) for document, in rows]
+
+    def list_videos_page(
+            self,
+            user: FirebaseUser,
+            limit: int,
+            cursor: Optional[str] = None,
+            inference_completed: Optional[bool] = None,
+            cancelled: Optional[bool] = None,
+            avatar: Optional[str] = None,
+            avatar_model: Optional[AvatarModel] = None,
+    ) -> Tuple[List[VideoMetadata], Optional[str]]:
+        # The cursor is the rowid of the last returned row. Seeking by rowid through the user email index is independent of the page number
+        conditions = ["user_email = ?", "rowid > ?"]
+        params: List[Any] = [user.email, self._parse_cursor(cursor=cursor)]
+
+        if inference_completed is not None:
+            conditions.append("inference_completed = ?")
+            params.append(int(inference_completed))
+
+        if cancelled is not None:
+            # Rarely set, hence filtered on the document instead of a column of its own
+            conditions.append("COALESCE(json_extract(document, '$.cancelled'), 0) = ?")
+            params.append(int(cancelled))
+
+        if avatar is not None:
+            conditions.append("avatar = ?")
+            params.append(avatar)
+
+        if avatar_model is not None:
+            conditions.append("avatar_model = ?")
+            params.append(avatar_model.value)
+
+        # One additional row is fetched in order to find out whether there is a next page
+        rows = self._connection().execute(
+            f"SELECT rowid, document FROM videos WHERE {' AND '.join(conditions)} ORDER BY rowid LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+
+        page = rows[:limit]
+        next_cursor = str(page[-1][0]) if len(rows) > limit else None
+
+        return [VideoMetadata.parse_obj(json.loads(document)) for _, document in page], next_cursor
+
+    def video_exists(self, video_id: str, user: FirebaseUser) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM videos WHERE video_id = ? AND user_email = ?",
+            (video_id, user.email),
+        ).fetchone()
+
+        return row is not None
+
+    def get_video(self, video_id: str, user: FirebaseUser) -> VideoMetadata:
+        row = self._connection().execute(
+            "SELECT document FROM videos WHERE video_id = ? AND user_email = ?",
+            (video_id, user.email),
+        ).fetchone()
+
+        if row is None:
+            raise self._not_found(video_id=video_id)
+        else:
+            return VideoMetadata.parse_obj(json.loads(row[0]))
+
+    def insert_video(self, video_metadata: VideoMetadata, user: FirebaseUser) -> VideoMetadata:
+        try:
+            with self._write_lock, self._connection() as connection:
+                connection.execute(
+                    "INSERT INTO videos VALUES (?, ?, ?, ?, ?, ?)",
+                    self._row(video_id=video_metadata.video_id, user_email=user.email, document=video_metadata.json_dict),
+                )
+        except sqlite3.IntegrityError:
+            raise self._conflict(video_id=video_metadata.video_id)
+
+        print(f"Inserting new video_metadata for user={user} with video_id={video_metadata.video_id}")
+
+        return video_metadata
+
+    def insert_documents(self, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """ Bulk inserts (user_email, document) pairs within a single transaction. Existing video_ids are overwritten. """
+        rows = (self._row(video_id=doc["videoId"], user_email=user_email, document=doc) for user_email, doc in documents)
+
+        with self._write_lock, self._connection() as connection:
+            cursor = connection.executemany("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        return cursor.rowcount
+
+    def upsert_video(self, video_metadata: VideoMetadata, user: FirebaseUser) -> VideoMetadata:
+        with self._write_lock, self._connection() as connection:
+            connection.execute(
+                """
+                INSERT INTO videos VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (video_id) DO UPDATE SET
+                    user_email = excluded.user_email,
+                    avatar = excluded.avatar,
+                    avatar_model = excluded.avatar_model,
+                    inference_completed = excluded.inference_completed,
+                    document = excluded.document
+                """,
+                self._row(video_id=video_metadata.video_id, user_email=user.email, document=video_metadata.json_dict),
+            )
+        print(f"Updating video_metadata for user={user} with video_id={video_metadata.video_id}")
+
+        return video_metadata
+
+    def delete_video(self, video_id: str, user: FirebaseUser) -> VideoMetadata:
+        video_metadata = self.get_video(video_id=video_id, user=user)
+
+        with self._write_lock, self._connection() as connection:
+            connection.execute("DELETE FROM videos WHERE video_id = ? AND user_email = ?", (video_id, user.email))
+        print(f"Removing video_metadata for user={user} with video_id={video_metadata.video_id}")
+
+        return video_metadata
+
+    def get_user_from_id(self, video_id: str) -> str:
+        row = self._connection().execute("SELECT user_email FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+
+        if row is None:
+            raise AvatarDbException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with id: {video_id} does not exist in db")
+
+        return row[0]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._write_lock, self._connection() as connection:
+            connection.execute("DELETE FROM videos")
+
+    def close(self) -> None:
+        """ Closes the connection of the calling thread, which checkpoints the WAL into the db file if it was the last connection """
+        connection: Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def create_db_client(
+        backend: DbBackend = DbBackend(AvatarConfig.db_backend),
+        db_filepath: str = AvatarConfig.db_filepath,
+        sqlite_db_filepath: str = AvatarConfig.sqlite_db_filepath,
+) -> BaseAvatarDbClient:
+    """ Creates the db client configured by the DB_BACKEND env var.
+
+    When switching an existing deployment to sqlite, the TinyDB file found at db_filepath is migrated on first start.
+    The sqlite file only appears once the migration has completed, such that an interrupted migration is retried on the next start.
+    """
+    if backend == DbBackend.tinydb:
+        return AvatarDbClient(db_filepath=db_filepath)
+
+    elif backend == DbBackend.sqlite:
+        if not os.path.isfile(sqlite_db_filepath) and os.path.isfile(db_filepath):
+            from avatar_backend_api.clients.db_migration import migrate_tinydb_file
+
+            migrate_tinydb_file(tinydb_filepath=db_filepath, sqlite_filepath=sqlite_db_filepath)
+
+        return SqliteAvatarDbClient(db_filepath=sqlite_db_filepath)
+
+    else:
+        raise ValueError(f"Unknown db backend={backend}. Choose one of: {[db_backend.value for db_backend in DbBackend]}")
@@ -0,0 +1,66 @@
+""" Migrates the video metadata of an existing TinyDB file into the SQLite backend.
+
+Usage:
+    python -m avatar_backend_api.clients.db_migration --tinydb /tmp/tinyDB/neuralVoices.json --sqlite /tmp/tinyDB/avatar.sqlite3
+
+The sqlite file only appears once all documents have been migrated, replacing any existing file, as on the first start of the sqlite backend.
+"""
+
+import argparse
+import os
+from itertools import islice
+from typing import Iterable, Tuple, Dict, Any, Iterator, List
+
+from avatar_backend_api.clients.db_client import AvatarDbClient, SqliteAvatarDbClient
+from avatar_backend_api.config import AvatarConfig
+
+MIGRATION_BATCH_SIZE = 10_000
+
+
+def _batches(documents: Iterable[Tuple[str, Dict[str, Any]]], batch_size: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+    iterator = iter(documents)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def migrate_tinydb_to_sqlite(tinydb_client: AvatarDbClient, sqlite_client: SqliteAvatarDbClient, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """ Copies all documents of all users from tinydb_client to sqlite_client and returns the number of migrated documents.
+    Documents which already exist in the sqlite db are overwritten, such that the migration can safely be rerun.
+    """
+    migrated = 0
+    for batch in _batches(tinydb_client.iter_documents(), batch_size=batch_size):
+        migrated += sqlite_client.insert_documents(documents=batch)
+
+    print(f"Migrated {migrated} video_metadata documents from {tinydb_client.db_filepath} to {sqlite_client.db_filepath}")
+
+    return migrated
+
+
+def migrate_tinydb_file(tinydb_filepath: str, sqlite_filepath: str, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """ Migrates the TinyDB file into a new sqlite file, which is only moved to sqlite_filepath once all documents have been migrated """
+    tmp_filepath = f"{sqlite_filepath}.migrating"
+
+    # Leftovers of an interrupted migration
+    for path in (tmp_filepath, f"{tmp_filepath}-wal", f"{tmp_filepath}-shm"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    sqlite_client = SqliteAvatarDbClient(db_filepath=tmp_filepath)
+    try:
+        migrated = migrate_tinydb_to_sqlite(tinydb_client=AvatarDbClient(db_filepath=tinydb_filepath), sqlite_client=sqlite_client, batch_size=batch_size)
+    finally:
+        sqlite_client.close()
+
+    os.replace(tmp_filepath, sqlite_filepath)
+
+    return migrated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the avatar metadata from a TinyDB json file to SQLite")
+    parser.add_argument("--tinydb", type=str, default=AvatarConfig.db_filepath, help="Path to the existing TinyDB json file")
+    parser.add_argument("--sqlite", type=str, default=AvatarConfig.sqlite_db_filepath, help="Path to the target SQLite db")
+    parser.add_argument("--batch_size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    migrate_tinydb_file(tinydb_filepath=args.tinydb, sqlite_filepath=args.sqlite, batch_size=args.batch_size)
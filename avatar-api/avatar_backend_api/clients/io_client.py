@@ -1,21 +1,43 @@
 import os.path
+import shutil
+import struct
+import wave
 from glob import glob
 from http import HTTPStatus
-from typing import BinaryIO, List, Optional, Union
+from typing import BinaryIO, List, Optional, Union, Iterable, AsyncIterable
 
 from fastapi import UploadFile, HTTPException
 from mtc_api_utils.api_types import FirebaseUser
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import FileResponse
 
 from avatar_backend_api.config import AvatarConfig
 
 VIDEO_EXTENSION = ".mp4"
+CHUNK_SIZE_BYTES = 1024 * 1024
+PARTIAL_FILE_SUFFIX = ".part"
 
 
 class IoClientException(HTTPException):
     pass
 
 
+def audio_duration_seconds(audio: BinaryIO) -> Optional[float]:
+    """ Returns the duration of a wav file, or None if the duration can not be determined, e.g. for other formats or malformed headers.
+    Rewinds the file afterwards
+    """
+    try:
+        audio.seek(0)
+        with wave.open(audio, "rb") as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+
+    except (wave.Error, EOFError, struct.error, ValueError, ZeroDivisionError):
+        return None
+
+    finally:
+        audio.seek(0)
+
+
 class BaseIOClient:
     def __init__(self, base_path: str, user_dir_mode: bool):
         self.base_path = base_path
@@ -34,10 +56,62 @@ class BaseIOClient:
             else:
                 return self.base_path
 
+    @staticmethod
+    def write_atomically(path: str, content: Union[bytes, BinaryIO, Iterable[bytes]]) -> str:
+        """ Writes content in chunks to a temporary file next to path, which is only renamed to path once all content has been written.
+        This keeps the memory consumption independent of the file size and prevents readers from seeing partially written files.
+        """
+        partial_path = path + PARTIAL_FILE_SUFFIX
+
+        try:
+            with open(partial_path, "wb") as disk_file:
+                if isinstance(content, bytes):
+                    disk_file.write(content)
+                elif hasattr(content, "read"):
+                    shutil.copyfileobj(content, disk_file, CHUNK_SIZE_BYTES)
+                else:
+                    for chunk in content:
+                        disk_file.write(chunk)
+
+            os.replace(partial_path, path)
+
+        except BaseException:
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
+            raise
+
+        return path
+
+    @staticmethod
+    async def write_atomically_async(path: str, chunks: AsyncIterable[bytes]) -> str:
+        """ Async variant of write_atomically, which executes the blocking file operations in the threadpool """
+        partial_path = path + PARTIAL_FILE_SUFFIX
+
+        try:
+            disk_file = await run_in_threadpool(open, partial_path, "wb")
+            try:
+                async for chunk in chunks:
+                    await run_in_threadpool(disk_file.write, chunk)
+            finally:
+                await run_in_threadpool(disk_file.close)
+
+            await run_in_threadpool(os.replace, partial_path, path)
+
+        except BaseException:
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
+            raise
+
+        return path
+
 
 class AudioIoClient(BaseIOClient):
     def matching_paths(self, video_id: str, user: Optional[FirebaseUser] = None) -> List[str]:
-        matching_paths = sorted(glob(os.path.join(self.user_dir(user=user), video_id, video_id) + ".*"))
+        matching_paths = sorted(
+            path
+            for path in glob(os.path.join(self.user_dir(user=user), video_id, video_id) + ".*")
+            if not path.endswith(PARTIAL_FILE_SUFFIX)
+        )
 
         if len(matching_paths) == 0:
             raise IoClientException(status_code=HTTPStatus.NOT_FOUND, detail=f"Unable to find file with video_id={video_id}")
@@ -61,11 +135,7 @@ class AudioIoClient(BaseIOClient):
         path = self.audio_path(video_id=video_id, file_ending=file_ending, user=user)
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-        with open(path, "wb") as disk_file:
-            file_bytes = audio.file.read()
-            disk_file.write(file_bytes)
-
-        return path
+        return self.write_atomically(path=path, content=audio.file)
 
     def read_from_disk(self, video_id: str, user: Optional[FirebaseUser] = None) -> BinaryIO:
         try:
@@ -73,6 +143,10 @@ class AudioIoClient(BaseIOClient):
         except FileNotFoundError:
             raise IoClientException(status_code=HTTPStatus.NOT_FOUND, detail=f"Unable to find video with video_id={video_id}")
 
+    def duration_seconds(self, video_id: str, user: Optional[FirebaseUser] = None) -> Optional[float]:
+        with self.read_from_disk(video_id=video_id, user=user) as audio:
+            return audio_duration_seconds(audio=audio)
+
     def delete_file(self, video_id: str, user: Optional[FirebaseUser] = None) -> None:
         for path in self.matching_paths(video_id=video_id, user=user):
             try:
@@ -91,19 +165,20 @@ class VideoIoClient(BaseIOClient):
     def file_exists(self, video_id: str, user: Optional[FirebaseUser] = None) -> bool:
         return os.path.isfile(self.video_path(video_id=video_id, user=user))
 
-    def save_to_disk(self, video_bytes: Union[bytes, BinaryIO], video_id: str, user: Optional[FirebaseUser] = None) -> str:
-        try:
-            video_bytes = video_bytes.read()
-        except AttributeError:
-            pass
+    def save_to_disk(self, video_bytes: Union[bytes, BinaryIO, Iterable[bytes]], video_id: str, user: Optional[FirebaseUser] = None) -> str:
+        """ Accepts the whole video as bytes, a file-like object or an iterable of chunks, e.g. a streamed http response """
+        path = self.video_path(video_id=video_id, user=user)
+
+        os.makedirs(self.user_dir(user=user), exist_ok=True)
+
+        return self.write_atomically(path=path, content=video_bytes)
 
+    async def save_to_disk_async(self, video_chunks: AsyncIterable[bytes], video_id: str, user: Optional[FirebaseUser] = None) -> str:
         path = self.video_path(video_id=video_id, user=user)
 
         os.makedirs(self.user_dir(user=user), exist_ok=True)
-        with open(path, "wb") as disk_file:
-            disk_file.write(video_bytes)
 
-        return path
+        return await self.write_atomically_async(path=path, chunks=video_chunks)
 
     def read_from_disk(self, video_id: str, user: Optional[FirebaseUser] = None) -> FileResponse:
         file_path = self.video_path(video_id=video_id, user=user)
@@ -1,13 +1,14 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from http import HTTPStatus
-from time import sleep
-from typing import Dict, Union, BinaryIO, Tuple, List, Optional
+from typing import Dict, Union, BinaryIO, Tuple, List, Optional, AsyncIterator
 
 import requests
 from fastapi import HTTPException
 from mtc_api_utils.api_types import ApiStatus
 
-from avatar_backend_api.api_types import AvatarModelRequest
+from avatar_backend_api.api_types import AvatarModelRequest, BackendQueueStatus
 from avatar_backend_api.clients.avatar_client import AvatarModelClient
 
 log = logging.Logger("MockNeuralVoiceModel-Logger")
@@ -28,21 +29,40 @@ class MockAvatarModelClient(AvatarModelClient):
     def get_status(self) -> Tuple[Optional[requests.Response], ApiStatus]:
         return requests.Response(), ApiStatus(readiness=self.get_readiness()[1], gpu_supported=True, gpu_enabled=True)
 
-    def list_video_ids(self) -> List[str]:
+    async def readiness(self) -> bool:
+        return True
+
+    async def queue_status(self) -> BackendQueueStatus:
+        return BackendQueueStatus(ready=True, queue_depth=0, warm_avatars=[])
+
+    async def estimated_completion_times(self) -> Dict[str, float]:
+        return {}
+
+    async def list_video_ids(self) -> List[str]:
         return [metadata.video_id for metadata in mock_db.values()]
 
-    def get_video(self, video_id: str) -> Tuple[int, bytes]:
-        return HTTPStatus.OK, bytes()
+    @asynccontextmanager
+    async def stream_video(self, video_id: str) -> AsyncIterator[AsyncIterator[bytes]]:
+        async def chunks() -> AsyncIterator[bytes]:
+            yield bytes()
+
+        yield chunks()
 
-    def post_audio(self, audio: Union[BinaryIO, Tuple[str, bytes]], metadata: AvatarModelRequest) -> AvatarModelRequest:
-        sleep(INFERENCE_DELAY_SECONDS)
+    async def post_audio(
+            self,
+            audio: Union[BinaryIO, Tuple[str, Union[bytes, BinaryIO]]],
+            metadata: AvatarModelRequest,
+            user_email: Optional[str] = None,
+            priority: int = 0,
+    ) -> AvatarModelRequest:
+        await asyncio.sleep(INFERENCE_DELAY_SECONDS)
 
         mock_db[metadata.video_id] = metadata
         print(f"Processed audio: {metadata.video_id}")
 
         return metadata
 
-    def delete_video(self, video_id: str) -> str:
+    async def delete_video(self, video_id: str) -> str:
         try:
             del mock_db[video_id]
         except KeyError:
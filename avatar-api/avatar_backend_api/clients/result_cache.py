@@ -0,0 +1,141 @@
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+from threading import Lock
+from typing import BinaryIO
+
+from mtc_api_utils.api_types import ApiType
+
+from avatar_backend_api.api_types import AvatarModel
+from avatar_backend_api.clients.io_client import VIDEO_EXTENSION, CHUNK_SIZE_BYTES, PARTIAL_FILE_SUFFIX
+from avatar_backend_api.config import AvatarConfig
+
+
+class ResultCacheStats(ApiType):
+    hits: int
+    misses: int
+    entries: int
+    size_bytes: int
+    max_size_bytes: int
+
+
+def hash_audio(audio: BinaryIO) -> str:
+    """ Hashes the audio file in chunks and rewinds it afterwards, such that it can still be read by the caller """
+    audio_hash = hashlib.sha256()
+
+    audio.seek(0)
+    while chunk := audio.read(CHUNK_SIZE_BYTES):
+        audio_hash.update(chunk)
+    audio.seek(0)
+
+    return audio_hash.hexdigest()
+
+
+class ResultCache:
+    """ Content-addressed store of finished videos.
+
+    The cache key covers everything the rendered video depends on: the audio content, the avatar, the model and the checkpoint version of the model.
+    Videos are hard linked between the cache and the user directories, hence a cache hit neither copies the video, nor does the eviction of a cached
+    video remove it from the user directories. The least recently used videos are evicted, once the cache exceeds max_size_bytes.
+    """
+
+    def __init__(self, cache_dir: str = AvatarConfig.result_cache_dir, max_size_bytes: int = AvatarConfig.result_cache_max_size_bytes):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()  # Maps cache keys to file sizes, ordered from least to most recently used
+        self._size_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_entries()
+
+    @staticmethod
+    def cache_key(audio_hash: str, avatar: str, avatar_model: AvatarModel, checkpoint_version: str) -> str:
+        return hashlib.sha256(f"{audio_hash}:{avatar}:{avatar_model.value}:{checkpoint_version}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + VIDEO_EXTENSION)
+
+    def link_cached_video(self, key: str, target_path: str) -> bool:
+        """ Links the cached video for key to target_path and returns True on a cache hit, otherwise returns False """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            _link_or_copy(source=self._path(key), target=target_path)
+
+            return True
+
+    def store(self, key: str, video_path: str) -> None:
+        """ Adds the video at video_path to the cache and evicts the least recently used videos if the cache is full """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            _link_or_copy(source=video_path, target=self._path(key))
+
+            size = os.path.getsize(self._path(key))
+            self._entries[key] = size
+            self._size_bytes += size
+
+            self._evict()
+
+    def stats(self) -> ResultCacheStats:
+        with self._lock:
+            return ResultCacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                size_bytes=self._size_bytes,
+                max_size_bytes=self.max_size_bytes,
+            )
+
+    def _evict(self) -> None:
+        while self._size_bytes > self.max_size_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size_bytes -= size
+
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+            print(f"Evicted video with key={key} from the result cache")
+
+    def _load_entries(self) -> None:
+        # The modification time is updated on every hit, which restores the LRU order after a restart
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith(VIDEO_EXTENSION)]
+
+        for entry in sorted(entries, key=lambda dir_entry: dir_entry.stat().st_mtime):
+            size = entry.stat().st_size
+            self._entries[entry.name[:-len(VIDEO_EXTENSION)]] = size
+            self._size_bytes += size
+
+        self._evict()
+
+
+def _link_or_copy(source: str, target: str) -> None:
+    """ Hard links source to target, falling back to a copy if both are located on different file systems """
+    tmp_target = target + PARTIAL_FILE_SUFFIX
+
+    try:
+        os.link(source, tmp_target)
+    except FileExistsError:
+        os.remove(tmp_target)
+        os.link(source, tmp_target)
+    except OSError:
+        shutil.copyfile(source, tmp_target)
+
+    os.replace(tmp_target, target)
+    os.utime(source)
@@ -15,6 +15,39 @@ class AvatarConfig(Config):
     neural_voice_backend_url: str = Config.parse_env_var("NEURAL_VOICE_BACKEND_URL", default="http://neural-voice-model:5000")
     motion_gan_backend_url: str = Config.parse_env_var("MOTION_GAN_BACKEND_URL", default="http://motion-gan-model:5000")
 
+    # Comma separated replica urls of each model backend, default to the single backend urls above
+    neural_voice_backend_urls: List[str] = Config.parse_env_var("NEURAL_VOICE_BACKEND_URLS", default=neural_voice_backend_url, convert_type=list)
+    motion_gan_backend_urls: List[str] = Config.parse_env_var("MOTION_GAN_BACKEND_URLS", default=motion_gan_backend_url, convert_type=list)
+
+    # Backend pool configs. Replicas are ejected after backend_ejection_threshold failed status checks in a row.
+    # The cold avatar penalty is added to the queue depth of replicas which have not recently processed the requested avatar
+    backend_ejection_threshold: int = Config.parse_env_var("BACKEND_EJECTION_THRESHOLD", default="3", convert_type=int)
+    backend_cold_avatar_penalty: int = Config.parse_env_var("BACKEND_COLD_AVATAR_PENALTY", default="2", convert_type=int)
+
+    # Admission control configs. Requests are rejected once all replicas of a model hold max_queue_depth tasks.
+    # Until the backends have recorded any stage timings, tasks are estimated to take default_task_seconds
+    max_queue_depth: int = Config.parse_env_var("MAX_QUEUE_DEPTH", default="20", convert_type=int)
+    default_task_seconds: float = Config.parse_env_var("DEFAULT_TASK_SECONDS", default="600", convert_type=float)
+
+    # Model client configs
+    model_client_timeout_seconds: float = Config.parse_env_var("MODEL_CLIENT_TIMEOUT_SECONDS", default="60", convert_type=float)
+    model_client_retries: int = Config.parse_env_var("MODEL_CLIENT_RETRIES", default="3", convert_type=int)
+    model_client_max_connections: int = Config.parse_env_var("MODEL_CLIENT_MAX_CONNECTIONS", default="10", convert_type=int)
+
+    # Readiness configs, unhealthy backends are checked with an exponential backoff up to readiness_max_backoff_seconds
+    readiness_refresh_interval_seconds: float = Config.parse_env_var("READINESS_REFRESH_INTERVAL_SECONDS", default="5", convert_type=float)
+    readiness_max_backoff_seconds: float = Config.parse_env_var("READINESS_MAX_BACKOFF_SECONDS", default="60", convert_type=float)
+    readiness_jitter_fraction: float = Config.parse_env_var("READINESS_JITTER_FRACTION", default="0.1", convert_type=float)
+
+    # Used by the model backends in order to notify the API about completed videos. Set to an empty string to disable notifications
+    avatar_api_url: str = Config.parse_env_var("AVATAR_API_URL", default="http://backend:5000")
+    # Shared secret of the API & the model backends, required by the routes only the backends may call. Notifications are disabled while it is unset
+    backend_service_token: str = Config.parse_env_var("BACKEND_SERVICE_TOKEN", default="")
+
+    # Result retrieval configs
+    result_poll_interval_seconds: int = Config.parse_env_var("RESULT_POLL_INTERVAL_SECONDS", default="60", convert_type=int)
+    result_retrieval_workers: int = Config.parse_env_var("RESULT_RETRIEVAL_WORKERS", default="4", convert_type=int)
+
     # Debug configs
     mockBackend: bool = Config.parse_env_var("MOCK_BACKEND", default="False", convert_type=bool)
 
@@ -25,11 +58,27 @@ class AvatarConfig(Config):
         for avatar in list(Config.parse_env_var("AVAILABLE_AVATARS", default="Jennifer_355_9415,Arthur_A2226", convert_type=list))
     }
 
+    max_page_size: int = Config.parse_env_var("MAX_PAGE_SIZE", default="1000", convert_type=int)  # Upper bound for the number of videos per listing
+
+    db_backend: str = Config.parse_env_var("DB_BACKEND", default="sqlite")  # One of: sqlite, tinydb
     db_filepath: str = Config.parse_env_var("DB_FILEPATH", default="/tmp/tinyDB/neuralVoices.json")
+    sqlite_db_filepath: str = Config.parse_env_var("SQLITE_DB_FILEPATH", default="/tmp/tinyDB/avatar.sqlite3")
 
     data_base_dir: str = Config.parse_env_var("DATA_BASE_DIR", default="/tmp/avatar")
     audio_input_dir: str = os.path.join(data_base_dir, "input_data", "audio")
     video_output_dir: str = os.path.join(data_base_dir, "output_data", "videos")
+    queue_journal_dir: str = os.path.join(data_base_dir, "queue")
+
+    # Result cache configs. The checkpoint versions are part of the cache key, hence they need to be increased whenever a model is retrained
+    result_cache_enabled: bool = Config.parse_env_var("RESULT_CACHE_ENABLED", default="True", convert_type=bool)
+    result_cache_dir: str = os.path.join(data_base_dir, "result_cache")
+    result_cache_max_size_bytes: int = int(Config.parse_env_var("RESULT_CACHE_MAX_SIZE_GB", default="50", convert_type=float) * 1024 ** 3)
+    neural_voice_checkpoint_version: str = Config.parse_env_var("NEURAL_VOICE_CHECKPOINT_VERSION", default="1")
+    motion_gan_checkpoint_version: str = Config.parse_env_var("MOTION_GAN_CHECKPOINT_VERSION", default="1")
+
+    # Inference queue configs
+    inference_workers: int = Config.parse_env_var("INFERENCE_WORKERS", default="1", convert_type=int)
+    stage_statistics_window: int = Config.parse_env_var("STAGE_STATISTICS_WINDOW", default="50", convert_type=int)  # Number of recent tasks per stage statistic
 
     @staticmethod
     def avatar_short_name(avatar_name: str) -> str:
@@ -1,16 +1,26 @@
+import os
+import signal
+import subprocess
 from abc import ABC, abstractmethod
-from typing import List
+from threading import Lock
+from typing import Dict, List
 
 from mtc_api_utils.base_model import MLBaseModel
 
 from avatar_backend_api.api_types import InferenceQueueTask
 from avatar_backend_api.clients.io_client import IoClient
 
+PROCESS_TERMINATION_TIMEOUT_SECONDS = 10
+
 
 class AvatarBaseModel(MLBaseModel, ABC):
 
     def __init__(self, io_client: IoClient):
         self.io_client = io_client
+
+        self._processes: Dict[str, subprocess.Popen] = {}  # Maps video_ids to their running pipeline process
+        self._processes_lock = Lock()
+
         super().__init__()
 
     @abstractmethod
@@ -19,5 +29,56 @@ class AvatarBaseModel(MLBaseModel, ABC):
 
     @staticmethod
     @abstractmethod
-    def available_avatars() -> List[str]:
+    def available_avatars() -> Dict[str, str]:
         raise Exception("Not implemented")
+
+    def run_pipeline(self, task: InferenceQueueTask, args: List[str], cwd: str) -> None:
+        """ Runs a pipeline script for task in its own process group, such that cancel is able to terminate the script including all of its children.
+        Raises a CalledProcessError if the pipeline fails or is terminated.
+        """
+        process = subprocess.Popen(
+            args=args,
+            cwd=cwd,  # Working directory from which to run the shell command
+            universal_newlines=True,  # Decode output
+            start_new_session=True,  # Places the pipeline into a new process group
+        )
+
+        with self._processes_lock:
+            self._processes[task.request.video_id] = process
+
+        try:
+            return_code = process.wait()
+        finally:
+            with self._processes_lock:
+                self._processes.pop(task.request.video_id, None)
+
+        if return_code != 0:
+            raise subprocess.CalledProcessError(returncode=return_code, cmd=args)
+
+    def cancel(self, video_id: str) -> bool:
+        """ Terminates the running pipeline of video_id and returns True, or returns False if no pipeline is running for it.
+        Processes ignoring SIGTERM are killed after PROCESS_TERMINATION_TIMEOUT_SECONDS.
+        """
+        with self._processes_lock:
+            process = self._processes.get(video_id)
+
+        if process is None:
+            return False
+
+        print(f"Terminating the pipeline of video_id={video_id}")
+        self._signal_process_group(process=process, sig=signal.SIGTERM)
+
+        try:
+            process.wait(timeout=PROCESS_TERMINATION_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            print(f"The pipeline of video_id={video_id} did not terminate within {PROCESS_TERMINATION_TIMEOUT_SECONDS}s, killing it")
+            self._signal_process_group(process=process, sig=signal.SIGKILL)
+
+        return True
+
+    @staticmethod
+    def _signal_process_group(process: subprocess.Popen, sig: signal.Signals) -> None:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass  # The pipeline has already exited
@@ -1,7 +1,9 @@
 import os
 from time import sleep
+from typing import Dict
 
 from avatar_backend_api.background_tools.inference_queue import AvatarBaseModel, InferenceQueueTask
+from avatar_backend_api.config import AvatarConfig
 
 INFERENCE_DELAY_SECONDS = 1
 
@@ -14,6 +16,10 @@ class MockAvatarModel(AvatarBaseModel):
     def is_ready(self) -> bool:
         return True
 
+    @staticmethod
+    def available_avatars() -> Dict[str, str]:
+        return AvatarConfig.available_avatars
+
     def inference(self, task: InferenceQueueTask) -> None:
         sleep(INFERENCE_DELAY_SECONDS)
         print(f"Processed audio: {task.request.video_id} with avatar: {task.request.avatar.value}")
@@ -0,0 +1,90 @@
+""" Compares the TinyDB and SQLite db clients on synthetic data.
+
+Usage:
+    python -m avatar_backend_api.tests.benchmark_db_client --rows 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple, Any
+
+from mtc_api_utils.api_types import FirebaseUser
+
+from avatar_backend_api.api_types import VideoMetadata, BaseAvatar, AvatarModel
+from avatar_backend_api.clients.db_client import AvatarDbClient, SqliteAvatarDbClient, BaseAvatarDbClient
+
+BENCHMARK_DIR = "/tmp/benchmark-dbs"
+VIDEOS_PER_USER = 100
+LOOKUPS = 1000
+
+
+def _documents(rows: int) -> List[Tuple[str, Dict[str, Any]]]:
+    template = VideoMetadata(
+        video_id="benchmark",
+        audio_name="benchmark-audio",
+        avatar=BaseAvatar.Jennifer_355_9415,
+        avatar_model=AvatarModel.motion_gan,
+    ).json_dict
+
+    return [(f"user-{index // VIDEOS_PER_USER}@example.com", {**template, "videoId": f"video-{index}"}) for index in range(rows)]
+
+
+def _load_tinydb(db_client: AvatarDbClient, documents: List[Tuple[str, Dict[str, Any]]]) -> None:
+    per_user: Dict[str, List[Dict[str, Any]]] = {}
+    for user_email, doc in documents:
+        per_user.setdefault(user_email, []).append(doc)
+
+    for user_email, docs in per_user.items():
+        db_client.db.table(name=user_email).insert_multiple(docs)
+
+
+def _timed(name: str, operation: Callable[[], Any], repetitions: int = 1) -> None:
+    start = perf_counter()
+    for _ in range(repetitions):
+        operation()
+    elapsed = perf_counter() - start
+
+    print(f"  {name:<28} total={elapsed:10.3f}s  per_op={elapsed / repetitions * 1e3:10.3f}ms")
+
+
+def benchmark(db_client: BaseAvatarDbClient, documents: List[Tuple[str, Dict[str, Any]]]) -> None:
+    video_ids = [doc["videoId"] for _, doc in random.sample(documents, k=min(LOOKUPS, len(documents)))]
+    user = FirebaseUser(email=documents[-1][0], roles=[])
+    metadata = VideoMetadata.parse_obj(documents[-1][1])
+
+    if isinstance(db_client, AvatarDbClient):
+        _timed("bulk load", lambda: _load_tinydb(db_client=db_client, documents=documents))
+    else:
+        _timed("bulk load", lambda: db_client.insert_documents(documents=documents))
+
+    lookups = iter(video_ids)
+    _timed("get_user_from_id", lambda: db_client.get_user_from_id(video_id=next(lookups)), repetitions=len(video_ids))
+    _timed("list_videos (first page)", lambda: db_client.list_videos(user=user, limit=20), repetitions=100)
+    _timed("get_video", lambda: db_client.get_video(video_id=metadata.video_id, user=user), repetitions=100)
+    _timed("upsert_video", lambda: db_client.upsert_video(video_metadata=metadata, user=user), repetitions=10)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the avatar db clients")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--skip_tinydb", action="store_true", help="TinyDB takes very long for large row counts")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+        documents = _documents(rows=rows)
+
+        clients: Dict[str, Callable[[], BaseAvatarDbClient]] = {
+            "sqlite": lambda: SqliteAvatarDbClient(db_filepath=os.path.join(BENCHMARK_DIR, f"{rows}.sqlite3")),
+        }
+        if not args.skip_tinydb:
+            clients["tinydb"] = lambda: AvatarDbClient(db_filepath=os.path.join(BENCHMARK_DIR, f"{rows}.json"))
+
+        for name, create_client in clients.items():
+            print(f"{name} with {rows} rows:")
+            benchmark(db_client=create_client(), documents=documents)
+
+    shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
@@ -4,10 +4,12 @@ from fastapi.testclient import TestClient
 
 from avatar_backend_api.api_types import VideoMetadata, ApiRoute, AvatarRequest
 from avatar_backend_api.app import app
-from avatar_backend_api.clients.avatar_client import AvatarModelClient
+from mtc_api_utils.clients.api_client import ApiClient
 
 
-class AvatarModelTestClient(AvatarModelClient):
+class AvatarModelTestClient(ApiClient):
+    """ Synchronous client for the avatar API, mirroring the AvatarModelClient interface """
+
     def __init__(self, backend_url="", http_client=TestClient(app=app)):
         super().__init__(backend_url=backend_url, http_client=http_client)
 
@@ -0,0 +1,168 @@
+from http import HTTPStatus
+from typing import List, Optional
+from unittest import IsolatedAsyncioTestCase
+
+from fastapi import HTTPException
+
+from avatar_backend_api.api_types import AvatarModelRequest, BackendQueueStatus, BaseAvatar, StageTiming
+from avatar_backend_api.clients.backend_pool import BackendPool
+from avatar_backend_api.clients.mock_avatar_model_client import MockAvatarModelClient
+
+TEST_EJECTION_THRESHOLD = 2
+TEST_COLD_AVATAR_PENALTY = 2
+
+
+class ReplicaTestClient(MockAvatarModelClient):
+    """ Mocks a single replica with a configurable queue status, which keeps track of the videos it received """
+
+    def __init__(self, backend_url: str, queue_depth: int = 0, warm_avatars: Optional[List[str]] = None):
+        super().__init__(backend_url=backend_url)
+        self.status = BackendQueueStatus(ready=True, queue_depth=queue_depth, warm_avatars=warm_avatars or [])
+        self.available = True
+        self.video_ids: List[str] = []
+        self.running_video_ids: List[str] = []  # Videos being processed, which are not listed until they are completed
+
+    async def queue_status(self) -> BackendQueueStatus:
+        if not self.available:
+            raise ConnectionError(f"Replica {self.backend_url} is unavailable")
+
+        return self.status
+
+    async def list_video_ids(self) -> List[str]:
+        return self.video_ids
+
+    async def post_audio(self, audio, metadata: AvatarModelRequest, user_email: Optional[str] = None, priority: int = 0) -> AvatarModelRequest:
+        self.video_ids.append(metadata.video_id)
+        return metadata
+
+    async def delete_video(self, video_id: str) -> str:
+        for video_ids in [self.video_ids, self.running_video_ids]:
+            if video_id in video_ids:
+                video_ids.remove(video_id)
+                return video_id
+
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"Video with video_id={video_id} was not found")
+
+
+def _request(video_id: str, avatar: BaseAvatar = BaseAvatar.Jennifer_355_9415) -> AvatarModelRequest:
+    return AvatarModelRequest(video_id=video_id, avatar=avatar.value)
+
+
+class TestBackendPool(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.busy = ReplicaTestClient(backend_url="busy", queue_depth=3, warm_avatars=[BaseAvatar.Jennifer_355_9415.value])
+        self.warm = ReplicaTestClient(backend_url="warm", queue_depth=1, warm_avatars=[BaseAvatar.Jennifer_355_9415.value])
+        self.idle = ReplicaTestClient(backend_url="idle", queue_depth=0)
+
+        self.pool = BackendPool(
+            replicas=[self.busy, self.warm, self.idle],
+            ejection_threshold=TEST_EJECTION_THRESHOLD,
+            cold_avatar_penalty=TEST_COLD_AVATAR_PENALTY,
+        )
+
+    async def test_unavailable_before_refresh(self):
+        with self.assertRaises(HTTPException) as context:
+            await self.pool.post_audio(audio=("test", bytes()), metadata=_request("test-id"))
+
+        self.assertEqual(HTTPStatus.SERVICE_UNAVAILABLE, context.exception.status_code)
+
+    async def test_dispatch(self):
+        self.assertTrue(await self.pool.readiness())
+
+        # The warm replica wins for its avatar despite its queue, the idle one for any other avatar
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("warm-1"))
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("cold-1", avatar=BaseAvatar.Arthur_A2226))
+        self.assertEqual(["warm-1"], self.warm.video_ids)
+        self.assertEqual(["cold-1"], self.idle.video_ids)
+
+        # Until the next refresh, replicas are anticipated to be warm for the avatars they received, as well as to hold one more task
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("cold-2", avatar=BaseAvatar.Arthur_A2226))
+        self.assertEqual(["cold-1", "cold-2"], self.idle.video_ids)
+
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("warm-2"))
+        self.assertEqual(["warm-1", "warm-2"], self.warm.video_ids)
+        self.assertEqual([], self.busy.video_ids)
+
+    async def test_admission_control(self):
+        await self.pool.refresh()
+        self.pool.max_queue_depth = 1
+
+        # Only the idle replica is able to accept the request, despite not being warm for the avatar
+        self.assertEqual("idle", self.pool.select_replica(avatar=BaseAvatar.Jennifer_355_9415.value).name)
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("video-1"))
+
+        self.warm.status = BackendQueueStatus(
+            ready=True,
+            queue_depth=1,
+            stage_timings={"inference": StageTiming(samples=1, mean_seconds=100, seconds_per_audio_second=10)},
+            estimated_seconds_remaining={"video-0": 42.2},
+        )
+        self.idle.status = BackendQueueStatus(ready=True, queue_depth=1)
+        await self.pool.refresh()
+
+        with self.assertRaises(HTTPException) as context:
+            await self.pool.post_audio(audio=("test", bytes()), metadata=_request("video-2"))
+
+        self.assertEqual(HTTPStatus.TOO_MANY_REQUESTS, context.exception.status_code)
+        self.assertEqual("43", context.exception.headers["Retry-After"])
+
+        # One queued task of 100s on average, followed by the new task of 5s audio
+        warm_replica = next(replica for replica in self.pool.replicas if replica.name == "warm")
+        self.assertEqual(150, warm_replica.estimate_seconds(audio_seconds=5, default_task_seconds=self.pool.default_task_seconds))
+
+    async def test_ejection(self):
+        await self.pool.refresh()
+        self.idle.available = False
+
+        await self.pool.refresh()
+        self.assertEqual(3, len(self.pool.healthy_replicas()))
+
+        await self.pool.refresh()
+        self.assertNotIn("idle", [replica.name for replica in self.pool.healthy_replicas()])
+
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("cold-1", avatar=BaseAvatar.Arthur_A2226))
+        self.assertEqual(["cold-1"], self.warm.video_ids)
+
+        self.idle.available = True
+        await self.pool.refresh()
+        self.assertEqual(3, len(self.pool.healthy_replicas()))
+
+    async def test_retrieval_from_producing_replica(self):
+        await self.pool.refresh()
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("video-1"))
+
+        # After a restart, the producing replica is found by listing the videos of all replicas
+        restarted_pool = BackendPool(replicas=[self.busy, self.warm, self.idle])
+        await restarted_pool.refresh()
+
+        for pool in [self.pool, restarted_pool]:
+            self.assertEqual("warm", (await pool._replica_for(video_id="video-1")).name)
+
+        await restarted_pool.delete_video(video_id="video-1")
+        self.assertEqual([], self.warm.video_ids)
+
+        with self.assertRaises(HTTPException):
+            await restarted_pool.delete_video(video_id="video-1")
+
+    async def test_cancel_in_flight_after_restart(self):
+        await self.pool.refresh()
+        await self.pool.post_audio(audio=("test", bytes()), metadata=_request("video-1"))
+
+        # The warm replica is still processing video-1 when the pool restarts, hence does not list it
+        self.warm.running_video_ids.append(self.warm.video_ids.pop())
+
+        restarted_pool = BackendPool(replicas=[self.busy, self.warm, self.idle])
+        await restarted_pool.refresh()
+
+        with self.assertRaises(HTTPException):
+            await restarted_pool._replica_for(video_id="video-1")
+
+        # The cancellation reaches the replica processing video-1, although all others reject it
+        self.assertEqual("video-1", await restarted_pool.delete_video(video_id="video-1"))
+        self.assertEqual([], self.warm.running_video_ids)
+
+        with self.assertRaises(HTTPException) as context:
+            await restarted_pool.delete_video(video_id="video-1")
+
+        self.assertEqual(HTTPStatus.NOT_FOUND, context.exception.status_code)
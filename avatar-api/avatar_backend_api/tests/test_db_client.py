@@ -1,11 +1,16 @@
+import os
 from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
 
 from mtc_api_utils.api_types import FirebaseUser
 
 from avatar_backend_api.api_types import VideoMetadata, AvatarModel, BaseAvatar
-from avatar_backend_api.clients.db_client import AvatarDbClient, AvatarDbException
+from avatar_backend_api.clients.db_client import AvatarDbClient, AvatarDbException, SqliteAvatarDbClient, BaseAvatarDbClient, DbBackend, create_db_client
+from avatar_backend_api.clients.db_migration import migrate_tinydb_to_sqlite
 
 TEST_DB_DIR = "/tmp/test-dbs/avatar-db.json"
+TEST_SQLITE_DB_DIR = "/tmp/test-dbs/avatar-db.sqlite3"
+TEST_MIGRATED_DB_DIR = "/tmp/test-dbs/avatar-db-migrated.sqlite3"
 
 TEST_USER = FirebaseUser.example()
 
@@ -24,39 +29,131 @@ TEST_METADATA_2 = VideoMetadata(
 )
 
 TEST_DB_CLIENT = AvatarDbClient(db_filepath=TEST_DB_DIR)
+TEST_SQLITE_DB_CLIENT = SqliteAvatarDbClient(db_filepath=TEST_SQLITE_DB_DIR)
 
 
 class TestDbClient(IsolatedAsyncioTestCase):
+    db_client: BaseAvatarDbClient = TEST_DB_CLIENT
 
     def setUp(self) -> None:
-        TEST_DB_CLIENT.db.drop_tables()
+        TEST_DB_CLIENT.clear()
+        TEST_SQLITE_DB_CLIENT.clear()
 
     def tearDown(self) -> None:
         self.setUp()
 
     def test_db_client(self):
         # Test access nonexistent entries & error handling
-        self.assertFalse(TEST_DB_CLIENT.video_exists(video_id=TEST_METADATA.video_id, user=TEST_USER))
-        self.assertEqual(0, len(TEST_DB_CLIENT.list_videos(user=TEST_USER)))
-        self.assertRaises(AvatarDbException, lambda: TEST_DB_CLIENT.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
-        self.assertRaises(AvatarDbException, lambda: TEST_DB_CLIENT.delete_video(TEST_METADATA_2.video_id, user=TEST_USER))
-        self.assertRaises(AvatarDbException, lambda: TEST_DB_CLIENT.get_user_from_id(video_id=TEST_METADATA.video_id))
+        self.assertFalse(self.db_client.video_exists(video_id=TEST_METADATA.video_id, user=TEST_USER))
+        self.assertEqual(0, len(self.db_client.list_videos(user=TEST_USER)))
+        self.assertRaises(AvatarDbException, lambda: self.db_client.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
+        self.assertRaises(AvatarDbException, lambda: self.db_client.delete_video(TEST_METADATA_2.video_id, user=TEST_USER))
+        self.assertRaises(AvatarDbException, lambda: self.db_client.get_user_from_id(video_id=TEST_METADATA.video_id))
 
         # Test successful manipulation of db
-        TEST_DB_CLIENT.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
-        self.assertEqual(1, len(TEST_DB_CLIENT.list_videos(user=TEST_USER)))
-        self.assertEqual(TEST_METADATA, TEST_DB_CLIENT.get_video(TEST_METADATA.video_id, user=TEST_USER))
-        self.assertEqual(TEST_METADATA, TEST_DB_CLIENT.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
+        self.db_client.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
+        self.assertEqual(1, len(self.db_client.list_videos(user=TEST_USER)))
+        self.assertEqual(TEST_METADATA, self.db_client.get_video(TEST_METADATA.video_id, user=TEST_USER))
+        self.assertEqual(TEST_METADATA, self.db_client.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
 
         TEST_METADATA.inference_completed = True
-        TEST_DB_CLIENT.upsert_video(video_metadata=TEST_METADATA, user=TEST_USER)
-        self.assertEqual(TEST_METADATA, TEST_DB_CLIENT.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
+        self.db_client.upsert_video(video_metadata=TEST_METADATA, user=TEST_USER)
+        self.assertEqual(TEST_METADATA, self.db_client.get_video(video_id=TEST_METADATA.video_id, user=TEST_USER))
+
+        self.db_client.insert_video(video_metadata=TEST_METADATA_2, user=TEST_USER)
+        self.assertEqual(2, len(self.db_client.list_videos(user=TEST_USER)))
+        self.assertEqual(TEST_METADATA_2, self.db_client.get_video(video_id=TEST_METADATA_2.video_id, user=TEST_USER))
+
+        self.assertEqual(TEST_METADATA_2, self.db_client.delete_video(TEST_METADATA_2.video_id, user=TEST_USER))
+        self.assertEqual(1, len(self.db_client.list_videos(user=TEST_USER)))
+        self.assertEqual(TEST_METADATA, self.db_client.get_video(TEST_METADATA.video_id, user=TEST_USER))
+        self.assertEqual(TEST_METADATA, self.db_client.delete_video(TEST_METADATA.video_id, user=TEST_USER))
+
+        self.assertRaises(AvatarDbException, lambda: self.db_client.get_user_from_id(video_id=TEST_METADATA.video_id))
+
+    def test_list_videos_pagination(self):
+        for index in range(5):
+            self.db_client.insert_video(video_metadata=VideoMetadata(**{**TEST_METADATA.json_dict, "videoId": f"test-id-{index}"}), user=TEST_USER)
+
+        self.assertEqual(5, len(self.db_client.list_videos(user=TEST_USER)))
+        self.assertEqual(["test-id-0", "test-id-1"], [video.video_id for video in self.db_client.list_videos(user=TEST_USER, limit=2)])
+        self.assertEqual(["test-id-2", "test-id-3"], [video.video_id for video in self.db_client.list_videos(user=TEST_USER, limit=2, offset=2)])
+        self.assertEqual(["test-id-4"], [video.video_id for video in self.db_client.list_videos(user=TEST_USER, limit=2, offset=4)])
+        self.assertEqual(TEST_USER.email, self.db_client.get_user_from_id(video_id="test-id-3"))
+
+    def test_list_videos_page(self):
+        for index in range(5):
+            self.db_client.insert_video(
+                video_metadata=VideoMetadata(**{**TEST_METADATA.json_dict, "videoId": f"test-id-{index}", "inferenceCompleted": index % 2 == 0}),
+                user=TEST_USER,
+            )
+
+        video_ids, cursor = [], None
+        while True:
+            page, cursor = self.db_client.list_videos_page(user=TEST_USER, limit=2, cursor=cursor)
+            video_ids.append([video.video_id for video in page])
+
+            if cursor is None:
+                break
+
+        self.assertEqual([["test-id-0", "test-id-1"], ["test-id-2", "test-id-3"], ["test-id-4"]], video_ids)
+
+        completed, cursor = self.db_client.list_videos_page(user=TEST_USER, limit=2, inference_completed=True)
+        self.assertEqual(["test-id-0", "test-id-2"], [video.video_id for video in completed])
+
+        completed, cursor = self.db_client.list_videos_page(user=TEST_USER, limit=2, cursor=cursor, inference_completed=True)
+        self.assertEqual(["test-id-4"], [video.video_id for video in completed])
+        self.assertIsNone(cursor)
+
+        cancelled_video = self.db_client.get_video(video_id="test-id-1", user=TEST_USER)
+        cancelled_video.cancelled = True
+        self.db_client.upsert_video(video_metadata=cancelled_video, user=TEST_USER)
+
+        cancelled, _ = self.db_client.list_videos_page(user=TEST_USER, limit=10, cancelled=True)
+        self.assertEqual(["test-id-1"], [video.video_id for video in cancelled])
+
+        processing, _ = self.db_client.list_videos_page(user=TEST_USER, limit=10, inference_completed=False, cancelled=False)
+        self.assertEqual(["test-id-3"], [video.video_id for video in processing])
 
+        other_avatar, _ = self.db_client.list_videos_page(user=TEST_USER, limit=10, avatar=BaseAvatar.Arthur_A2226.value)
+        self.assertEqual([], other_avatar)
+
+        other_model, _ = self.db_client.list_videos_page(user=TEST_USER, limit=10, avatar_model=AvatarModel.neural_voice)
+        self.assertEqual([], other_model)
+
+        self.assertRaises(AvatarDbException, lambda: self.db_client.list_videos_page(user=TEST_USER, limit=2, cursor="invalid"))
+
+
+class TestSqliteDbClient(TestDbClient):
+    db_client: BaseAvatarDbClient = TEST_SQLITE_DB_CLIENT
+
+    def test_migration(self):
+        TEST_DB_CLIENT.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
         TEST_DB_CLIENT.insert_video(video_metadata=TEST_METADATA_2, user=TEST_USER)
-        self.assertEqual(2, len(TEST_DB_CLIENT.list_videos(user=TEST_USER)))
-        self.assertEqual(TEST_METADATA_2, TEST_DB_CLIENT.get_video(video_id=TEST_METADATA_2.video_id, user=TEST_USER))
 
-        self.assertEqual(TEST_METADATA_2, TEST_DB_CLIENT.delete_video(TEST_METADATA_2.video_id, user=TEST_USER))
-        self.assertEqual(1, len(TEST_DB_CLIENT.list_videos(user=TEST_USER)))
-        self.assertEqual(TEST_METADATA, TEST_DB_CLIENT.get_video(TEST_METADATA.video_id, user=TEST_USER))
-        self.assertEqual(TEST_METADATA, TEST_DB_CLIENT.delete_video(TEST_METADATA.video_id, user=TEST_USER))
+        self.assertEqual(2, migrate_tinydb_to_sqlite(tinydb_client=TEST_DB_CLIENT, sqlite_client=TEST_SQLITE_DB_CLIENT))
+        self.assertEqual(TEST_DB_CLIENT.list_videos(user=TEST_USER), TEST_SQLITE_DB_CLIENT.list_videos(user=TEST_USER))
+        self.assertEqual(TEST_USER.email, TEST_SQLITE_DB_CLIENT.get_user_from_id(video_id=TEST_METADATA_2.video_id))
+
+        # Rerunning the migration must not duplicate any documents
+        migrate_tinydb_to_sqlite(tinydb_client=TEST_DB_CLIENT, sqlite_client=TEST_SQLITE_DB_CLIENT)
+        self.assertEqual(2, TEST_SQLITE_DB_CLIENT.count())
+
+    def test_interrupted_migration_is_retried(self):
+        TEST_DB_CLIENT.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
+        TEST_DB_CLIENT.insert_video(video_metadata=TEST_METADATA_2, user=TEST_USER)
+
+        if os.path.isfile(TEST_MIGRATED_DB_DIR):
+            os.remove(TEST_MIGRATED_DB_DIR)
+
+        with patch.object(SqliteAvatarDbClient, "insert_documents", side_effect=RuntimeError("Migration crashed")):
+            self.assertRaises(RuntimeError, lambda: create_db_client(backend=DbBackend.sqlite, db_filepath=TEST_DB_DIR, sqlite_db_filepath=TEST_MIGRATED_DB_DIR))
+
+        self.assertFalse(os.path.isfile(TEST_MIGRATED_DB_DIR))
+
+        db_client = create_db_client(backend=DbBackend.sqlite, db_filepath=TEST_DB_DIR, sqlite_db_filepath=TEST_MIGRATED_DB_DIR)
+        self.assertEqual(2, db_client.count())
+        self.assertEqual(TEST_DB_CLIENT.list_videos(user=TEST_USER), db_client.list_videos(user=TEST_USER))
+
+        db_client.close()
+        os.remove(TEST_MIGRATED_DB_DIR)
@@ -1,6 +1,8 @@
 import shutil
 import unittest
-from time import sleep
+from threading import Event
+from time import sleep, time
+from typing import List, Optional
 from unittest import TestCase
 
 from fastapi import UploadFile
@@ -9,12 +11,15 @@ from mtc_api_utils.api_types import FirebaseUser
 from avatar_backend_api.api_types import AvatarModelRequest, BaseAvatar
 from avatar_backend_api.app import io_client
 from avatar_backend_api.background_tools.inference_queue import InferenceQueue, InferenceQueueTask
+from avatar_backend_api.background_tools.stage_statistics import StageStatistics, estimate_task_seconds
+from avatar_backend_api.background_tools.task_queue import InferenceTaskQueue
 from avatar_backend_api.clients.io_client import IoClient
 from avatar_backend_api.clients.mock_avatar_model_client import INFERENCE_DELAY_SECONDS
 from avatar_backend_api.models.mock_avatar_model import MockAvatarModel
 from avatar_backend_api.tests.test_io_client import TEST_VIDEO_BASE_PATH, TEST_AUDIO_BASE_PATH
 
 TEST_AUDIO_DIR = "/tmp/test-audio"
+TEST_JOURNAL_DIR = "/tmp/test-queue-journal"
 
 TEST_UPLOAD_FILE = UploadFile(
     filename="fest-audio-name",
@@ -29,6 +34,8 @@ TEST_TASK = InferenceQueueTask(
     )
 )
 
+PIPELINE_SECONDS = 30
+
 TEST_TASK_2 = InferenceQueueTask(
     user=TEST_TASK.user,
     request=AvatarModelRequest(
@@ -65,6 +72,248 @@ class TestInferenceQueue(TestCase):
         sleep(INFERENCE_DELAY_SECONDS * 3)
         self.assertEqual(0, self.inf_queue.queue.qsize(), msg="Expected worker to process both tasks in the allotted time")
 
+        status = self.inf_queue.status()
+        self.assertEqual(0, status.queue_depth)
+        self.assertEqual(2, status.stage_timings["inference"].samples)
+        self.assertIn(TEST_TASK.request.avatar.value, status.warm_avatars)
+
+    def test_cancel(self):
+        inf_queue = InferenceQueue(
+            model=PipelineTestModel(io_client=io_client),
+            io_client=self.inf_queue.io_client,
+            audio_input_dir=TEST_AUDIO_DIR,
+            daemon_worker=True,
+        )
+
+        inf_queue.add_task(TEST_TASK)
+        inf_queue.add_task(TEST_TASK_2)
+
+        while TEST_TASK.request.video_id not in inf_queue.model._processes:
+            sleep(0.1)
+
+        # The queued task is removed right away
+        self.assertTrue(inf_queue.cancel(video_id=TEST_TASK_2.request.video_id))
+        self.assertEqual(1, inf_queue.queue.qsize())
+
+        # The running pipeline is terminated, instead of running for PIPELINE_SECONDS
+        start = time()
+        self.assertTrue(inf_queue.cancel(video_id=TEST_TASK.request.video_id))
+
+        while not inf_queue.queue.empty():
+            sleep(0.1)
+
+        self.assertLess(time() - start, PIPELINE_SECONDS / 2)
+        self.assertFalse(inf_queue.cancel(video_id=TEST_TASK.request.video_id))
+        self.assertNotIn("post_processing", inf_queue.status().stage_timings)
+
+
+    def test_cancel_while_dequeuing(self):
+        inf_queue = SlowAudioInferenceQueue(
+            model=PipelineTestModel(io_client=io_client),
+            io_client=self.inf_queue.io_client,
+            audio_input_dir=TEST_AUDIO_DIR,
+            daemon_worker=True,
+        )
+
+        inf_queue.add_task(TEST_TASK)
+        self.assertTrue(inf_queue.reading_audio.wait(timeout=5))
+
+        # The task has left the queue but its audio duration is still being read, hence it is already registered as running
+        start = time()
+        self.assertTrue(inf_queue.cancel(video_id=TEST_TASK.request.video_id))
+        inf_queue.audio_read.set()
+
+        while not inf_queue.queue.empty():
+            sleep(0.1)
+
+        # The pipeline is never started
+        self.assertLess(time() - start, PIPELINE_SECONDS / 2)
+        self.assertNotIn("inference", inf_queue.status().stage_timings)
+
+    def test_cancelled_task_is_not_measured(self):
+        inf_queue = InferenceQueue(
+            model=GracefulPipelineTestModel(io_client=io_client),
+            io_client=self.inf_queue.io_client,
+            audio_input_dir=TEST_AUDIO_DIR,
+            daemon_worker=True,
+        )
+
+        inf_queue.add_task(TEST_TASK)
+
+        while TEST_TASK.request.video_id not in inf_queue.model._processes:
+            sleep(0.1)
+
+        # The pipeline exits successfully once terminated, yet its shortened runtime must not distort the estimates
+        self.assertTrue(inf_queue.cancel(video_id=TEST_TASK.request.video_id))
+
+        while not inf_queue.queue.empty():
+            sleep(0.1)
+
+        self.assertEqual({}, inf_queue.status().stage_timings)
+
+    def test_worker_survives_failing_audio_read(self):
+        inf_queue = FailingAudioInferenceQueue(
+            model=MockAvatarModel(io_client=io_client),
+            io_client=self.inf_queue.io_client,
+            audio_input_dir=TEST_AUDIO_DIR,
+            daemon_worker=True,
+        )
+
+        inf_queue.add_task(TEST_TASK)
+        inf_queue.add_task(TEST_TASK_2)
+
+        sleep(INFERENCE_DELAY_SECONDS * 3)
+        self.assertEqual(0, inf_queue.queue.qsize(), msg="Expected the worker to process the task after the failing one")
+        self.assertEqual(1, inf_queue.status().stage_timings["inference"].samples)
+        self.assertEqual({}, inf_queue._running_tasks)
+
+
+class FailingAudioInferenceQueue(InferenceQueue):
+
+    def _audio_seconds(self, task: InferenceQueueTask) -> Optional[float]:
+        if task.request.video_id == TEST_TASK.request.video_id:
+            raise OSError("Unable to read the audio")
+
+        return None
+
+
+class SlowAudioInferenceQueue(InferenceQueue):
+
+    def __init__(self, **kwargs):
+        self.reading_audio = Event()
+        self.audio_read = Event()
+
+        super().__init__(**kwargs)
+
+    def _audio_seconds(self, task: InferenceQueueTask) -> Optional[float]:
+        self.reading_audio.set()
+        self.audio_read.wait()
+
+        return None
+
+
+class PipelineTestModel(MockAvatarModel):
+
+    def inference(self, task: InferenceQueueTask) -> None:
+        self.run_pipeline(task=task, args=["bash", "-c", f"sleep {PIPELINE_SECONDS}"], cwd="/tmp")
+
+
+class GracefulPipelineTestModel(MockAvatarModel):
+
+    def inference(self, task: InferenceQueueTask) -> None:
+        self.run_pipeline(task=task, args=["bash", "-c", f"trap 'exit 0' TERM; sleep {PIPELINE_SECONDS} & wait"], cwd="/tmp")
+
+
+def _task(video_id: str, email: str, priority: int = 0) -> InferenceQueueTask:
+    return InferenceQueueTask(
+        user=FirebaseUser(email=email, roles=[]),
+        request=AvatarModelRequest(video_id=video_id, avatar=TEST_TASK.request.avatar),
+        priority=priority,
+    )
+
+
+class TestInferenceTaskQueue(TestCase):
+
+    def setUp(self) -> None:
+        shutil.rmtree(path=TEST_JOURNAL_DIR, ignore_errors=True)
+        self.queue = InferenceTaskQueue(journal_dir=TEST_JOURNAL_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(path=TEST_JOURNAL_DIR, ignore_errors=True)
+
+    def _drain(self) -> List[str]:
+        video_ids = []
+        while (task := self.queue.get(timeout=0)) is not None:
+            video_ids.append(task.request.video_id)
+            self.queue.task_done(task=task)
+
+        return video_ids
+
+    def test_priority_and_fairness(self):
+        for task in [
+            _task("a1", email="a"), _task("a2", email="a"), _task("a3", email="a"),
+            _task("b1", email="b"), _task("b2", email="b"),
+            _task("urgent", email="a", priority=1),
+        ]:
+            self.assertTrue(self.queue.put(task))
+
+        self.assertEqual(["urgent", "a1", "b1", "a2", "b2", "a3"], [task.request.video_id for task in self.queue.pending_tasks()])
+        self.assertEqual(["urgent", "a1", "b1", "a2", "b2", "a3"], self._drain())
+        self.assertTrue(self.queue.empty())
+
+    def test_duplicate_suppression(self):
+        self.assertTrue(self.queue.put(TEST_TASK))
+        self.assertFalse(self.queue.put(TEST_TASK))
+
+        # Tasks remain tracked while being processed
+        task = self.queue.get(timeout=0)
+        self.assertFalse(self.queue.put(TEST_TASK))
+        self.assertEqual(0, self.queue.pending())
+        self.assertEqual(1, self.queue.qsize())
+
+        self.queue.task_done(task=task)
+        self.assertTrue(self.queue.put(TEST_TASK))
+
+    def test_remove(self):
+        for task in [_task("a1", email="a"), _task("a2", email="a"), _task("b1", email="b")]:
+            self.queue.put(task)
+
+        self.assertEqual("a1", self.queue.remove(video_id="a1").request.video_id)
+        self.assertIsNone(self.queue.remove(video_id="a1"))
+        self.assertEqual(2, self.queue.qsize())
+
+        # Tasks which have been handed to a worker are not removed
+        running_task = self.queue.get(timeout=0)
+        self.assertIsNone(self.queue.remove(video_id=running_task.request.video_id))
+
+        self.assertIsNotNone(self.queue.remove(video_id="b1"))
+        self.assertEqual(0, self.queue.pending())
+        self.assertEqual(1, len(InferenceTaskQueue(journal_dir=TEST_JOURNAL_DIR).pending_tasks()))
+
+    def test_journal(self):
+        self.queue.put(TEST_TASK)
+        self.queue.put(TEST_TASK_2)
+        self.queue.task_done(task=self.queue.get(timeout=0))
+
+        restored_queue = InferenceTaskQueue(journal_dir=TEST_JOURNAL_DIR)
+        self.assertEqual(1, restored_queue.qsize())
+
+        restored_task = restored_queue.get(timeout=0)
+        self.assertEqual(TEST_TASK_2, restored_task)
+        self.assertIsNone(restored_queue.get(timeout=0))
+
+
+class TestStageStatistics(TestCase):
+
+    def test_timings(self):
+        statistics = StageStatistics(window_size=2)
+        self.assertIsNone(estimate_task_seconds(timings=statistics.timings()))
+
+        statistics.record(stage="inference", duration_seconds=100, audio_seconds=10)
+        statistics.record(stage="inference", duration_seconds=20, audio_seconds=10)
+        statistics.record(stage="inference", duration_seconds=40, audio_seconds=10)
+        statistics.record(stage="post_processing", duration_seconds=4)
+
+        timings = statistics.timings()
+        self.assertEqual(2, timings["inference"].samples)
+        self.assertEqual(30, timings["inference"].mean_seconds)
+        self.assertEqual(3, timings["inference"].seconds_per_audio_second)
+        self.assertIsNone(timings["post_processing"].seconds_per_audio_second)
+
+        self.assertEqual(34, estimate_task_seconds(timings=timings))
+        self.assertEqual(64, estimate_task_seconds(timings=timings, audio_seconds=20))
+
+    def test_measure_discard(self):
+        statistics = StageStatistics()
+
+        with statistics.measure(stage="inference", discard=lambda: True):
+            pass
+
+        with statistics.measure(stage="post_processing", discard=lambda: False):
+            pass
+
+        self.assertEqual(["post_processing"], list(statistics.timings().keys()))
+
 
 if __name__ == '__main__':
     unittest.main()
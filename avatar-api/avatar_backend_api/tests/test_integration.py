@@ -1,11 +1,12 @@
 from http import HTTPStatus
 from time import sleep
 from unittest import TestCase
+from unittest.mock import patch
 
 from fastapi import HTTPException
 from httpx import HTTPStatusError
 
-from avatar_backend_api.api_types import AvatarModel, AvatarRequest, BaseAvatar
+from avatar_backend_api.api_types import AvatarModel, AvatarRequest, BaseAvatar, ApiRoute, InferenceCompletedNotification, BACKEND_TOKEN_HEADER
 from avatar_backend_api.clients.mock_avatar_model_client import INFERENCE_DELAY_SECONDS
 from avatar_backend_api.config import AvatarConfig
 from avatar_backend_api.tests.integration_test_client import AvatarModelTestClient
@@ -31,8 +32,14 @@ class TestIntegration(TestCase):
 
     @classmethod
     def setUpClass(cls) -> None:
+        # Entering the TestClient runs the app startup events, which start the result poll worker
+        cls.client.http_client.__enter__()
         cls.client.wait_for_service_readiness()
 
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.client.http_client.__exit__(None, None, None)
+
     def setUp(self) -> None:
         try:
             self.client.delete_video(video_id=TEST_INFERENCE_REQUEST.video_id)
@@ -83,3 +90,18 @@ class TestIntegration(TestCase):
 
         self.assertIn(TEST_INFERENCE_REQUEST.video_id, video_ids)
         self.assertIn(TEST_INFERENCE_REQUEST.video_id, video_ids)
+
+    def test_inference_completed_requires_backend_token(self):
+        notification = InferenceCompletedNotification(video_id=TEST_INFERENCE_REQUEST.video_id, avatar_model=TEST_INFERENCE_REQUEST.avatar_model)
+
+        def notify(headers=None) -> int:
+            return self.client.http_client.post(url=ApiRoute.inference_completed.value, json=notification.json_dict, headers=headers).status_code
+
+        with patch.object(AvatarConfig, "backend_service_token", ""):
+            # Without a configured token, nobody may notify the API
+            self.assertEqual(HTTPStatus.UNAUTHORIZED, notify(headers={BACKEND_TOKEN_HEADER: ""}))
+
+        with patch.object(AvatarConfig, "backend_service_token", "test-token"):
+            self.assertEqual(HTTPStatus.UNAUTHORIZED, notify())
+            self.assertEqual(HTTPStatus.UNAUTHORIZED, notify(headers={BACKEND_TOKEN_HEADER: "wrong-token"}))
+            self.assertEqual(HTTPStatus.ACCEPTED, notify(headers={BACKEND_TOKEN_HEADER: "test-token"}))
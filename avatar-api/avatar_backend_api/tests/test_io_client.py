@@ -1,9 +1,13 @@
+import io
 import os.path
 import shutil
+import struct
+import wave
 from enum import Enum
+from glob import glob
 from unittest import TestCase
 
-from avatar_backend_api.clients.io_client import IoClient, IoClientException
+from avatar_backend_api.clients.io_client import IoClient, IoClientException, audio_duration_seconds
 from avatar_backend_api.tests.test_db_client import TEST_USER
 from fastapi import UploadFile
 from mtc_api_utils.api_types import FirebaseUser
@@ -48,6 +52,22 @@ class TestIoClient(TestCase):
     def tearDown(self) -> None:
         shutil.rmtree(TEST_BASE_PATH, ignore_errors=True)
 
+    def test_audio_duration_seconds(self):
+        audio = io.BytesIO()
+        with wave.open(audio, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(16000)
+            wav_file.writeframes(bytes(2 * 8000))
+
+        self.assertEqual(0.5, audio_duration_seconds(audio=io.BytesIO(audio.getvalue())))
+
+        # A frame rate of 0 and a truncated header are malformed, rather than failing
+        zero_framerate = bytearray(audio.getvalue())
+        zero_framerate[24:28] = struct.pack("<I", 0)
+        self.assertIsNone(audio_duration_seconds(audio=io.BytesIO(bytes(zero_framerate))))
+        self.assertIsNone(audio_duration_seconds(audio=io.BytesIO(audio.getvalue()[:30])))
+
     def test_audio_without_user_dir_mode(self):
         client = TEST_IO_CLIENT.audio
 
@@ -167,3 +187,29 @@ class TestIoClient(TestCase):
 
         client.delete_file(video_id=TEST_ID, user=TEST_USER)
         self.assertFalse(client.file_exists(video_id=TEST_ID, user=TEST_USER))
+
+    def test_video_save_chunks(self):
+        client = TEST_IO_CLIENT.video
+
+        with open(TEST_FILE_PATH, "rb") as test_file:
+            file_bytes = test_file.read()
+
+        # Save as an iterable of chunks, as produced by a streamed download
+        chunks = [file_bytes[start:start + 1024] for start in range(0, len(file_bytes), 1024)]
+        path = client.save_to_disk(video_bytes=iter(chunks), video_id=TEST_ID)
+
+        with open(path, "rb") as saved_file:
+            self.assertEqual(file_bytes, saved_file.read())
+
+        self.assertEqual([client.video_path(video_id=TEST_ID)], client.list_videos())
+
+        # A failing download must neither leave a partial file behind nor overwrite the existing video
+        def failing_chunks():
+            yield chunks[0]
+            raise IOError("Connection lost")
+
+        self.assertRaises(IOError, lambda: client.save_to_disk(video_bytes=failing_chunks(), video_id=TEST_ID))
+        self.assertEqual([path], glob(os.path.join(TEST_VIDEO_BASE_PATH, "*")))
+
+        with open(path, "rb") as saved_file:
+            self.assertEqual(file_bytes, saved_file.read())
@@ -1,12 +1,15 @@
 import os.path
 import shutil
-from unittest import TestCase
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from unittest import IsolatedAsyncioTestCase
 
 from fastapi import HTTPException
 
 from avatar_backend_api.api_types import AvatarModel, AvatarModelRequest
 from avatar_backend_api.background_tools.model_result_poll_worker import ModelResultPollWorker
 from avatar_backend_api.clients.mock_avatar_model_client import MockAvatarModelClient
+from avatar_backend_api.clients.result_cache import ResultCache
 from avatar_backend_api.tests.test_db_client import TEST_USER, TEST_METADATA, TEST_DB_CLIENT
 from avatar_backend_api.tests.test_io_client import TEST_IO_CLIENT_WITH_USER_MODE
 
@@ -14,22 +17,30 @@ TEST_AVATAR_MODEL = AvatarModel.neural_voice
 
 TEST_MODEL_REQUEST = AvatarModelRequest(**TEST_METADATA.json_dict)
 
+TEST_CACHE_DIR = "/tmp/test-poll-worker-cache"
 
-class TestResultPollWorker(ModelResultPollWorker):
-    """ A test variation of the ModelResultPollWorker which does not call any actions in the background """
 
-    def _worker(self):
-        pass
+class CancellingAvatarModelClient(MockAvatarModelClient):
+    """ Simulates a user cancelling the video while it is being downloaded """
 
+    @asynccontextmanager
+    async def stream_video(self, video_id: str) -> AsyncIterator[AsyncIterator[bytes]]:
+        video_metadata = TEST_DB_CLIENT.get_video(video_id=video_id, user=TEST_USER)
+        video_metadata.cancelled = True
+        TEST_DB_CLIENT.upsert_video(video_metadata=video_metadata, user=TEST_USER)
 
-class TestModelResultPollWorker(TestCase):
+        async with super().stream_video(video_id=video_id) as chunks:
+            yield chunks
+
+
+class TestModelResultPollWorker(IsolatedAsyncioTestCase):
 
     def setUp(self) -> None:
-        self.poll_worker = TestResultPollWorker(
+        # The background polling is only started by calling start, which is omitted here
+        self.poll_worker = ModelResultPollWorker(
             io_client=TEST_IO_CLIENT_WITH_USER_MODE,
             db_client=TEST_DB_CLIENT,
             model_clients={TEST_AVATAR_MODEL: MockAvatarModelClient(backend_url="")},
-            daemon_worker=True,
         )
 
         self.poll_worker.db_client.db.drop_tables()
@@ -38,25 +49,61 @@ class TestModelResultPollWorker(TestCase):
 
         self.client = self.poll_worker.model_clients[TEST_AVATAR_MODEL]
 
-    def test_no_results(self):
+    async def test_no_results(self):
         def fail_on_being_called(video_id: str, avatar_model: AvatarModel):
             self.fail(msg=f"Did not expect any available results for video_id={video_id} and avatar_model={avatar_model.value}")
 
-        self.poll_worker._poll_models(perform_on_available_video=fail_on_being_called)
+        await self.poll_worker._poll_models(perform_on_available_video=fail_on_being_called)
 
-    def test_result_available(self):
+    async def test_result_available(self):
         # Required for retrieving user from video_id
         self.poll_worker.db_client.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
 
         # Simulate inference
-        self.client.post_audio(audio=(TEST_MODEL_REQUEST.video_id, bytes()), metadata=TEST_MODEL_REQUEST)
+        await self.client.post_audio(audio=(TEST_MODEL_REQUEST.video_id, bytes()), metadata=TEST_MODEL_REQUEST)
 
         #
-        self.poll_worker._retrieve_video_from_model(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL)
+        await self.poll_worker._retrieve_video_from_model(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL)
         self.assertTrue(self.poll_worker.db_client.video_exists(video_id=TEST_MODEL_REQUEST.video_id, user=TEST_USER))
 
-        self.test_no_results()
-        self.assertRaises(
-            HTTPException,
-            lambda: self.poll_worker._retrieve_video_from_model(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL),
+        await self.test_no_results()
+        with self.assertRaises(HTTPException):
+            await self.poll_worker._retrieve_video_from_model(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL)
+
+    async def test_submit_retrieval(self):
+        self.poll_worker.db_client.insert_video(video_metadata=TEST_METADATA, user=TEST_USER)
+        await self.client.post_audio(audio=(TEST_MODEL_REQUEST.video_id, bytes()), metadata=TEST_MODEL_REQUEST)
+
+        # Simulate a completion notification sent by the model backend, duplicate notifications are ignored while the retrieval is pending
+        retrieval = self.poll_worker.submit_retrieval(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL)
+        self.assertIsNone(self.poll_worker.submit_retrieval(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL))
+        await retrieval
+
+        self.assertTrue(self.poll_worker.db_client.get_video(video_id=TEST_MODEL_REQUEST.video_id, user=TEST_USER).inference_completed)
+        await self.test_no_results()
+
+    async def test_cancelled_during_retrieval(self):
+        shutil.rmtree(TEST_CACHE_DIR, ignore_errors=True)
+        result_cache = ResultCache(cache_dir=TEST_CACHE_DIR, max_size_bytes=1024)
+
+        poll_worker = ModelResultPollWorker(
+            io_client=self.poll_worker.io_client,
+            db_client=self.poll_worker.db_client,
+            model_clients={TEST_AVATAR_MODEL: CancellingAvatarModelClient(backend_url="")},
+            result_cache=result_cache,
         )
+
+        poll_worker.db_client.insert_video(video_metadata=TEST_METADATA.copy(update={"cache_key": "test-key", "inference_completed": False}), user=TEST_USER)
+        await poll_worker.model_clients[TEST_AVATAR_MODEL].post_audio(audio=(TEST_MODEL_REQUEST.video_id, bytes()), metadata=TEST_MODEL_REQUEST)
+
+        await poll_worker._retrieve_video_from_model(video_id=TEST_MODEL_REQUEST.video_id, avatar_model=TEST_AVATAR_MODEL)
+
+        # The cancellation is kept, while the downloaded video is neither kept nor cached
+        video_metadata = poll_worker.db_client.get_video(video_id=TEST_MODEL_REQUEST.video_id, user=TEST_USER)
+        self.assertTrue(video_metadata.cancelled)
+        self.assertFalse(video_metadata.inference_completed)
+        self.assertFalse(poll_worker.io_client.video.file_exists(video_id=TEST_MODEL_REQUEST.video_id, user=TEST_USER))
+        self.assertEqual(0, result_cache.stats().entries)
+
+        await self.test_no_results()
+        shutil.rmtree(TEST_CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,89 @@
+import asyncio
+from http import HTTPStatus
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from avatar_backend_api.api_types import AvatarModel, ApiRoute
+from avatar_backend_api.background_tools.readiness_cache import ModelReadinessCache
+from avatar_backend_api.clients.avatar_client import AvatarModelClient
+from avatar_backend_api.clients.mock_avatar_model_client import MockAvatarModelClient
+
+TEST_REFRESH_INTERVAL_SECONDS = 2
+TEST_MAX_BACKOFF_SECONDS = 10
+
+
+class UnavailableModelClient(MockAvatarModelClient):
+
+    async def readiness(self) -> bool:
+        raise ConnectionError("Backend unavailable")
+
+
+class TestModelReadinessCache(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.cache = ModelReadinessCache(
+            model_clients={
+                AvatarModel.neural_voice: MockAvatarModelClient(backend_url=""),
+                AvatarModel.motion_gan: UnavailableModelClient(backend_url=""),
+            },
+            refresh_interval_seconds=TEST_REFRESH_INTERVAL_SECONDS,
+            max_backoff_seconds=TEST_MAX_BACKOFF_SECONDS,
+            jitter_fraction=0,
+        )
+
+    async def test_readiness_per_model(self):
+        self.assertFalse(self.cache.is_ready(model=AvatarModel.neural_voice))
+
+        self.assertTrue(await self.cache.refresh(model=AvatarModel.neural_voice))
+        self.assertFalse(await self.cache.refresh(model=AvatarModel.motion_gan))
+
+        self.assertTrue(self.cache.is_ready(model=AvatarModel.neural_voice))
+        self.assertFalse(self.cache.is_ready(model=AvatarModel.motion_gan))
+        self.assertFalse(self.cache.is_ready())
+
+    async def test_backoff(self):
+        await self.cache.refresh(model=AvatarModel.neural_voice)
+        self.assertEqual(TEST_REFRESH_INTERVAL_SECONDS, self.cache.next_delay(model=AvatarModel.neural_voice))
+
+        delays = []
+        for _ in range(4):
+            await self.cache.refresh(model=AvatarModel.motion_gan)
+            delays.append(self.cache.next_delay(model=AvatarModel.motion_gan))
+
+        self.assertEqual([2, 4, 8, TEST_MAX_BACKOFF_SECONDS], delays)
+
+    async def test_background_refresh(self):
+        self.cache.start()
+        await asyncio.sleep(0.1)
+        await self.cache.stop()
+
+        self.assertTrue(self.cache.is_ready(model=AvatarModel.neural_voice))
+
+
+class TestAvatarModelClientReadiness(IsolatedAsyncioTestCase):
+
+    @staticmethod
+    def client(handler) -> AvatarModelClient:
+        client = AvatarModelClient(backend_url="http://backend")
+        client.async_client = httpx.AsyncClient(base_url="http://backend", transport=httpx.MockTransport(handler))
+        return client
+
+    async def test_readiness(self):
+        requested_paths = []
+
+        def ready(request: httpx.Request) -> httpx.Response:
+            requested_paths.append(request.url.path)
+            return httpx.Response(HTTPStatus.OK, json={"readiness": True, "gpu_supported": True, "gpu_enabled": True})
+
+        def not_ready(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(HTTPStatus.SERVICE_UNAVAILABLE, json={"readiness": False, "gpu_supported": True, "gpu_enabled": True})
+
+        def unreachable(request: httpx.Request) -> httpx.Response:
+            raise httpx.ConnectError("Backend unavailable", request=request)
+
+        self.assertTrue(await self.client(ready).readiness())
+        self.assertEqual([ApiRoute.readiness.value], requested_paths)
+
+        self.assertFalse(await self.client(not_ready).readiness())
+        self.assertFalse(await self.client(unreachable).readiness())
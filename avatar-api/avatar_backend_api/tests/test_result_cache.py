@@ -0,0 +1,71 @@
+import io
+import os
+import shutil
+from unittest import TestCase
+
+from avatar_backend_api.api_types import AvatarModel, BaseAvatar
+from avatar_backend_api.clients.result_cache import ResultCache, hash_audio
+
+TEST_CACHE_DIR = "/tmp/test-result-cache"
+TEST_OUTPUT_DIR = "/tmp/test-result-cache-output"
+TEST_VIDEO_SIZE_BYTES = 100
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self) -> None:
+        shutil.rmtree(TEST_CACHE_DIR, ignore_errors=True)
+        shutil.rmtree(TEST_OUTPUT_DIR, ignore_errors=True)
+        os.makedirs(TEST_OUTPUT_DIR)
+
+        self.cache = ResultCache(cache_dir=TEST_CACHE_DIR, max_size_bytes=2 * TEST_VIDEO_SIZE_BYTES)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_CACHE_DIR, ignore_errors=True)
+        shutil.rmtree(TEST_OUTPUT_DIR, ignore_errors=True)
+
+    def _video(self, name: str) -> str:
+        path = os.path.join(TEST_OUTPUT_DIR, name + ".mp4")
+        with open(path, "wb") as video_file:
+            video_file.write(os.urandom(TEST_VIDEO_SIZE_BYTES))
+
+        return path
+
+    def test_cache_key(self):
+        audio = io.BytesIO(b"test-audio")
+        audio_hash = hash_audio(audio)
+        self.assertEqual(b"test-audio", audio.read(), msg="Expected the audio to be rewound after hashing")
+
+        key = ResultCache.cache_key(audio_hash=audio_hash, avatar=BaseAvatar.Jennifer_355_9415.value, avatar_model=AvatarModel.motion_gan, checkpoint_version="1")
+        self.assertEqual(key, ResultCache.cache_key(audio_hash=audio_hash, avatar=BaseAvatar.Jennifer_355_9415.value, avatar_model=AvatarModel.motion_gan, checkpoint_version="1"))
+        self.assertNotEqual(key, ResultCache.cache_key(audio_hash=audio_hash, avatar=BaseAvatar.Jennifer_355_9415.value, avatar_model=AvatarModel.motion_gan, checkpoint_version="2"))
+        self.assertNotEqual(key, ResultCache.cache_key(audio_hash=audio_hash, avatar=BaseAvatar.Arthur_A2226.value, avatar_model=AvatarModel.motion_gan, checkpoint_version="1"))
+
+    def test_hit_and_miss(self):
+        target_path = os.path.join(TEST_OUTPUT_DIR, "user", "target.mp4")
+        self.assertFalse(self.cache.link_cached_video(key="a", target_path=target_path))
+
+        video_path = self._video("a")
+        self.cache.store(key="a", video_path=video_path)
+
+        self.assertTrue(self.cache.link_cached_video(key="a", target_path=target_path))
+        with open(video_path, "rb") as video_file, open(target_path, "rb") as target_file:
+            self.assertEqual(video_file.read(), target_file.read())
+
+        stats = self.cache.stats()
+        self.assertEqual((1, 1, 1), (stats.hits, stats.misses, stats.entries))
+
+    def test_lru_eviction(self):
+        self.cache.store(key="a", video_path=self._video("a"))
+        self.cache.store(key="b", video_path=self._video("b"))
+
+        # Using a makes b the least recently used video
+        self.assertTrue(self.cache.link_cached_video(key="a", target_path=os.path.join(TEST_OUTPUT_DIR, "a-copy.mp4")))
+        self.cache.store(key="c", video_path=self._video("c"))
+
+        self.assertFalse(self.cache.link_cached_video(key="b", target_path=os.path.join(TEST_OUTPUT_DIR, "b-copy.mp4")))
+        self.assertTrue(self.cache.link_cached_video(key="a", target_path=os.path.join(TEST_OUTPUT_DIR, "a-copy.mp4")))
+        self.assertEqual(2 * TEST_VIDEO_SIZE_BYTES, self.cache.stats().size_bytes)
+
+        # The remaining entries are restored on restart
+        self.assertEqual(2, ResultCache(cache_dir=TEST_CACHE_DIR, max_size_bytes=2 * TEST_VIDEO_SIZE_BYTES).stats().entries)
@@ -43,19 +43,19 @@ def build_dataset(args, mode):
         if mode=='train':        
             input_dir = args.input_train_root_dir
             output_dir = args.output_train_root_dir
-            flow_dir = args.flow_train_root_dir
+            flow_path = args.flow_train_root_dir
         elif mode=='val':
             input_dir = args.input_val_root_dir
             output_dir = args.output_val_root_dir
-            flow_dir = args.flow_val_root_dir
+            flow_path = args.flow_val_root_dir
         elif mode=='test':
             input_dir = args.input_test_root_dir
             output_dir = None
-            flow_dir = None
+            flow_path = None
 
         dataset = OpticalFlowDataset(args = args,
                                     input_root_dir=input_dir, 
-                                    flow_dir=flow_dir,
+                                    flow_path=flow_path,
                                     output_root_dir=output_dir, 
                                     transform_input=transform_input, 
                                     transform_output=transform_output, 
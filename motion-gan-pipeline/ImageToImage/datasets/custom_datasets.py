@@ -9,27 +9,6 @@ import os
 from torchvision import transforms
 import numpy as np
 
-def readFlow(fn):
-    """ Read .flo file in Middlebury format"""
-    # Code adapted from:
-    # http://stackoverflow.com/questions/28013200/reading-middlebury-flow-files-with-python-bytes-array-numpy
-
-    # WARNING: this will work on little-endian architectures (eg Intel x86) only!
-    # print 'fn = %s'%(fn)
-    with open(fn, 'rb') as f:
-        magic = np.fromfile(f, np.float32, count=1)
-        if 202021.25 != magic:
-            print('Magic number incorrect. Invalid .flo file')
-            return None
-        else:
-            w = np.fromfile(f, np.int32, count=1)
-            h = np.fromfile(f, np.int32, count=1)
-            # print 'Reading %d x %d flo file\n' % (w, h)
-            data = np.fromfile(f, np.float32, count=2*int(w)*int(h))
-            # Reshape data into 3D array (columns, rows, bands)
-            # The reshape here is for visualization, the original code is (w,h,2)
-            return np.resize(data, (int(h), int(w), 2))
-
 # Example from https://pytorch.org/tutorials/beginner/data_loading_tutorial.html
 class CustomDataset(Dataset):
     def __init__(self, args, input_root_dir, output_root_dir, label_root_dir, transform_input=None, transform_output=None, transform_label_map=None, mode='train'):
@@ -104,11 +83,11 @@ class CustomDataset(Dataset):
         return sample
 
 class OpticalFlowDataset(Dataset):
-    def __init__(self, args, input_root_dir, flow_dir, output_root_dir, transform_input=None, transform_output=None, mode='train'):
+    def __init__(self, args, input_root_dir, flow_path, output_root_dir, transform_input=None, transform_output=None, mode='train'):
         """
         Args:
             input_root_dir (string): Directory with all the input images.
-            flow_dir(string): Directory with all the computed optical flow.
+            flow_path(string): Optical flow store of all frames, see preprocessing/flow_store.py.
             output_root_dir (string): Directory with all the output images.
             transform (callable, optional): Optional transform to be applied
             on a sample.
@@ -126,8 +105,8 @@ class OpticalFlowDataset(Dataset):
             self.output_img_name_list = sorted(os.listdir(self.output_root_dir))
             self.transform_output = transform_output
 
-            self.flow_dir = flow_dir
-            self.flow_name_list = sorted(os.listdir(self.flow_dir))
+            # Memory-mapped (N - 1, H, W, 2) float16 flows, read without loading the whole video
+            self.flows = np.load(flow_path, mmap_mode='r')
 
 
     def convert_to_rgb(self, image):
@@ -159,7 +138,7 @@ class OpticalFlowDataset(Dataset):
             output_image = self.convert_to_rgb(output_image)
 
             # Load previous images & Optical Flows
-            flow = np.zeros_like(readFlow(os.path.join(self.flow_dir, self.flow_name_list[0])))
+            flow = np.zeros(self.flows.shape[1:], dtype=np.float32)
 
             flows = [] 
             prev_imgs = []  
@@ -175,10 +154,7 @@ class OpticalFlowDataset(Dataset):
                     prev_imgs.append(self.transform_output(prev_img))
 
                     # load flow
-                    flow_name = os.path.join(self.flow_dir,
-                                            self.flow_name_list[idx - i])
-                    tmp_flow = readFlow(flow_name)
-                    flow += tmp_flow
+                    flow += self.flows[idx - i]
                     flows.append(self.transform_output(flow))
             
             else:
@@ -8,13 +8,21 @@ import PIL
 import configargparse
 from pathlib import Path
 import os
+import sys
+import bisect
+import copy
 from tqdm import tqdm
 import numpy as np
+from torch.utils.data import ConcatDataset, DataLoader
 
 from models.unet import UNet
-from datasets.base import build_dataloader
+from datasets.base import build_dataset
 from utils.utils import create_image_pair, save_image_list
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_runner.image_writer import ImageWriter
+from pipeline_runner.model_registry import load_cached
+
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -25,6 +33,7 @@ def config_parser():
     # dataloader options
     parser.add_argument("--mode", type=str, default='test', help="test mode has if no ground truth data available, val otherwise")
     parser.add_argument("--batch_size", type=int, default=16, help="size of the batches")
+    parser.add_argument("--inference_batch_size", type=int, default=8, help="number of frames generated at once, across all jobs")
     parser.add_argument("--num_workers", type=int, default=0, help="number of workers to use during batch generation")
     parser.add_argument("--num_input_channels", type=int, default=3, help="number of input image channels")
     parser.add_argument("--num_output_channels", type=int, default=3, help="number of output image channels")
@@ -43,6 +52,8 @@ def config_parser():
     # logging/saving options
     parser.add_argument("--video_name", type=str, help='name of the reference video', default='Clara')
     parser.add_argument("--out_dir", type=str, help='directory in which to save result images', default='./results/')
+    parser.add_argument("--batch_job", nargs=2, action='append', default=[], metavar=('INPUT_TEST_ROOT_DIR', 'OUT_DIR'),
+                        help='further job of the same avatar, whose frames are generated within the same batches. May be repeated')
     # dataroot
     parser.add_argument("--dataroot", required=True, type=str, help='input data dataroot', default='')
     parser.add_argument("--checkpoint_dir", required=True, type=str, help='path to checkpoint folder', default='../checkpoints/')
@@ -62,6 +73,37 @@ def load_model(network, args, device):
             print("-> loaded model %s (epoch: final)"%(args.load_path))
 
 
+def generate_images(network, args, device, jobs):
+    """ Generates the frames of all jobs, given as (input_test_root_dir, out_dir), merged into batches of args.inference_batch_size.
+    The network is in eval mode, hence every frame only depends on its own edge map, regardless of the other frames in its batch.
+    """
+    datasets = []
+    for input_dir, out_dir in jobs:
+        os.makedirs(out_dir, exist_ok=True)
+
+        job_args = copy.copy(args)
+        job_args.input_test_root_dir = input_dir
+        datasets.append(build_dataset(job_args, mode=args.mode))
+
+    dataset = ConcatDataset(datasets)
+    # Unlike the training loaders, no frames may be dropped
+    loader = DataLoader(dataset, batch_size=args.inference_batch_size, shuffle=False, num_workers=args.num_workers, pin_memory=False, drop_last=False)
+
+    frame_idx = 0
+    with torch.no_grad(), ImageWriter('generated frames') as writer:
+        for data in tqdm(loader):
+            inputs = data['input_image'].to(device)
+            prediction = network(inputs)
+
+            images_output = create_image_pair([prediction])
+
+            # Routes every frame back to the out dir of its job
+            for image, name in zip(images_output, data['name']):
+                job_idx = bisect.bisect_right(dataset.cumulative_sizes, frame_idx)
+                save_image_list([image], jobs[job_idx][1], [name], writer=writer)
+                frame_idx += 1
+
+
 if __name__=='__main__':
 
     parser = config_parser()
@@ -114,7 +156,7 @@ if __name__=='__main__':
                     ' --input_train_root_dir ' + data_input_path +
                     '/edges --output_train_root_dir ' + data_input_path +
                     '/cropped --flow_train_root_dir ' + data_input_path +
-                    '/opticalflow --height ' + str(args.height) + ' --width ' + str(args.width))
+                    '/opticalflow.npy --height ' + str(args.height) + ' --width ' + str(args.width))
         
         else:
             os.system('python train.py -c config/train.yml --checkpoints_dir ' + chkp_dir +
@@ -127,27 +169,22 @@ if __name__=='__main__':
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print("Running code on", device)
 
-    # initialize the dataloaders
-    test_loader = build_dataloader(args, mode=args.mode, shuffle=False) 
-
     # build the network 
-    network = UNet(args).to(device)
+    def load_network():
+        network = UNet(args).to(device)
+        load_model(network, args, device)
+        network.eval()
+        return network
 
-    load_model(network, args, device)
-    network.eval()
+    network = load_cached(avatar=args.video_name, name='UNet', checkpoint_path=args.load_path, loader=load_network)
 
     # run inference
-    with torch.no_grad():
-        for batch_idx, data in enumerate(tqdm(test_loader)):
-            
-            inputs = data['input_image'].to(device)
-            names = data['name']
+    if args.batch_job and args.mode != 'test':
+        raise ValueError('Further jobs can only be generated in test mode')
 
-            prediction = network(inputs)
+    jobs = [(args.input_test_root_dir, args.out_dir)] + [tuple(job) for job in args.batch_job]
+    if len(jobs) > 1:
+        print('Generating the frames of %d jobs within the same batches' % len(jobs))
 
-            images = create_image_pair([inputs, prediction])
-            images_output = create_image_pair([prediction])
-            
-            # save_image_list(images, args.results_dir, names)
-            save_image_list(images_output, args.out_dir, names)
+    generate_images(network, args, device, jobs)
 
@@ -43,11 +43,11 @@ def config_parser():
     # dataset options
     parser.add_argument("--dataset_type", type=str, help="options: CustomDataset", default='CustomDataset') 
     parser.add_argument("--input_train_root_dir", type=str, help="Path to training input images", default='./data/input_images_train') 
-    parser.add_argument("--flow_train_root_dir", type=str, help="Path to training optical flows", default='./data/opticalflow_train') 
+    parser.add_argument("--flow_train_root_dir", type=str, help="Path to the optical flow store of the training images", default='./data/opticalflow_train.npy') 
     parser.add_argument("--output_train_root_dir", type=str, help="Path to training output images", default='./data/output_images_train')  
     parser.add_argument("--label_train_root_dir", type=str, help="Path to training label images", default='./data/label_images_train')  
     parser.add_argument("--input_val_root_dir", type=str, help="Path to val input images", default='./data/input_images_val') 
-    parser.add_argument("--flow_val_root_dir", type=str, help="Path to val optical flows", default='./data/opticalflow_val') 
+    parser.add_argument("--flow_val_root_dir", type=str, help="Path to the optical flow store of the val images", default='./data/opticalflow_val.npy') 
     parser.add_argument("--output_val_root_dir", type=str, help="Path to val output images", default='./data/output_images_val')
     parser.add_argument("--label_val_root_dir", type=str, help="Path to val label images", default='./data/label_images_val')  
     parser.add_argument("--width", type=int, default=640, help="width")
@@ -26,6 +26,9 @@ def create_image_pair(images_to_concat):
     return images
 
 
-def save_image_list(image_list, save_path, names):
+def save_image_list(image_list, save_path, names, writer=None):
     for image, name in zip(image_list, names):
-        image.save(save_path+name)
+        if writer is None:
+            image.save(save_path+name)
+        else:
+            writer.save(image, save_path+name)
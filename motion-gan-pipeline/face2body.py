@@ -4,7 +4,7 @@
 from genericpath import isfile
 from math import floor
 import os
-from PIL import Image
+import sys
 import numpy as np
 import argparse
 from tqdm import tqdm
@@ -20,8 +20,13 @@ from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
 from torchvision import transforms
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessing'))
+from frame_store import open_frame_store
+from landmark_store import PROJECTED_LANDMARKS, LandmarkStore
+from body_pose_store import BODY_POSES, LEFT_HIP, LEFT_SHOULDER, RIGHT_HIP, RIGHT_SHOULDER, load_body_poses
+
 class LandmarkDataset(Dataset):
-    def __init__(self, landmarks_dir, body_dir, im_size, split):
+    def __init__(self, landmarks_path, body_pose_path, im_size, split):
         """
         Args:
             input_root_dir (string): Directory with all the input images.
@@ -29,15 +34,15 @@ class LandmarkDataset(Dataset):
             transform (callable, optional): Optional transform to be applied
             on a sample.
         """
-        self.landmarks_dir = landmarks_dir
-        self.body_dir = body_dir
+        self.landmarks = LandmarkStore(landmarks_path)
+        self.body_poses = load_body_poses(body_pose_path)
         self.w, self.h = im_size
 
         # set split for train test
         self.split_ratio = 0.8
         self.split = split
 
-        self.total_num = len(os.listdir(self.landmarks_dir))
+        self.total_num = len(self.landmarks)
 
     def __len__(self):
         
@@ -57,12 +62,8 @@ class LandmarkDataset(Dataset):
 
         idx += base
 
-        landmark_path = os.path.join(self.landmarks_dir, '%05d.lms' % idx)
-        body_path = os.path.join(self.body_dir, '%05d.npy' % idx)
-
-        input_ldk = np.loadtxt(landmark_path)[:, :-1]
-        output_ldk = np.load(body_path)[:, :-2]
-        output_ldk = np.array([output_ldk[11], output_ldk[12], output_ldk[23], output_ldk[24]])
+        input_ldk = self.landmarks[idx]
+        output_ldk = np.array(self.body_poses[idx, [LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP], :2])
 
         # scale
         input_ldk[:, 0] = input_ldk[:, 0] / self.w
@@ -80,12 +81,12 @@ class LandmarkDataset(Dataset):
         return sample
 
 
-def train_regression_head2body(landmarks_dir, body_dir, checkpoint_path, im_size):
+def train_regression_head2body(landmarks_path, body_pose_path, checkpoint_path, im_size):
 
-    train_dataset = LandmarkDataset(landmarks_dir, body_dir, im_size, "Train")
+    train_dataset = LandmarkDataset(landmarks_path, body_pose_path, im_size, "Train")
     train_dataloader = DataLoader(train_dataset, batch_size=train_dataset.__len__())
 
-    test_dataset = LandmarkDataset(landmarks_dir, body_dir, im_size, "Test")
+    test_dataset = LandmarkDataset(landmarks_path, body_pose_path, im_size, "Test")
     test_dataloader = DataLoader(test_dataset, batch_size=test_dataset.__len__())
 
     # check device
@@ -158,8 +159,8 @@ if __name__ == '__main__':
 
     inopt = parser.parse_args()
 
-    landmarks_dir = os.path.join(inopt.dataset_base, 'debug/proj_landmarks')
-    body_dir = os.path.join(inopt.dataset_base, 'body_pose')
+    landmarks_path = os.path.join(inopt.dataset_base, PROJECTED_LANDMARKS)
+    body_pose_path = os.path.join(inopt.dataset_base, BODY_POSES)
     checkpoint_path = os.path.join(inopt.checkpoint_dir, inopt.target_name, 'head2body.pkl')
 
 
@@ -167,8 +168,8 @@ if __name__ == '__main__':
         print('Head2body already trained!')
     
     else:
-        tmp_img = Image.open(os.path.join(inopt.dataset_base, 'frames', '00000.jpg'))
-        im_size = tmp_img.size
-        train_regression_head2body(landmarks_dir, body_dir, checkpoint_path, im_size)
+        frames = open_frame_store(inopt.dataset_base)
+        im_size = (frames.width, frames.height)
+        train_regression_head2body(landmarks_path, body_pose_path, checkpoint_path, im_size)
 
     
@@ -12,6 +12,22 @@ import os
 import numpy as np
 
 
+def load_deepspeech_features(clip_root):
+    """ Memory-maps the (N, 16, 29) DeepSpeech features of the clip, see preprocessing/deepspeech_store.py """
+    return np.load(os.path.join(clip_root, 'audio_feature.npy'), mmap_mode='r')
+
+
+def load_deca_expressions(clip_root):
+    """ Returns the (N, 53) DECA expressions of the tracked frames of the clip as float32 tensor, see preprocessing/deca_store.py """
+    return torch.from_numpy(np.load(os.path.join(clip_root, 'deca_codes', 'expr.npy')))
+
+
+def load_flat_deepspeech_features(clip_root):
+    """ Returns the DeepSpeech features of the clip as float32 tensor of shape (N, 16 * 29) """
+    features = load_deepspeech_features(clip_root)
+    return torch.from_numpy(np.asarray(features, dtype=np.float32).reshape(len(features), -1))
+
+
 def load_audio_expressions(clip_root):
     audio_expr_path = os.path.join(clip_root, 'audio_expr')
 
@@ -90,9 +106,7 @@ class AudioDataset(BaseDataset):
             name = self.clip_names[i]
             clip_root = os.path.join(self.dataset_root, name)
 
-            deepspeech_feature_path = os.path.join(clip_root, 'audio_feature')
-    
-            audio_features_len = len(os.listdir(deepspeech_feature_path))
+            audio_features_len = len(load_deepspeech_features(clip_root))
 
             # if audio_features_len > self.A2H_item_length:
             #     self.valid_clips.append(i)
@@ -118,7 +132,6 @@ class AudioDataset(BaseDataset):
         for i in range(len(self.valid_clips)):
             name = self.clip_names[i]
             clip_root = os.path.join(self.dataset_root, name)
-            deepspeech_feature_path = os.path.join(clip_root, 'audio_feature')
 
             # Load audio
             try:
@@ -129,7 +142,7 @@ class AudioDataset(BaseDataset):
                 pass
 
             # load deepspeech
-            self.audio_features[i] = torch.from_numpy(np.stack([np.load(os.path.join(deepspeech_feature_path, ds)).flatten() for ds in os.listdir(deepspeech_feature_path)], axis=0))
+            self.audio_features[i] = load_flat_deepspeech_features(clip_root)
 
             
             try:
@@ -5,8 +5,10 @@ import sys
 from unittest import skip
 
 sys.path.append("..")
+sys.path.append("../preprocessing")
 
 from datasets.base_dataset import BaseDataset
+from datasets.audio_dataset import load_deepspeech_features, load_flat_deepspeech_features
 import scipy.io as sio
 import torch
 import librosa
@@ -15,6 +17,7 @@ import os
 import numpy as np
 
 from funcs import utils
+from frame_store import open_frame_store
 
 
 class DeepspeechDataset(BaseDataset):
@@ -68,13 +71,11 @@ class DeepspeechDataset(BaseDataset):
             # check lenght of video
             name = self.clip_names[i]
             clip_root = os.path.join(self.dataset_root, name)
-            n_frames = len(os.listdir(os.path.join(clip_root, 'frames')))
+            n_frames = len(open_frame_store(clip_root))
 
             if n_frames >= start_point + self.target_length: # added 25 because later they remove 25 and without it, crashes
                 
-                deepspeech_feature_path = os.path.join(clip_root, 'audio_feature')
-        
-                audio_features_len = len(os.listdir(deepspeech_feature_path))
+                audio_features_len = len(load_deepspeech_features(clip_root))
 
                 if audio_features_len > self.A2H_item_length:
                     self.valid_clips.append(i)
@@ -118,10 +119,9 @@ class DeepspeechDataset(BaseDataset):
         for i in range(len(self.valid_clips)):
             name = self.clip_names[self.valid_clips[i]]
             clip_root = os.path.join(self.dataset_root, name)
-            deepspeech_feature_path = os.path.join(clip_root, 'audio_feature')
 
             # load deepspeech
-            self.audio_features[i] = torch.from_numpy(np.stack([np.load(os.path.join(deepspeech_feature_path, ds)).flatten() for ds in sorted(os.listdir(deepspeech_feature_path))], axis=0))
+            self.audio_features[i] = load_flat_deepspeech_features(clip_root)
             
             # 3D landmarks & headposes
             self.start_point[i] = start_point # They had 300 at 60 fps
@@ -5,8 +5,10 @@ from email.mime import audio
 import sys
 
 sys.path.append("..")
+sys.path.append("../preprocessing")
 
 from datasets.base_dataset import BaseDataset
+from datasets.audio_dataset import load_deca_expressions, load_flat_deepspeech_features
 import scipy.io as sio
 import torch
 import librosa
@@ -14,6 +16,8 @@ import os
 import numpy as np
 
 from funcs import utils
+from frame_store import open_frame_store
+from landmark_store import DETECTED_LANDMARKS, LandmarkStore
 
 
 class EmotionDataset(BaseDataset):
@@ -61,12 +65,8 @@ class EmotionDataset(BaseDataset):
             clip_root = os.path.join(self.dataset_root, name)
 
             # Paths to subfolders
-            frames_path = os.path.join(clip_root, 'frames')
             flame_path = os.path.join(clip_root, 'debug/debug_render')
-            deepspeech_feature_path = os.path.join(clip_root, 'audio_feature')
             emotions_path = os.path.join(clip_root, 'emotions')
-            expr_path = os.path.join(clip_root, 'deca_expr')
-            landmarks_path = os.path.join(clip_root, 'landmarks')
             fit_data_path = os.path.join(clip_root, 'track_params.pt')
 
             # load wav audio signal
@@ -75,13 +75,13 @@ class EmotionDataset(BaseDataset):
             self.audio[i] = (x, sr)
 
             # load frames
-            self.frames[i] = [os.path.join(frames_path, f'{f}.jpg') for f in range(len(os.listdir(frames_path)))]
+            self.frames[i] = open_frame_store(clip_root)
 
             # load debug
             self.flame[i] = [os.path.join(flame_path, f'{f}.jpg') for f in range(len(os.listdir(flame_path)))]
 
             # load deepspeech
-            self.audio_features[i] = torch.from_numpy(np.stack([np.load(os.path.join(deepspeech_feature_path, f'{ds}.deepspeech.npy')).flatten() for ds in range(len(os.listdir(deepspeech_feature_path)))], axis=0))
+            self.audio_features[i] = load_flat_deepspeech_features(clip_root)
             
             # load emotions
             try:
@@ -91,10 +91,11 @@ class EmotionDataset(BaseDataset):
                 self.emotions[i] = None
             
             # load landmarks
-            self.landmarks[i] = torch.from_numpy(np.stack([np.loadtxt(os.path.join(landmarks_path, ldk)) for ldk in sorted(os.listdir(landmarks_path))], axis=0))
+            landmark_store = LandmarkStore(os.path.join(clip_root, DETECTED_LANDMARKS))
+            self.landmarks[i] = torch.from_numpy(landmark_store.read(landmark_store.valid_ids()))
 
             # load expressions
-            self.exps[i] = torch.from_numpy(np.stack([np.load(os.path.join(expr_path, f'{exp}.npy')) for exp in range(len(os.listdir(expr_path)))], axis=0))
+            self.exps[i] = load_deca_expressions(clip_root)
 
             # 3D landmarks & headposes
             fit_data = torch.load(fit_data_path)
@@ -5,6 +5,7 @@ import sys
 from unittest import skip
 
 sys.path.append("..")
+sys.path.append("../preprocessing")
 
 from datasets.base_dataset import BaseDataset
 import scipy.io as sio
@@ -16,6 +17,7 @@ import numpy as np
 from models.networks import APC_encoder
 
 from funcs import utils
+from frame_store import open_frame_store
 
 
 class FullDataset(BaseDataset):
@@ -74,7 +76,7 @@ class FullDataset(BaseDataset):
             # check lenght of video
             name = self.clip_names[i]
             clip_root = os.path.join(self.dataset_root, name)
-            n_frames = len(os.listdir(os.path.join(clip_root, 'frames')))
+            n_frames = len(open_frame_store(clip_root))
 
             if n_frames >= start_point + self.target_length + 25: # added 25 because later they remove 25 and without it, crashes
                 APC_name = os.path.split(self.opt.APC_model_path)[-1]
@@ -23,6 +23,7 @@ from preprocessing.face_tracking.FLAME.config import cfg as FLAME_cfg
 from preprocessing.face_tracking.FLAME.lbs import vertices2landmarks
 from preprocessing.face_tracking.render_3dmm import Render_FLAME
 from preprocessing.face_tracking.util import *
+from frame_store import open_frame_store
 
 
 def write_video_with_audio(audio_path, output_path, prefix='pred_', h=512, w=512, fps=25):
@@ -51,7 +52,7 @@ def load_audio_expressions(new_opt):
         # check lenght of video
         name = self.clip_names[i]
         clip_root = os.path.join(self.dataset_root, name)
-        n_frames = len(os.listdir(os.path.join(clip_root, 'frames')))
+        n_frames = len(open_frame_store(clip_root))
         if n_frames >= start_point + self.target_length + 25: # added 25 because later they remove 25 and without it, crashes
             audio_path = os.path.join(clip_root, name + '.wav')
             audio, _ = librosa.load(audio_path, sr=self.sample_rate)
@@ -22,11 +22,15 @@ import torch
 from funcs import utils
 import sys
 sys.path.append('../preprocessing/')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_runner.image_writer import ImageWriter
+from pipeline_runner.model_registry import load_cached
 from face_tracking.FLAME.FLAME import FLAME
 from face_tracking.FLAME.config import cfg as FLAME_cfg
 from face_tracking.FLAME.lbs import vertices2landmarks
 from face_tracking.render_3dmm import Render_FLAME
 from face_tracking.util import *
+from landmark_store import GENERATED_LANDMARKS, empty_landmarks, save_landmarks
 from finetune import finetune
 from PIL import Image
 
@@ -93,9 +97,13 @@ if __name__ == '__main__':
                  checkpoint_path=os.path.join(inopt.checkpoint_dir, 'Audio2Headpose_TED_checkpoint.pkl'),
                  fps=25)
 
-    Audio2Headpose = create_model(opt)
-    Audio2Headpose.load_checkpoint(checkpoint_path)
-    Audio2Headpose.eval()
+    def load_audio2headpose():
+        model = create_model(opt)
+        model.load_checkpoint(checkpoint_path)
+        model.eval()
+        return model
+
+    Audio2Headpose = load_cached(avatar=inopt.target_name, name='Audio2Headpose', checkpoint_path=checkpoint_path, loader=load_audio2headpose)
 
     # Load data
     dataset = create_dataset(opt)
@@ -148,7 +156,7 @@ if __name__ == '__main__':
 
         cxy = torch.tensor((w / 2.0, h / 2.0), dtype=torch.float).cpu()
 
-        model_3dmm = FLAME(FLAME_cfg.model)
+        model_3dmm = load_cached(avatar=None, name='FLAME', checkpoint_path=FLAME_cfg.model.flame_model_path, loader=lambda: FLAME(FLAME_cfg.model))
         renderer = Render_FLAME(model_3dmm.faces_tensor, focal, h, w, 1, device)
 
         # Smooth predicted headpose
@@ -171,61 +179,65 @@ if __name__ == '__main__':
         # Make images
         save_root = inopt.out_dir
         os.makedirs(os.path.join(save_root, 'render'), exist_ok=True)
-        os.makedirs(os.path.join(save_root, 'landmarks'), exist_ok=True)
         
         np.save(os.path.join(save_root, 'headposes.npy'), pred_headpose)
 
-        deca_expr_path = os.path.join(inopt.dataroot, 'video', inopt.target_name,'deca_expr')
         audio_expr_path = os.path.join(inopt.out_dir, 'audio_expr')
 
-        for i in tqdm(range(nframe), desc='rendering: '):
-            R = torch.from_numpy(pred_headpose[i, 0:3]).unsqueeze(
-                0).to(device).double()
-            t = torch.from_numpy(pred_headpose[i, 3:6]).unsqueeze(
-                0).to(device).double()
-            
-            # Zero translation
-            # t = torch.tensor((0, 0, -5)).unsqueeze(
-            #     0).to(device).double()
-
-            id = id_para.to(device).double()
-            expr = torch.from_numpy(np.load(os.path.join(audio_expr_path, '%05d.npy' % i))).to(device).double()
-
-            '''
-            # Original Rotation and Translation used for debug
-            if 0:
-                og_R = torch.from_numpy(og_rot[i]).unsqueeze(0).to(device).double()
-                og_t = torch.from_numpy(og_trans[i]).unsqueeze(
+        generated_landmarks = None
+        with ImageWriter('render') as writer:
+            for i in tqdm(range(nframe), desc='rendering: '):
+                R = torch.from_numpy(pred_headpose[i, 0:3]).unsqueeze(
                     0).to(device).double()
-                print(
-                    f'OG Rotation euler: \n{og_R.data}, \nOG trans: \n{og_t.data}')
-                print(
-                    f'\nPred Rotation euler: \n{R.data},\nPred trans: \n{t.data}')
-
-                og_rott_geo = model_3dmm.forward_geo(id, expr, og_R, og_t)
-
-                og_landmarks3d = model_3dmm.get_3dlandmarks(
-                    id, expr, og_R, og_t, focal, cxy).cpu()
-                og_proj_geo = proj_pts(og_landmarks3d, focal, cxy)
-                # Porj points
-                colormap_blue = plt.cm.Blues
-                for num, lin in enumerate(np.linspace(0, 0.9, len(og_proj_geo[0, :, 0]))):
-                    plt.scatter(og_proj_geo[0, num, 0].detach().cpu(),
-                                og_proj_geo[0, num, 1].detach().cpu(),
-                                color=colormap_blue(lin),
-                                s=10)
+                t = torch.from_numpy(pred_headpose[i, 3:6]).unsqueeze(
+                    0).to(device).double()
+            
+                # Zero translation
+                # t = torch.tensor((0, 0, -5)).unsqueeze(
+                #     0).to(device).double()
+
+                id = id_para.to(device).double()
+                expr = torch.from_numpy(np.load(os.path.join(audio_expr_path, '%05d.npy' % i))).to(device).double()
+
+                '''
+                # Original Rotation and Translation used for debug
+                if 0:
+                    og_R = torch.from_numpy(og_rot[i]).unsqueeze(0).to(device).double()
+                    og_t = torch.from_numpy(og_trans[i]).unsqueeze(
+                        0).to(device).double()
+                    print(
+                        f'OG Rotation euler: \n{og_R.data}, \nOG trans: \n{og_t.data}')
+                    print(
+                        f'\nPred Rotation euler: \n{R.data},\nPred trans: \n{t.data}')
+
+                    og_rott_geo = model_3dmm.forward_geo(id, expr, og_R, og_t)
+
+                    og_landmarks3d = model_3dmm.get_3dlandmarks(
+                        id, expr, og_R, og_t, focal, cxy).cpu()
+                    og_proj_geo = proj_pts(og_landmarks3d, focal, cxy)
+                    # Porj points
+                    colormap_blue = plt.cm.Blues
+                    for num, lin in enumerate(np.linspace(0, 0.9, len(og_proj_geo[0, :, 0]))):
+                        plt.scatter(og_proj_geo[0, num, 0].detach().cpu(),
+                                    og_proj_geo[0, num, 1].detach().cpu(),
+                                    color=colormap_blue(lin),
+                                    s=10)
             
-            '''
-
-            rott_geo = model_3dmm.forward_geo(id, expr, R, t)
-            landmarks3d = model_3dmm.get_3dlandmarks_forehead(id, expr, R, t, focal, cxy).cpu()
-            proj_geo = proj_pts(landmarks3d, focal, cxy)
-            np.savetxt(os.path.join(save_root, 'landmarks', '%05d.lms' % i), proj_geo[0].detach().cpu().numpy())
-            render_imgs = renderer(rott_geo.float(), model_3dmm.faces_tensor)
-            img_arr = render_imgs[0, :, :, :3].cpu().numpy()
-            img_arr *= 255
-            img_arr = img_arr.astype(np.uint8)
-            im = Image.fromarray(img_arr)
-            im.save(os.path.join(save_root, 'render','%05d.png' % i))
+                '''
+
+                rott_geo = model_3dmm.forward_geo(id, expr, R, t)
+                landmarks3d = model_3dmm.get_3dlandmarks_forehead(id, expr, R, t, focal, cxy).cpu()
+                proj_geo = proj_pts(landmarks3d, focal, cxy)
+                if generated_landmarks is None:
+                    generated_landmarks = empty_landmarks(nframe, proj_geo.shape[1])
+                generated_landmarks[i] = proj_geo[0].detach().cpu().numpy()[:, :2]
+                render_imgs = renderer(rott_geo.float(), model_3dmm.faces_tensor)
+                img_arr = render_imgs[0, :, :, :3].cpu().numpy()
+                img_arr *= 255
+                img_arr = img_arr.astype(np.uint8)
+                im = Image.fromarray(img_arr)
+                writer.save(im, os.path.join(save_root, 'render','%05d.png' % i))
+
+        save_landmarks(os.path.join(save_root, GENERATED_LANDMARKS), generated_landmarks)
 
     print('Finish!')
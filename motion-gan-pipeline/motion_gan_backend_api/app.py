@@ -3,14 +3,16 @@
 
 import logging
 from http import HTTPStatus
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from fastapi import UploadFile, Depends, Query, HTTPException
 from fastapi.responses import FileResponse
 from mtc_api_utils.api import BaseApi
+from mtc_api_utils.api_types import FirebaseUser
 from mtc_api_utils.clients.firebase_client import firebase_user_auth
+from starlette.concurrency import run_in_threadpool
 
-from avatar_backend_api.api_types import ApiRoute, InferenceQueueTask, AvatarModelRequest
+from avatar_backend_api.api_types import ApiRoute, AvatarModel, BackendQueueStatus, InferenceQueueTask, AvatarModelRequest
 from avatar_backend_api.clients.io_client import IoClient, IoClientException
 from avatar_backend_api.models.avatar_base_model import AvatarBaseModel
 from avatar_backend_api.models.mock_avatar_model import MockAvatarModel
@@ -30,6 +32,10 @@ inference_queue = MotionGanInferenceQueue(
     io_client=io_client,
     audio_input_dir=MotionGanConfig.audio_input_dir,
     video_output_dir=MotionGanConfig.video_output_dir,
+    avatar_model=AvatarModel.motion_gan,
+    avatar_api_url=MotionGanConfig.avatar_api_url,
+    num_workers=MotionGanConfig.inference_workers,
+    journal_dir=MotionGanConfig.queue_journal_dir,
 )
 
 app = BaseApi(is_ready=motion_gan_model.is_ready, config=MotionGanConfig)
@@ -80,9 +86,18 @@ async def get_video(video_id: str = Query(alias="videoId")):  # -> FileResponse:
     tags=tags,
     dependencies=[Depends(user_auth)],
 )
-async def model_inference(audio: UploadFile, request_metadata: AvatarModelRequest = Depends()) -> AvatarModelRequest:
+async def model_inference(
+        audio: UploadFile,
+        request_metadata: AvatarModelRequest = Depends(),
+        user_email: Optional[str] = Query(alias="userEmail", default=None),
+        priority: int = Query(default=0),
+) -> AvatarModelRequest:
     print(f"Processing request for video_id={request_metadata.video_id}")
 
+    if inference_queue.queue.contains(video_id=request_metadata.video_id):
+        print(f"Ignoring duplicate request for video_id={request_metadata.video_id}")
+        return request_metadata
+
     if not request_metadata.video_id:
         print(f"Creating video_id={request_metadata.video_id}")
         request_metadata.video_id = audio.filename
@@ -92,12 +107,24 @@ async def model_inference(audio: UploadFile, request_metadata: AvatarModelReques
     inference_queue.add_task(
         task=InferenceQueueTask(
             request=request_metadata,
+            user=FirebaseUser(email=user_email, roles=[]) if user_email else None,
+            priority=priority,
         ),
     )
 
     return request_metadata
 
 
+@app.get(
+    path=ApiRoute.queue_status.value,
+    response_model=BackendQueueStatus,
+    tags=tags,
+    dependencies=[Depends(user_auth.with_roles(MotionGanConfig.required_roles))],
+)
+async def queue_status() -> BackendQueueStatus:
+    return inference_queue.status()
+
+
 @app.delete(
     path=ApiRoute.video.value,
     response_model=str,
@@ -105,9 +132,13 @@ async def model_inference(audio: UploadFile, request_metadata: AvatarModelReques
     dependencies=[Depends(user_auth)],
 )
 async def delete_video(video_id: str = Query(alias="videoId")) -> str:
+    # Deleting a video which is still queued or being processed cancels its task
+    if await run_in_threadpool(inference_queue.cancel, video_id=video_id):
+        return f"The task with video_id={video_id} was cancelled successfully"
+
     try:
         io_client.video.delete_file(video_id=video_id)
-    except FileNotFoundError:
+    except IoClientException:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"No files with video_id={video_id} found")
 
     return f"The files with video_id={video_id} were removed successfully"
@@ -15,11 +15,21 @@ class MotionGanConfig(AvatarConfig):
     db_filepath: str = Config.parse_env_var("DB_FILEPATH", default="/tmp/tinyDB/neuralVoices.json")
 
     motion_gan_base_dir: str = "/app"  # Location of the neural-code dir in the execution environment
+    conda_envs_dir: str = Config.parse_env_var("CONDA_ENVS_DIR", default="/opt/conda/envs")  # The pipeline stages run within the envs of the image
+    # Memory the models kept resident by every stage worker may occupy before the least recently used avatars are evicted
+    model_registry_budget_gb: float = Config.parse_env_var("MODEL_REGISTRY_BUDGET_GB", default="8", convert_type=float)
+    # Workers per conda env executing CPU stages concurrently to each other & to the GPU stages
+    pipeline_cpu_workers: int = Config.parse_env_var("PIPELINE_CPU_WORKERS", default="2", convert_type=int)
+    # Concurrent jobs of the same avatar whose UNet inference is batched, & how long a batch waits for further jobs before it queues for the GPU
+    gan_max_batch_jobs: int = Config.parse_env_var("GAN_MAX_BATCH_JOBS", default="4", convert_type=int)
+    gan_batch_deadline_seconds: float = Config.parse_env_var("GAN_BATCH_DEADLINE_SECONDS", default="0", convert_type=float)
 
     data_base_dir: str = Config.parse_env_var("DATA_BASE_DIR", default="/tmp/motionGan")
 
     audio_input_dir: str = os.path.join(data_base_dir, "input_data", "audio")
-    video_output_dir: str = os.path.join(data_base_dir, "output_data", "videos")
+    output_data_dir: str = os.path.join(data_base_dir, "output_data")
+    video_output_dir: str = os.path.join(output_data_dir, "videos")
+    queue_journal_dir: str = os.path.join(data_base_dir, "queue")
 
     checkpoints_dir: str = os.path.join(data_base_dir, "checkpoints")
     video_input_dir: str = os.path.join(data_base_dir, "input_data", "video")
@@ -22,3 +22,14 @@ class MotionGanInferenceQueue(InferenceQueue):
                 filename=f"{task.request.video_id}_to_{task.request.avatar.name}{VIDEO_EXTENSION}",
                 new_filename=task.request.video_id + VIDEO_EXTENSION,
             )
+
+    def cleanup(self, task: InferenceQueueTask) -> None:
+        super().cleanup(task=task)
+
+        # Intermediate outputs of all pipeline stages, see full_pipeline.sh
+        output_dir = os.path.join(MotionGanConfig.output_data_dir, f"{task.request.video_id}_to_{task.request.avatar.name}")
+        shutil.rmtree(path=output_dir, ignore_errors=True)
+
+        partial_video_path = os.path.join(MotionGanConfig.video_output_dir, f"{task.request.video_id}_to_{task.request.avatar.name}{VIDEO_EXTENSION}")
+        if os.path.isfile(partial_video_path):
+            os.remove(partial_video_path)
@@ -1,13 +1,16 @@
 # SPDX-License-Identifier: MIT
 # © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
 import os
-import subprocess
 from enum import Enum
 from typing import Dict
 
 from avatar_backend_api.api_types import InferenceQueueTask
+from avatar_backend_api.clients.io_client import IoClient
 from avatar_backend_api.models.avatar_base_model import AvatarBaseModel
 from motion_gan_backend_api.config import MotionGanConfig
+from pipeline_runner.model_registry import MEMORY_BUDGET_ENV_VAR
+from pipeline_runner.motion_gan_stages import motion_gan_stages, PRELOAD_MODULES
+from pipeline_runner.runner import PipelineRunner, conda_python_executable
 
 
 class Pipeline(Enum):
@@ -18,6 +21,20 @@ class Pipeline(Enum):
 
 
 class MotionGANModel(AvatarBaseModel):
+    def __init__(self, io_client: IoClient):
+        # The full pipeline runs within long-lived stage workers, the other pipelines are still run as bash scripts
+        self.pipeline_runner = PipelineRunner(
+            project_dir=MotionGanConfig.motion_gan_base_dir,
+            python_executables={env: conda_python_executable(conda_envs_dir=MotionGanConfig.conda_envs_dir, env=env) for env in PRELOAD_MODULES.keys()},
+            preload=PRELOAD_MODULES,
+            worker_env={MEMORY_BUDGET_ENV_VAR: str(int(MotionGanConfig.model_registry_budget_gb * 1024 ** 3))},
+            cpu_workers_per_env=MotionGanConfig.pipeline_cpu_workers,
+            max_batch_jobs=MotionGanConfig.gan_max_batch_jobs,
+            batch_deadline_seconds=MotionGanConfig.gan_batch_deadline_seconds,
+        )
+
+        super().__init__(io_client=io_client)
+
     def init_model(self):
         # Checking if either expected files are available
         for avatar in MotionGanConfig.available_avatars.keys():
@@ -33,14 +50,25 @@ class MotionGANModel(AvatarBaseModel):
         print("All files were successfully downloaded, motionGan model is ready")
 
     def inference(self, task: InferenceQueueTask, pipeline: Pipeline = Pipeline.full_pipeline) -> None:
-        subprocess.run(
-            args=["bash", pipeline.value, MotionGanConfig.data_base_dir, task.request.video_id, task.request.avatar.name],
-            cwd=MotionGanConfig.motion_gan_base_dir,  # Working directory from which to run the shell command
-            universal_newlines=True,  # Decode output
-            check=True,  # Throw exception if return code != 0
-        )
+        if pipeline == Pipeline.full_pipeline:
+            self.pipeline_runner.run(
+                job_id=task.request.video_id,
+                stages=motion_gan_stages(data_dir=MotionGanConfig.data_base_dir, audio_name=task.request.video_id, video_name=task.request.avatar.name),
+                data_dir=MotionGanConfig.data_base_dir,
+            )
+
+        else:
+            self.run_pipeline(
+                task=task,
+                args=["bash", pipeline.value, MotionGanConfig.data_base_dir, task.request.video_id, task.request.avatar.name],
+                cwd=MotionGanConfig.motion_gan_base_dir,
+            )
+
         print(f"Inference completed for {task.request.video_id} - {task.request.avatar.value}")
 
+    def cancel(self, video_id: str) -> bool:
+        return self.pipeline_runner.cancel(job_id=video_id) or super().cancel(video_id=video_id)
+
     @staticmethod
     def available_avatars() -> Dict[str, str]:
         with os.scandir(MotionGanConfig.checkpoints_dir) as dirs:
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Reports the state of the stage cache & the disk usage per avatar, see pipeline_runner.stage_cache.
+
+Usage: python -m pipeline_runner.cache_report --data_dir /tmp/motionGan [--avatar Clara] [--prune]
+
+Only the files are compared against the manifests. Changed parameters or code are detected the next time the stage runs.
+"""
+
+import argparse
+import os
+
+from pipeline_runner.stage_cache import MANIFEST_DIR_NAME, StageCache
+
+
+def disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(os.path.join(dir_path, name)) for dir_path, _, file_names in os.walk(path) for name in file_names)
+
+
+def format_size(size_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size_bytes < 1024 or unit == "GB":
+            return "{:.1f} {}".format(size_bytes, unit)
+        size_bytes /= 1024
+
+
+def report_avatar(data_dir, avatar, prune):
+    video_dir = os.path.join(data_dir, "input_data", "video", avatar)
+    checkpoint_dir = os.path.join(data_dir, "checkpoints", avatar)
+    cache = StageCache(base_dir=video_dir, manifest_dir=os.path.join(video_dir, MANIFEST_DIR_NAME))
+
+    usage = disk_usage(video_dir) + (disk_usage(checkpoint_dir) if os.path.isdir(checkpoint_dir) else 0)
+    cached_bytes = 0
+
+    print("Avatar {}: {} on disk".format(avatar, format_size(usage)))
+
+    for stage in cache.stages():
+        valid, reason = cache.verify(stage)
+        output_bytes = sum(entry["size"] for entry in cache.load(stage)["outputs"].values())
+
+        if valid:
+            cached_bytes += output_bytes
+            state = "valid"
+        elif prune:
+            cache.invalidate(stage)
+            state = "pruned ({})".format(reason)
+        else:
+            state = "stale ({})".format(reason)
+
+        print("  {:<40} {:>10}  {}".format(stage, format_size(output_bytes), state))
+
+    print("  {:<40} {:>10}".format("valid cached outputs", format_size(cached_bytes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data_dir", required=True, help="Data base dir of the pipeline, containing input_data & checkpoints")
+    parser.add_argument("--avatar", default=None, help="Only report this avatar")
+    parser.add_argument("--prune", action="store_true", help="Remove the manifests of stale stages")
+    opt = parser.parse_args()
+
+    video_base_dir = os.path.join(opt.data_dir, "input_data", "video")
+    avatars = [opt.avatar] if opt.avatar else sorted(name for name in os.listdir(video_base_dir) if os.path.isdir(os.path.join(video_base_dir, name)))
+
+    for avatar in avatars:
+        report_avatar(data_dir=opt.data_dir, avatar=avatar, prune=opt.prune)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Writes the per-frame images of the pipeline scripts on a pool of threads, such that encoding a PNG or JPEG overlaps the computation of the next frames.
+
+The number of pending images is bounded, hence a script producing frames faster than they are written blocks instead of buffering them all in memory.
+PIL & cv2 release the GIL while encoding, hence threads suffice. The first error of a write is raised by the next call to submit, flush or close,
+such that a failed write fails the stage. Images submitted as debug output are dropped if the writer skips debug output, see --skip_debug_images.
+
+Imported by the scripts running within the stage workers, hence it is restricted to the standard library & python 3.7.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_NUM_THREADS = 4
+DEFAULT_MAX_PENDING = 64
+
+
+class ImageWriter:
+
+    def __init__(self, name, num_threads=DEFAULT_NUM_THREADS, max_pending=DEFAULT_MAX_PENDING, skip_debug=False):
+        """ With num_threads=0, the images are written synchronously by submit """
+        self.name = name
+        self.skip_debug = skip_debug
+
+        self._executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="image_writer") if num_threads > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._error = None
+
+        self.written = 0
+        self.skipped = 0
+        self.write_seconds = 0.0  # Summed over all threads
+        self.blocked_seconds = 0.0  # Spent by submit waiting for a free slot
+        self._start_time = None
+
+    def submit(self, write, *args, debug=False, **kwargs):
+        """ Calls write(*args, **kwargs) on the pool, e.g. writer.submit(cv2.imwrite, path, image). Blocks while max_pending writes are pending """
+        self._raise_error()
+
+        if debug and self.skip_debug:
+            self.skipped += 1
+            return
+
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+
+        if self._executor is None:
+            self._write(write, args, kwargs)
+            self._raise_error()
+            return
+
+        start = time.perf_counter()
+        self._slots.acquire()
+        self.blocked_seconds += time.perf_counter() - start
+
+        future = self._executor.submit(self._write, write, args, kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def save(self, image, path, debug=False, **kwargs):
+        """ Saves the PIL image to path on the pool """
+        self.submit(image.save, path, debug=debug, **kwargs)
+
+    def flush(self):
+        """ Waits for all pending writes, raising the first error of any of them """
+        with self._lock:
+            pending = list(self._pending)
+
+        for future in pending:
+            future.result()
+
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
+        print(self.summary())
+
+    def stats(self):
+        elapsed_seconds = time.perf_counter() - self._start_time if self._start_time is not None else 0.0
+
+        return {
+            "written": self.written,
+            "skipped": self.skipped,
+            "pending": len(self._pending),
+            "elapsed_seconds": elapsed_seconds,
+            "write_seconds": self.write_seconds,
+            "blocked_seconds": self.blocked_seconds,
+            "images_per_second": self.written / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return "Wrote {} images of {} in {:.1f}s ({:.1f} images/s, {:.1f}s of writing, {:.1f}s blocked on the writer), skipped {} debug images".format(
+            stats["written"], self.name, stats["elapsed_seconds"], stats["images_per_second"], stats["write_seconds"], stats["blocked_seconds"],
+            stats["skipped"])
+
+    def _write(self, write, args, kwargs):
+        start = time.perf_counter()
+        try:
+            write(*args, **kwargs)
+
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            return
+
+        with self._lock:
+            self.written += 1
+            self.write_seconds += time.perf_counter() - start
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+        # The exception of the script takes precedence over the errors of its pending writes
+        elif self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Keeps the models loaded by the pipeline scripts resident within a stage worker, such that they are only loaded once per avatar.
+
+The models of an avatar are kept until the estimated size of all resident models exceeds the memory budget, in which case the models of the least
+recently used avatars are evicted. Models are identified by their checkpoint & its modification time, hence retrained checkpoints are reloaded.
+The registry is part of the pipeline runner package, which the stage workers never unload, hence it outlives the scripts using it.
+
+Imported by the scripts running within the stage workers, hence it is restricted to the standard library & python 3.7. Scripts run on their own
+import it just the same, in which case every model is loaded once per run.
+"""
+
+import gc
+import itertools
+import os
+import sys
+from collections import OrderedDict
+
+SHARED = "__shared__"  # Pseudo avatar for models which are used by all avatars
+MEMORY_BUDGET_ENV_VAR = "MODEL_REGISTRY_BUDGET_BYTES"
+DEFAULT_MEMORY_BUDGET_BYTES = 8 * 1024 ** 3
+
+
+def estimate_bytes(obj, depth=0):
+    """ Estimates the memory held by the tensors of a model, including the models & tensors referenced by its attributes """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return 0
+
+    if isinstance(obj, torch.nn.Module):
+        return sum(tensor.numel() * tensor.element_size() for tensor in itertools.chain(obj.parameters(), obj.buffers()))
+
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+
+    if depth >= 2:
+        return 0
+
+    if isinstance(obj, dict):
+        values = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    elif hasattr(obj, "__dict__"):
+        values = vars(obj).values()
+    else:
+        return 0
+
+    return sum(estimate_bytes(value, depth=depth + 1) for value in values)
+
+
+class ModelRegistry:
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        # Maps avatars to their models, ordered from least to most recently used. Every model is stored as (key, model, size_bytes)
+        self._avatars = OrderedDict()
+
+    def get(self, avatar, name, checkpoint_path, loader):
+        """ Returns the model name of avatar, which is loaded by calling loader if it is not resident or if its checkpoint has changed """
+        avatar = avatar or SHARED
+        key = (checkpoint_path, os.path.getmtime(checkpoint_path) if checkpoint_path and os.path.exists(checkpoint_path) else None)
+
+        models = self._avatars.setdefault(avatar, {})
+        self._avatars.move_to_end(avatar)
+
+        if name in models and models[name][0] == key:
+            self.hits += 1
+            return models[name][1]
+
+        self.misses += 1
+        models.pop(name, None)
+
+        print("Loading model {} of avatar {} from {}".format(name, avatar, checkpoint_path))
+        model = loader()
+        models[name] = (key, model, estimate_bytes(model))
+
+        self._evict()
+
+        return model
+
+    def size_bytes(self):
+        return sum(size for models in self._avatars.values() for _, _, size in models.values())
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "avatars": list(self._avatars.keys()),
+            "size_bytes": self.size_bytes(),
+            "memory_budget_bytes": self.memory_budget_bytes,
+        }
+
+    def clear(self):
+        self._avatars.clear()
+        _release_memory()
+
+    def _evict(self):
+        # The most recently used avatar is never evicted, even if its models alone exceed the budget
+        while self.size_bytes() > self.memory_budget_bytes and len(self._avatars) > 1:
+            avatar, models = self._avatars.popitem(last=False)
+            print("Evicting the models {} of avatar {} from the model registry".format(sorted(models.keys()), avatar))
+
+            del models
+            _release_memory()
+
+
+def _release_memory():
+    gc.collect()
+
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+model_registry = ModelRegistry(memory_budget_bytes=int(os.environ.get(MEMORY_BUDGET_ENV_VAR, DEFAULT_MEMORY_BUDGET_BYTES)))
+
+
+def load_cached(avatar, name, checkpoint_path, loader):
+    """ Returns the resident model name of avatar, see ModelRegistry.get. Pass avatar=None for models shared by all avatars """
+    return model_registry.get(avatar=avatar, name=name, checkpoint_path=checkpoint_path, loader=loader)
@@ -0,0 +1,213 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+from typing import List, Dict
+
+from pipeline_runner.stage import CPU, GPU, Stage
+
+FPS = 25
+SAMPLE_RATE = 16000
+BODY_TRACKING_WORKERS = 4  # Processes tracking the shards of long videos, see get_mediapipe.py
+
+DEEPSPEECH_ENV = "deepspeech"
+PYENV_ENV = "pyenv"
+
+# Imported once by the stage workers on startup
+PRELOAD_MODULES: Dict[str, List[str]] = {
+    DEEPSPEECH_ENV: ["numpy", "tensorflow"],
+    PYENV_ENV: ["numpy", "torch", "torchvision", "pytorch3d", "mediapipe", "cv2"],
+}
+
+
+def _preprocessing_stage(name: str, step: str, env: str, data_dir: str, media_type: str, media_name: str, extra_args: List[str] = (), **kwargs) -> Stage:
+    return Stage(
+        name=name,
+        env=env,
+        cwd="preprocessing",
+        script="preprocessing.py",
+        args=[
+            "--dataroot", os.path.join(data_dir, "input_data", media_type),
+            "--name", media_name,
+            "--target_fps", str(FPS),
+            "--preprocessing_type", media_type,
+            "--step", step,
+            "--use_DECA",
+            *extra_args,
+        ],
+        **kwargs,
+    )
+
+
+def motion_gan_stages(data_dir: str, audio_name: str, video_name: str) -> List[Stage]:
+    """ Stages of full_pipeline.sh for a single audio & video, declared in the order of the script.
+
+    The dependencies are derived from the files the stages read, such that the audio preprocessing runs concurrently to the video preprocessing and the
+    head-to-body training concurrently to the audio expressions & head motion. The head motion has to wait for the audio expressions, since transfer.py
+    renders the generated head poses with them.
+    The preprocessing steps keep manifests of their own within the dataset dir, see Preprocessor.run_step, and are skipped by preprocessing.py itself.
+    The per-avatar stages keep their manifests within the video dir. The stages producing the video are not cached, since postprocessing deletes their outputs.
+    """
+    audio_dir = os.path.join("input_data", "audio", audio_name)
+    video_dir = os.path.join("input_data", "video", video_name)
+    out_dir = os.path.join("output_data", f"{audio_name}_to_{video_name}")
+    checkpoint_dir = os.path.join(data_dir, "checkpoints", "")
+    track_params = os.path.join(video_dir, "track_params.pt")
+
+    def video_stage(name: str, step: str, env: str, device: str, inputs: List[str], outputs: List[str], depends_on: List[str], extra_args: List[str] = ()) -> Stage:
+        return _preprocessing_stage(
+            name=f"video_{name}", step=step, env=env, data_dir=data_dir, media_type="video", media_name=video_name, extra_args=extra_args,
+            inputs=inputs, outputs=outputs, depends_on=depends_on, device=device,
+        )
+
+    video_wav = os.path.join(video_dir, f"{video_name}.wav")
+    video_mp4 = os.path.join(video_dir, f"{video_name}.mp4")
+
+    return [
+        # Video preprocessing, see process_video.sh
+        Stage(
+            name="video_wav",
+            env=DEEPSPEECH_ENV,
+            cwd="preprocessing",
+            command=["ffmpeg", "-i", os.path.join(data_dir, video_mp4), "-ar", str(SAMPLE_RATE), "-y", os.path.join(data_dir, video_wav)],
+            inputs=[video_mp4],
+            outputs=[video_wav],
+            manifest_dir=video_dir,
+            device=CPU,
+        ),
+        video_stage("noise_reduction", "12", PYENV_ENV, CPU, inputs=[video_wav], outputs=[video_wav], depends_on=["video_wav"]),
+        video_stage("deepspeech", "0", DEEPSPEECH_ENV, CPU, inputs=[video_wav], outputs=[os.path.join(video_dir, "audio_feature.npy")], depends_on=["video_noise_reduction"]),
+        video_stage("frames", "1", PYENV_ENV, CPU, inputs=[video_mp4], outputs=[os.path.join(video_dir, "frame_store")], depends_on=[]),
+        video_stage("landmarks", "2", PYENV_ENV, GPU, inputs=[os.path.join(video_dir, "frame_store")], outputs=[os.path.join(video_dir, "landmarks.npy")], depends_on=["video_frames"]),
+        video_stage(
+            "head_pose", "3", PYENV_ENV, GPU,
+            inputs=[os.path.join(video_dir, "frame_store"), os.path.join(video_dir, "landmarks.npy")],
+            outputs=[track_params, os.path.join(video_dir, "deca_codes"), os.path.join(video_dir, "expr_masks"), os.path.join(video_dir, "debug", "proj_landmarks.npy")],
+            depends_on=["video_landmarks"],
+            # None of the stages reads the debug renderings of the tracking
+            extra_args=["--skip_debug_images"],
+        ),
+        video_stage(
+            "audio_expressions", "4", PYENV_ENV, GPU,
+            inputs=[os.path.join(video_dir, "audio_feature.npy"), os.path.join(video_dir, "deca_codes")],
+            outputs=[os.path.join(video_dir, "audio_expr"), os.path.join(video_dir, "mapping.npy")],
+            depends_on=["video_deepspeech", "video_head_pose"],
+        ),
+        video_stage("matting", "5", PYENV_ENV, GPU, inputs=[os.path.join(video_dir, "frame_store")], outputs=[os.path.join(video_dir, "matting")], depends_on=["video_frames"]),
+        video_stage(
+            "body_tracking", "9", PYENV_ENV, CPU, inputs=[os.path.join(video_dir, "frame_store")], outputs=[os.path.join(video_dir, "body_pose.npy")], depends_on=["video_frames"],
+            extra_args=["--body_tracking_workers", str(BODY_TRACKING_WORKERS)],
+        ),
+        video_stage(
+            "edges", "11", PYENV_ENV, CPU,
+            inputs=[os.path.join(video_dir, "matting"), os.path.join(video_dir, "debug", "proj_landmarks.npy"), os.path.join(video_dir, "body_pose.npy")],
+            outputs=[os.path.join(video_dir, "edges"), os.path.join(video_dir, "cropped")],
+            depends_on=["video_head_pose", "video_matting", "video_body_tracking"],
+        ),
+
+        # Audio preprocessing, see process_audio.sh
+        _preprocessing_stage(
+            name="audio_noise_reduction", step="12", env=DEEPSPEECH_ENV, device=CPU, data_dir=data_dir, media_type="audio", media_name=audio_name,
+            inputs=[os.path.join(audio_dir, f"{audio_name}.wav")], outputs=[os.path.join(audio_dir, f"{audio_name}.wav")],
+        ),
+        _preprocessing_stage(
+            name="audio_deepspeech", step="0", env=DEEPSPEECH_ENV, device=CPU, data_dir=data_dir, media_type="audio", media_name=audio_name,
+            inputs=[os.path.join(audio_dir, f"{audio_name}.wav")], outputs=[os.path.join(audio_dir, "audio_feature.npy")], depends_on=["audio_noise_reduction"],
+        ),
+
+        Stage(
+            name="audio_expressions",
+            env=PYENV_ENV,
+            cwd="preprocessing",
+            script="third/Audio2ExpressionNet/get_audioexpr.py",
+            args=[
+                "--name", audio_name,
+                "--dataset_base", os.path.join(data_dir, audio_dir),
+                "--out_dir", os.path.join(data_dir, out_dir),
+                "--mapping_path", os.path.join(data_dir, video_dir, "mapping.npy"),
+            ],
+            inputs=[os.path.join(audio_dir, "audio_feature.npy"), os.path.join(video_dir, "mapping.npy")],
+            outputs=[os.path.join(out_dir, "audio_expr")],
+            depends_on=["audio_deepspeech", "video_audio_expressions"],
+        ),
+        Stage(
+            name="head_motion",
+            env=PYENV_ENV,
+            cwd="motion-generation",
+            script="transfer.py",
+            args=[
+                "--dataroot", os.path.join(data_dir, "input_data"),
+                "--dataset_names", audio_name,
+                "--target_name", video_name,
+                "--out_dir", os.path.join(data_dir, out_dir),
+                "--checkpoint_dir", checkpoint_dir,
+            ],
+            inputs=[os.path.join(audio_dir, "audio_feature.npy"), track_params, os.path.join(out_dir, "audio_expr")],
+            outputs=[os.path.join(out_dir, "headposes.npy"), os.path.join(out_dir, "landmarks.npy"), os.path.join(out_dir, "render")],
+            depends_on=["audio_expressions", "video_head_pose"],
+        ),
+        Stage(
+            name="head_to_body",
+            env=PYENV_ENV,
+            cwd=".",
+            script="face2body.py",
+            args=["--dataset_base", os.path.join(data_dir, video_dir), "--target_name", video_name, "--checkpoint_dir", checkpoint_dir],
+            inputs=[os.path.join(video_dir, "debug", "proj_landmarks.npy"), os.path.join(video_dir, "body_pose.npy")],
+            outputs=[os.path.join("checkpoints", video_name, "head2body.pkl")],
+            depends_on=["video_head_pose", "video_body_tracking"],
+            manifest_dir=video_dir,
+        ),
+        Stage(
+            name="edge_map",
+            env=PYENV_ENV,
+            cwd="preprocessing",
+            script="combine_edges.py",
+            args=[
+                "--dataset_base", os.path.join(data_dir, video_dir),
+                "--out_dir", os.path.join(data_dir, out_dir),
+                "--target_name", video_name,
+                "--checkpoint_dir", checkpoint_dir,
+            ],
+            inputs=[os.path.join(out_dir, "headposes.npy"), os.path.join(out_dir, "landmarks.npy"), os.path.join(video_dir, "matting"), os.path.join("checkpoints", video_name, "head2body.pkl")],
+            outputs=[os.path.join(out_dir, "edges")],
+            depends_on=["head_motion", "head_to_body", "video_matting"],
+        ),
+        Stage(
+            name="gan_inference",
+            env=PYENV_ENV,
+            cwd="ImageToImage",
+            script="generate_images.py",
+            args=[
+                "--dataroot", os.path.join(data_dir, "input_data", "video"),
+                "--video_name", video_name,
+                "--input_test_root_dir", os.path.join(data_dir, out_dir, "edges", ""),
+                "--out_dir", os.path.join(data_dir, out_dir, "generated_frames", ""),
+                "--checkpoint_dir", checkpoint_dir,
+            ],
+            inputs=[os.path.join(out_dir, "edges"), os.path.join(video_dir, "edges")],
+            outputs=[os.path.join(out_dir, "generated_frames")],
+            depends_on=["edge_map", "video_edges"],
+            # Jobs of the same avatar share the UNet, hence their frames are generated within the same batches
+            batch_key=f"gan_inference:{checkpoint_dir}:{video_name}",
+            batch_args=["--batch_job", os.path.join(data_dir, out_dir, "edges", ""), os.path.join(data_dir, out_dir, "generated_frames", "")],
+        ),
+        Stage(
+            name="postprocessing",
+            env=PYENV_ENV,
+            cwd=".",
+            script="postprocessing.py",
+            args=[
+                "--dataroot", os.path.join(data_dir, "input_data"),
+                "--name_audio", audio_name,
+                "--out_dir", os.path.join(data_dir, out_dir),
+                "--fps", str(FPS),
+                "--sr", str(SAMPLE_RATE),
+                "--clean",
+                "--move_to_one_folder",
+            ],
+            inputs=[os.path.join(out_dir, "generated_frames"), os.path.join(audio_dir, f"{audio_name}.wav")],
+            outputs=[os.path.join("output_data", "videos", f"{audio_name}_to_{video_name}.mp4")],
+            depends_on=["gan_inference"],
+            device=CPU,
+        ),
+    ]
@@ -0,0 +1,427 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import json
+import os
+import signal
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import replace
+from queue import Queue
+from threading import Event, Lock
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pipeline_runner.stage import CPU, GPU, Stage, critical_path, topological_order
+from pipeline_runner.stage_cache import MANIFEST_DIR_NAME, StageCache, code_version
+
+WORKER_TERMINATION_TIMEOUT_SECONDS = 10
+
+
+class StageFailedException(Exception):
+    pass
+
+
+class PipelineCancelledException(Exception):
+    pass
+
+
+class StageWorker:
+    """ Handle of a long-lived worker process executing the stages of a single conda env one at a time, see pipeline_runner.worker.
+
+    The worker is started on first use and restarted after it has been terminated or has crashed. Models loaded by the stages through
+    pipeline_runner.model_registry stay resident within the worker until it is restarted.
+    """
+
+    def __init__(self, env: str, python_executable: str, project_dir: str, preload: List[str], extra_env: Optional[Dict[str, str]] = None):
+        self.env = env
+        self.python_executable = python_executable
+        self.project_dir = project_dir
+        self.preload = preload
+        self.extra_env = extra_env or {}
+
+        self._process: Optional[subprocess.Popen] = None
+
+    def _start(self) -> None:
+        env_bin_dir = os.path.dirname(self.python_executable)
+
+        print(f"Starting the stage worker for env={self.env}")
+        self._process = subprocess.Popen(
+            args=[self.python_executable, "-m", "pipeline_runner.worker", "--project_dir", self.project_dir, "--preload", *self.preload],
+            cwd=self.project_dir,
+            # Equivalent to activating the conda env, such that tools like ffmpeg are taken from the env
+            env={**os.environ, **self.extra_env, "PATH": env_bin_dir + os.pathsep + os.environ.get("PATH", ""), "CONDA_PREFIX": os.path.dirname(env_bin_dir)},
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            start_new_session=True,  # Places the worker & its subprocesses into a process group of their own, see terminate
+        )
+
+        # Assigned before waiting for the worker to be ready, such that a worker which hangs on startup can be terminated as well
+        if not self._read_response(process=self._process).get("ready"):
+            raise StageFailedException(f"The stage worker for env={self.env} failed to start")
+
+    @staticmethod
+    def _read_response(process: subprocess.Popen) -> Dict:
+        line = process.stdout.readline()
+
+        if not line:
+            # The worker is exiting. Its remaining subprocesses are killed and the worker is reaped, such that it is restarted on next use
+            _signal_process_group(process=process, sig=signal.SIGKILL)
+            raise StageFailedException(f"The stage worker exited with code {process.wait()}")
+
+        return json.loads(line)
+
+    def run(self, stage: Stage) -> None:
+        """ Executes the stage & blocks until it is done. Expects the caller to have acquired the worker from its WorkerPool """
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+        request = {"cwd": stage.cwd, "script": stage.script, "args": stage.args, "command": stage.command}
+
+        try:
+            self._process.stdin.write(json.dumps(request) + "\n")
+            self._process.stdin.flush()
+
+        except OSError as e:
+            raise StageFailedException(f"Unable to send stage {stage.name} to the stage worker: {e}")
+
+        response = self._read_response(process=self._process)
+
+        if not response["ok"]:
+            raise StageFailedException(f"Stage {stage.name} failed: {response['error']}")
+
+    def terminate(self) -> None:
+        """ Terminates the worker including all processes it started. Safe to call from another thread while run is blocking """
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+
+        print(f"Terminating the stage worker for env={self.env}")
+        _signal_process_group(process=process, sig=signal.SIGTERM)
+
+        try:
+            process.wait(timeout=WORKER_TERMINATION_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            _signal_process_group(process=process, sig=signal.SIGKILL)
+            process.wait()
+
+    def stop(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.stdin.close()
+            self.terminate()
+
+
+def _signal_process_group(process: subprocess.Popen, sig: signal.Signals) -> None:
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass  # The worker has already exited
+
+
+class WorkerPool:
+    """ Idle workers of a single conda env & device, each of which is handed out to one stage at a time """
+
+    def __init__(self, workers: List[StageWorker]):
+        self.workers = workers
+
+        self._idle: "Queue[StageWorker]" = Queue()
+        for worker in workers:
+            self._idle.put(worker)
+
+    @contextmanager
+    def acquire(self) -> Iterator[StageWorker]:
+        """ Blocks until a worker is idle """
+        worker = self._idle.get()
+
+        try:
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+
+class StageBatch:
+    """ Stages of several jobs with the same batch key, executed as a single stage by the first job, see batched_stage """
+
+    def __init__(self, job_id: str, stage: Stage):
+        self.members: List[Tuple[str, Stage]] = [(job_id, stage)]
+
+        self.full = Event()  # Set once no further jobs may join
+        self.done = Event()
+        self.duration: Optional[float] = None  # Set if the batch succeeded
+        self.error: Optional[Exception] = None
+
+
+def batched_stage(stages: List[Stage]) -> Stage:
+    """ Merges stages with the same batch key into the first one, by appending the batch args of the others to its args """
+    return replace(stages[0], args=stages[0].args + [arg for stage in stages[1:] for arg in stage.batch_args])
+
+
+class PipelineRunner:
+    """ Runs pipelines of stages within long-lived workers instead of starting a fresh interpreter for every script.
+
+    Keeping the workers alive saves the interpreter start-up & the imports of heavy libraries for every stage. Every stage is started as soon as the stages
+    it depends on are done, such that independent branches run concurrently. Every conda env has a single worker for GPU stages, which keeps the models
+    resident & the GPU memory bounded, and cpu_workers_per_env workers for CPU stages. The durations of the stages & the critical path of every job are
+    logged. Stages with a manifest dir are skipped while their manifest is valid.
+
+    Stages with the same batch key, which are waiting for a worker at the same time, are executed as a single stage of up to max_batch_jobs jobs.
+    A batch waits at most batch_deadline_seconds for further jobs before it queues for a worker, and remains open until it gets one.
+    Jobs may be cancelled from another thread, which terminates the workers they occupy.
+    """
+
+    def __init__(
+            self,
+            project_dir: str,
+            python_executables: Dict[str, str],
+            preload: Optional[Dict[str, List[str]]] = None,
+            worker_env: Optional[Dict[str, str]] = None,
+            cpu_workers_per_env: int = 1,
+            max_batch_jobs: int = 1,
+            batch_deadline_seconds: float = 0.0,
+    ):
+        self.project_dir = os.path.abspath(project_dir)
+        self.max_batch_jobs = max_batch_jobs
+        self.batch_deadline_seconds = batch_deadline_seconds
+
+        def worker(env: str) -> StageWorker:
+            return StageWorker(
+                env=env, python_executable=python_executables[env], project_dir=self.project_dir, preload=(preload or {}).get(env, []), extra_env=worker_env,
+            )
+
+        # Workers are only started once a stage is assigned to them, hence unused pools cost nothing
+        self.pools: Dict[Tuple[str, str], WorkerPool] = {}
+        for env in python_executables.keys():
+            self.pools[(env, GPU)] = WorkerPool(workers=[worker(env=env)])
+            self.pools[(env, CPU)] = WorkerPool(workers=[worker(env=env) for _ in range(cpu_workers_per_env)])
+
+        self._state_lock = Lock()
+        self._running_jobs: Set[str] = set()
+        self._active_workers: Dict[str, Set[StageWorker]] = {}  # Maps job ids to the workers currently executing their stages
+        self._cancelled_jobs: Set[str] = set()
+        self._open_batches: Dict[str, StageBatch] = {}  # Maps batch keys to the batch further jobs may join
+        self._manifest_locks: Dict[Tuple[str, str], Lock] = {}  # Maps manifest dirs & stage names to the lock serializing their cached runs
+
+    def run(self, job_id: str, stages: List[Stage], data_dir: str) -> Dict[str, float]:
+        """ Runs all stages of the job in dependency order and returns the duration of every executed stage in seconds """
+        durations: Dict[str, float] = {}
+        start = perf_counter()
+
+        with self._state_lock:
+            self._running_jobs.add(job_id)
+
+        try:
+            self._run_concurrently(job_id=job_id, stages=stages, data_dir=data_dir, durations=durations)
+
+        finally:
+            with self._state_lock:
+                self._running_jobs.discard(job_id)
+                self._cancelled_jobs.discard(job_id)
+
+        path, path_seconds = critical_path(stages=stages, durations=durations)
+
+        print(
+            f"Pipeline of job {job_id} completed in {perf_counter() - start:.1f}s, its stages took {sum(durations.values()):.1f}s: "
+            + ", ".join(f"{name}={seconds:.1f}s" for name, seconds in durations.items())
+        )
+        print(f"Critical path of job {job_id} took {path_seconds:.1f}s: " + " -> ".join(f"{name}={durations.get(name, 0.0):.1f}s" for name in path))
+
+        return durations
+
+    def _run_concurrently(self, job_id: str, stages: List[Stage], data_dir: str, durations: Dict[str, float]) -> None:
+        """ Submits every stage once all of its dependencies are done. After a failure no further stages are started, the running ones are awaited &
+        the first exception is raised """
+        remaining: Dict[str, Stage] = {stage.name: stage for stage in topological_order(stages=stages)}
+        completed: Set[str] = set()
+        running: Dict[Future, Stage] = {}
+        failure: Optional[Exception] = None
+
+        with ThreadPoolExecutor(max_workers=max(len(stages), 1), thread_name_prefix=f"pipeline-{job_id}") as executor:
+            while running or (remaining and failure is None):
+                if failure is None:
+                    for stage in [stage for stage in remaining.values() if all(dependency in completed for dependency in stage.depends_on)]:
+                        del remaining[stage.name]
+                        running[executor.submit(self._run_cached_stage, job_id=job_id, stage=stage, data_dir=data_dir)] = stage
+
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    stage = running.pop(future)
+
+                    try:
+                        durations.update(future.result())
+                        completed.add(stage.name)
+
+                    except Exception as e:
+                        failure = failure or e
+
+        if failure is not None:
+            raise failure
+
+    def _run_cached_stage(self, job_id: str, stage: Stage, data_dir: str) -> Dict[str, float]:
+        """ Runs the stage unless its manifest is valid. Checked right before the stage, since its inputs are created by the stages it depends on """
+        if stage.manifest_dir is None:
+            return {stage.name: self._run_stage(job_id=job_id, stage=stage)}
+
+        cache = StageCache(base_dir=data_dir, manifest_dir=os.path.join(data_dir, stage.manifest_dir, MANIFEST_DIR_NAME))
+        params = {"args": stage.args, "command": stage.command}
+        version = code_version(base_dir=self.project_dir, paths=([os.path.join(stage.cwd, stage.script)] if stage.script else []) + stage.code)
+
+        # Concurrent jobs for the same avatar share its manifests & outputs, hence only one of them may run the stage, after which the others skip it
+        with self._manifest_lock(manifest_dir=cache.manifest_dir, stage_name=stage.name):
+            done, reason = cache.check(stage=stage.name, inputs=stage.inputs, outputs=stage.outputs, params=params, version=version)
+            if done:
+                print(f"Skipping stage {stage.name} of job {job_id}, since its manifest is valid")
+                return {}
+
+            print(f"Stage {stage.name} of job {job_id} is not cached: {reason}")
+            cache.clear_outputs(inputs=stage.inputs, outputs=stage.outputs)
+            duration = self._run_stage(job_id=job_id, stage=stage)
+            cache.record(stage=stage.name, inputs=stage.inputs, outputs=stage.outputs, params=params, version=version)
+
+        return {stage.name: duration}
+
+    def _manifest_lock(self, manifest_dir: str, stage_name: str) -> Lock:
+        with self._state_lock:
+            return self._manifest_locks.setdefault((os.path.abspath(manifest_dir), stage_name), Lock())
+
+    def _run_stage(self, job_id: str, stage: Stage) -> float:
+        if stage.batch_key is None or self.max_batch_jobs <= 1:
+            return self._execute(members=[(job_id, stage)], stage=stage)
+
+        with self._state_lock:
+            batch = self._open_batches.get(stage.batch_key)
+
+            if batch is None:
+                batch = StageBatch(job_id=job_id, stage=stage)
+                self._open_batches[stage.batch_key] = batch
+            else:
+                batch.members.append((job_id, stage))
+
+                if len(batch.members) >= self.max_batch_jobs:
+                    self._close_batch(batch=batch)
+
+        leader_job_id = batch.members[0][0]
+        if leader_job_id != job_id:
+            print(f"Stage {stage.name} of job {job_id} joined the batch of job {leader_job_id}")
+            return self._await_batch(job_id=job_id, stage=stage, batch=batch)
+
+        # Waits for further jobs to join, unless the batch is full
+        batch.full.wait(timeout=self.batch_deadline_seconds)
+
+        try:
+            return self._execute(members=batch.members, stage=stage, batch=batch)
+
+        except Exception as e:
+            batch.error = e
+            raise
+
+        finally:
+            batch.done.set()
+
+    def _await_batch(self, job_id: str, stage: Stage, batch: StageBatch) -> float:
+        batch.done.wait()
+
+        with self._state_lock:
+            cancelled = job_id in self._cancelled_jobs
+
+        if cancelled:
+            raise PipelineCancelledException(f"Job {job_id} was cancelled during stage {stage.name}")
+        if batch.duration is None:
+            raise StageFailedException(f"Stage {stage.name} of job {job_id} failed within the batch of job {batch.members[0][0]}: {batch.error}")
+
+        return batch.duration
+
+    def _close_batch(self, batch: StageBatch) -> None:
+        """ Stops further jobs from joining the batch. Expects the caller to hold the state lock """
+        batch_key = batch.members[0][1].batch_key
+        if self._open_batches.get(batch_key) is batch:
+            del self._open_batches[batch_key]
+
+        batch.full.set()
+
+    def _execute(self, members: List[Tuple[str, Stage]], stage: Stage, batch: Optional[StageBatch] = None) -> float:
+        """ Executes the stage on behalf of all member jobs, the first of which is the calling one. Returns the duration of the stage """
+        job_id = members[0][0]
+
+        with self.pools[(stage.env, stage.device)].acquire() as worker:
+            with self._state_lock:
+                if batch is not None:
+                    self._close_batch(batch=batch)
+
+                # Jobs which have been cancelled in the meantime are dropped
+                active_members = [(member_job_id, member_stage) for member_job_id, member_stage in members if member_job_id not in self._cancelled_jobs]
+                if not active_members:
+                    raise PipelineCancelledException(f"Job {job_id} was cancelled")
+
+                for member_job_id, _ in active_members:
+                    self._active_workers.setdefault(member_job_id, set()).add(worker)
+
+            active_job_ids = [member_job_id for member_job_id, _ in active_members]
+            if len(active_members) > 1:
+                print(f"Running stage {stage.name} of jobs {active_job_ids} as a batch in env={stage.env} on {stage.device}")
+            else:
+                print(f"Running stage {stage.name} of job {active_job_ids[0]} in env={stage.env} on {stage.device}")
+
+            start = perf_counter()
+
+            try:
+                worker.run(stage=batched_stage(stages=[member_stage for _, member_stage in active_members]))
+
+            except StageFailedException:
+                with self._state_lock:
+                    if job_id in self._cancelled_jobs:
+                        raise PipelineCancelledException(f"Job {job_id} was cancelled during stage {stage.name}")
+                raise
+
+            finally:
+                with self._state_lock:
+                    for member_job_id in active_job_ids:
+                        self._active_workers[member_job_id].discard(worker)
+                        if not self._active_workers[member_job_id]:
+                            del self._active_workers[member_job_id]
+
+        duration = perf_counter() - start
+
+        if batch is not None:
+            batch.duration = duration  # The other jobs of the batch succeeded, even if the calling one has been cancelled
+
+        with self._state_lock:
+            if job_id in self._cancelled_jobs:
+                raise PipelineCancelledException(f"Job {job_id} was cancelled during stage {stage.name}")
+
+        return duration
+
+    def cancel(self, job_id: str) -> bool:
+        """ Cancels the job, terminating the workers which currently execute its stages, unless they execute a batch together with other jobs.
+        Returns False if the job is not running
+        """
+        with self._state_lock:
+            if job_id not in self._running_jobs:
+                return False
+
+            self._cancelled_jobs.add(job_id)
+
+            workers = [
+                worker for worker in self._active_workers.get(job_id, set())
+                if all(other_job_id in self._cancelled_jobs for other_job_id, other_workers in self._active_workers.items() if worker in other_workers)
+            ]
+
+        for worker in workers:
+            worker.terminate()
+
+        return True
+
+    def stop(self) -> None:
+        for pool in self.pools.values():
+            for worker in pool.workers:
+                worker.stop()
+
+
+def conda_python_executable(conda_envs_dir: str, env: str) -> str:
+    """ Returns the python interpreter of a conda env. Falls back to the current interpreter if the env does not exist, e.g. outside of the docker image """
+    python_executable = os.path.join(conda_envs_dir, env, "bin", "python")
+
+    return python_executable if os.path.isfile(python_executable) else sys.executable
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Tuple
+
+GPU = "gpu"
+CPU = "cpu"
+
+
+@dataclass
+class Stage:
+    """ A single step of a pipeline, executed by the long-lived worker of its conda env.
+
+    A stage either runs a python script in-process, as if it was started by "python <script> <args>", or an external command such as ffmpeg.
+    Inputs & outputs are paths relative to the data base dir. If manifest_dir is set, the stage is skipped while its manifest within manifest_dir matches
+    its inputs, outputs, arguments & code, see pipeline_runner.stage_cache. The code comprises the script and the paths in code, relative to the project dir.
+    Stages without dependencies between them run concurrently, GPU stages one at a time per conda env. Stages of different jobs with the same batch key
+    may be executed together, by appending the batch args of the other jobs to the args of the first one.
+    """
+    name: str
+    env: str
+    cwd: str  # Relative to the project dir
+    script: Optional[str] = None  # Relative to cwd
+    args: List[str] = field(default_factory=list)
+    command: Optional[List[str]] = None
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    depends_on: List[str] = field(default_factory=list)
+    manifest_dir: Optional[str] = None  # Relative to the data base dir
+    code: List[str] = field(default_factory=list)
+    device: str = GPU
+    batch_key: Optional[str] = None
+    batch_args: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if (self.script is None) == (self.command is None):
+            raise ValueError(f"Stage {self.name} requires either a script or a command")
+        if self.device not in (GPU, CPU):
+            raise ValueError(f"Stage {self.name} has unknown device {self.device}")
+
+
+def topological_order(stages: List[Stage]) -> List[Stage]:
+    """ Orders the stages such that every stage comes after all of its dependencies, preserving the declaration order otherwise """
+    stages_by_name: Dict[str, Stage] = {stage.name: stage for stage in stages}
+
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in stages_by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+    ordered: List[Stage] = []
+    visited, visiting = set(), set()
+
+    def visit(stage: Stage) -> None:
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Dependency cycle involving stage {stage.name}")
+
+        visiting.add(stage.name)
+        for dependency in stage.depends_on:
+            visit(stages_by_name[dependency])
+        visiting.remove(stage.name)
+
+        visited.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+
+    return ordered
+
+
+def critical_path(stages: List[Stage], durations: Dict[str, float]) -> Tuple[List[str], float]:
+    """ Returns the chain of dependent stages with the longest total duration & that duration. Stages without a duration, e.g. cached ones, count as 0s """
+    finish_seconds: Dict[str, float] = {}
+    predecessor: Dict[str, Optional[str]] = {}
+
+    for stage in topological_order(stages=stages):
+        slowest_dependency = max(stage.depends_on, key=lambda dependency: finish_seconds[dependency], default=None)
+
+        predecessor[stage.name] = slowest_dependency
+        finish_seconds[stage.name] = durations.get(stage.name, 0.0) + (finish_seconds[slowest_dependency] if slowest_dependency is not None else 0.0)
+
+    if not finish_seconds:
+        return [], 0.0
+
+    last = max(finish_seconds, key=lambda name: finish_seconds[name])
+    path = [last]
+    while predecessor[path[-1]] is not None:
+        path.append(predecessor[path[-1]])
+
+    return path[::-1], finish_seconds[last]
@@ -0,0 +1,237 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Content-addressed cache of pipeline stages.
+
+After a stage has completed, a manifest is written which records the sha256 of every input & output file, the parameters of the stage and the version
+of its code. A stage is only skipped if its manifest matches all of them, hence partial outputs of crashed stages, changed inputs & updated code or
+checkpoints are detected. Since the outputs of a stage are the inputs of the next ones, rerunning a stage invalidates all stages downstream of it.
+Files whose size & modification time match the manifest are not hashed again. Concurrent runs of a stage, e.g. by two jobs for the same avatar, are
+serialized by a lock file next to its manifest.
+
+Imported by the preprocessing scripts in every conda env of the pipeline, hence it is restricted to the standard library & python 3.7.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+MANIFEST_DIR_NAME = ".manifests"
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 1024 ** 2
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def list_files(base_dir, paths):
+    """ Returns all files at or below the given paths relative to base_dir, skipping manifest dirs. Missing paths contribute no files """
+    files = []
+
+    for path in paths:
+        full_path = os.path.join(base_dir, path)
+
+        if os.path.isfile(full_path):
+            files.append(os.path.normpath(path))
+
+        elif os.path.isdir(full_path):
+            for dir_path, dir_names, file_names in os.walk(full_path):
+                dir_names[:] = sorted(name for name in dir_names if name != MANIFEST_DIR_NAME)
+                files.extend(os.path.relpath(os.path.join(dir_path, name), base_dir) for name in sorted(file_names))
+
+    return sorted(set(files))
+
+
+def file_digests(base_dir, paths, known=None):
+    """ Maps every file below paths to its size, modification time & sha256. Digests in known are reused for files whose size & mtime are unchanged """
+    known = known or {}
+    digests = {}
+
+    for file in list_files(base_dir=base_dir, paths=paths):
+        stat = os.stat(os.path.join(base_dir, file))
+        entry = known.get(file)
+
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            digests[file] = entry
+        else:
+            digests[file] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(os.path.join(base_dir, file))}
+
+    return digests
+
+
+def code_version(base_dir, paths, extra=""):
+    """ Hashes the python sources at or below the given paths. Other files, e.g. checkpoints, only count if listed explicitly & are identified by their
+    size & modification time """
+    digest = hashlib.sha256(extra.encode("utf-8"))
+    listed_files = {os.path.normpath(path) for path in paths}
+
+    for file in list_files(base_dir=base_dir, paths=paths):
+        full_path = os.path.join(base_dir, file)
+
+        if file.endswith(".py"):
+            digest.update("{}:{}\n".format(file, file_sha256(full_path)).encode("utf-8"))
+
+        elif file in listed_files:
+            stat = os.stat(full_path)
+            digest.update("{}:{}:{}\n".format(file, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def _same_digests(recorded, current):
+    return recorded.keys() == current.keys() and all(recorded[file]["sha256"] == current[file]["sha256"] for file in recorded)
+
+
+class StageCache:
+    """ Manifests of the stages operating on the files below base_dir, stored within manifest_dir as <stage>.json """
+
+    def __init__(self, base_dir, manifest_dir=None):
+        self.base_dir = base_dir
+        self.manifest_dir = manifest_dir or os.path.join(base_dir, MANIFEST_DIR_NAME)
+
+    def manifest_path(self, stage):
+        return os.path.join(self.manifest_dir, stage + ".json")
+
+    @contextmanager
+    def lock(self, stage):
+        """ Holds an exclusive lock on the stage across processes, such that only one of them checks, runs & records it at a time """
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+        with open(os.path.join(self.manifest_dir, stage + ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Released once the file is closed
+            yield
+
+    def load(self, stage):
+        try:
+            with open(self.manifest_path(stage)) as f:
+                return json.load(f)
+
+        except (OSError, ValueError):
+            return None
+
+    def check(self, stage, inputs, outputs, params, version):
+        """ Returns (True, None) if the stage can be skipped & (False, reason) otherwise. A stale manifest is removed, such that an interrupted rerun is
+        not mistaken for a completed one """
+        manifest = self.load(stage)
+
+        if manifest is None:
+            return False, "no manifest"
+
+        params = json.loads(json.dumps(params))  # Compared in the same form as loaded from the manifest, e.g. tuples become lists
+        reason = None
+        if manifest.get("version") != MANIFEST_VERSION:
+            reason = "manifest format changed"
+        elif manifest["params"] != params:
+            reason = "parameters changed"
+        elif manifest["code_version"] != version:
+            reason = "code changed"
+        else:
+            reason = self._files_changed(manifest=manifest, inputs=inputs, outputs=outputs)
+
+        if reason is not None:
+            self.invalidate(stage)
+            return False, reason
+
+        return True, None
+
+    def verify(self, stage):
+        """ Like check, but only compares the files against the manifest, since parameters & code version are only known to the stage itself """
+        manifest = self.load(stage)
+
+        if manifest is None:
+            return False, "no manifest"
+
+        # The manifest dir may be shared by caches with different base dirs, hence the base dir is taken from the manifest
+        base_dir = os.path.normpath(os.path.join(self.manifest_dir, manifest["base_dir"]))
+
+        reason = self._files_changed(manifest=manifest, inputs=manifest["input_paths"], outputs=manifest["output_paths"], base_dir=base_dir)
+        return reason is None, reason
+
+    def _files_changed(self, manifest, inputs, outputs, base_dir=None):
+        base_dir = base_dir or self.base_dir
+
+        if not _same_digests(manifest["inputs"], file_digests(base_dir=base_dir, paths=inputs, known=manifest["inputs"])):
+            return "inputs changed"
+        if not _same_digests(manifest["outputs"], file_digests(base_dir=base_dir, paths=outputs, known=manifest["outputs"])):
+            return "outputs are missing or modified"
+
+        return None
+
+    def clear_outputs(self, inputs, outputs):
+        """ Removes the outputs of a previous run, except for outputs which are modified in place """
+        input_paths = {os.path.normpath(path) for path in inputs}
+
+        for path in outputs:
+            full_path = os.path.join(self.base_dir, path)
+
+            if os.path.normpath(path) in input_paths:
+                continue
+
+            if os.path.isdir(full_path):
+                shutil.rmtree(full_path)
+            elif os.path.isfile(full_path):
+                os.remove(full_path)
+
+    def record(self, stage, inputs, outputs, params, version):
+        # The inputs are mostly outputs of the stages recorded before, e.g. the frame store, which are not hashed again while unchanged
+        known = self.known_digests()
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "stage": stage,
+            "created": time.time(),
+            "params": params,
+            "code_version": version,
+            "base_dir": os.path.relpath(self.base_dir, self.manifest_dir),
+            "input_paths": list(inputs),
+            "output_paths": list(outputs),
+            "inputs": file_digests(base_dir=self.base_dir, paths=inputs, known=known),
+            "outputs": file_digests(base_dir=self.base_dir, paths=outputs, known=known),
+        }
+
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+        # Replaced atomically, such that a crash never leaves a truncated manifest behind
+        tmp_path = self.manifest_path(stage) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path(stage))
+
+    def known_digests(self):
+        """ Merges the digests of all manifests within manifest_dir, keyed relative to base_dir """
+        known = {}
+
+        for stage in self.stages():
+            manifest = self.load(stage)
+            if manifest is None or manifest.get("version") != MANIFEST_VERSION:
+                continue
+
+            # The manifest dir may be shared by caches with different base dirs, see verify
+            base_dir = os.path.normpath(os.path.join(self.manifest_dir, manifest["base_dir"]))
+            for file, entry in list(manifest["inputs"].items()) + list(manifest["outputs"].items()):
+                known[os.path.relpath(os.path.join(base_dir, file), self.base_dir)] = entry
+
+        return known
+
+    def invalidate(self, stage):
+        try:
+            os.remove(self.manifest_path(stage))
+        except FileNotFoundError:
+            pass
+
+    def stages(self):
+        if not os.path.isdir(self.manifest_dir):
+            return []
+
+        return sorted(name[:-len(".json")] for name in os.listdir(self.manifest_dir) if name.endswith(".json"))
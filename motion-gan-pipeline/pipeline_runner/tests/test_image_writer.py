@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import unittest
+from threading import Event, Thread
+from unittest import TestCase
+
+from pipeline_runner.image_writer import ImageWriter
+
+TEST_TIMEOUT_SECONDS = 5
+
+
+def _fail(message: str) -> None:
+    raise IOError(message)
+
+
+class TestImageWriter(TestCase):
+
+    def test_back_pressure(self):
+        writer = ImageWriter(name="test", num_threads=1, max_pending=2)
+        release = Event()
+        written = []
+
+        def write(idx):
+            release.wait(timeout=TEST_TIMEOUT_SECONDS)
+            written.append(idx)
+
+        writer.submit(write, 0)
+        writer.submit(write, 1)
+
+        # Both slots are taken by the blocked writes, hence the third submit blocks until one of them completes
+        third_submit = Thread(target=writer.submit, args=(write, 2))
+        third_submit.start()
+        third_submit.join(timeout=0.2)
+        self.assertTrue(third_submit.is_alive())
+
+        release.set()
+        third_submit.join(timeout=TEST_TIMEOUT_SECONDS)
+        self.assertFalse(third_submit.is_alive())
+
+        writer.close()
+        self.assertEqual([0, 1, 2], written)
+        self.assertEqual(3, writer.stats()["written"])
+        self.assertGreater(writer.stats()["blocked_seconds"], 0)
+
+    def test_error_propagation(self):
+        writer = ImageWriter(name="test", num_threads=2)
+        writer.submit(_fail, "disk full")
+
+        with self.assertRaises(IOError):
+            writer.flush()
+
+        # Every later call fails as well, such that the stage fails even if it never flushes
+        with self.assertRaises(IOError):
+            writer.submit(print, "next image")
+
+        with self.assertRaises(IOError):
+            writer.close()
+
+    def test_synchronous_error_propagation(self):
+        writer = ImageWriter(name="test", num_threads=0)
+
+        with self.assertRaises(IOError):
+            writer.submit(_fail, "disk full")
+
+    def test_script_error_takes_precedence(self):
+        with self.assertRaises(ValueError):
+            with ImageWriter(name="test") as writer:
+                writer.submit(_fail, "disk full")
+                raise ValueError("script failed")
+
+    def test_skip_debug(self):
+        written = []
+
+        with ImageWriter(name="test", skip_debug=True) as writer:
+            writer.submit(written.append, "image")
+            writer.submit(written.append, "debug image", debug=True)
+
+        self.assertEqual(["image"], written)
+        self.assertEqual(1, writer.stats()["skipped"])
+
+
+if __name__ == '__main__':
+    unittest.main()
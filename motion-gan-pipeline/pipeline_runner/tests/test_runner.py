@@ -0,0 +1,202 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+import shutil
+import sys
+import unittest
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Set, Tuple
+from unittest import TestCase
+
+from pipeline_runner.runner import PipelineRunner, StageFailedException, WorkerPool
+from pipeline_runner.stage import CPU, GPU, Stage, critical_path, topological_order
+
+TEST_ENV = "test"
+TEST_DATA_DIR = "/tmp/test-pipeline-runner"
+TEST_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STAGE_SECONDS = 0.2
+
+
+class FakeStageWorker:
+    """ Executes stages in-process instead of within a conda env: sleeps for STAGE_SECONDS, writes the outputs & fails the stages named in failing """
+
+    def __init__(self, log: List[Tuple[str, List[str], float, float]], log_lock: Lock, failing: Set[str]):
+        self.log = log
+        self.log_lock = log_lock
+        self.failing = failing
+
+    def run(self, stage: Stage) -> None:
+        start = perf_counter()
+        sleep(STAGE_SECONDS)
+
+        if stage.name in self.failing:
+            raise StageFailedException(f"Stage {stage.name} failed")
+
+        for output in stage.outputs:
+            with open(os.path.join(TEST_DATA_DIR, output), "w") as f:
+                f.write(stage.name)
+
+        with self.log_lock:
+            self.log.append((stage.name, list(stage.args), start, perf_counter()))
+
+    def terminate(self) -> None:
+        pass
+
+
+def _stage(name: str, depends_on: Optional[List[str]] = None, device: str = GPU, **kwargs) -> Stage:
+    return Stage(name=name, env=TEST_ENV, cwd=".", command=["true"], depends_on=depends_on or [], device=device, **kwargs)
+
+
+class TestPipelineRunner(TestCase):
+
+    def setUp(self) -> None:
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+        os.makedirs(TEST_DATA_DIR)
+
+        self.log: List[Tuple[str, List[str], float, float]] = []
+        self.failing: Set[str] = set()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+    def _runner(self, cpu_workers: int = 2, **kwargs) -> PipelineRunner:
+        runner = PipelineRunner(project_dir=TEST_PROJECT_DIR, python_executables={TEST_ENV: sys.executable}, **kwargs)
+
+        log_lock = Lock()
+        runner.pools[(TEST_ENV, GPU)] = WorkerPool(workers=[FakeStageWorker(log=self.log, log_lock=log_lock, failing=self.failing)])
+        runner.pools[(TEST_ENV, CPU)] = WorkerPool(workers=[FakeStageWorker(log=self.log, log_lock=log_lock, failing=self.failing) for _ in range(cpu_workers)])
+
+        return runner
+
+    def _executed(self) -> Dict[str, Tuple[float, float]]:
+        return {name: (start, end) for name, _, start, end in self.log}
+
+    def test_topological_order(self):
+        stages = [_stage("render", depends_on=["track", "audio"]), _stage("track", depends_on=["frames"]), _stage("frames"), _stage("audio")]
+        self.assertEqual(["frames", "track", "audio", "render"], [stage.name for stage in topological_order(stages=stages)])
+
+        with self.assertRaises(ValueError):
+            topological_order(stages=[_stage("a", depends_on=["b"]), _stage("b", depends_on=["a"])])
+
+        with self.assertRaises(ValueError):
+            topological_order(stages=[_stage("a", depends_on=["unknown"])])
+
+    def test_critical_path(self):
+        stages = [_stage("frames"), _stage("track", depends_on=["frames"]), _stage("audio"), _stage("render", depends_on=["track", "audio"])]
+
+        path, seconds = critical_path(stages=stages, durations={"frames": 2, "track": 5, "audio": 4, "render": 1})
+        self.assertEqual(["frames", "track", "render"], path)
+        self.assertEqual(8, seconds)
+
+    def test_dependency_order(self):
+        stages = [
+            _stage("frames", device=CPU),
+            _stage("landmarks", depends_on=["frames"], device=CPU),
+            _stage("audio", depends_on=["frames"], device=CPU),
+            _stage("render", depends_on=["landmarks", "audio"]),
+        ]
+
+        durations = self._runner().run(job_id="job", stages=stages, data_dir=TEST_DATA_DIR)
+        self.assertEqual({"frames", "landmarks", "audio", "render"}, durations.keys())
+
+        executed = self._executed()
+        for stage in stages:
+            for dependency in stage.depends_on:
+                self.assertLessEqual(executed[dependency][1], executed[stage.name][0], msg=f"{stage.name} started before {dependency} was done")
+
+        # Independent stages run concurrently on the CPU workers
+        self.assertLess(executed["landmarks"][0], executed["audio"][1])
+        self.assertLess(executed["audio"][0], executed["landmarks"][1])
+
+    def test_failure_propagation(self):
+        self.failing.add("landmarks")
+        stages = [
+            _stage("frames", device=CPU),
+            _stage("landmarks", depends_on=["frames"], device=CPU),
+            _stage("audio", depends_on=["frames"], device=CPU),
+            _stage("render", depends_on=["landmarks", "audio"]),
+        ]
+
+        with self.assertRaises(StageFailedException):
+            self._runner().run(job_id="job", stages=stages, data_dir=TEST_DATA_DIR)
+
+        # The stage running concurrently to the failed one completes, whereas the stages depending on it are never started
+        self.assertEqual({"frames", "audio"}, self._executed().keys())
+
+    def test_batching(self):
+        runner = self._runner(max_batch_jobs=2, batch_deadline_seconds=2)
+        results: Dict[str, Dict[str, float]] = {}
+
+        def run(job_id: str) -> None:
+            stage = _stage("unet", args=["--job", job_id], batch_key="avatar", batch_args=["--job", job_id])
+            results[job_id] = runner.run(job_id=job_id, stages=[stage], data_dir=TEST_DATA_DIR)
+
+        jobs = [Thread(target=run, args=(job_id,)) for job_id in ["job-1", "job-2"]]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+
+        # Both jobs are executed as a single stage, whose duration is reported to both of them
+        self.assertEqual(1, len(self.log))
+        self.assertEqual({"--job"}, set(self.log[0][1][::2]))
+        self.assertEqual({"job-1", "job-2"}, set(self.log[0][1][1::2]))
+        self.assertEqual(results["job-1"], results["job-2"])
+
+    def test_failed_batch(self):
+        self.failing.add("unet")
+        runner = self._runner(max_batch_jobs=2, batch_deadline_seconds=2)
+        errors: Dict[str, Exception] = {}
+
+        def run(job_id: str) -> None:
+            try:
+                runner.run(job_id=job_id, stages=[_stage("unet", batch_key="avatar", batch_args=["--job", job_id])], data_dir=TEST_DATA_DIR)
+            except StageFailedException as e:
+                errors[job_id] = e
+
+        jobs = [Thread(target=run, args=(job_id,)) for job_id in ["job-1", "job-2"]]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+
+        self.assertEqual({"job-1", "job-2"}, errors.keys())
+
+    def test_cached_stage(self):
+        stages = [_stage("frames", outputs=["frames.npy"], manifest_dir=".", device=CPU)]
+        runner = self._runner()
+
+        self.assertEqual({"frames"}, runner.run(job_id="job-1", stages=stages, data_dir=TEST_DATA_DIR).keys())
+        self.assertEqual({}, runner.run(job_id="job-2", stages=stages, data_dir=TEST_DATA_DIR))
+        self.assertEqual(1, len(self.log))
+
+        # A modified output invalidates the manifest
+        with open(os.path.join(TEST_DATA_DIR, "frames.npy"), "w") as f:
+            f.write("modified")
+
+        self.assertEqual({"frames"}, runner.run(job_id="job-3", stages=stages, data_dir=TEST_DATA_DIR).keys())
+        self.assertEqual(2, len(self.log))
+
+    def test_concurrent_cached_stage(self):
+        stages = [_stage("frames", outputs=["frames.npy"], manifest_dir=".", device=CPU)]
+        runner = self._runner()
+        results: Dict[str, Dict[str, float]] = {}
+
+        def run(job_id: str) -> None:
+            results[job_id] = runner.run(job_id=job_id, stages=stages, data_dir=TEST_DATA_DIR)
+
+        jobs = [Thread(target=run, args=(job_id,)) for job_id in ["job-1", "job-2"]]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+
+        # Although two CPU workers are idle, only one of the jobs runs the stage, the other one skips it once the manifest is recorded
+        self.assertEqual(1, len(self.log))
+        self.assertEqual([set(), {"frames"}], sorted((set(durations.keys()) for durations in results.values()), key=len))
+
+
+if __name__ == '__main__':
+    unittest.main()
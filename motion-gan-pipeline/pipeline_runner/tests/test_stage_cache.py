@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+import shutil
+import unittest
+from threading import Thread
+from time import sleep
+from typing import List
+from unittest import TestCase
+from unittest.mock import patch
+
+from pipeline_runner import stage_cache
+from pipeline_runner.stage_cache import StageCache, code_version
+
+TEST_DATA_DIR = "/tmp/test-stage-cache"
+TEST_PARAMS = {"args": ["--fps", "25"], "command": None}
+TEST_VERSION = "version-1"
+
+
+def _write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class TestStageCache(TestCase):
+
+    def setUp(self) -> None:
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+        _write(os.path.join(TEST_DATA_DIR, "video.mp4"), "video")
+        _write(os.path.join(TEST_DATA_DIR, "frames", "00000.jpg"), "frame 0")
+        _write(os.path.join(TEST_DATA_DIR, "frames", "00001.jpg"), "frame 1")
+
+        self.cache = StageCache(base_dir=TEST_DATA_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+    def _check(self, params=None, version=TEST_VERSION):
+        return self.cache.check(stage="frames", inputs=["video.mp4"], outputs=["frames"], params=params or TEST_PARAMS, version=version)
+
+    def _record(self) -> None:
+        self.cache.record(stage="frames", inputs=["video.mp4"], outputs=["frames"], params=TEST_PARAMS, version=TEST_VERSION)
+
+    def test_hit(self):
+        self.assertEqual((False, "no manifest"), self._check())
+
+        self._record()
+        self.assertEqual((True, None), self._check())
+        self.assertEqual(["frames"], self.cache.stages())
+        self.assertEqual((True, None), self.cache.verify(stage="frames"))
+
+    def test_invalidation(self):
+        for change, reason in [
+            (lambda: self._check(params={"args": ["--fps", "30"], "command": None}), "parameters changed"),
+            (lambda: self._check(version="version-2"), "code changed"),
+            (lambda: _write(os.path.join(TEST_DATA_DIR, "video.mp4"), "other video") or self._check(), "inputs changed"),
+            (lambda: os.remove(os.path.join(TEST_DATA_DIR, "frames", "00001.jpg")) or self._check(), "outputs are missing or modified"),
+        ]:
+            self._record()
+            self.assertEqual((False, reason), change())
+
+            # The stale manifest is removed, such that an interrupted rerun is not mistaken for a completed one
+            self.assertIsNone(self.cache.load(stage="frames"))
+            self.assertEqual((False, "no manifest"), self._check())
+
+    def test_rewritten_files_match_by_content(self):
+        self._record()
+
+        # Rewriting a file with the same content updates its mtime, hence it is hashed again but still matches
+        _write(os.path.join(TEST_DATA_DIR, "video.mp4"), "video")
+        self.assertEqual((True, None), self._check())
+
+    def test_record_reuses_known_digests(self):
+        self._record()
+
+        # The frames are the input of the next stage, which is recorded by a cache with a different base dir sharing the manifest dir, like the runner
+        _write(os.path.join(TEST_DATA_DIR, "landmarks.npy"), "landmarks")
+        data_dir, video_dir = os.path.split(TEST_DATA_DIR)
+        landmark_cache = StageCache(base_dir=data_dir, manifest_dir=self.cache.manifest_dir)
+
+        with patch.object(stage_cache, "file_sha256", wraps=stage_cache.file_sha256) as file_sha256:
+            landmark_cache.record(
+                stage="landmarks", inputs=[os.path.join(video_dir, "frames")], outputs=[os.path.join(video_dir, "landmarks.npy")], params=TEST_PARAMS, version=TEST_VERSION,
+            )
+
+        # Only the new output is hashed
+        self.assertEqual([os.path.join(TEST_DATA_DIR, "landmarks.npy")], [args[0] for args, _ in file_sha256.call_args_list])
+        self.assertEqual(
+            list(self.cache.load(stage="frames")["outputs"].values()),
+            list(landmark_cache.load(stage="landmarks")["inputs"].values()),
+        )
+        self.assertEqual((True, None), landmark_cache.verify(stage="landmarks"))
+
+    def test_lock(self):
+        events: List[str] = []
+
+        def run(job_id: str) -> None:
+            # A separate cache per job, as created by the preprocessing of every job
+            with StageCache(base_dir=TEST_DATA_DIR).lock(stage="frames"):
+                events.append(f"{job_id} started")
+                sleep(0.1)
+                events.append(f"{job_id} done")
+
+        jobs = [Thread(target=run, args=(job_id,)) for job_id in ["job-1", "job-2"]]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+
+        self.assertEqual([event.replace("started", "done") for event in events[::2]], events[1::2])
+        self.assertEqual([], self.cache.stages())
+
+    def test_clear_outputs(self):
+        _write(os.path.join(TEST_DATA_DIR, "track_params.pt"), "params")
+
+        # Outputs which are modified in place are also inputs & must be kept
+        self.cache.clear_outputs(inputs=["video.mp4", "track_params.pt"], outputs=["frames", "track_params.pt"])
+
+        self.assertFalse(os.path.exists(os.path.join(TEST_DATA_DIR, "frames")))
+        self.assertTrue(os.path.isfile(os.path.join(TEST_DATA_DIR, "track_params.pt")))
+
+    def test_code_version(self):
+        _write(os.path.join(TEST_DATA_DIR, "code", "stage.py"), "print('stage')")
+        _write(os.path.join(TEST_DATA_DIR, "code", "model.pth"), "weights")
+
+        version = code_version(base_dir=TEST_DATA_DIR, paths=["code"])
+        with_checkpoint = code_version(base_dir=TEST_DATA_DIR, paths=["code", "code/model.pth"])
+        self.assertNotEqual(version, with_checkpoint)
+
+        # Only python sources count, unless other files are listed explicitly
+        _write(os.path.join(TEST_DATA_DIR, "code", "model.pth"), "retrained weights")
+        self.assertEqual(version, code_version(base_dir=TEST_DATA_DIR, paths=["code"]))
+        self.assertNotEqual(with_checkpoint, code_version(base_dir=TEST_DATA_DIR, paths=["code", "code/model.pth"]))
+
+        _write(os.path.join(TEST_DATA_DIR, "code", "stage.py"), "print('updated stage')")
+        self.assertNotEqual(version, code_version(base_dir=TEST_DATA_DIR, paths=["code"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
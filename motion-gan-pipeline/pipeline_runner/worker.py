@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Long-lived stage worker, started by the PipelineRunner within the python interpreter of a conda env.
+
+Reads one json request per line from stdin & answers with one json response per line. Everything the stages print is redirected to stderr,
+such that stdout is reserved for the responses. Libraries imported by a stage, e.g. torch or tensorflow, stay imported for all subsequent stages,
+whereas the modules of the project itself are unloaded after every stage, since the pipeline scripts use conflicting top-level module names.
+The pipeline runner package is never unloaded, such that the models kept by pipeline_runner.model_registry outlive the stages which loaded them.
+
+Runs in every conda env of the pipeline, hence it is restricted to the standard library & python 3.7.
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import runpy
+import subprocess
+import sys
+import traceback
+
+
+def run_script(script_path, args, cwd):
+    saved_cwd, saved_path, saved_argv = os.getcwd(), list(sys.path), list(sys.argv)
+
+    os.chdir(cwd)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+    sys.argv = [script_path] + list(args)
+
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError("{} exited with code {}".format(script_path, e.code))
+
+    finally:
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+        sys.argv = saved_argv
+
+
+def unload_project_modules(project_dir):
+    """ Removes all modules located within project_dir, except for the pipeline runner itself """
+    runner_dir = os.path.dirname(os.path.abspath(__file__))
+
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None) or ""
+
+        if module_file.startswith(project_dir) and not module_file.startswith(runner_dir):
+            del sys.modules[name]
+
+
+def release_memory():
+    gc.collect()
+
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def handle(request, project_dir):
+    cwd = os.path.join(project_dir, request["cwd"])
+
+    try:
+        if request.get("script") is not None:
+            run_script(script_path=request["script"], args=request["args"], cwd=cwd)
+        else:
+            subprocess.run(request["command"], cwd=cwd, check=True)
+
+        return {"ok": True}
+
+    except Exception as e:
+        traceback.print_exc()
+        return {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+
+    finally:
+        unload_project_modules(project_dir=project_dir)
+        release_memory()
+
+        model_registry = sys.modules.get("pipeline_runner.model_registry")
+        if model_registry is not None:
+            print("Model registry: {}".format(model_registry.model_registry.stats()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--project_dir", required=True)
+    parser.add_argument("--preload", nargs="*", default=[], help="Modules imported on startup, such that the first stage does not pay for them")
+    opt = parser.parse_args()
+
+    # Responses are written to a duplicate of stdout, while stdout itself is redirected to stderr, including the output of subprocesses
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    project_dir = os.path.abspath(opt.project_dir)
+
+    for module in opt.preload:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print("Unable to preload {}: {}".format(module, e), file=sys.stderr)
+
+    responses.write(json.dumps({"ready": True}) + "\n")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        responses.write(json.dumps(handle(request=json.loads(line), project_dir=project_dir)) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Helpers shared by the stores of preprocessed arrays, e.g. landmark_store.py, deepspeech_store.py, frame_store.py & deca_store.py.
+
+Single array stores are replaced atomically through a temporary file, such that readers never see a truncated file. Arrays too large to be built
+in memory are streamed into the temporary file by an ArrayWriter. A store directory is complete
+once its manifest.json exists. The manifest is removed before the store is rewritten and written last, likewise through a temporary file.
+The stores convert the per-frame files of existing datasets from %05d<suffix> files, see numbered_file_ids & convert_dirs.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def save_array_atomic(path, array):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class ArrayWriter:
+    """ Writes an (N, ...) array chunk by chunk into a memory-mapped file, which only replaces path once all N items are written """
+
+    def __init__(self, path, shape, dtype, unit='frame'):
+        self.path = path
+        self.length = shape[0]
+        self.unit = unit
+        self.written = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.tmp_path = path + '.tmp.npy'
+        self.array = open_memmap(self.tmp_path, mode='w+', dtype=dtype, shape=shape)
+
+    def write(self, start, items):
+        if start != self.written:
+            raise ValueError('%s %d written to %s, expected %s %d' % (self.unit.capitalize(), start, self.path, self.unit, self.written))
+
+        self.array[start:start + len(items)] = items
+        self.written += len(items)
+
+    def close(self):
+        if self.written != self.length:
+            self.discard()
+            raise ValueError('Only %d of %d %ss were written to %s' % (self.written, self.length, self.unit, self.path))
+
+        self.array.flush()
+        del self.array
+
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        """ Removes the partially written array, leaving any previous array at path untouched """
+        del self.array
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+        else:
+            self.discard()
+
+
+def remove_manifest(store_dir):
+    """ Marks the store as incomplete, while it is being rewritten """
+    manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+
+def write_manifest(store_dir, manifest):
+    """ Marks the store as complete, replacing the manifest atomically """
+    tmp_path = os.path.join(store_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST_NAME))
+
+
+def read_manifest(store_dir, missing_message):
+    """ Returns the manifest of a complete store, raising FileNotFoundError with missing_message for incomplete stores """
+    manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        raise FileNotFoundError(missing_message)
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def numbered_file_ids(file_dir, suffix, consecutive=True):
+    """ Returns the sorted ids of the %05d<suffix> files in file_dir. With consecutive, the ids must be numbered consecutively from 0 """
+    ids = sorted(int(name[:-len(suffix)]) for name in os.listdir(file_dir) if name.endswith(suffix) and name[:-len(suffix)].isdigit())
+
+    if consecutive and ids != list(range(len(ids))):
+        raise ValueError('The %s files of %s are not numbered consecutively from 0' % (suffix, file_dir))
+
+    return ids
+
+
+def convert_dirs(conversions, pack, unit='frames'):
+    """ Converts the per-frame files of every (file_dir, path) pair into the store at path with pack(file_dir, path), skipping missing dirs """
+    for file_dir, path in conversions:
+        if not os.path.isdir(file_dir):
+            print('Skipping %s, not found' % file_dir)
+            continue
+
+        print('Converted %d %s of %s into %s' % (pack(file_dir, path), unit, file_dir, path))
+
+
+def convert_dataset_main(description, file_dir_name, store_name, pack, unit='frames'):
+    """ Command line converter of the per-frame files in <dataset_base>/<file_dir_name> into the store <dataset_base>/<store_name> """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--dataset_base', required=True, help='Dataset dir containing %s/' % file_dir_name)
+    opt = parser.parse_args()
+
+    convert_dirs([(os.path.join(opt.dataset_base, file_dir_name), os.path.join(opt.dataset_base, store_name))], pack, unit)
@@ -67,6 +67,20 @@ class PreprocessingOptions(Options):
         parser.add_argument('--use_FLAME', action='store_true', help='If true, use flame tracker for face model')
         parser.add_argument('--use_BASEL', action='store_true', help='If true, use basel tracker for face model')
 
+        parser.add_argument('--landmark_batch_size', type=int, default=16, help='Frames processed at once by the landmark detection')
+        parser.add_argument('--landmark_detection_stride', type=int, default=5, help='Faces are detected every n frames & tracked in between, 1 detects every frame')
+        parser.add_argument('--landmark_workers', type=int, default=0, help='If > 0, landmarks are detected by a pool of CPU processes instead of the GPU')
+        parser.add_argument('--deca_batch_size', type=int, default=32, help='Frames encoded at once by the DECA tracker')
+        parser.add_argument('--deca_workers', type=int, default=4, help='DataLoader processes cropping the faces for the DECA tracker, 0 crops in the main process')
+        parser.add_argument('--body_tracking_workers', type=int, default=0, help='If > 0, long videos are split into shards whose bodies are tracked by a pool of processes')
+        parser.add_argument('--body_segmentation', action='store_true', help='If true, MediaPipe also computes the segmentation mask of the body, only used by the debug images')
+        parser.add_argument('--optical_flow_method', type=str, default='flownet2', choices=['flownet2', 'tvl1'], help='FlowNet2 on the GPU or TV-L1 on the CPU')
+        parser.add_argument('--optical_flow_scale', type=float, default=1.0, help='Scale of the frames the optical flow is computed on, e.g. 0.5 for half resolution flow')
+        parser.add_argument('--optical_flow_batch_size', type=int, default=8, help='Frame pairs inferred at once by FlowNet2')
+        parser.add_argument('--optical_flow_workers', type=int, default=0, help='If > 0, the TV-L1 flow is computed by a pool of CPU processes')
+        parser.add_argument('--image_writer_threads', type=int, default=4, help='Threads writing the images of a step in the background, 0 writes them synchronously')
+        parser.add_argument('--skip_debug_images', action='store_true', help='If true, debug images are not written')
+
         parser.add_argument('--train_split', type=float, default=0.9, help='Percentage of data used for training')
         parser.add_argument('--val_split', type=float, default=0.01, help='Percentage of data used for validation')
 
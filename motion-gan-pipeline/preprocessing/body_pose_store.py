@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" MediaPipe body poses of all frames of a video, packed into a single (N, 33, 4) float32 .npy file instead of one %05d.npy file per frame.
+
+Every pose holds the x & y pixel coordinates, the depth & the visibility of the 33 MediaPipe pose landmarks. Frames without pose are all zeros.
+The file is memory-mapped, hence single frames are read without loading the whole video.
+
+Usage, converting the .npy files of an existing dataset: python body_pose_store.py --dataset_base <video dir>
+"""
+
+import os
+
+import numpy as np
+
+from array_store import convert_dataset_main, numbered_file_ids, save_array_atomic
+
+BODY_POSES = 'body_pose.npy'  # Relative to the dataset base, see step 9
+NUM_BODY_LANDMARKS = 33
+
+# Indices of the landmarks predicted by the head2body regression, see face2body.py
+LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP = 11, 12, 23, 24
+
+
+def load_body_poses(path):
+    """ Returns the memory-mapped (N, 33, 4) body poses """
+    if not os.path.isfile(path):
+        raise FileNotFoundError('No body poses at %s, please track the body first (step 9)' % path)
+
+    return np.load(path, mmap_mode='r')
+
+
+def save_body_poses(path, poses):
+    save_array_atomic(path, np.asarray(poses, dtype=np.float32))
+
+
+def empty_body_poses(num_frames):
+    """ Returns an array for the poses of num_frames frames, all of them missing """
+    return np.zeros((num_frames, NUM_BODY_LANDMARKS, 4), dtype=np.float32)
+
+
+def pack_body_pose_dir(pose_dir, path):
+    """ Converts a directory of %05d.npy files into a single body pose file. Returns the number of converted frames """
+    frame_ids = numbered_file_ids(pose_dir, '.npy')
+    if not frame_ids:
+        return 0
+
+    poses = empty_body_poses(len(frame_ids))
+    for idx in frame_ids:
+        poses[idx] = np.load(os.path.join(pose_dir, '%05d.npy' % idx))
+
+    save_body_poses(path, poses)
+    return len(frame_ids)
+
+
+def main():
+    convert_dataset_main('Converts the per-frame body poses of a dataset into a single body pose file', 'body_pose', BODY_POSES, pack_body_pose_dir)
+
+
+if __name__ == '__main__':
+    main()
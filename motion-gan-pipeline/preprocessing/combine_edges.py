@@ -4,6 +4,7 @@
 from ast import Num
 from genericpath import isfile
 import os
+import sys
 from tqdm import tqdm
 import numpy as np
 import torch
@@ -17,8 +18,13 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import argparse
 from edge_creation.utils import get_edge_predicted, get_edge_image_mixed, get_crop_coords, convert_to_rgb
+from landmark_store import DETECTED_LANDMARKS, GENERATED_LANDMARKS, LandmarkStore
 from scipy.ndimage import gaussian_filter1d
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_runner.image_writer import ImageWriter
+from pipeline_runner.model_registry import load_cached
+
 def combine_edges(inopt):
     # load generated headposes
     generated_hp_path = os.path.join(inopt.out_dir, 'headposes.npy')
@@ -35,19 +41,18 @@ def combine_edges(inopt):
     img = Image.open(os.path.join(inopt.dataset_base, 'matting', '%05d.png' % 0))
     img = convert_to_rgb(img)
 
-    ldk_paths = os.listdir(os.path.join(inopt.out_dir, 'landmarks'))
-    points = np.mean([np.loadtxt(os.path.join(inopt.out_dir, 'landmarks', ldk))[:,:2] for ldk in ldk_paths], axis=0)
+    generated_landmarks = LandmarkStore(os.path.join(inopt.out_dir, GENERATED_LANDMARKS))
+    tracked_landmarks = LandmarkStore(os.path.join(inopt.dataset_base, DETECTED_LANDMARKS))
+    points = generated_landmarks.mean()
     crop_coords = get_crop_coords(points, img.size)
 
-    for frame_num in tqdm(range(generated_hp.shape[0])):
-
-        ist, index = KDTree(tracked_hp).query(generated_hp[frame_num], workers=-1)
+    with ImageWriter('edges') as writer:
+        for frame_num in tqdm(range(generated_hp.shape[0])):
 
-        img_path = os.path.join(inopt.dataset_base, 'matting', '%05d.png' % index)
-        generated_landmark_path = os.path.join(inopt.out_dir, 'landmarks', '%05d.lms' % frame_num)
-        tracked_landmark_path = os.path.join(inopt.dataset_base, 'landmarks', '%05d.lms' % index)
+            ist, index = KDTree(tracked_hp).query(generated_hp[frame_num], workers=-1)
 
-        get_edge_image_mixed(inopt.out_dir, img_path, generated_landmark_path, tracked_landmark_path, crop_coords, frame_num)
+            img_path = os.path.join(inopt.dataset_base, 'matting', '%05d.png' % index)
+            get_edge_image_mixed(inopt.out_dir, img_path, generated_landmarks[frame_num], tracked_landmarks[index], crop_coords, frame_num, writer=writer)
         
 
 def predict_face2body(inopt):
@@ -61,12 +66,17 @@ def predict_face2body(inopt):
         print('No checkpoint found.')
         exit()
 
-    model = model = nn.Linear(77 * 2, 4 * 2).to(device)
-    model.load_state_dict(torch.load(checkpoint_path))
-    model.eval()
+    def load_head2body():
+        model = nn.Linear(77 * 2, 4 * 2).to(device)
+        model.load_state_dict(torch.load(checkpoint_path))
+        model.eval()
+        return model
+
+    model = load_cached(avatar=inopt.target_name, name='head2body', checkpoint_path=checkpoint_path, loader=load_head2body)
 
     # landmarks
-    num_ldk = len(os.listdir(os.path.join(inopt.out_dir, 'landmarks')))
+    landmarks = LandmarkStore(os.path.join(inopt.out_dir, GENERATED_LANDMARKS))
+    num_ldk = len(landmarks)
 
     # transforms
     trans = transforms.ToTensor()
@@ -79,10 +89,8 @@ def predict_face2body(inopt):
     print('Predicting body landmarks..')
     output_ldks = []
     for idx in tqdm(range(num_ldk)):
-        landmark_name = os.path.join(inopt.out_dir, 'landmarks', '%05d.lms' % idx)
-
         # load and transform input
-        input_ldk = np.loadtxt(landmark_name)[:, :2]
+        input_ldk = landmarks[idx]
         input_ldk[:, 0] = input_ldk[:, 0] / w
         input_ldk[:, 1] = input_ldk[:, 1] / h
         input_ldk = trans(input_ldk).flatten().float().to(device).unsqueeze(0)
@@ -107,10 +115,10 @@ def predict_face2body(inopt):
     output_ldks = gaussian_filter1d(output_ldks.reshape(-1, 8), smooth_sigma, axis=0).reshape(-1, 4, 2)
 
     print('\nMaking edges..')
-    for idx in tqdm(range(num_ldk)):
-        landmark_name = os.path.join(inopt.out_dir, 'landmarks', '%05d.lms' % idx)
-        output_ldk = output_ldks[idx]
-        get_edge_predicted(idx, inopt.out_dir, landmark_name, output_ldk, im_size)
+    with ImageWriter('edges') as writer:
+        for idx in tqdm(range(num_ldk)):
+            output_ldk = output_ldks[idx]
+            get_edge_predicted(idx, inopt.out_dir, landmarks[idx], output_ldk, im_size, writer=writer)
 
     
 
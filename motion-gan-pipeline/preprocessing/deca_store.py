@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" DECA codes of all tracked frames of a video, stored once per avatar as one memory-mapped float32 array per code instead of one file per frame.
+
+The store is a directory containing <code>.npy files of shape (N, ...), e.g. shape, exp, pose, cam, light & detail as returned by DECA.encode, the
+expression used by the trackers (expr, DECA expression & jaw pose) and the crop transforms (tform), and a manifest.json which is written last,
+such that a store without manifest is incomplete.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from array_store import read_manifest, remove_manifest, write_manifest
+
+DECA_STORE_DIR = 'deca_codes'
+MANIFEST_VERSION = 1
+EXPRESSIONS = 'expr'  # Expression parameters of the face model, as used by Audio2ExpressionNet & the transforms
+
+
+class DecaStoreWriter:
+    """ Writes the codes of batches of frames into a new DECA store, allocating the array of a code on its first batch """
+
+    def __init__(self, store_dir, num_frames):
+        self.store_dir = store_dir
+        self.num_frames = num_frames
+        self.arrays = {}
+
+        os.makedirs(store_dir, exist_ok=True)
+
+        remove_manifest(store_dir)
+
+    def write(self, ids, codes):
+        """ Writes the codes, a dict of arrays or tensors of shape (len(ids), ...), of the frames with the given ids """
+        for name, values in codes.items():
+            if hasattr(values, 'detach'):
+                values = values.detach().cpu().numpy()
+
+            values = np.asarray(values, dtype=np.float32)
+            if name not in self.arrays:
+                self.arrays[name] = open_memmap(os.path.join(self.store_dir, name + '.npy'), mode='w+', dtype=np.float32,
+                                                shape=(self.num_frames,) + values.shape[1:])
+
+            self.arrays[name][ids] = values
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'num_frames': self.num_frames,
+            'codes': {name: list(array.shape[1:]) for name, array in self.arrays.items()},
+        }
+        self.arrays = {}
+
+        write_manifest(self.store_dir, manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted store remains without manifest
+        if exc_type is None:
+            self.close()
+
+
+class DecaStore:
+    """ Read access to a DECA store. Every code is a memory-mapped array of shape (N, ...), indexed by tracked frame """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        manifest = read_manifest(store_dir, 'No complete DECA store at %s, please track the face first (step 3)' % store_dir)
+
+        self.num_frames = manifest['num_frames']
+        self.codes = sorted(manifest['codes'])
+
+        self._arrays = {}
+
+    def __len__(self):
+        return self.num_frames
+
+    def __contains__(self, name):
+        return name in self.codes
+
+    def __getitem__(self, name):
+        if name not in self.codes:
+            raise KeyError('No code %s in %s, the store contains %s' % (name, self.store_dir, ', '.join(self.codes)))
+
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.store_dir, name + '.npy'), mmap_mode='r')
+
+        return self._arrays[name]
+
+    @property
+    def expressions(self):
+        return self[EXPRESSIONS]
+
+
+def open_deca_store(dataset_base):
+    return DecaStore(os.path.join(dataset_base, DECA_STORE_DIR))
@@ -2,10 +2,16 @@
 20.10.14
 Code collection from VOCA:
 https://github.com/TimoBolkart/voca
+
+The DeepSpeech graph is imported once per process and its session kept open, see get_extractor. Audio is processed in overlapping chunks, such
+that the memory needed does not depend on the length of the clip, and the features are streamed into a single array per clip, see deepspeech_store.
 """
 import argparse
 import re
 import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
 
 from scipy.io import wavfile
 import os
@@ -18,6 +24,212 @@ import moviepy.editor as mp
 from pydub import AudioSegment
 from subprocess import call
 
+from deepspeech_store import DEEPSPEECH_FEATURES, DeepSpeechFeatureWriter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_runner.model_registry import load_cached
+
+SAMPLE_RATE = 16000  # DeepSpeech expects 16kHz audio
+N_INPUT = 26  # MFCC features per time step
+N_CONTEXT = 9  # Time steps of past & future context per input vector
+MFCC_WINDOW = 400  # Samples per MFCC frame, 25ms
+MFCC_STEP = 160  # Samples between MFCC frames, 10ms
+PREEMPHASIS = 0.97
+DEEPSPEECH_FPS = 50  # The BiRNN only sees every second MFCC frame
+
+
+def sliding_windows(array, window_size):
+    """ Returns a read-only view of shape (len(array) - window_size + 1, window_size, ...) onto all windows of consecutive rows of the array.
+    Equivalent to np.lib.stride_tricks.sliding_window_view, which is not available with the numpy version required by tensorflow 1.15
+    """
+    array = np.ascontiguousarray(array)
+    return np.lib.stride_tricks.as_strided(
+        array,
+        (len(array) - window_size + 1, window_size) + array.shape[1:],
+        (array.strides[0],) + array.strides,
+        writeable=False)
+
+
+class DeepSpeechExtractor:
+    """ Holds the imported DeepSpeech graph & an open session, and streams the features of 16kHz int16 audio.
+
+    The BiRNN runs on chunks of chunk_seconds, each extended by overlap_seconds of context on both sides, whose logits are discarded. The input
+    normalization uses the statistics of the whole clip, which are gathered in a first pass over its MFCCs, as if the clip was processed at once.
+    """
+
+    def __init__(self, graph_fname, chunk_seconds=30.0, overlap_seconds=2.0):
+        with tf.io.gfile.GFile(graph_fname, "rb") as f:
+            graph_def = tf.compat.v1.GraphDef()
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="deepspeech")
+
+        self.input_tensor = self.graph.get_tensor_by_name('deepspeech/input_node:0')
+        self.seq_length = self.graph.get_tensor_by_name('deepspeech/input_lengths:0')
+        self.layer_6 = self.graph.get_tensor_by_name('deepspeech/logits:0')
+
+        self.session = tf.compat.v1.Session(graph=self.graph)
+
+        self.chunk_steps = max(1, int(chunk_seconds * DEEPSPEECH_FPS))
+        self.overlap_steps = int(overlap_seconds * DEEPSPEECH_FPS)
+
+    def close(self):
+        self.session.close()
+
+    @staticmethod
+    def num_steps(num_samples):
+        """ Number of time steps of the BiRNN, i.e. every second MFCC frame """
+        num_mfcc_frames = 1 + max(0, int(np.ceil((num_samples - MFCC_WINDOW) / MFCC_STEP)))
+        return (num_mfcc_frames + 1) // 2
+
+    @staticmethod
+    def mfcc_steps(audio, start, end):
+        """ Returns the MFCCs of the time steps [start, end), identical to those of the whole clip """
+        first_sample = 2 * start * MFCC_STEP
+        last_sample = min(2 * (end - 1) * MFCC_STEP + MFCC_WINDOW, len(audio))
+
+        # The pre-emphasis of the chunk needs the sample before it, hence it is applied here instead of by mfcc
+        signal = np.asarray(audio[max(0, first_sample - 1):last_sample], dtype=np.float64)
+        if first_sample == 0:
+            signal = np.append(signal[0], signal[1:] - PREEMPHASIS * signal[:-1])
+        else:
+            signal = signal[1:] - PREEMPHASIS * signal[:-1]
+
+        return mfcc(signal, samplerate=SAMPLE_RATE, numcep=N_INPUT, preemph=0)[::2][:end - start]
+
+    def normalization(self, audio, num_steps):
+        """ Returns the mean & std of all input vectors of the clip, each MFCC being weighted by the number of input vectors it is part of """
+        total, total_squares = 0.0, 0.0
+
+        for start in range(0, num_steps, self.chunk_steps):
+            features = self.mfcc_steps(audio, start, min(start + self.chunk_steps, num_steps))
+            steps = np.arange(start, start + len(features))
+            weights = np.minimum(steps + N_CONTEXT, num_steps - 1) - np.maximum(steps - N_CONTEXT, 0) + 1
+
+            total += np.dot(weights, features.sum(axis=1))
+            total_squares += np.dot(weights, np.square(features).sum(axis=1))
+
+        num_values = num_steps * (2 * N_CONTEXT + 1) * N_INPUT
+        mean = total / num_values
+
+        return mean, np.sqrt(max(total_squares / num_values - mean ** 2, 0.0))
+
+    def input_vectors(self, audio, start, end, num_steps, mean, std):
+        """ Returns the normalized input vectors of the time steps [start, end), including their past & future context """
+        context_start, context_end = max(0, start - N_CONTEXT), min(num_steps, end + N_CONTEXT)
+        features = self.mfcc_steps(audio, context_start, context_end)
+
+        # Empty context before the first & after the last time step of the clip
+        features = np.pad(features, ((context_start - (start - N_CONTEXT), (end + N_CONTEXT) - context_end), (0, 0)))
+
+        windows = sliding_windows(features, 2 * N_CONTEXT + 1).reshape(end - start, -1)
+
+        return (windows - mean) / std
+
+    def logits(self, audio):
+        """ Yields the (n, 29) logits of consecutive chunks of the clip, at 50 fps """
+        num_steps = self.num_steps(len(audio))
+        mean, std = self.normalization(audio, num_steps)
+
+        for start in range(0, num_steps, self.chunk_steps):
+            end = min(start + self.chunk_steps, num_steps)
+            context_start, context_end = max(0, start - self.overlap_steps), min(num_steps, end + self.overlap_steps)
+
+            input_vector = self.input_vectors(audio, context_start, context_end, num_steps, mean, std)
+            network_output = self.session.run(self.layer_6, feed_dict={self.input_tensor: input_vector[np.newaxis, ...],
+                                                                       self.seq_length: [input_vector.shape[0]]})
+
+            yield network_output[start - context_start:end - context_start, 0]
+
+    def stream(self, audio, target_fps, window_size=16, window_stride=1):
+        """ Yields (first window, windows) for consecutive chunks of the (N, window_size, 29) features of the 16kHz int16 audio, see num_windows """
+        num_frames = int(round(len(audio) / float(SAMPLE_RATE) * target_fps))
+        frames = interpolate_stream(self.logits(audio), self.num_steps(len(audio)), DEEPSPEECH_FPS, target_fps, num_frames)
+
+        return window_stream(frames, num_frames, window_size, window_stride)
+
+
+def get_extractor(graph_fname):
+    """ Returns the extractor of the graph, which is kept resident within the stage workers """
+    return load_cached(avatar=None, name='DeepSpeech', checkpoint_path=graph_fname, loader=lambda: DeepSpeechExtractor(graph_fname))
+
+
+def interpolate_stream(chunks, input_len, input_rate, output_rate, output_len):
+    """ Linearly resamples the features arriving in chunks, as np.interp would the concatenated features. Yields the resampled features in chunks """
+    ratio = float(input_rate) / output_rate
+    buffer, buffer_start = None, 0
+    frame = 0
+
+    for chunk in chunks:
+        buffer = chunk if buffer is None else np.concatenate((buffer, chunk))
+        available = buffer_start + len(buffer)
+
+        # Output frames between two available input frames, or after the last one
+        end = output_len if available == input_len else min(output_len, int(np.ceil((available - 1) / ratio)) + 1)
+        positions = np.arange(frame, end) * ratio
+        lower = np.minimum(np.floor(positions).astype(int), input_len - 1)
+        upper = np.minimum(lower + 1, input_len - 1)
+
+        ready = upper < available
+        positions, lower, upper = positions[ready], lower[ready], upper[ready]
+        if not len(positions):
+            continue
+
+        weights = np.clip(positions - lower, 0, 1)[:, np.newaxis]
+        yield (1 - weights) * buffer[lower - buffer_start] + weights * buffer[upper - buffer_start]
+
+        frame += len(positions)
+        if frame == output_len:
+            return
+
+        next_lower = min(int(np.floor(frame * ratio)), input_len - 1, available)
+        buffer = buffer[next_lower - buffer_start:]
+        buffer_start = next_lower
+
+
+def num_windows(num_frames, window_size, window_stride):
+    half = int(window_size / 2)
+    return len(range(0, num_frames + 2 * half - window_size, window_stride))
+
+
+def window_stream(chunks, num_frames, window_size, window_stride):
+    """ Yields (first window, windows) of the zero padded frames arriving in chunks, window i starting window_size / 2 frames before frame i """
+    half = int(window_size / 2)
+    total = num_windows(num_frames, window_size, window_stride)
+
+    buffer, buffer_start = None, 0  # Buffer of the padded frames
+    window = 0
+
+    def windows_until(buffer, buffer_start, window):
+        """ Returns the windows from window on which lie within the buffer, None if there are none """
+        last = min((total - 1) * window_stride, buffer_start + len(buffer) - window_size)
+        if last < window:
+            return None
+
+        return np.array(sliding_windows(buffer, window_size)[window - buffer_start:last - buffer_start + 1:window_stride])
+
+    for chunk in chunks:
+        if buffer is None:
+            buffer = np.concatenate((np.zeros((half, chunk.shape[1])), chunk))
+        else:
+            buffer = np.concatenate((buffer, chunk))
+
+        windows = windows_until(buffer, buffer_start, window)
+        if windows is not None:
+            yield window // window_stride, windows
+            window += len(windows) * window_stride
+
+            buffer = buffer[window - buffer_start:]
+            buffer_start = window
+
+    if buffer is not None:
+        windows = windows_until(np.concatenate((buffer, np.zeros((half, buffer.shape[1])))), buffer_start, window)
+        if windows is not None:
+            yield window // window_stride, windows
+
+
 class AudioHandler:
     def __init__(self, config):
         self.config = config
@@ -35,106 +247,60 @@ class AudioHandler:
         else:
             raise NotImplementedError("Audio features not supported")
 
-    def convert_to_deepspeech(self, audio):
-        def audioToInputVector(audio, fs, numcep, numcontext):
-            # Get mfcc coefficients
-            features = mfcc(audio, samplerate=fs, numcep=numcep)
-
-            # We only keep every second feature (BiRNN stride = 2)
-            features = features[::2]
-
-            # One stride per time step in the input
-            num_strides = len(features)
-
-            # Add empty initial and final contexts
-            empty_context = np.zeros((numcontext, numcep), dtype=features.dtype)
-            features = np.concatenate((empty_context, features, empty_context))
-
-            # Create a view into the array with overlapping strides of size
-            # numcontext (past) + 1 (present) + numcontext (future)
-            window_size = 2 * numcontext + 1
-            train_inputs = np.lib.stride_tricks.as_strided(
-                features,
-                (num_strides, window_size, numcep),
-                (features.strides[0], features.strides[0], features.strides[1]),
-                writeable=False)
-
-            # Flatten the second and third dimensions
-            train_inputs = np.reshape(train_inputs, [num_strides, -1])
-
-            train_inputs = np.copy(train_inputs)
-            train_inputs = (train_inputs - np.mean(train_inputs)) / np.std(train_inputs)
-
-            # Return results
-            return train_inputs
+    def stream(self, audio):
+        """ Yields (first window, windows) of the 16kHz int16 audio, see DeepSpeechExtractor.stream """
+        extractor = get_extractor(self.config['deepspeech_graph_fname'])
+        return extractor.stream(audio, self.target_fps, self.audio_window_size, self.audio_window_stride)
 
+    def convert_to_deepspeech(self, audio):
         if type(audio) == dict:
             pass
         else:
             raise ValueError('Wrong type for audio')
 
-        # Load graph and place_holders
-
-        with tf.io.gfile.GFile(self.config['deepspeech_graph_fname'], "rb") as f:
-            graph_def = tf.compat.v1.GraphDef()
-            graph_def.ParseFromString(f.read())
-
-        from tensorflow.python.framework.ops import get_default_graph
-        graph = get_default_graph()
-        tf.import_graph_def(graph_def, name="deepspeech")
-        input_tensor = graph.get_tensor_by_name('deepspeech/input_node:0')
-        # input_tensor = graph.get_tensor_by_name('input_node:0')
-        seq_length = graph.get_tensor_by_name('deepspeech/input_lengths:0')
-        layer_6 = graph.get_tensor_by_name('deepspeech/logits:0')
+        processed_audio = copy.deepcopy(audio)
+        for subj in audio.keys():
+            for seq in audio[subj].keys():
+                print('process audio: %s - %s' % (subj, seq))
 
-        n_input = 26
-        n_context = 9
+                audio_sample = audio[subj][seq]['audio']
+                sample_rate = audio[subj][seq]['sample_rate']
+                if sample_rate != SAMPLE_RATE:
+                    audio_sample = resampy.resample(audio_sample.astype(float), sample_rate, SAMPLE_RATE)
 
-        processed_audio = copy.deepcopy(audio)
-        with tf.compat.v1.Session(graph=graph) as sess:
-            for subj in audio.keys():
-                for seq in audio[subj].keys():
-                    print('process audio: %s - %s' % (subj, seq))
-
-                    audio_sample = audio[subj][seq]['audio']
-                    sample_rate = audio[subj][seq]['sample_rate']
-                    resampled_audio = resampy.resample(audio_sample.astype(float), sample_rate, 16000)
-                    input_vector = audioToInputVector(resampled_audio.astype('int16'), 16000, n_input, n_context)
-
-                    network_output = sess.run(layer_6, feed_dict={input_tensor: input_vector[np.newaxis, ...],
-                                                                  seq_length: [input_vector.shape[0]]})
-
-                    # Resample network output from 50 fps to 60 fps
-                    audio_len_s = float(audio_sample.shape[0]) / sample_rate
-                    num_frames = int(round(audio_len_s * self.target_fps))
-                    network_output = self.interpolate_features(network_output[:, 0], 50, self.target_fps,
-                                                               output_len=num_frames)
-
-                    # Make windows
-                    zero_pad = np.zeros((int(self.audio_window_size / 2), network_output.shape[1]))
-                    network_output = np.concatenate((zero_pad, network_output, zero_pad), axis=0)
-                    windows = []
-                    for window_index in range(0, network_output.shape[0] - self.audio_window_size,
-                                              self.audio_window_stride):
-                        windows.append(network_output[window_index:window_index + self.audio_window_size])
-
-                    processed_audio[subj][seq]['audio'] = np.array(windows)
+                windows = [chunk for _, chunk in self.stream(audio_sample.astype('int16'))]
+                processed_audio[subj][seq]['audio'] = np.concatenate(windows) if windows else np.zeros((0, self.audio_window_size, self.num_audio_features))
         return processed_audio
 
     def interpolate_features(self, features, input_rate, output_rate, output_len=None):
-        num_features = features.shape[1]
         input_len = features.shape[0]
         seq_len = input_len / float(input_rate)
         if output_len is None:
             output_len = int(seq_len * output_rate)
-        input_timestamps = np.arange(input_len) / float(input_rate)
-        output_timestamps = np.arange(output_len) / float(output_rate)
-        output_features = np.zeros((output_len, num_features))
-        for feat in range(num_features):
-            output_features[:, feat] = np.interp(output_timestamps,
-                                                 input_timestamps,
-                                                 features[:, feat])
-        return output_features
+        output_features = list(interpolate_stream([features], input_len, input_rate, output_rate, output_len))
+        return np.concatenate(output_features) if output_features else np.zeros((0, features.shape[1]))
+
+
+@contextmanager
+def open_audio(path_wav):
+    """ Memory-maps the wav file as mono 16kHz int16 samples, converting it with ffmpeg into a temporary file if necessary.
+    Multi-channel audio is downmixed to the mean of its channels, as librosa.load(mono=True) did
+    """
+    try:
+        sample_rate, audio = wavfile.read(path_wav, mmap=True)
+    except ValueError:
+        sample_rate, audio = None, None
+
+    if sample_rate == SAMPLE_RATE and audio.ndim == 1 and audio.dtype == np.int16:
+        yield audio
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_converted = os.path.join(tmp_dir, 'audio.wav')
+        call(['ffmpeg', '-loglevel', 'error', '-i', path_wav, '-ac', '1', '-ar', str(SAMPLE_RATE), '-acodec', 'pcm_s16le', path_converted])
+
+        _, audio = wavfile.read(path_converted, mmap=True)
+        yield audio
 
 
 class AudioFeatures:
@@ -146,33 +312,27 @@ class AudioFeatures:
         return self.audio_handler.process(tmp_audio)['subj']['seq']['audio']
 
     def inference_interpolate_styles(self, audio_fname):
-        # TODO: check if this works
-        # sample_rate, audio = wavfile.read(audio_fname)
-        import soundfile as sf
-        import librosa
-        import wavio
-
-        x,_ = librosa.load(audio_fname, sr=16000)
-        sf.write(audio_fname, x, 16000)
-        print('Successfully converted.')
-
-        wav = wavio.read(audio_fname)
-        audio, sample_rate = wav.data, wav.rate
-
-        # audio, sample_rate = librosa.load(audio_fname)
-        
-        print("sample rate: ", sample_rate)
-        if audio.ndim != 1:
-            print('Audio has multiple channels, only first channel is considered')
-            audio = audio[:, 0]
-
-        processed_audio = self.process_audio(audio, sample_rate)
-        return processed_audio
+        with open_audio(audio_fname) as audio:
+            return self.process_audio(audio, SAMPLE_RATE)
 
     def run(self, audio_fname):
         features = self.inference_interpolate_styles(audio_fname)
         return features
 
+    def write(self, audio_fname, out_path):
+        """ Streams the features of the audio file into a single (N, window_size, 29) array at out_path, see deepspeech_store. Returns N """
+        handler = self.audio_handler
+
+        with open_audio(audio_fname) as audio:
+            num_frames = int(round(len(audio) / float(SAMPLE_RATE) * handler.target_fps))
+            total = num_windows(num_frames, handler.audio_window_size, handler.audio_window_stride)
+
+            with DeepSpeechFeatureWriter(out_path, total, window_size=handler.audio_window_size, num_features=handler.num_audio_features) as writer:
+                for start, windows in handler.stream(audio):
+                    writer.write(start, windows)
+
+        return total
+
 
 class FFMPEGMetaReader:
     """
@@ -307,16 +467,10 @@ def extract_ds(dataset_base, name, file_type, sample_rate=16000, target_fps=25.0
 
     config["target_fps"] = target_fps
 
-    # Compute features
-    features = AudioFeatures(config=config).run(path_wav)
-    folder_out = os.path.join(dataset_base, "audio_feature")
-
-    # Save features
-    mkdir(folder_out)
-    for i, feature in enumerate(features):
-        fn_out = "%05d.deepspeech.npy" % i
-        np.save(os.path.join(folder_out, fn_out), feature)
-    print("Written {} files to '{}'".format(features.shape[0], folder_out))
+    # Compute & save features
+    path_out = os.path.join(dataset_base, DEEPSPEECH_FEATURES)
+    num_features = AudioFeatures(config=config).write(path_wav, path_out)
+    print("Written {} features to '{}'".format(num_features, path_out))
 
 
 if __name__ == "__main__":
@@ -339,15 +493,10 @@ if __name__ == "__main__":
         raise Warning("Careful: fps is not an integer ({})".format(metadata["fps"]))
     config["target_fps"] = int(metadata["fps"])
 
-    # Compute features
-    features = AudioFeatures(config=config).run(path_wav)
-    folder_out = os.path.join(
+    # Compute & save features
+    path_out = os.path.join(
         './NeuralVoicePuppetry/Audio2ExpressionNet/Inference/datasets/{}'.format(
-            folder_nvp), file_id, "audio_feature")
-
-    # Save features
-    mkdir(folder_out)
-    for i, feature in enumerate(features):
-        fn_out = "%05d.deepspeech.npy" % i
-        np.save(os.path.join(folder_out, fn_out), feature)
-    print("Written {} files to '{}'".format(features.shape[0], folder_out))
+            folder_nvp), file_id, DEEPSPEECH_FEATURES)
+    num_features = AudioFeatures(config=config).write(path_wav, path_out)
+    print("Written {} features to '{}'".format(num_features, path_out))
+
@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" DeepSpeech features of all frames of a clip, packed into a single (N, 16, 29) float32 .npy file instead of one %05d.deepspeech.npy file per frame.
+
+Feature i is the window of 16 DeepSpeech logits centered on frame i. The file is memory-mapped, hence slicing a sequence of frames neither parses
+nor reads the whole clip.
+
+Usage, converting the .deepspeech.npy files of an existing dataset: python deepspeech_store.py --dataset_base <dataset dir>
+"""
+
+import os
+
+import numpy as np
+
+from array_store import ArrayWriter, convert_dataset_main, numbered_file_ids
+
+DEEPSPEECH_FEATURES = 'audio_feature.npy'  # Relative to the dataset base, see step 0
+WINDOW_SIZE = 16
+NUM_FEATURES = 29
+
+
+def load_deepspeech_features(path):
+    """ Returns the memory-mapped (N, 16, 29) features """
+    if not os.path.isfile(path):
+        raise FileNotFoundError('No DeepSpeech features at %s, please extract them first (step 0)' % path)
+
+    return np.load(path, mmap_mode='r')
+
+
+class DeepSpeechFeatureWriter(ArrayWriter):
+    """ Writes the features of a clip chunk by chunk, see ArrayWriter """
+
+    def __init__(self, path, num_frames, window_size=WINDOW_SIZE, num_features=NUM_FEATURES):
+        super().__init__(path, (num_frames, window_size, num_features), np.float32)
+
+
+def pack_feature_dir(feature_dir, path):
+    """ Converts a directory of %05d.deepspeech.npy files into a single feature file. Returns the number of converted frames """
+    frame_ids = numbered_file_ids(feature_dir, '.deepspeech.npy')
+    if not frame_ids:
+        return 0
+
+    first = np.load(os.path.join(feature_dir, '%05d.deepspeech.npy' % 0))
+    with DeepSpeechFeatureWriter(path, len(frame_ids), window_size=first.shape[0], num_features=first.shape[1]) as writer:
+        for idx in frame_ids:
+            writer.write(idx, np.load(os.path.join(feature_dir, '%05d.deepspeech.npy' % idx))[np.newaxis])
+
+    return len(frame_ids)
+
+
+def main():
+    convert_dataset_main('Converts the per-frame .deepspeech.npy files of a dataset into a single feature file', 'audio_feature', DEEPSPEECH_FEATURES,
+                         pack_feature_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,8 +16,11 @@ from scipy.ndimage import shift
 from tqdm import tqdm
 from math import floor
 
+from landmark_store import LandmarkStore
+from body_pose_store import load_body_poses
 
-def read_keypoints(A_path, size):        
+
+def read_keypoints(keypoints, size):        
     # mapping from keypoints to face part 
     part_list = [[list(range(0, 17)) + list(range(68, 83)) + [0]], # face
                     [range(17, 22)],                                  # right eyebrow
@@ -29,8 +32,7 @@ def read_keypoints(A_path, size):
                     [range(60, 65), [64,65,66,67,60]]                 # tongue
                 ]
     label_list = [50, 100, 100, 125, 150, 150, 200, 250] # labeling for different facial parts        
-    keypoints = np.loadtxt(A_path)[:,:2]
-    # keypoints = np.loadtxt(A_path, delimiter=' ')
+    keypoints = np.asarray(keypoints)[:,:2]
     
     # add upper half face by symmetry
     pts = keypoints[:17, :].astype(np.int32)
@@ -49,7 +51,7 @@ def read_keypoints(A_path, size):
 
     return keypoints, part_list, part_labels
 
-def read_keypoints_forehead(A_path, size):        
+def read_keypoints_forehead(keypoints, size):        
     # mapping from keypoints to face part 
     part_list = [[list(range(0, 17)) + list(range(68, 77)) + [0]], # face
                     [range(17, 22)],                                  # right eyebrow
@@ -61,7 +63,7 @@ def read_keypoints_forehead(A_path, size):
                     [range(60, 65), [64,65,66,67,60]]                 # tongue
                 ]
     label_list = [50, 100, 100, 125, 150, 150, 200, 250] # labeling for different facial parts        
-    keypoints = np.loadtxt(A_path)[:,:2]
+    keypoints = np.asarray(keypoints)[:,:2]
     
     # label map for facial part
     w, h = size
@@ -200,15 +202,22 @@ def convert_to_rgb(image):
             raiseExceptions('Non-compatible image format!')
         return image_new
 
-def get_edge_predicted(img_num, out_dir, landmark_name, predicted_ldk, im_size):
+def save_image(image, path, writer=None):
+    # Saves the PIL image through the image writer of the step, if any
+    if writer is None:
+        image.save(path)
+    else:
+        writer.save(image, path)
+
+def get_edge_predicted(img_num, out_dir, landmarks, predicted_ldk, im_size, writer=None):
     # Used at inference time when combining generated landmarks and predicted shoulders
 
     params = get_img_params(im_size, loadSize=np.max(im_size))      
     transform_scaleA = get_transform(params, method=Image.BILINEAR, normalize=False, toTensor=False)
 
     # Draw face
-    # keypoints, part_list, part_labels = read_keypoints(landmark_name, im_size)
-    keypoints, part_list, part_labels = read_keypoints_forehead(landmark_name, im_size)
+    # keypoints, part_list, part_labels = read_keypoints(landmarks, im_size)
+    keypoints, part_list, part_labels = read_keypoints_forehead(landmarks, im_size)
     im_edges, dist_tensor = draw_face_edges(keypoints, part_list, im_size)
 
     # body edges
@@ -254,9 +263,9 @@ def get_edge_predicted(img_num, out_dir, landmark_name, predicted_ldk, im_size):
     edge_path = os.path.join(out_dir, 'edges')
     os.makedirs(edge_path, exist_ok=True)
     edge_image = transform_scaleA(Image.fromarray(im_edges))
-    edge_image.save(os.path.join(edge_path, '%05d.png' % img_num))
+    save_image(edge_image, os.path.join(edge_path, '%05d.png' % img_num), writer)
 
-def get_edge_image_mixed(out_dir, img_name, landmark_name, tr_landmark_name, crop_coords, img_num):
+def get_edge_image_mixed(out_dir, img_name, landmarks, tr_landmarks, crop_coords, img_num, writer=None):
     # Used at inference time when combining generated landmarks and original frame's edges
 
     # Flag for cropping
@@ -266,8 +275,8 @@ def get_edge_image_mixed(out_dir, img_name, landmark_name, tr_landmark_name, cro
     img = Image.open(img_name)
     img = convert_to_rgb(img)
     img_size = img.size
-    points = np.loadtxt(landmark_name)[:,:2]
-    tr_points = np.loadtxt(tr_landmark_name, delimiter=' ')
+    points = landmarks[:,:2]
+    tr_points = tr_landmarks
     face_dist_x = np.mean(tr_points[31:36, 0]-points[31:36, 0])
     face_dist_y = np.mean(tr_points[31:36, 1]-points[31:36, 1])
 
@@ -281,8 +290,8 @@ def get_edge_image_mixed(out_dir, img_name, landmark_name, tr_landmark_name, cro
     transform_label = get_transform(params, method=Image.NEAREST, normalize=False, toTensor=False)
     transform_scaleB = get_transform(params, normalize=False, toTensor=False)
 
-    # keypoints, part_list, part_labels = read_keypoints(landmark_name, img_size)
-    keypoints, part_list, part_labels = read_keypoints_forehead(landmark_name, img_size)
+    # keypoints, part_list, part_labels = read_keypoints(landmarks, img_size)
+    keypoints, part_list, part_labels = read_keypoints_forehead(landmarks, img_size)
 
     im_edges, dist_tensor = draw_face_edges(keypoints, part_list, img_size)
 
@@ -303,9 +312,9 @@ def get_edge_image_mixed(out_dir, img_name, landmark_name, tr_landmark_name, cro
 
     edge_path = os.path.join(out_dir, 'edges')
     os.makedirs(edge_path, exist_ok=True)
-    edge_image.save(os.path.join(edge_path, '%05d.png' % img_num))
+    save_image(edge_image, os.path.join(edge_path, '%05d.png' % img_num), writer)
 
-def get_edge_image(index, img_path, tracked_landmark_path, edges_dir, cropped_dir, im_size, crop_coords):
+def get_edge_image(index, img_path, tracked_landmarks, edges_dir, cropped_dir, im_size, crop_coords, writer=None):
     # Used in preprocessing when combining tracked landmarks with frame's edges
 
     # Flag for cropping
@@ -326,8 +335,8 @@ def get_edge_image(index, img_path, tracked_landmark_path, edges_dir, cropped_di
     transform_scaleB = get_transform(params, normalize=False, toTensor=False)
 
     # Draw face
-    # keypoints, part_list, part_labels = read_keypoints(tracked_landmark_path, im_size)
-    keypoints, part_list, part_labels = read_keypoints_forehead(tracked_landmark_path, im_size)
+    # keypoints, part_list, part_labels = read_keypoints(tracked_landmarks, im_size)
+    keypoints, part_list, part_labels = read_keypoints_forehead(tracked_landmarks, im_size)
     im_edges, dist_tensor = draw_face_edges(keypoints, part_list, im_size)
 
     # Other Edges
@@ -346,10 +355,10 @@ def get_edge_image(index, img_path, tracked_landmark_path, edges_dir, cropped_di
         img_image = transform_scaleB(img)
 
     # Save edges and cropped target for GAN training
-    edge_image.save(os.path.join(edges_dir, '%05d.png' % index))
-    img_image.save(os.path.join(cropped_dir, '%05d.png' % index))
+    save_image(edge_image, os.path.join(edges_dir, '%05d.png' % index), writer)
+    save_image(img_image, os.path.join(cropped_dir, '%05d.png' % index), writer)
 
-def get_edge_image_body(index, img_path, tracked_landmark_path, edges_dir, cropped_dir, im_size, crop_coords, body_landmark_path):
+def get_edge_image_body(index, img_path, tracked_landmarks, edges_dir, cropped_dir, im_size, crop_coords, body_keypoints, writer=None):
     # Used in preprocessing when combining tracked landmarks with tracked body edges
 
     # Flag for cropping
@@ -370,12 +379,11 @@ def get_edge_image_body(index, img_path, tracked_landmark_path, edges_dir, cropp
     transform_scaleB = get_transform(params, normalize=False, toTensor=False)
 
     # Draw face
-    # keypoints, part_list, part_labels = read_keypoints(tracked_landmark_path, im_size)
-    keypoints, part_list, part_labels = read_keypoints_forehead(tracked_landmark_path, im_size)
+    # keypoints, part_list, part_labels = read_keypoints(tracked_landmarks, im_size)
+    keypoints, part_list, part_labels = read_keypoints_forehead(tracked_landmarks, im_size)
     im_edges, dist_tensor = draw_face_edges(keypoints, part_list, im_size)
 
     # body edges
-    body_keypoints = np.load(body_landmark_path)
     body_edges = np.array(draw_body_edges(body_keypoints, im_size))
     body_edges = body_edges * (part_labels == 0) # remove edges within face
     im_edges += body_edges
@@ -402,33 +410,36 @@ def get_edge_image_body(index, img_path, tracked_landmark_path, edges_dir, cropp
         img_image = transform_scaleB(img)
 
     # Save edges and cropped target for GAN training
-    edge_image.save(os.path.join(edges_dir, '%05d.png' % index))
-    img_image.save(os.path.join(cropped_dir, '%05d.png' % index))
+    save_image(edge_image, os.path.join(edges_dir, '%05d.png' % index), writer)
+    save_image(img_image, os.path.join(cropped_dir, '%05d.png' % index), writer)
 
-def make_edges(mattdir, landmarkdir, edges_dir, cropped_dir):
+def make_edges(mattdir, landmark_path, edges_dir, cropped_dir, writer=None):
     
     # Compute crop size
     img = Image.open(os.path.join(mattdir, '%05d.png' % 0))
     im_size = img.size
 
-    points = np.mean([np.loadtxt(os.path.join(landmarkdir, ldk))[:,:2] for ldk in os.listdir(landmarkdir)], axis=0)
+    landmarks = LandmarkStore(landmark_path)
+    points = landmarks.mean()
     crop_coords = get_crop_coords(points, im_size)
 
     for index in tqdm(range(len(os.listdir(mattdir)))):
 
         img_path = os.path.join(mattdir, '%05d.png' % index)
-        tracked_landmark_path = os.path.join(landmarkdir, '%05d.lms' % index)
 
-        get_edge_image(index, img_path, tracked_landmark_path, edges_dir, cropped_dir, im_size, crop_coords)
+        get_edge_image(index, img_path, landmarks[index], edges_dir, cropped_dir, im_size, crop_coords, writer=writer)
 
-def make_edges_body(mattdir, landmarkdir, edges_dir, cropped_dir, body_dir, split_val=0.0):
+def make_edges_body(mattdir, landmark_path, edges_dir, cropped_dir, body_pose_path, split_val=0.0, writer=None):
     # Compute crop size
     img = Image.open(os.path.join(mattdir, '%05d.png' % 0))
     im_size = img.size
 
-    points = np.mean([np.loadtxt(os.path.join(landmarkdir, ldk))[:,:2] for ldk in os.listdir(landmarkdir)], axis=0)
+    landmarks = LandmarkStore(landmark_path)
+    points = landmarks.mean()
     crop_coords = get_crop_coords(points, im_size)
 
+    body_poses = load_body_poses(body_pose_path)
+
     num_frames = len(os.listdir(mattdir))
     num_train = floor(num_frames * (1.0 - split_val))
 
@@ -436,20 +447,16 @@ def make_edges_body(mattdir, landmarkdir, edges_dir, cropped_dir, body_dir, spli
     for index in tqdm(range(num_train)):
 
         img_path = os.path.join(mattdir, '%05d.png' % index)
-        tracked_landmark_path = os.path.join(landmarkdir, '%05d.lms' % index)
-        body_landmark_path = os.path.join(body_dir, '%05d.npy' % index)
 
-        get_edge_image_body(index, img_path, tracked_landmark_path, edges_dir, cropped_dir, im_size, crop_coords, body_landmark_path)
+        get_edge_image_body(index, img_path, landmarks[index], edges_dir, cropped_dir, im_size, crop_coords, np.array(body_poses[index]), writer=writer)
     
     # val
     for index in tqdm(range(num_train, num_frames)):
 
         img_path = os.path.join(mattdir, '%05d.png' % index)
-        tracked_landmark_path = os.path.join(landmarkdir, '%05d.lms' % index)
-        body_landmark_path = os.path.join(body_dir, '%05d.npy' % index)
 
         os.makedirs(edges_dir + '_val', exist_ok=True)
         os.makedirs(cropped_dir + '_val', exist_ok=True)
 
-        get_edge_image_body(index, img_path, tracked_landmark_path, edges_dir + '_val', cropped_dir + '_val', im_size, crop_coords, body_landmark_path)
+        get_edge_image_body(index, img_path, landmarks[index], edges_dir + '_val', cropped_dir + '_val', im_size, crop_coords, np.array(body_poses[index]), writer=writer)
     
@@ -75,7 +75,7 @@ class EMOCA_tracker:
             plt.close()
 
 
-def emotion_detection(dataset_base, emotion_dir):
+def emotion_detection(dataset_base, emotion_dir, frames_dir):
     '''
         Face tracker using FLAME model.
         Used to have geometry prior for nerf sampling.
@@ -88,7 +88,7 @@ def emotion_detection(dataset_base, emotion_dir):
     emoca_tracker = EMOCA_tracker()
 
     # Run deca on all frames
-    testdata = TestData(os.path.join(id_dir, 'frames'), face_detector="fan", max_detection=20)
+    testdata = TestData(frames_dir, face_detector="fan", max_detection=20)
     
     for i, data in enumerate(tqdm(testdata)):
         batch = testdata[i]
@@ -103,4 +103,4 @@ if __name__ == '__main__':
 
     dataset_base = '/media/apennino/EmotionDetection/Test/Greta/'
     emotion_dir = '/media/apennino/EmotionDetection/Test/Greta/emotions/'
-    emotion_detection(dataset_base, emotion_dir)
+    emotion_detection(dataset_base, emotion_dir, os.path.join(dataset_base, 'frames'))
@@ -1,18 +1,14 @@
 import torch
 import cv2
-import numpy as np
-import os
 
+from landmark_store import LandmarkStore
 
-def load_dir(lmspath, framepath, start, end):
-    lmss = []
-    imgs_paths = []
-    for i in range(start, end):
-        if os.path.isfile(os.path.join(lmspath, '%05d.lms' % i)):
-            lms = np.loadtxt(os.path.join(
-                lmspath, '%05d.lms' % i), dtype=np.float32)
-            lmss.append(lms)
-            imgs_paths.append(os.path.join(framepath, '%05d.jpg' % i))
-    lmss = np.stack(lmss)
+
+def load_dir(lmspath, start, end):
+    """ Returns the landmarks of all frames with landmarks between start & end, read from the landmark store at lmspath,
+    and the ids of these frames within the frame store """
+    store = LandmarkStore(lmspath)
+    frame_ids = store.valid_ids(start, end)
+    lmss = store.read(frame_ids)
     lmss = torch.as_tensor(lmss).cuda()
-    return lmss, imgs_paths
+    return lmss, frame_ids
@@ -15,6 +15,9 @@ import cv2
 import argparse
 from pathlib import Path
 from tqdm import tqdm
+from frame_store import open_frame_store
+from landmark_store import DETECTED_LANDMARKS
+from deca_store import EXPRESSIONS, DecaStoreWriter
 import matplotlib.pyplot as plt
 from PIL import Image
 
@@ -25,7 +28,7 @@ from pytorch3d.io import IO, save_obj
 #     openmesh.write_mesh(path, mesh, binary=True)
 
 
-def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_masks_dir):
+def track_face_FLAME(dataset_base, h, w, frame_num, out_path, deca_store_dir, expr_masks_dir):
     '''
     Face tracker using FLAME model.
     Used to have geometry prior for nerf sampling.
@@ -47,7 +50,8 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
     debug_meshes_dir = os.path.join(id_dir, 'debug', 'debug_meshes')
     Path(debug_meshes_dir).mkdir(parents=True, exist_ok=True)
 
-    lms, img_paths = load_dir(os.path.join(id_dir, 'landmarks'), os.path.join(id_dir, 'frames'), start_id, end_id)
+    lms, frame_ids = load_dir(os.path.join(id_dir, DETECTED_LANDMARKS), start_id, end_id)
+    frames = open_frame_store(id_dir)
 
     num_frames = lms.shape[0]
     cxy = torch.tensor((w / 2.0, h / 2.0), dtype=torch.float).cuda()
@@ -171,7 +175,7 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
             print('pose', iter, loss.item())
 
             # Added save landmarks images for debug
-            img = Image.open(img_paths[0])
+            img = Image.fromarray(frames[frame_ids[0]])
             colormap_blue = plt.cm.Blues
             colormap_red = plt.cm.Reds
 
@@ -216,7 +220,7 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
             print('poseidexp', iter, loss_lan.item(),
                   loss_regid.item(), loss_regexp.item())
 
-            img = Image.open(img_paths[0])
+            img = Image.fromarray(frames[frame_ids[0]])
             colormap_blue = plt.cm.Blues
             colormap_red = plt.cm.Reds
 
@@ -247,6 +251,10 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
     trans = trans.detach()
     light_para = light_para.detach()
 
+    # Save expr
+    with DecaStoreWriter(deca_store_dir, num_frames) as deca_store:
+        deca_store.write(slice(0, num_frames), {EXPRESSIONS: exp_para})
+
     batch_size = 10
     device_default = torch.device('cuda:0')
     device_render = torch.device('cuda:0')
@@ -259,7 +267,7 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
             sel_ids = np.arange(i * batch_size, i * batch_size + batch_size)
         imgs = []
         for sel_id in sel_ids:
-            imgs.append(cv2.imread(img_paths[sel_id])[:, :, ::-1])
+            imgs.append(frames[frame_ids[sel_id]])
         imgs = np.stack(imgs)
         sel_imgs = torch.as_tensor(imgs).cuda()
 
@@ -297,9 +305,6 @@ def track_face_FLAME(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr
             cv2.imwrite(os.path.join(expr_masks_dir, str(sel_ids[j]) + '.jpg'),
                         mask_img[j])
 
-            # Save expr
-            np.save(os.path.join(decaexpr_dir, f'{sel_ids[j]}.npy'), sel_exp_para[j].cpu().numpy())
-
             # renderer.get_and_save_mesh(rott_geo, os.path.join(debug_meshes_dir, str(sel_ids[j]) + '.obj'))
 
     print('about to save params..')
@@ -328,7 +333,8 @@ def track_face(dataset_base, h, w, frame_num, out_path, expr_masks_dir):
     end_id = frame_num
 
     id_dir = dataset_base
-    lms, img_paths = load_dir(os.path.join(id_dir, 'landmarks'), os.path.join(id_dir, 'frames'), start_id, end_id)
+    lms, frame_ids = load_dir(os.path.join(id_dir, DETECTED_LANDMARKS), start_id, end_id)
+    frames = open_frame_store(id_dir)
     num_frames = lms.shape[0]
     cxy = torch.tensor((w/2.0, h/2.0), dtype=torch.float).cuda()
     id_dim, exp_dim, tex_dim, point_num = 100, 79, 100, 34650
@@ -440,7 +446,7 @@ def track_face(dataset_base, h, w, frame_num, out_path, expr_masks_dir):
     for param_group in optimizer_frame.param_groups:
         param_group['lr'] = 0.1
 
-    img = Image.open(img_paths[0])
+    img = Image.fromarray(frames[frame_ids[0]])
     # plt.imshow(img)
     plt.scatter(lms[0, :, 0].detach().cpu(), lms[0, :, 1].detach().cpu(), c='r', s=10)
     plt.scatter(proj_geo[0, :, 0].detach().cpu(), proj_geo[0, :, 1].detach().cpu(), c='b', s=10)
@@ -472,7 +478,7 @@ def track_face(dataset_base, h, w, frame_num, out_path, expr_masks_dir):
                 param_group['lr'] *= 0.2
     print(loss_lan.item(), torch.mean(trans[:, 2]).item())
 
-    img = Image.open(img_paths[0])
+    img = Image.fromarray(frames[frame_ids[0]])
     # plt.imshow(img)
     plt.scatter(lms[0, :, 0].detach().cpu(), lms[0, :, 1].detach().cpu(), c='r', s=10)
     plt.scatter(proj_geo[0, :, 0].detach().cpu(), proj_geo[0, :, 1].detach().cpu(), c='b', s=10)
@@ -487,7 +493,7 @@ def track_face(dataset_base, h, w, frame_num, out_path, expr_masks_dir):
     sel_ids = np.arange(0, num_frames, int(num_frames/batch_size))[:batch_size]
     imgs = []
     for sel_id in sel_ids:
-        imgs.append(cv2.imread(img_paths[sel_id])[:, :, ::-1])
+        imgs.append(frames[frame_ids[sel_id]])
     imgs = np.stack(imgs)
     sel_imgs = torch.as_tensor(imgs).cuda()
     sel_lms = lms[sel_ids]
@@ -557,7 +563,7 @@ def track_face(dataset_base, h, w, frame_num, out_path, expr_masks_dir):
             sel_ids = np.arange(i*batch_size, i*batch_size+batch_size)
         imgs = []
         for sel_id in sel_ids:
-            imgs.append(cv2.imread(img_paths[sel_id])[:, :, ::-1])
+            imgs.append(frames[frame_ids[sel_id]])
         imgs = np.stack(imgs)
         sel_imgs = torch.as_tensor(imgs).cuda()
         sel_lms = lms[sel_ids]
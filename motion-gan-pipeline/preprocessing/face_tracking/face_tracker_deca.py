@@ -17,10 +17,12 @@ from .render_3dmm import Render_FLAME
 from .FLAME.FLAME import FLAME
 from .FLAME.config import cfg
 from .FLAME.lbs import vertices2landmarks
-import cv2
 from pathlib import Path
 from tqdm import tqdm
-import matplotlib.pyplot as plt
+from frame_store import open_frame_store
+from landmark_store import DETECTED_LANDMARKS, PROJECTED_LANDMARKS, LandmarkStore, empty_landmarks, save_landmarks
+from deca_store import EXPRESSIONS, DecaStoreWriter
+from pipeline_runner.image_writer import ImageWriter
 from PIL import Image, ImageDraw
 
 
@@ -38,11 +40,83 @@ class DECA_tracker:
         return codedict
 
 
-def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_masks_dir):
+def collate_crops(items):
+    """ Collates the face crops of TestData items & the parameters of their crop transforms, dropping the full resolution images """
+    return torch.stack([item['image'] for item in items]), np.stack([item['tform'].params for item in items])
+
+
+def fit_rigid_pose(landmarks, lms, euler_angle, trans, focals, cxy, lr, num_iters, lr_steps=(), check_every=100, tol=1e-4):
+    '''
+        Fits the rotations & translations of the model landmarks (N, K, 3) to the detected landmarks lms (N, K, 2), for C candidate focal lengths
+        at once. The poses euler_angle & trans of shape (C, N, 3) are optimized in place. Every candidate has its own loss & Adam treats every
+        parameter separately, hence the candidates are fitted exactly as if one after the other.
+        lr_steps are (iteration, factor) pairs scaling the learning rate after the given iteration. Once the loss of every candidate changed by less
+        than tol (relative) within check_every iterations, in either direction, the next step is taken right away, or the fit stops after the last one.
+        Returns the final landmark loss of every candidate.
+        '''
+    num_candidates, num_frames = euler_angle.shape[:2]
+
+    euler_angle.requires_grad = True
+    trans.requires_grad = True
+    optimizer = torch.optim.Adam([euler_angle, trans], lr=lr)
+
+    geometry = landmarks.expand(num_candidates, -1, -1, -1).reshape(num_candidates * num_frames, -1, 3)
+    targets = lms.expand(num_candidates, -1, -1, -1).reshape(num_candidates * num_frames, -1, 2)
+    focal_length = focals.view(-1, 1).expand(-1, num_frames).reshape(-1, 1)
+    lr_steps = list(lr_steps)
+    prev_loss = None
+
+    for iter in range(num_iters):
+        rott_geo = forward_rott(geometry, euler_angle.view(-1, 3), trans.view(-1, 3))
+        proj_geo = proj_pts(rott_geo, focal_length, cxy)
+
+        loss_lan = ((proj_geo[:, :, :2] - targets) ** 2).view(num_candidates, -1).mean(dim=1)
+        optimizer.zero_grad()
+        loss_lan.sum().backward()
+        optimizer.step()
+
+        step = lr_steps and iter == lr_steps[0][0]
+        if iter % check_every == 0:
+            converged = prev_loss is not None and bool(((prev_loss - loss_lan).abs() < tol * prev_loss).all())
+            if converged and not lr_steps:
+                break
+            step = step or converged
+            prev_loss = loss_lan.detach()
+
+        if step:
+            for param_group in optimizer.param_groups:
+                param_group['lr'] *= lr_steps[0][1]
+            lr_steps.pop(0)
+            prev_loss = None
+
+    euler_angle.requires_grad = False
+    trans.requires_grad = False
+
+    return loss_lan.detach()
+
+
+def save_landmark_image(path, points, h, w):
+    im = Image.new('RGB', (w, h), (255, 255, 255))
+    draw = ImageDraw.Draw(im)
+    margin = (max(h, w) // 500) + 1
+    for point in points:
+        ldmks = ([point[0] - margin, point[1] - margin, point[0] + margin, point[1] + margin])
+        draw.ellipse(ldmks, fill=(255, 0, 0))
+
+    im.save(path)
+
+
+def track_face_DECA(dataset_base, h, w, frame_num, out_path, deca_store_dir, expr_masks_dir, deca_batch_size=32, deca_workers=4, pose_device='cpu',
+                    image_writer=None):
     '''
         Face tracker using FLAME model.
         Used to have geometry prior for nerf sampling.
+        DECA encodes batches of deca_batch_size frames, whose faces are cropped by deca_workers DataLoader workers.
+        The head poses are fitted on pose_device, as their many small steps are faster on CPU than launching GPU kernels.
+        The masks & debug images are written by image_writer, synchronously if None.
         '''
+    if image_writer is None:
+        image_writer = ImageWriter('head pose', num_threads=0)
 
     def set_requires_grad(tensor_list):
         for tensor in tensor_list:
@@ -59,14 +133,13 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
     Path(debug_render_dir).mkdir(parents=True, exist_ok=True)
     debug_mix_dir = os.path.join(id_dir, 'debug', 'debug_mixed')
     Path(debug_mix_dir).mkdir(parents=True, exist_ok=True)
-    debug_land_dir = os.path.join(id_dir, 'debug', 'proj_landmarks')
-    Path(debug_land_dir).mkdir(parents=True, exist_ok=True)
     debug_land_img_dir = os.path.join(id_dir, 'debug', 'proj_landmarks_img')
     Path(debug_land_img_dir).mkdir(parents=True, exist_ok=True)
     debug_meshes_dir = os.path.join(id_dir, 'debug', 'debug_meshes')
     # Path(debug_meshes_dir).mkdir(parents=True, exist_ok=True)
 
-    lms, img_paths = load_dir(os.path.join(id_dir, 'landmarks'), os.path.join(id_dir, 'frames'), start_id, end_id)
+    lms, frame_ids = load_dir(os.path.join(id_dir, DETECTED_LANDMARKS), start_id, end_id)
+    frames = open_frame_store(id_dir)
     num_frames = lms.shape[0]
     cxy = torch.tensor((w / 2.0, h / 2.0), dtype=torch.float).cuda()
     id_dim, exp_dim, tex_dim = 100, 53, 50
@@ -83,19 +156,28 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
     id_para = lms.new_zeros((num_frames, id_dim), requires_grad=True)
     exp_para = lms.new_zeros((num_frames, exp_dim), requires_grad=False)
 
-    # Run deca on all frames
-    testdata = datasets.TestData(img_paths, iscrop=True, face_detector='fan')
-    for i, data in enumerate(tqdm(testdata)):
-        images = data['image'].cuda()[None, ...]
-        codedict = deca_tracker(images)
-        to_show = codedict['images']
-        shape_params = codedict['shape']
-        expression_params = codedict['exp']
-        pose_params = codedict['pose']
-
-        id_para.data[i] = shape_params
-        exp_para.data[i] = torch.cat((expression_params.flatten(), pose_params[:, 3:].flatten()), dim=0)
-        np.save(os.path.join(decaexpr_dir, '%05d.npy' % i), exp_para.data[i].unsqueeze(0).cpu().numpy())
+    # Run deca on all frames. The faces are cropped around their landmarks, frames without landmarks are detected on the CPU of the workers
+    frame_paths = [os.path.join(id_dir, 'frames', '%05d.jpg' % i) for i in frame_ids]  # Only name the frames, which are read from the frame store
+    testdata = datasets.TestData(frame_paths, iscrop=True, face_detector='fan', frames=[frames[i] for i in frame_ids],
+                                 landmarks=LandmarkStore(os.path.join(id_dir, DETECTED_LANDMARKS)).read(frame_ids),
+                                 detector_device='cpu' if deca_workers > 0 else 'cuda')
+    loader = torch.utils.data.DataLoader(testdata, batch_size=deca_batch_size, num_workers=deca_workers, collate_fn=collate_crops, pin_memory=True)
+
+    with DecaStoreWriter(deca_store_dir, num_frames) as deca_store:
+        start = 0
+        for images, tforms in tqdm(loader):
+            end = start + len(images)
+            codedict = deca_tracker(images.cuda(non_blocking=True))
+            shape_params = codedict['shape']
+            expression_params = codedict['exp']
+            pose_params = codedict['pose']
+
+            id_para.data[start:end] = shape_params
+            exp_para.data[start:end] = torch.cat((expression_params, pose_params[:, 3:]), dim=1)
+
+            deca_store.write(slice(start, end), {name: code for name, code in codedict.items() if name != 'images'})
+            deca_store.write(slice(start, end), {EXPRESSIONS: exp_para.data[start:end], 'tform': tforms})
+            start = end
 
         '''# TO TEST DECA
         pose_params = codedict['pose']
@@ -143,170 +225,51 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
     # mean of shape
     id_para = torch.mean(id_para, axis=0).unsqueeze(0)
 
-    # Find best focal
-    arg_focal = 600
-    arg_landis = 1e5
+    # The shape & expressions are fixed from here on, only the rigid head pose is fitted. The landmarks of the face model are hence computed
+    # once, in its canonical pose, & the fits only rotate, translate & project them
+    with torch.no_grad():
+        zeros = lms.new_zeros((num_frames, 3), dtype=torch.double)
+        canonical_lms = model_3dmm.get_3dlandmarks(id_para.expand(num_frames, -1), exp_para, zeros, zeros, None, cxy).to(pose_device)
+
+    pose_lms = lms.to(pose_device)
+    pose_cxy = cxy.to(pose_device)
+
+    # Find best focal, fitting the poses of the selected frames for all candidates at once
+    focals = torch.arange(700, 1000, 100, dtype=torch.double, device=pose_device)
     sel_ids = np.arange(0, num_frames, 40)
     sel_num = sel_ids.shape[0]
-    
-    for focal in tqdm(range(700, 1000, 100)):
-        
-        euler_angle = lms.new_zeros((sel_num, 3), dtype=torch.double, requires_grad=True)
-        trans = lms.new_zeros((sel_num, 3), dtype=torch.double, requires_grad=True)
-        trans.data[:, 2] -= 1  # DIFFERENT
-        # trans.data[:, 2] -= 7  # ORIGINAL
-        focal_length = lms.new_zeros(1, requires_grad=False)
-        focal_length.data += focal
-        set_requires_grad([euler_angle, trans])
-
-        optimizer_frame = torch.optim.Adam([euler_angle, trans], lr=.1)
-
-        for iter in range(2000):
-            id_para_batch = id_para.expand(sel_num, -1)
-            exp_para_batch = exp_para[sel_ids]
-            geometry = model_3dmm.get_3dlandmarks(
-                id_para_batch, exp_para_batch, euler_angle, trans, focal_length, cxy)
-
-            proj_geo = proj_pts(geometry, focal_length, cxy)
-
-            loss_lan = cal_lan_loss(
-                proj_geo[:, :, :2], lms[sel_ids].detach())
-            loss = loss_lan
-            optimizer_frame.zero_grad()
-            loss.backward(retain_graph=True)
-            optimizer_frame.step()
-            if iter % 100 == 0 and False:
-                print(focal, 'pose', iter, loss.item())
-
-        for iter in range(2500):
-            id_para_batch = id_para.expand(sel_num, -1)
-            exp_para_batch = exp_para[sel_ids]
-
-            geometry = model_3dmm.get_3dlandmarks(
-                id_para_batch, exp_para_batch, euler_angle, trans, focal_length, cxy)
-
-            proj_geo = proj_pts(geometry, focal_length, cxy)
-
-            loss_lan = cal_lan_loss(
-                proj_geo[:, :, :2], lms[sel_ids].detach())
-            loss = loss_lan 
-            optimizer_frame.zero_grad()
-            loss.backward(retain_graph=True)
-            optimizer_frame.step()
-            if iter % 100 == 0 and False:
-                print(focal, 'poseidexp', iter, loss_lan.item(),
-                      loss_regid.item(), loss_regexp.item())
-            if iter % 1500 == 0 and iter >= 1500:
-                for param_group in optimizer_frame.param_groups:
-                    param_group['lr'] *= 0.2
-        # print(focal, loss_lan.item(), torch.mean(trans[:, 2]).item())
-
-        if loss_lan.item() < arg_landis:
-            arg_landis = loss_lan.item()
-            arg_focal = focal
-    #'''      
+
+    euler_angle = canonical_lms.new_zeros((len(focals), sel_num, 3))
+    trans = canonical_lms.new_zeros((len(focals), sel_num, 3))
+    trans[:, :, 2] -= 1  # DIFFERENT
+    # trans[:, :, 2] -= 7  # ORIGINAL
+
+    loss_lan = fit_rigid_pose(canonical_lms[sel_ids], pose_lms[sel_ids], euler_angle, trans, focals, pose_cxy,
+                              lr=.1, num_iters=4500, lr_steps=[(3500, 0.2)])
+
+    # A candidate only counts if its fit is plausible at all
+    arg_focal = int(focals[torch.argmin(loss_lan)]) if loss_lan.min() < 1e5 else 600
     print('find best focal', arg_focal)
 
     # Free up some memory
     torch.cuda.empty_cache()
 
-    euler_angle = lms.new_zeros((num_frames, 3), dtype=torch.double, requires_grad=True)
-    trans = lms.new_zeros((num_frames, 3), dtype=torch.double, requires_grad=True)
-    trans.data[:, 2] -= 1  # DIFFERENT
-    # trans.data[:, 2] -= 7  # ORIGINAL
+    euler_angle = canonical_lms.new_zeros((1, num_frames, 3))
+    trans = canonical_lms.new_zeros((1, num_frames, 3))
+    trans[:, :, 2] -= 1  # DIFFERENT
+    # trans[:, :, 2] -= 7  # ORIGINAL
     light_para = lms.new_zeros((num_frames, 27), requires_grad=True)
 
     focal_length = lms.new_zeros(1, requires_grad=False)
     focal_length.data += arg_focal
 
-    set_requires_grad([euler_angle, trans, light_para])
-
     # ORIGINAL
     # optimizer_idexp = torch.optim.Adam([id_para, exp_para], lr=.1)
-    optimizer_frame = torch.optim.Adam([euler_angle, trans], lr=1)
-
-    for iter in tqdm(range(1500)):
-        id_para_batch = id_para.expand(num_frames, -1)
-
-        geometry = model_3dmm.get_3dlandmarks(
-            id_para_batch, exp_para, euler_angle, trans, focal_length, cxy)
-
-        proj_geo = proj_pts(geometry, focal_length, cxy)
-
-        loss_lan = cal_lan_loss(
-            proj_geo[:, :, :2], lms.detach())
-        loss = loss_lan
-        optimizer_frame.zero_grad()
-        loss.backward(retain_graph=True)
-        optimizer_frame.step()
-        if iter == 1000:
-            for param_group in optimizer_frame.param_groups:
-                param_group['lr'] = 0.1
-        if iter % 250 == 0 and False:
-            # print('pose', iter, loss.item())
-
-            img = Image.open(img_paths[0])
-            colormap_blue = plt.cm.Blues
-            colormap_red = plt.cm.Reds
-
-            plt.imshow(img)
-            for num, lin in enumerate(np.linspace(0, 0.9, len(lms[0, :, 0]))):
-                plt.scatter(lms[0, num, 0].detach().cpu(),
-                            lms[0, num, 1].detach().cpu(),
-                            color=colormap_blue(lin),
-                            s=10)
-
-                plt.scatter(proj_geo[0, num, 0].detach().cpu(),
-                            proj_geo[0, num, 1].detach().cpu(),
-                            color=colormap_red(lin),
-                            s=10)
-
-            plt.savefig(os.path.join(debug_ldk_dir, f'ldk_1_{iter}.png'))
-            plt.close()
-
-    for param_group in optimizer_frame.param_groups:
-        param_group['lr'] = 0.1  # ORIGINAL
-
-    for iter in tqdm(range(2000)):
-        id_para_batch = id_para.expand(num_frames, -1)
-
-        geometry = model_3dmm.get_3dlandmarks(
-            id_para_batch, exp_para, euler_angle, trans, focal_length, cxy)
-
-        proj_geo = proj_pts(geometry, focal_length, cxy)
+    fit_rigid_pose(canonical_lms, pose_lms, euler_angle, trans, focal_length.to(pose_device, torch.double), pose_cxy,
+                   lr=1, num_iters=3500, lr_steps=[(1000, 0.1), (2500, 0.2)])
 
-        loss_lan = cal_lan_loss(
-            proj_geo[:, :, :2], lms.detach())
-        loss = loss_lan
-        optimizer_frame.zero_grad()
-        loss.backward(retain_graph=True)
-        optimizer_frame.step()
-
-        if iter % 100 == 0 and False:
-            # print('pose', iter, loss_lan.item())
-
-            img = Image.open(img_paths[0])
-            colormap_blue = plt.cm.Blues
-            colormap_red = plt.cm.Reds
-
-            plt.imshow(img)
-            for num, lin in enumerate(np.linspace(0, 0.9, len(lms[0, :, 0]))):
-                plt.scatter(lms[0, num, 0].detach().cpu(),
-                            lms[0, num, 1].detach().cpu(),
-                            color=colormap_blue(lin),
-                            s=10)
-
-                plt.scatter(proj_geo[0, num, 0].detach().cpu(),
-                            proj_geo[0, num, 1].detach().cpu(),
-                            color=colormap_red(lin),
-                            s=10)
-
-            plt.savefig(os.path.join(debug_ldk_dir, f'ldk_2_{iter}.png'))
-            plt.close()
-
-        if iter % 1000 == 0 and iter >= 1000:
-            for param_group in optimizer_frame.param_groups:
-                param_group['lr'] *= 0.2
+    euler_angle = euler_angle[0].cuda()
+    trans = trans[0].cuda()
 
     # THEY DO THIS
     exp_para = exp_para.detach()
@@ -317,6 +280,7 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
     batch_size = 10
     renderer = Render_FLAME(model_3dmm.faces_tensor, arg_focal, h, w, batch_size, device_render)
     pts3D = []
+    proj_landmarks = None
 
     for i in tqdm(range(int((num_frames - 1) / batch_size + 1))):
         if (i + 1) * batch_size > num_frames:
@@ -325,7 +289,7 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
             sel_ids = np.arange(i * batch_size, i * batch_size + batch_size)
         imgs = []
         for sel_id in sel_ids:
-            imgs.append(cv2.imread(img_paths[sel_id])[:, :, ::-1])
+            imgs.append(frames[frame_ids[sel_id]])
         imgs = np.stack(imgs)
         sel_imgs = torch.as_tensor(imgs).cuda()
 
@@ -354,6 +318,8 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
         ldmks = model_3dmm.get_3dlandmarks_forehead(
                 sel_id_para, sel_exp_para, sel_euler, sel_trans, arg_focal, cxy)
         proj_geos = proj_pts(ldmks, focal_length, cxy)
+        if proj_landmarks is None:
+            proj_landmarks = empty_landmarks(num_frames, proj_geos.shape[1])
        
         render_imgs = renderer(rott_geo.to(device_render), model_3dmm.faces_tensor.to(device_render))
         render_imgs = render_imgs.to(device_default).detach()
@@ -364,16 +330,19 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
             img_arr = render_imgs[j, :, :, :3].cpu().numpy()
             img_arr *= 255
             img_arr = img_arr.astype(np.uint8)
-            im = Image.fromarray(img_arr)
-            im.save(os.path.join(debug_render_dir, '%05d.jpg' % sel_ids[j]))
+            image_writer.save(Image.fromarray(img_arr), os.path.join(debug_render_dir, '%05d.jpg' % sel_ids[j]), debug=True)
 
             # Save mask
             black_pixels_mask = np.all(img_arr != [255, 255, 255], axis=-1)
             mask_img = np.zeros_like(img_arr)
             mask_img[black_pixels_mask] = [255, 255, 255]
-        
-            im = Image.fromarray(mask_img)
-            im.save(os.path.join(expr_masks_dir, '%05d.jpg' % sel_ids[j]))
+            image_writer.save(Image.fromarray(mask_img), os.path.join(expr_masks_dir, '%05d.jpg' % sel_ids[j]))
+
+            proj_geo = proj_geos[j].detach().cpu().numpy()
+            proj_landmarks[sel_ids[j]] = proj_geo[:, :2]
+
+            if image_writer.skip_debug:
+                continue
 
             # Save mixed
             alpha_blend= 0.1
@@ -382,23 +351,14 @@ def track_face_DECA(dataset_base, h, w, frame_num, out_path, decaexpr_dir, expr_
                                         img_arr[black_pixels_mask] * (1 - alpha_blend)
 
             og_img = og_img.astype(np.uint8)
-            im = Image.fromarray(og_img)
-            im.save(os.path.join(debug_mix_dir, '%05d.jpg' % sel_ids[j]))
-
-            # Save landmarks
-            im = Image.new('RGB', (w, h), (255, 255, 255))
-            proj_geo = proj_geos[j]
-            for point in proj_geo:
-                margin = (max(h, w) // 500) + 1
-                ldmks = ([point[0] - margin, point[1] - margin, point[0] + margin, point[1] + margin])
-                draw = ImageDraw.Draw(im)
-                draw.ellipse(ldmks, fill=(255, 0, 0))
-                
-            im.save(os.path.join(debug_land_img_dir, '%05d.jpg' % sel_ids[j]))
-            np.savetxt(os.path.join(debug_land_dir, '%05d.lms' % sel_ids[j]), proj_geo.detach().cpu().numpy())
+            image_writer.save(Image.fromarray(og_img), os.path.join(debug_mix_dir, '%05d.jpg' % sel_ids[j]), debug=True)
+
+            # Save landmarks, drawn by the writer
+            image_writer.submit(save_landmark_image, os.path.join(debug_land_img_dir, '%05d.jpg' % sel_ids[j]), proj_geo, h, w, debug=True)
 
             
     pts3D = torch.cat(pts3D, dim=0)
+    save_landmarks(os.path.join(id_dir, PROJECTED_LANDMARKS), proj_landmarks)
 
     print('about to save params..')
 
@@ -4,6 +4,7 @@
 import os
 
 from face_tracking.data_loader import load_dir
+from landmark_store import DETECTED_LANDMARKS
 from face_tracking.FLAME.FLAME import FLAME
 from face_tracking.FLAME.config import cfg
 from face_tracking.render_3dmm import Render_FLAME
@@ -34,8 +35,7 @@ class GeometryGenerator:
         start_id = 0
         end_id = frame_num
         id_dir = dataset_base
-        self.lms, self.img_paths = load_dir(os.path.join(id_dir, 'landmarks'),
-                                            os.path.join(id_dir, 'frames'),
+        self.lms, self.frame_ids = load_dir(os.path.join(id_dir, DETECTED_LANDMARKS),
                                             start_id, end_id)
 
         self.num_frames = self.lms.shape[0]
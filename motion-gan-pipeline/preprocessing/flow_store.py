@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Optical flows between all consecutive frames of a video, packed into a single (N - 1, H, W, 2) float16 .npy file instead of one .flo file per pair.
+
+Flow i maps frame i to frame i + 1, as (x, y) displacements in pixels of the full resolution frames. The flows may be stored downscaled, in which case
+H & W are smaller than the frames but the displacements keep their full resolution magnitude. The file is memory-mapped, hence single flows are read
+without loading the whole video. float16 halves the size of the .flo files, its precision of 1/32 pixel for displacements below 64 pixels suffices
+for the warping losses.
+
+Usage, converting the .flo files of an existing dataset: python flow_store.py --dataset_base <video dir>
+"""
+
+import os
+
+import numpy as np
+
+from array_store import ArrayWriter, convert_dataset_main, numbered_file_ids
+
+OPTICAL_FLOW = 'opticalflow.npy'  # Relative to the dataset base, see step 13
+FLO_MAGIC = 202021.25
+
+
+def load_optical_flow(path):
+    """ Returns the memory-mapped (N - 1, H, W, 2) flows """
+    if not os.path.isfile(path):
+        raise FileNotFoundError('No optical flow at %s, please compute it first (step 13)' % path)
+
+    return np.load(path, mmap_mode='r')
+
+
+class OpticalFlowWriter(ArrayWriter):
+    """ Writes the flows of a video chunk by chunk, see ArrayWriter """
+
+    def __init__(self, path, num_flows, height, width):
+        super().__init__(path, (num_flows, height, width, 2), np.float16, unit='flow')
+
+
+def read_flo(path):
+    """ Reads a .flo file in Middlebury format as (H, W, 2) float32 array """
+    with open(path, 'rb') as f:
+        if np.fromfile(f, np.float32, count=1)[0] != FLO_MAGIC:
+            raise ValueError('%s is no .flo file' % path)
+
+        w, h = np.fromfile(f, np.int32, count=2)
+        return np.fromfile(f, np.float32, count=2 * w * h).reshape(h, w, 2)
+
+
+def pack_flo_dir(flo_dir, path):
+    """ Converts a directory of %05d.flo files into a single flow file. Returns the number of converted flows """
+    flow_ids = numbered_file_ids(flo_dir, '.flo')
+    if not flow_ids:
+        return 0
+
+    height, width, _ = read_flo(os.path.join(flo_dir, '%05d.flo' % 0)).shape
+    with OpticalFlowWriter(path, len(flow_ids), height, width) as writer:
+        for idx in flow_ids:
+            writer.write(idx, read_flo(os.path.join(flo_dir, '%05d.flo' % idx))[np.newaxis])
+
+    return len(flow_ids)
+
+
+def main():
+    convert_dataset_main('Converts the per-pair .flo files of a dataset into a single flow file', 'opticalflow', OPTICAL_FLOW, pack_flo_dir, unit='flows')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Decoded video frames, stored once per dataset as chunks of memory-mapped uint8 arrays instead of one image file per frame.
+
+The store is a directory containing chunk_%05d.npy files of shape (chunk_size, H, W, 3) in RGB order, the last one possibly shorter, and a
+manifest.json which is written last, such that a store without manifest is incomplete. Frames are memory-mapped on access, hence random access &
+batch iteration neither decode images nor read more than the requested frames.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from array_store import read_manifest, remove_manifest, write_manifest
+
+FRAME_STORE_DIR = 'frame_store'
+MANIFEST_VERSION = 1
+DEFAULT_CHUNK_SIZE = 64
+
+
+class FrameStoreWriter:
+    """ Appends RGB uint8 frames of equal size to a new frame store, flushing them every chunk_size frames """
+
+    def __init__(self, store_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+
+        self.num_frames = 0
+        self.chunks = []
+        self.buffer = None
+        self.buffered = 0
+
+        os.makedirs(store_dir, exist_ok=True)
+
+        remove_manifest(store_dir)
+
+    def append(self, frame):
+        if self.buffer is None:
+            self.buffer = np.empty((self.chunk_size,) + frame.shape, dtype=np.uint8)
+
+        elif frame.shape != self.buffer.shape[1:]:
+            raise ValueError('Frame %d has shape %s, expected %s' % (self.num_frames, frame.shape, self.buffer.shape[1:]))
+
+        self.buffer[self.buffered] = frame
+        self.buffered += 1
+        self.num_frames += 1
+
+        if self.buffered == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffered:
+            return
+
+        chunk_name = 'chunk_%05d.npy' % len(self.chunks)
+        np.save(os.path.join(self.store_dir, chunk_name), self.buffer[:self.buffered])
+
+        self.chunks.append(chunk_name)
+        self.buffered = 0
+
+    def close(self):
+        self._flush()
+
+        if self.buffer is None:
+            raise ValueError('No frames were written to %s' % self.store_dir)
+
+        height, width, channels = self.buffer.shape[1:]
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'num_frames': self.num_frames,
+            'height': height,
+            'width': width,
+            'channels': channels,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+        }
+
+        write_manifest(self.store_dir, manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted store remains without manifest
+        if exc_type is None:
+            self.close()
+
+
+class FrameStore:
+    """ Read access to a frame store. Frames are RGB uint8 arrays of shape (H, W, 3), indexed by frame number """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        manifest = read_manifest(store_dir, 'No complete frame store at %s, please extract the frames first (step 1)' % store_dir)
+
+        self.num_frames = manifest['num_frames']
+        self.height = manifest['height']
+        self.width = manifest['width']
+        self.chunk_size = manifest['chunk_size']
+        self.chunk_names = manifest['chunks']
+
+        self._chunks = [None] * len(self.chunk_names)
+
+    @property
+    def shape(self):
+        return self.num_frames, self.height, self.width, 3
+
+    def __len__(self):
+        return self.num_frames
+
+    def _chunk(self, chunk_idx):
+        if self._chunks[chunk_idx] is None:
+            self._chunks[chunk_idx] = np.load(os.path.join(self.store_dir, self.chunk_names[chunk_idx]), mmap_mode='r')
+
+        return self._chunks[chunk_idx]
+
+    def __getitem__(self, idx):
+        """ Returns a read-only view of the frame """
+        idx = int(idx)
+        if not 0 <= idx < self.num_frames:
+            raise IndexError('Frame %d out of range, the store contains %d frames' % (idx, self.num_frames))
+
+        return self._chunk(idx // self.chunk_size)[idx % self.chunk_size]
+
+    def __iter__(self):
+        for idx in range(self.num_frames):
+            yield self[idx]
+
+    def read(self, ids):
+        """ Returns the frames with the given ids as an array of shape (len(ids), H, W, 3) """
+        batch = np.empty((len(ids), self.height, self.width, 3), dtype=np.uint8)
+
+        for batch_idx, idx in enumerate(ids):
+            batch[batch_idx] = self[idx]
+
+        return batch
+
+    def batches(self, batch_size, ids=None):
+        """ Yields (ids, frames) for consecutive batches of the given frame ids, all frames by default """
+        ids = list(range(self.num_frames)) if ids is None else list(ids)
+
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start:start + batch_size]
+            yield batch_ids, self.read(batch_ids)
+
+    def export_images(self, out_dir, ext='jpg'):
+        """ Writes every frame to out_dir as %05d.<ext>, for tools which only read image files """
+        os.makedirs(out_dir, exist_ok=True)
+
+        for idx in range(self.num_frames):
+            cv2.imwrite(os.path.join(out_dir, '%05d.%s' % (idx, ext)), cv2.cvtColor(self[idx], cv2.COLOR_RGB2BGR))
+
+
+def open_frame_store(dataset_base):
+    return FrameStore(os.path.join(dataset_base, FRAME_STORE_DIR))
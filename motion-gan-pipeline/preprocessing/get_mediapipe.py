@@ -1,82 +1,129 @@
 # SPDX-License-Identifier: MIT
 # © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
 
-import mediapipe as mp
+""" MediaPipe body tracking on the frames of a frame store.
+
+The pose is tracked in video mode: the detector only runs until a body is found, the following frames track the landmarks of the previous frame,
+which is considerably cheaper than a full detection per frame and yields temporally smooth landmarks.
+Long videos may be split into contiguous shards tracked by a pool of processes. Every shard starts tracking `overlap` frames before its first frame,
+such that the tracker has locked onto the body once the frames of the shard are reached. The poses of these warm-up frames are discarded.
+"""
+
+import multiprocessing
 import os
-from PIL import Image, ImageDraw
+
 import cv2
+import mediapipe as mp
 import numpy as np
+from PIL import Image, ImageDraw
 from tqdm import tqdm
 
-def extract_mediapipe(input_path, output_path):
+from body_pose_store import NUM_BODY_LANDMARKS, empty_body_poses, save_body_poses
+from frame_store import FrameStore, open_frame_store
 
-    # process video
-    frames_path = os.path.join(input_path, 'frames')
-    
+DEFAULT_OVERLAP = 25  # One second of warm-up at 25 fps
+
+
+def draw_debug_images(debug_dir, idx, image, results, poses, enable_segmentation):
+    """ Saves the image annotated with the tracked pose, and the image with its landmarks """
     mp_drawing = mp.solutions.drawing_utils
     mp_drawing_styles = mp.solutions.drawing_styles
     mp_pose = mp.solutions.pose
 
-    pose = mp_pose.Pose(
-        static_image_mode=True,
-        model_complexity=2,
-        enable_segmentation=True,
-        min_detection_confidence=0.5) 
+    annotated_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    if enable_segmentation and results.segmentation_mask is not None:
+        condition = np.stack((results.segmentation_mask,) * 3, axis=-1) > 0.1
+        bg_image = np.zeros(image.shape, dtype=np.uint8)
+        bg_image[:] = (192, 192, 192) # gray
+        annotated_image = np.where(condition, annotated_image, bg_image)
+    # Draw pose landmarks on the image.
+    mp_drawing.draw_landmarks(
+        annotated_image,
+        results.pose_landmarks,
+        mp_pose.POSE_CONNECTIONS,
+        landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style())
+
+    cv2.imwrite(os.path.join(debug_dir, str(idx) + '.png'), annotated_image)
+
+    tmp = Image.fromarray(image)
+    draw = ImageDraw.Draw(tmp)
+    margin = (max(image.shape[:2]) // 500) + 3
+    for point in poses:
+        draw.ellipse([point[0] - margin, point[1] - margin, point[0] + margin, point[1] + margin], fill=(255))
+    tmp.save(os.path.join(debug_dir, str(idx) + '_landmarks.png'))
+
+
+def track_body(frames, start, end, overlap=DEFAULT_OVERLAP, model_complexity=2, enable_segmentation=False, debug_dir=None, progress=True):
+    """ Returns the poses of the frames [start, end) as array of shape (end - start, 33, 4): x & y in pixels, depth and visibility.
+    Tracking starts `overlap` frames before start, frames without pose are all zeros
+    """
+    mp_pose = mp.solutions.pose
 
-    for idx, img_path in enumerate(tqdm([os.path.join(frames_path, f) for f in sorted(os.listdir(frames_path))])):
-        image = cv2.imread(img_path)
-        image_height, image_width, _ = image.shape
-        # Convert the BGR image to RGB before processing.
-        results = pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))   
+    poses = empty_body_poses(end - start)
+    warm_up = max(0, start - overlap)
 
-        save_path = os.path.join(output_path, '%05d.npy' % idx)
+    with mp_pose.Pose(
+            static_image_mode=False,
+            model_complexity=model_complexity,
+            smooth_landmarks=True,
+            enable_segmentation=enable_segmentation,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5) as pose:
 
-        if not results.pose_landmarks:
-            ldk_poses = np.zeros(shape=(33, 4)) 
+        ids = range(warm_up, end)
+        for idx in tqdm(ids) if progress else ids:
+            image = frames[idx]
+            image_height, image_width, _ = image.shape
+            # Frames are stored in RGB order, as expected by mediapipe
+            results = pose.process(np.ascontiguousarray(image))
 
-        else:
-            ldk_poses = []
-            # Save as numpy
-            for i in range(33):
-                # landmarks: x, y, z, visibility
-                ldk = results.pose_landmarks.landmark[i]
-                ldk_poses.append([ldk.x * image_width , ldk.y * image_height , ldk.z, ldk.visibility])
+            if idx < start or not results.pose_landmarks:
+                continue
 
-        np.save(save_path, ldk_poses)
+            # landmarks: x, y, z, visibility
+            poses[idx - start] = [[ldk.x * image_width, ldk.y * image_height, ldk.z, ldk.visibility] for ldk in results.pose_landmarks.landmark]
 
-        # Save landmarks and edges for DEBUGGING
-        debug = False
+            if debug_dir is not None:
+                draw_debug_images(debug_dir, idx, image, results, poses[idx - start], enable_segmentation)
+
+    return poses
+
+
+def _track_shard(args):
+    store_dir, start, end, overlap, model_complexity, enable_segmentation = args
+
+    return track_body(FrameStore(store_dir), start, end, overlap=overlap, model_complexity=model_complexity,
+                      enable_segmentation=enable_segmentation, progress=False)
+
+
+def extract_mediapipe(input_path, output_path, num_workers=0, overlap=DEFAULT_OVERLAP, model_complexity=2, enable_segmentation=False, debug=False):
+    """ Tracks the body in all frames of the dataset at input_path, writing their poses to output_path as a single (N, 33, 4) array.
+    With num_workers > 0, the video is split into up to num_workers contiguous shards tracked by a pool of processes.
+    Debug images are drawn into <output dir>/debug/body_pose, tracking the whole video in the current process
+    """
+    frames = open_frame_store(input_path)
+    num_frames = len(frames)
+
+    # Shards shorter than a few warm-ups would spend most of their time warming up
+    num_shards = min(num_workers, num_frames // (4 * overlap)) if not debug else 0
+
+    if num_shards <= 1:
+        debug_dir = None
         if debug:
-            debug_path = os.path.join(output_path, 'debug')        
-            os.makedirs(debug_path, exist_ok=True)
-
-            annotated_image = image.copy()
-            condition = np.stack((results.segmentation_mask,) * 3, axis=-1) > 0.1
-            bg_image = np.zeros(image.shape, dtype=np.uint8)
-            bg_image[:] = (192, 192, 192) # gray
-            annotated_image = np.where(condition, annotated_image, bg_image)
-            # Draw pose landmarks on the image.
-            mp_drawing.draw_landmarks(
-                annotated_image,
-                results.pose_landmarks,
-                mp_pose.POSE_CONNECTIONS,
-                landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style())
-            
-            cv2.imwrite(os.path.join(debug_path, str(idx) + '.png'), annotated_image)
-
-            tmp = Image.open(img_path)
-            size = (image_height, image_width)
-
-            for point in ldk_poses:
-                margin = (max(size) // 500) + 3
-                ldmks = ([point[0] - margin, point[1] - margin, point[0] + margin, point[1] + margin])
-                draw = ImageDraw.Draw(tmp)
-                draw.ellipse(ldmks, fill=(255))
-                tmp.save(os.path.join(debug_path, str(idx) + '_landmarks.png'))
-        
-
-if __name__ == "__main__":
-
-    input_path = '/home/alberto/motion-gan-pipeline/input_data/video/Clara'
-    output_path = '/home/alberto/motion-gan-pipeline/input_data/video/Clara/body_pose'
-    extract_mediapipe(input_path, output_path)
+            debug_dir = os.path.join(os.path.dirname(output_path), 'debug', 'body_pose')
+            os.makedirs(debug_dir, exist_ok=True)
+
+        poses = track_body(frames, 0, num_frames, overlap=overlap, model_complexity=model_complexity,
+                           enable_segmentation=enable_segmentation, debug_dir=debug_dir)
+
+    else:
+        bounds = np.linspace(0, num_frames, num_shards + 1).astype(int)
+        shards = [(frames.store_dir, int(start), int(end), overlap, model_complexity, enable_segmentation) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        with multiprocessing.get_context('spawn').Pool(num_shards) as pool:
+            poses = np.concatenate(list(tqdm(pool.imap(_track_shard, shards), total=len(shards))))
+
+    assert poses.shape == (num_frames, NUM_BODY_LANDMARKS, 4)
+    save_body_poses(output_path, poses)
+
+    print('Tracked a body pose in %d of %d frames' % (np.count_nonzero(poses.any(axis=(1, 2))), num_frames))
@@ -1,52 +1,91 @@
 # SPDX-License-Identifier: MIT
 # © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
 
+""" Optical flow between all consecutive frames, written into a single flow store, see flow_store.py.
+
+compute_optical_flow runs FlowNet2 on batches of frame pairs on the GPU, compute_optical_flow_slow runs TV-L1 on the CPU, optionally sharded across a
+pool of processes. Both may compute the flow on frames downscaled by `scale`, which speeds up the flow quadratically.
+"""
+
+import multiprocessing
+import os
+
+import cv2
 import numpy as np
 from skimage.color import rgb2gray
 from skimage.registration import optical_flow_tvl1
-from PIL import Image
 from tqdm import tqdm
-import os
 
-def compute_optical_flow_slow(frames, opticalflow_dir, debug_opticalflow_dir):
+from flow_store import OpticalFlowWriter
+
+CONFIG_FILE = 'third/mmflow/flownet2CS/flownet2cs_8x1_sfine_flyingthings3d_subset_384x768.py'
+CHECKPOINT_FILE = 'third/mmflow/flownet2CS/flownet2cs_8x1_sfine_flyingthings3d_subset_384x768.pth'
+
+
+def load_frame(path, scale=1.0, gray=False):
+    """ Loads the frame as BGR uint8 image, as expected by mmflow, or as gray level float image in [0, 1], as expected by TV-L1 """
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # --- Convert the images to gray level: color is not supported by TV-L1.
+    return rgb2gray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) if gray else image
 
-    for i in tqdm(range(len(frames)-1)):
-        out_name = os.path.join(opticalflow_dir,'%05d.npy' % i)
-        # --- Load the sequence
-        image0 = np.array(Image.open(frames[i]))
-        image1 = np.array(Image.open(frames[i+1]))
 
-        # --- Convert the images to gray level: color is not supported.
-        image0 = rgb2gray(image0)
-        image1 = rgb2gray(image1)
+def _tvl1_shard(args):
+    frames, scale = args
 
-        # --- Compute the optical flow
+    images = [load_frame(frame, scale, gray=True) for frame in frames]
+    flows = []
+    for image0, image1 in zip(images[:-1], images[1:]):
         v, u = optical_flow_tvl1(image0, image1)
+        flows.append(np.stack((u, v), axis=-1) / scale)
 
-        of = np.stack((v,u),axis=0)
-        np.save(out_name, of)
+    return np.stack(flows)
 
-    return
 
-def compute_optical_flow(frames, opticalflow_dir, debug_opticalflow_dir):
-    from mmflow.apis import inference_model, init_model
-    from mmflow.datasets import visualize_flow, write_flow
+def compute_optical_flow_slow(frames, flow_path, scale=1.0, num_workers=0, shard_size=32):
+    """ TV-L1 flow between the consecutive frames, with num_workers > 0 on a pool of processes each computing shard_size consecutive flows at once """
+    num_flows = len(frames) - 1
+    height, width = load_frame(frames[0], scale, gray=True).shape
+
+    # Consecutive shards share their boundary frame
+    shards = [(frames[start:start + shard_size + 1], scale) for start in range(0, num_flows, shard_size)]
+
+    with OpticalFlowWriter(flow_path, num_flows, height, width) as writer:
+        if num_workers <= 0:
+            for flows in tqdm(map(_tvl1_shard, shards), total=len(shards)):
+                writer.write(writer.written, flows)
 
-    import mmcv
+        else:
+            with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+                for flows in tqdm(pool.imap(_tvl1_shard, shards), total=len(shards)):
+                    writer.write(writer.written, flows)
 
-    # Specify the path to model config and checkpoint file
-    config_file = 'third/mmflow/flownet2CS/flownet2cs_8x1_sfine_flyingthings3d_subset_384x768.py'
-    checkpoint_file = 'third/mmflow/flownet2CS/flownet2cs_8x1_sfine_flyingthings3d_subset_384x768.pth'
-    device = 'cuda:0'
+
+def compute_optical_flow(frames, flow_path, debug_opticalflow_dir, scale=1.0, batch_size=8, image_writer=None, device='cuda:0'):
+    """ FlowNet2 flow between the consecutive frames, inferred batch_size pairs at a time. The flows are visualized in debug_opticalflow_dir """
+    from mmflow.apis import inference_model, init_model
+    from mmflow.datasets import visualize_flow
 
     # init a model
-    model = init_model(config_file, checkpoint_file, device=device)
-
-    # inference the demo image
-    for i in tqdm(range(len(frames)-1)):
-        out_name = os.path.join(opticalflow_dir,'%05d.flo' % i) 
-        result = inference_model(model, frames[i] , frames[i+1])
-        write_flow(result, flow_file=out_name)
-        # save the visualized flow map
-        debug_file = os.path.join(debug_opticalflow_dir, '%05d.png' % i)
-        flow_map = visualize_flow(result, save_file=debug_file)
+    model = init_model(CONFIG_FILE, CHECKPOINT_FILE, device=device)
+
+    num_flows = len(frames) - 1
+    height, width, _ = load_frame(frames[0], scale).shape
+
+    with OpticalFlowWriter(flow_path, num_flows, height, width) as writer:
+        for start in tqdm(range(0, num_flows, batch_size)):
+            # Every frame is loaded once, the pairs of the batch share their frames
+            images = [load_frame(frame, scale) for frame in frames[start:start + batch_size + 1]]
+
+            # Batched inference returns the results of all pairs, of which only the forward flow is kept
+            results = inference_model(model, images[:-1], images[1:])
+            flows = np.stack([result['flow'] if result.get('flow') is not None else result['flow_fw'] for result in results]) / scale
+            writer.write(start, flows)
+
+            # save the visualized flow maps
+            if image_writer is not None:
+                for i, flow in enumerate(flows):
+                    image_writer.submit(visualize_flow, flow, save_file=os.path.join(debug_opticalflow_dir, '%05d.png' % (start + i)), debug=True)
@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Batched FAN 2D landmark detection on the frames of a frame store.
+
+The face detector only runs on every detection_stride-th frame, the frames in between reuse the face box of the last detection, which suffices for
+the slow head movements of a talking head video. A reused box is only kept if the landmark network is confident about the face within it and the
+landmarks are centered within the box, otherwise the frame is detected individually, as are frames without box. Both the detector and the landmark
+network process whole batches of frames, instead of one frame at a time as FaceAlignment.get_landmarks does.
+
+On CPU, the frames may additionally be sharded across a pool of processes, each of which loads the models once & tracks the face within contiguous
+ranges of frames.
+Written against the face_alignment 1.3 API.
+"""
+
+import multiprocessing
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from frame_store import FrameStore
+from landmark_store import empty_landmarks
+
+NUM_LANDMARKS = 68
+MIN_CONFIDENCE = 0.4  # Mean heatmap peak of the landmarks, below which a reused face box is considered lost
+
+_shard_detector = None  # The detector of a pool process, see _init_shard_worker
+
+
+class BatchedLandmarkDetector:
+
+    def __init__(self, device, batch_size=16, detection_stride=5, min_confidence=MIN_CONFIDENCE):
+        import face_alignment
+
+        self.fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False, device=device)
+        self.device = device
+        self.batch_size = batch_size
+        self.detection_stride = detection_stride
+        self.min_confidence = min_confidence
+
+    def _to_tensor(self, images):
+        return torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2).float().to(self.device)
+
+    @torch.no_grad()
+    def detect_faces(self, images):
+        """ Returns the box (x1, y1, x2, y2) of the most confident face of every image, None if no face was found """
+        boxes = []
+
+        for start in range(0, len(images), self.batch_size):
+            for faces in self.fa.face_detector.detect_from_batch(self._to_tensor(images[start:start + self.batch_size])):
+                boxes.append(np.asarray(faces[0][:4]) if len(faces) > 0 else None)
+
+        return boxes
+
+    @torch.no_grad()
+    def landmarks(self, images, boxes):
+        """ Runs the landmark network on the given face boxes. Returns the landmarks as array of shape (len(images), 68, 2) and the mean heatmap peak
+        of every image as its confidence
+        """
+        from face_alignment.utils import crop, get_preds_fromhm
+
+        landmarks = np.empty((len(images), NUM_LANDMARKS, 2), dtype=np.float32)
+        confidences = np.empty(len(images), dtype=np.float32)
+
+        for start in range(0, len(images), self.batch_size):
+            centers, scales, crops = [], [], []
+
+            # Same crop as FaceAlignment.get_landmarks_from_image
+            for image, box in zip(images[start:start + self.batch_size], boxes[start:start + self.batch_size]):
+                center = torch.tensor([box[2] - (box[2] - box[0]) / 2.0, box[3] - (box[3] - box[1]) / 2.0])
+                center[1] = center[1] - (box[3] - box[1]) * 0.12
+                scale = (box[2] - box[0] + box[3] - box[1]) / self.fa.face_detector.reference_scale
+
+                centers.append(center)
+                scales.append(scale)
+                crops.append(crop(np.asarray(image), center, scale))
+
+            inputs = self._to_tensor(np.stack(crops)).div_(255.0)
+            heatmaps = self.fa.face_alignment_net(inputs).detach().to(device='cpu', dtype=torch.float32).numpy()
+
+            for i, (center, scale) in enumerate(zip(centers, scales)):
+                _, pts_img, scores = get_preds_fromhm(heatmaps[i:i + 1], center.numpy(), scale)
+                landmarks[start + i] = np.asarray(pts_img).reshape(NUM_LANDMARKS, 2)
+                confidences[start + i] = np.mean(scores)
+
+        return landmarks, confidences
+
+    def tracks_face(self, landmarks, confidence, box):
+        """ Whether the landmarks predicted within a reused face box still belong to a face within that box """
+        center_x, center_y = np.mean(landmarks, axis=0)
+        return confidence >= self.min_confidence and box[0] <= center_x <= box[2] and box[1] <= center_y <= box[3]
+
+    def __call__(self, frames, ids, progress=True):
+        """ Returns the landmarks of the frames with the given, consecutive ids as array of shape (len(ids), 68, 2). Frames without face are NaN """
+        result = empty_landmarks(len(ids), NUM_LANDMARKS)
+        last_box = None
+
+        batch_starts = range(0, len(ids), self.batch_size)
+        for start in tqdm(batch_starts) if progress else batch_starts:
+            batch_ids = ids[start:start + self.batch_size]
+            images = frames.read(batch_ids)
+
+            # Detects all key frames of the batch at once, the first frame also if the previous batch ended without face
+            key_frames = [i for i, idx in enumerate(batch_ids) if (idx - ids[0]) % self.detection_stride == 0 or (i == 0 and last_box is None)]
+            key_boxes = dict(zip(key_frames, self.detect_faces(images[key_frames])))
+
+            boxes = []
+            for i in range(len(batch_ids)):
+                if i in key_frames:
+                    last_box = key_boxes[i]
+                boxes.append(last_box)
+
+            # Frames whose face was lost at the last key frame are detected individually
+            missing = [i for i, box in enumerate(boxes) if box is None and i not in key_frames]
+            for i, box in zip(missing, self.detect_faces(images[missing])):
+                boxes[i] = box
+
+            found = [i for i, box in enumerate(boxes) if box is not None]
+            if found:
+                landmarks, confidences = self.landmarks(images[found], [boxes[i] for i in found])
+                result[start + np.array(found)] = landmarks
+
+                # Frames whose reused box no longer holds the face are detected individually as well
+                detected = set(key_frames) | set(missing)
+                lost = [i for i, frame_landmarks, confidence in zip(found, landmarks, confidences)
+                        if i not in detected and not self.tracks_face(frame_landmarks, confidence, boxes[i])]
+
+                if lost:
+                    for i, box in zip(lost, self.detect_faces(images[lost])):
+                        boxes[i] = box
+                    result[start + np.array(lost)] = np.nan
+
+                    redetected = [i for i in lost if boxes[i] is not None]
+                    if redetected:
+                        landmarks, _ = self.landmarks(images[redetected], [boxes[i] for i in redetected])
+                        result[start + np.array(redetected)] = landmarks
+
+            last_box = boxes[-1]
+
+        return result
+
+
+def _init_shard_worker(batch_size, detection_stride):
+    """ Loads the models once per pool process, instead of once per shard """
+    global _shard_detector
+
+    torch.set_num_threads(1)
+    _shard_detector = BatchedLandmarkDetector(device='cpu', batch_size=batch_size, detection_stride=detection_stride)
+
+
+def _detect_shard(args):
+    store_dir, ids = args
+
+    return _shard_detector(FrameStore(store_dir), ids, progress=False)
+
+
+def detect_landmarks(store_dir, batch_size=16, detection_stride=5, num_workers=0):
+    """ Returns the landmarks of all frames of the frame store as array of shape (N, 68, 2), NaN for frames without face.
+    With num_workers > 0, the frames are split into contiguous shards processed by a pool of CPU processes, otherwise the GPU is used if available
+    """
+    frames = FrameStore(store_dir)
+    ids = list(range(len(frames)))
+
+    if num_workers <= 0:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        return BatchedLandmarkDetector(device=device, batch_size=batch_size, detection_stride=detection_stride)(frames, ids)
+
+    shards = [shard.tolist() for shard in np.array_split(ids, num_workers * 4) if len(shard)]
+    with multiprocessing.get_context('spawn').Pool(num_workers, initializer=_init_shard_worker, initargs=(batch_size, detection_stride)) as pool:
+        results = list(tqdm(pool.imap(_detect_shard, [(store_dir, shard) for shard in shards]), total=len(shards)))
+
+    return np.concatenate(results)
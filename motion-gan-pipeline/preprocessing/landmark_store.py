@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+""" Landmarks of all frames of a sequence, packed into a single (N, K, 2) float32 .npy file instead of one %05d.lms text file per frame.
+
+Frames without landmarks are NaN, see LandmarkStore.valid. The file is memory-mapped, hence single frames are read without parsing the whole sequence.
+
+Usage, converting the .lms files of an existing dataset: python landmark_store.py --dataset_base <video dir> [--out_dir <inference out dir>]
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from array_store import convert_dirs, numbered_file_ids, save_array_atomic
+
+DETECTED_LANDMARKS = 'landmarks.npy'  # FAN landmarks of the video frames, relative to the dataset base, see step 2
+PROJECTED_LANDMARKS = os.path.join('debug', 'proj_landmarks.npy')  # Landmarks of the tracked face model, relative to the dataset base, see step 3
+GENERATED_LANDMARKS = 'landmarks.npy'  # Landmarks of the generated head motion, relative to the inference out dir
+
+
+class LandmarkStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.landmarks = np.load(path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    @property
+    def num_landmarks(self):
+        return self.landmarks.shape[1]
+
+    @property
+    def valid(self):
+        """ Boolean mask of the frames with landmarks """
+        return ~np.isnan(self.landmarks).any(axis=(1, 2))
+
+    def valid_ids(self, start=0, end=None):
+        return [int(idx) + start for idx in np.flatnonzero(self.valid[start:end])]
+
+    def __getitem__(self, idx):
+        """ Returns the (K, 2) landmarks of the frame, raising a KeyError for frames without landmarks """
+        landmarks = np.array(self.landmarks[idx])
+
+        if np.isnan(landmarks).any():
+            raise KeyError('No landmarks for frame %d in %s' % (idx, self.path))
+
+        return landmarks
+
+    def read(self, ids):
+        return np.array(self.landmarks[list(ids)])
+
+    def mean(self):
+        """ Mean landmarks over all frames with landmarks """
+        return np.asarray(self.landmarks[self.valid]).mean(axis=0)
+
+
+def save_landmarks(path, landmarks):
+    """ Writes the (N, K, >=2) landmarks, of which only x & y are kept, NaN for frames without landmarks """
+    save_array_atomic(path, np.asarray(landmarks, dtype=np.float32)[:, :, :2])
+
+
+def empty_landmarks(num_frames, num_landmarks):
+    """ Returns an array for the landmarks of num_frames frames, all of them missing """
+    return np.full((num_frames, num_landmarks, 2), np.nan, dtype=np.float32)
+
+
+def pack_landmark_dir(lms_dir, path, num_frames=None):
+    """ Converts a directory of %05d.lms files into a landmark store. Returns the number of converted frames """
+    # Frames without landmarks have no file
+    frame_ids = numbered_file_ids(lms_dir, '.lms', consecutive=False)
+    if not frame_ids:
+        return 0
+
+    first = np.loadtxt(os.path.join(lms_dir, '%05d.lms' % frame_ids[0]))
+    landmarks = empty_landmarks(num_frames or frame_ids[-1] + 1, len(first))
+
+    for idx in frame_ids:
+        landmarks[idx] = np.loadtxt(os.path.join(lms_dir, '%05d.lms' % idx))[:, :2]
+
+    save_landmarks(path, landmarks)
+    return len(frame_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts the per-frame .lms files of a dataset into landmark stores')
+    parser.add_argument('--dataset_base', required=True, help='Video dir containing landmarks/ & debug/proj_landmarks/')
+    parser.add_argument('--out_dir', default=None, help='Inference out dir containing the generated landmarks/')
+    opt = parser.parse_args()
+
+    conversions = [
+        (os.path.join(opt.dataset_base, 'landmarks'), os.path.join(opt.dataset_base, DETECTED_LANDMARKS)),
+        (os.path.join(opt.dataset_base, 'debug', 'proj_landmarks'), os.path.join(opt.dataset_base, PROJECTED_LANDMARKS)),
+    ]
+    if opt.out_dir is not None:
+        conversions.append((os.path.join(opt.out_dir, 'landmarks'), os.path.join(opt.out_dir, GENERATED_LANDMARKS)))
+
+    convert_dirs(conversions, pack_landmark_dir)
+
+
+if __name__ == '__main__':
+    main()
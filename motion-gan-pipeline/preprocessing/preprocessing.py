@@ -2,15 +2,28 @@
 # © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
 
 import os
+import sys
+import inspect
 import cv2
-from skimage import io
 import numpy as np
 from tqdm import tqdm
 import torch
 import json
+import tempfile
 
 from autils.options import PreprocessingOptions
+from frame_store import FRAME_STORE_DIR, FrameStoreWriter, open_frame_store
+from deepspeech_store import DEEPSPEECH_FEATURES, load_deepspeech_features
+from body_pose_store import BODY_POSES
+from deca_store import DECA_STORE_DIR, DecaStore
+from flow_store import OPTICAL_FLOW
+from landmark_store import DETECTED_LANDMARKS, PROJECTED_LANDMARKS, LandmarkStore, save_landmarks
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_runner.image_writer import ImageWriter
+from pipeline_runner.stage_cache import StageCache, code_version
+
+PREPROCESSING_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 class Preprocessor:
@@ -31,35 +44,35 @@ class Preprocessor:
         self.dataset_base = os.path.join(self.dataroot, self.name)
 
         self.mapp = {
-            '0': lambda: self.deepspeech_preprocessing(),
-            '1': lambda: self.extract_images(),
-            '2': lambda: self.landmark_detection(),
-            '3': lambda: self.head_pose_estimation(),
-            '4': lambda: self.audioexpression_features(),
-            '5': lambda: self.face_matting(),
-            '6': lambda: self.extract_meshes(),
-            '7': lambda: self.save_params(),
-            '8': lambda: self.speech_to_text(),
-            '9': lambda: self.body_tracking(),
-            '10': lambda: self.emotion_detection(),
-            '11': lambda: self.edge_detection(),
-            '12': lambda: self.audio_noise_reduction(),
-            '13': lambda: self.optical_flow(),
+            '0': self.deepspeech_preprocessing,
+            '1': self.extract_images,
+            '2': self.landmark_detection,
+            '3': self.head_pose_estimation,
+            '4': self.audioexpression_features,
+            '5': self.face_matting,
+            '6': self.extract_meshes,
+            '7': self.save_params,
+            '8': self.speech_to_text,
+            '9': self.body_tracking,
+            '10': self.emotion_detection,
+            '11': self.edge_detection,
+            '12': self.audio_noise_reduction,
+            '13': self.optical_flow,
         }
 
     def initialize(self):
 
-        self.audiofeature_dir = os.path.join(self.dataset_base, "audio_feature")
+        self.audiofeature_path = os.path.join(self.dataset_base, DEEPSPEECH_FEATURES)
 
         self.audioexpr_dir = os.path.join(self.dataset_base, 'audio_expr')
 
-        self.decaexpr_dir = os.path.join(self.dataset_base, 'deca_expr')
+        self.decastore_dir = os.path.join(self.dataset_base, DECA_STORE_DIR)
 
-        self.framesdir = os.path.join(self.dataset_base, 'frames')
+        self.frame_store_dir = os.path.join(self.dataset_base, FRAME_STORE_DIR)
 
-        self.landmarkdir = os.path.join(self.dataset_base, 'landmarks')
+        self.landmarkpath = os.path.join(self.dataset_base, DETECTED_LANDMARKS)
 
-        self.projectedlankmarkdir = os.path.join(self.dataset_base, 'debug', 'proj_landmarks')
+        self.projectedlandmarkpath = os.path.join(self.dataset_base, PROJECTED_LANDMARKS)
 
         self.trackparamspath = os.path.join(self.dataset_base, 'track_params.pt')
         self.textpath = os.path.join(self.dataset_base, 'transcript.txt')
@@ -72,7 +85,7 @@ class Preprocessor:
 
         self.expr_masks_dir = os.path.join(self.dataset_base, 'expr_masks')
 
-        self.body_dir = os.path.join(self.dataset_base, 'body_pose')
+        self.bodyposepath = os.path.join(self.dataset_base, BODY_POSES)
 
         self.emotion_dir = os.path.join(self.dataset_base, 'emotions')
 
@@ -82,23 +95,66 @@ class Preprocessor:
 
         self.APC_path = os.path.join(self.dataset_base, 'APC_feat.npy')
 
-        self.opticalflow_dir = os.path.join(self.dataset_base, 'opticalflow')
+        self.opticalflowpath = os.path.join(self.dataset_base, OPTICAL_FLOW)
         self.debug_opticalflow_dir = os.path.join(self.dataset_base, 'debug', 'opticalflow')
 
+        self.stage_cache = StageCache(self.dataset_base)
+
+        # Files read & written by every step, relative to the dataset base, and the code it depends on, relative to the preprocessing dir.
+        # A step is skipped if its manifest matches all of them, see pipeline_runner.stage_cache. Steps modifying their inputs in place are never skipped.
+        video_file, audio_file = self.name + '.mp4', self.name + '.wav'
+        tracker = 'DECA' if self.opt.use_DECA else 'FLAME' if self.opt.use_FLAME else 'BASEL' if self.opt.use_BASEL else None
+
+        self.cached_steps = {
+            '0': dict(inputs=[audio_file], outputs=[DEEPSPEECH_FEATURES], params={'target_fps': self.target_fps}, code=['deepspeech_features.py', 'deepspeech_store.py']),
+            '1': dict(inputs=[video_file], outputs=[FRAME_STORE_DIR], params={}, code=['frame_store.py']),
+            '2': dict(
+                inputs=[FRAME_STORE_DIR], outputs=[DETECTED_LANDMARKS],
+                params={'detection_stride': self.opt.landmark_detection_stride}, code=['landmark_detection.py', 'landmark_store.py'],
+            ),
+            '3': dict(
+                inputs=[FRAME_STORE_DIR, DETECTED_LANDMARKS],
+                outputs=['track_params.pt', DECA_STORE_DIR, 'expr_masks', PROJECTED_LANDMARKS],
+                params={'tracker': tracker},
+                code=['face_tracking', 'deca_store.py', os.path.join('third', 'DECA', 'decalib'), os.path.join('third', 'DECA', 'data', 'deca_model.tar')],
+            ),
+            '4': dict(inputs=[DEEPSPEECH_FEATURES, DECA_STORE_DIR], outputs=['audio_expr', 'mapping.npy'], params={}, code=[os.path.join('third', 'Audio2ExpressionNet')]),
+            '5': dict(
+                inputs=[FRAME_STORE_DIR], outputs=['matting'], params={},
+                code=[os.path.join('third', 'RobustVideoMatting'), os.path.join('third', 'RobustVideoMatting', 'checkpoints', 'rvm_mobilenetv3.pth')],
+            ),
+            '6': dict(inputs=[FRAME_STORE_DIR, DETECTED_LANDMARKS, 'track_params.pt'], outputs=['meshes'], params={}, code=['facemesh_generator.py', 'face_tracking']),
+            '7': dict(
+                inputs=[FRAME_STORE_DIR, DETECTED_LANDMARKS, 'track_params.pt', DEEPSPEECH_FEATURES, 'audio_expr', DECA_STORE_DIR],
+                outputs=['transforms_train.json', 'transforms_val.json', 'transforms_test.json', 'near-far.json'],
+                params={'train_split': self.train_split, 'val_split': self.val_split},
+                code=[os.path.join('face_tracking', 'geo_transform.py')],
+            ),
+            '8': dict(inputs=[audio_file], outputs=['transcript.txt'], params={}, code=['speech_to_text.py']),
+            '9': dict(inputs=[FRAME_STORE_DIR], outputs=[BODY_POSES], params={}, code=['get_mediapipe.py', 'body_pose_store.py']),
+            '10': dict(inputs=[FRAME_STORE_DIR], outputs=['emotions'], params={}, code=['emoca_tracker.py']),
+            '11': dict(
+                inputs=['matting', PROJECTED_LANDMARKS, BODY_POSES], outputs=['edges', 'cropped'], params={}, code=['edge_creation', 'body_pose_store.py'],
+            ),
+            '13': dict(
+                inputs=['matting'], outputs=[OPTICAL_FLOW, os.path.join('debug', 'opticalflow')],
+                params={'method': self.opt.optical_flow_method, 'scale': self.opt.optical_flow_scale}, code=['get_optical_flow.py', 'flow_store.py'],
+            ),
+        }
+
+    def image_writer(self, name):
+        """ Writer of the images of a step, which are written once the step leaves the writer's context """
+        return ImageWriter(name, num_threads=self.opt.image_writer_threads, skip_debug=self.opt.skip_debug_images)
+
     def get_valid_frames(self):
 
-        max_frame_num = len(os.listdir(self.framesdir))
+        frames = open_frame_store(self.dataset_base)
+        max_frame_num = len(frames)
 
-        valid_img_ids = []
-        for i in range(max_frame_num):
-            if os.path.isfile(os.path.join(self.landmarkdir, '%05d.lms' % i)):
-                valid_img_ids.append(i)
+        valid_img_ids = LandmarkStore(self.landmarkpath).valid_ids(0, max_frame_num)
 
         valid_img_num = len(valid_img_ids)
-        tmp_img = cv2.imread(os.path.join(self.framesdir, '%05d.jpg' % valid_img_ids[0]))
-        # tmp_img = cv2.imread(os.path.join(self.framesdir, str(valid_img_ids[0]) + '.png'))
-
-        h, w = tmp_img.shape[0], tmp_img.shape[1]
+        h, w = frames.height, frames.width
 
         self.max_frame_num, self.valid_img_ids, self.valid_img_num, self.h, self.w = \
             max_frame_num, valid_img_ids, valid_img_num, h, w
@@ -108,25 +164,11 @@ class Preprocessor:
 
         print(f'\n\n--- Step 0: Extracting DeepSpeech features ---\n\n')
 
-        os.makedirs(self.audiofeature_dir, exist_ok=True)
-
-        if len(os.listdir(self.audiofeature_dir)) != 0:
-            print('Already done.\n\n')
-
-            return
-
-        extract_ds(self.dataset_base, self.name, self.type, self.target_fps)
+        extract_ds(self.dataset_base, self.name, self.type, target_fps=self.target_fps)
 
     def extract_images(self):
         print(f'\n\n--- Step 1: Extracting images from video ---\n\n')
 
-        os.makedirs(self.framesdir, exist_ok=True)
-
-        if len(os.listdir(self.framesdir)) != 0:
-            print('Already done.\n\n')
-
-            return
-        
         def image_resize(image, width = None, height = None, inter = cv2.INTER_AREA):
             # initialize the dimensions of the image to be resized and
             # grab the image size
@@ -160,46 +202,38 @@ class Preprocessor:
 
         vid_file = os.path.join(self.dataset_base, self.name + '.mp4')
 
+        # The video is decoded once into the frame store, from which all later steps read, see frame_store.py
         cap = cv2.VideoCapture(vid_file)
-        frame_num = 0
-        while (True):
-            _, frame = cap.read()
-            if frame is None:
-                break
-            # resize frame to be have max dimention = 720
-            (h, w) = frame.shape[:2]
-            if w > h:
-                frame = image_resize(frame, width=720)
-            else:
-                frame = image_resize(frame, height=720)
-                
-            cv2.imwrite(os.path.join(self.framesdir, '%05d.jpg' % frame_num), frame)
-            frame_num = frame_num + 1
+        with FrameStoreWriter(self.frame_store_dir) as writer:
+            while (True):
+                _, frame = cap.read()
+                if frame is None:
+                    break
+                # resize frame to be have max dimention = 720
+                (h, w) = frame.shape[:2]
+                if w > h:
+                    frame = image_resize(frame, width=720)
+                else:
+                    frame = image_resize(frame, height=720)
+
+                writer.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         cap.release()
 
+        print(f'Extracted {writer.num_frames} frames')
+
     def landmark_detection(self):
-        import face_alignment
+        from landmark_detection import detect_landmarks
 
         print('\n\n--- Step 2: Detect Landmarks ---\n\n')
 
-        os.makedirs(self.landmarkdir, exist_ok=True)
+        # Frames without face are NaN
+        landmarks = detect_landmarks(self.frame_store_dir,
+                                     batch_size=self.opt.landmark_batch_size,
+                                     detection_stride=self.opt.landmark_detection_stride,
+                                     num_workers=self.opt.landmark_workers)
+        save_landmarks(self.landmarkpath, landmarks)
 
-        if len(os.listdir(self.landmarkdir)) != 0:
-            print('Already done.\n\n')
-            return
-
-        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False)
-        for image_path in tqdm(os.listdir(self.framesdir)):
-            if image_path.endswith('.jpg') or image_path.endswith('.png'):
-                input = io.imread(os.path.join(self.framesdir, image_path))[:, :, :3]
-                preds = fa.get_landmarks(input)
-                try:
-                    if len(preds) > 0:
-                        lands = preds[0].reshape(-1, 2)[:, :2]
-                        np.savetxt(os.path.join(self.landmarkdir, image_path[:-3] + 'lms'), lands, '%f')
-
-                except TypeError:
-                    pass
+        print(f'Detected landmarks in {len(LandmarkStore(self.landmarkpath).valid_ids())} of {len(landmarks)} frames')
 
     def head_pose_estimation(self):
         from face_tracking.face_tracker import track_face_FLAME, track_face
@@ -211,26 +245,24 @@ class Preprocessor:
         os.makedirs(self.debug_dir, exist_ok=True)
         os.makedirs(self.expr_masks_dir, exist_ok=True)
 
-        if os.path.isfile(self.trackparamspath):
-            print('Already done.\n\n')
-            return  
-
         if self.opt.use_DECA:
-            os.makedirs(self.decaexpr_dir, exist_ok=True)
-
             print('Using DECA tracking..\n')
-            track_face_DECA(self.dataset_base, self.h, self.w,
-                            self.max_frame_num,
-                            self.trackparamspath,
-                            self.decaexpr_dir,
-                            self.expr_masks_dir)
+            with self.image_writer('step 3') as image_writer:
+                track_face_DECA(self.dataset_base, self.h, self.w,
+                                self.max_frame_num,
+                                self.trackparamspath,
+                                self.decastore_dir,
+                                self.expr_masks_dir,
+                                deca_batch_size=self.opt.deca_batch_size,
+                                deca_workers=self.opt.deca_workers,
+                                image_writer=image_writer)
 
         elif self.opt.use_FLAME:
             print('Using FLAME tracking..\n')
             track_face_FLAME(self.dataset_base, self.h, self.w,
                              self.max_frame_num,
                              self.trackparamspath,
-                             self.decaexpr_dir,
+                             self.decastore_dir,
                              self.expr_masks_dir)
 
         elif self.opt.use_BASEL:
@@ -249,11 +281,6 @@ class Preprocessor:
 
         os.makedirs(self.audioexpr_dir, exist_ok=True)
 
-        if len(os.listdir(self.audioexpr_dir)) != 0:
-            print('Already done.\n\n')
-
-            return
-
         get_audioexpr(self.name, self.dataset_base, self.audioexpr_dir)
 
     def face_matting(self):
@@ -264,30 +291,28 @@ class Preprocessor:
 
         os.makedirs(self.mattdir, exist_ok=True)
 
-        if len(os.listdir(self.mattdir)) != 0:
-            print('Already done.\n\n')
-            return
-
         matting_path = './third/RobustVideoMatting/'
 
         checkpoint_path = matting_path + 'checkpoints/'
         # vid_file = os.path.join(self.dataset_base, self.name + '.mp4')
 
         # if not os.path.isfile(vid_file):
-        vid_file = self.framesdir
+        vid_file = open_frame_store(self.dataset_base)
 
         model = MattingNetwork('mobilenetv3').eval().cuda()  # or "resnet50"
         model.load_state_dict(torch.load(checkpoint_path + 'rvm_mobilenetv3.pth'))
 
-        convert_video(
-            model,  # The model, can be on any device (cpu or cuda).
-            input_source=vid_file,  # A video file or an image sequence directory.
-            output_type='png_sequence',  # Choose "video" or "png_sequence"
-            output_composition=self.mattdir,  # File path if video; directory path if png sequence.
-            output_video_mbps=4,  # Output video mbps. Not needed for png sequence.
-            downsample_ratio=None,  # A hyperparameter to adjust or use None for auto.
-            seq_chunk=12,  # Process n frames at once for better parallelism.
-        )
+        with self.image_writer('step 5') as image_writer:
+            convert_video(
+                model,  # The model, can be on any device (cpu or cuda).
+                input_source=vid_file,  # A video file, an image sequence directory or a sequence of frames.
+                output_type='png_sequence',  # Choose "video" or "png_sequence"
+                output_composition=self.mattdir,  # File path if video; directory path if png sequence.
+                output_video_mbps=4,  # Output video mbps. Not needed for png sequence.
+                downsample_ratio=None,  # A hyperparameter to adjust or use None for auto.
+                seq_chunk=12,  # Process n frames at once for better parallelism.
+                image_writer=image_writer,  # Writes the png sequence in the background.
+            )
 
     def extract_meshes(self):
         from facemesh_generator import GeometryGenerator
@@ -297,10 +322,6 @@ class Preprocessor:
 
         os.makedirs(self.mesh_dir, exist_ok=True)
 
-        if len(os.listdir(self.mesh_dir)) != 0:
-            print('Already done.\n\n')
-            return
-
         generator = GeometryGenerator(self.dataset_base,
                                       self.h, self.w,
                                       self.max_frame_num,
@@ -317,6 +338,12 @@ class Preprocessor:
         self.get_valid_frames()
 
         params_dict = torch.load(self.trackparamspath)
+        landmarks = LandmarkStore(self.landmarkpath)
+        audio_features = load_deepspeech_features(self.audiofeature_path) if os.path.isfile(self.audiofeature_path) else []
+        try:
+            deca_expressions = DecaStore(self.decastore_dir).expressions
+        except FileNotFoundError:
+            deca_expressions = []
         w, h, valid_img_ids = self.w, self.h, self.valid_img_ids
         focal_len = params_dict['focal']
         euler_angle = params_dict['euler']
@@ -357,15 +384,12 @@ class Preprocessor:
                 frame_dict['aud_id'] = int(valid_img_ids[i])
 
                 # add audio-expression
-                try:
+                if int(valid_img_ids[i]) < len(audio_features):
                     # add audio_feature
-                    frame_dict['audio_feature'] = np.load(os.path.join(self.audiofeature_dir,
-                                                                       '%05d.deepspeech.npy' % int(valid_img_ids[i]))
-                                                          ).tolist()
+                    frame_dict['audio_feature'] = audio_features[int(valid_img_ids[i])].tolist()
 
-                except FileNotFoundError:
-                    print('Missing: %05d.deepspeech.npy' % int(valid_img_ids[i]))
-                    pass
+                else:
+                    print('Missing: audio feature %05d' % int(valid_img_ids[i]))
 
                 # add audio-expression
                 try:
@@ -377,13 +401,10 @@ class Preprocessor:
                     pass
 
                 # add deca-expression
-                try:
-                    frame_dict['deca_expr'] = np.load(os.path.join(self.decaexpr_dir,
-                                                                    '%05d.npy' % i)
-                                                       ).tolist()
-                except FileNotFoundError:
-                    print(f'Missing: %05d.npy' % i)
-                    pass
+                if i < len(deca_expressions):
+                    frame_dict['deca_expr'] = deca_expressions[i][np.newaxis].tolist()
+                else:
+                    print('Missing: deca expression %05d' % i)
 
                 # add mesh path
                 try:
@@ -410,7 +431,7 @@ class Preprocessor:
                 dir_pose[:3, 3] = trans[i]
                 frame_dict['direct_transform'] = dir_pose.numpy().tolist()
 
-                lms = np.loadtxt(os.path.join(self.landmarkdir, '%05d.lms' % valid_img_ids[i]))
+                lms = landmarks[valid_img_ids[i]]
                 min_x, max_x = np.min(lms, 0)[0], np.max(lms, 0)[0]
 
                 cx = int((min_x + max_x) / 2.0)
@@ -448,10 +469,6 @@ class Preprocessor:
         from preprocessing.speech_to_text import speech_to_text
         print('\n\n--- Step 8: Speech to text ---\n\n')
 
-        if os.path.isfile(self.textpath):
-            print('Already done.\n\n')
-            return
-
         speech_to_text(self.name, self.dataset_base, self.textpath)
 
     def body_tracking(self):
@@ -460,13 +477,9 @@ class Preprocessor:
 
         print('\n\n--- Step 9: Body tracking ---\n\n')
 
-        os.makedirs(self.body_dir, exist_ok=True)
-
-        if len(os.listdir(self.body_dir)) != 0:
-            print('Already done.\n\n')
-            return
-
-        extract_mediapipe(self.dataset_base, self.body_dir)
+        extract_mediapipe(self.dataset_base, self.bodyposepath,
+                          num_workers=self.opt.body_tracking_workers,
+                          enable_segmentation=self.opt.body_segmentation)
 
     def emotion_detection(self):
         from emoca_tracker import emotion_detection
@@ -476,13 +489,14 @@ class Preprocessor:
 
         os.makedirs(self.emotion_dir, exist_ok=True)
 
-        if len(os.listdir(self.emotion_dir)) != 0:
-            print('Already done.\n\n')
-            return
-
         print('Using EMOCA emotion tracking..\n')
-        emotion_detection(self.dataset_base, 
-                          self.emotion_dir)
+        # EMOCA only reads image files
+        with tempfile.TemporaryDirectory() as frames_dir:
+            open_frame_store(self.dataset_base).export_images(frames_dir)
+
+            emotion_detection(self.dataset_base,
+                              self.emotion_dir,
+                              frames_dir)
 
         return
 
@@ -495,29 +509,28 @@ class Preprocessor:
         os.makedirs(self.edges_dir, exist_ok=True)
         os.makedirs(self.cropped_dir, exist_ok=True)
 
-        if len(os.listdir(self.edges_dir)) != 0:
-            print('Already done.\n\n')
-            return
-
         ## Switch here for body edges or tracked body pose edges 
         tracked = True
 
-        if not tracked:
-            print('Making body edges using extracted edges..')
-            make_edges(self.mattdir,
-                    self.projectedlankmarkdir,
-                    self.edges_dir,
-                    self.cropped_dir)
+        with self.image_writer('step 11') as image_writer:
+            if not tracked:
+                print('Making body edges using extracted edges..')
+                make_edges(self.mattdir,
+                        self.projectedlandmarkpath,
+                        self.edges_dir,
+                        self.cropped_dir,
+                        writer=image_writer)
 
-        else:
-            # TODO: REMOVE split_val 
-            print('Making body edges using tracked body poses..')
-            make_edges_body(self.mattdir,
-                            self.projectedlankmarkdir,
-                            self.edges_dir,
-                            self.cropped_dir,
-                            self.body_dir,
-                            split_val=0.1)
+            else:
+                # TODO: REMOVE split_val 
+                print('Making body edges using tracked body poses..')
+                make_edges_body(self.mattdir,
+                                self.projectedlandmarkpath,
+                                self.edges_dir,
+                                self.cropped_dir,
+                                self.bodyposepath,
+                                split_val=0.1,
+                                writer=image_writer)
 
         return
     
@@ -536,35 +549,61 @@ class Preprocessor:
         return self
     
     def optical_flow(self):
-        from get_optical_flow import compute_optical_flow
+        from get_optical_flow import compute_optical_flow, compute_optical_flow_slow
 
         print('\n\n--- Step 13: Optical Flow ---\n\n')
         self.get_valid_frames()
 
-        os.makedirs(self.opticalflow_dir, exist_ok=True)
         os.makedirs(self.debug_opticalflow_dir, exist_ok=True)
 
-        if len(os.listdir(self.opticalflow_dir)) != 0:
-            print('Already done.\n\n')
-            return
-
         frames = [os.path.join(self.mattdir, f) for f in sorted(os.listdir(self.mattdir))]
 
-        compute_optical_flow(frames, self.opticalflow_dir, self.debug_opticalflow_dir)
+        if self.opt.optical_flow_method == 'tvl1':
+            compute_optical_flow_slow(frames, self.opticalflowpath, scale=self.opt.optical_flow_scale, num_workers=self.opt.optical_flow_workers)
+
+        else:
+            with self.image_writer('step 13') as image_writer:
+                compute_optical_flow(frames, self.opticalflowpath, self.debug_opticalflow_dir,
+                                     scale=self.opt.optical_flow_scale,
+                                     batch_size=self.opt.optical_flow_batch_size,
+                                     image_writer=image_writer)
         
         return
 
+    def run_step(self):
+        if self.step not in self.cached_steps:
+            self.mapp[self.step]()
+            return
+
+        cached_step = self.cached_steps[self.step]
+        stage = 'step_%s_%s' % (self.step, self.mapp[self.step].__name__)
+        version = code_version(PREPROCESSING_DIR, cached_step['code'], extra=inspect.getsource(self.mapp[self.step]))
+
+        # Concurrent jobs for the same avatar share its dataset dir, hence only one of them may run the step, after which the others skip it
+        with self.stage_cache.lock(stage):
+            done, reason = self.stage_cache.check(stage, cached_step['inputs'], cached_step['outputs'], cached_step['params'], version)
+            if done:
+                print(f'\n\n--- Step {self.step}: Already done ---\n\n')
+                return
+
+            print(f'Running step {self.step}: {reason}')
+            self.stage_cache.clear_outputs(cached_step['inputs'], cached_step['outputs'])
+
+            self.mapp[self.step]()
+
+            self.stage_cache.record(stage, cached_step['inputs'], cached_step['outputs'], cached_step['params'], version)
+
     def preprocess_video(self):
 
         print('Preprocessing video: ', self.name)
 
-        self.mapp[self.step]()
+        self.run_step()
 
     def preprocess_audio(self):
 
         print('Preprocessing audio: ', self.name)
 
-        self.mapp[self.step]()
+        self.run_step()
 
     def __call__(self):
         if self.type == 'audio':
@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+import shutil
+import sys
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from array_store import ArrayWriter, numbered_file_ids, save_array_atomic
+from body_pose_store import NUM_BODY_LANDMARKS, load_body_poses, pack_body_pose_dir
+from flow_store import FLO_MAGIC, load_optical_flow, pack_flo_dir
+from landmark_store import LandmarkStore, pack_landmark_dir
+
+TEST_DATA_DIR = '/tmp/test-array-store'
+
+
+class TestArrayStore(TestCase):
+
+    def setUp(self):
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+        os.makedirs(TEST_DATA_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+    def test_save_array_atomic(self):
+        path = os.path.join(TEST_DATA_DIR, 'store', 'array.npy')
+
+        save_array_atomic(path, np.zeros(3))
+        save_array_atomic(path, np.arange(4))
+
+        np.testing.assert_array_equal(np.load(path), np.arange(4))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['array.npy'])
+
+    def test_array_writer(self):
+        path = os.path.join(TEST_DATA_DIR, 'array.npy')
+
+        with ArrayWriter(path, (5, 2), np.float32) as writer:
+            writer.write(0, np.zeros((2, 2)))
+            with self.assertRaises(ValueError):
+                writer.write(3, np.ones((2, 2)))
+
+            writer.write(writer.written, np.ones((3, 2)))
+
+        np.testing.assert_array_equal(np.load(path), np.array([[0, 0]] * 2 + [[1, 1]] * 3, dtype=np.float32))
+        self.assertEqual(os.listdir(TEST_DATA_DIR), ['array.npy'])
+
+    def test_array_writer_keeps_previous_array(self):
+        path = os.path.join(TEST_DATA_DIR, 'array.npy')
+        save_array_atomic(path, np.arange(3))
+
+        # An incomplete array is discarded on close
+        writer = ArrayWriter(path, (5, 2), np.float32)
+        writer.write(0, np.zeros((2, 2)))
+        with self.assertRaises(ValueError):
+            writer.close()
+
+        # As is the array of a failed write
+        with self.assertRaises(RuntimeError):
+            with ArrayWriter(path, (5, 2), np.float32) as writer:
+                writer.write(0, np.zeros((5, 2)))
+                raise RuntimeError('Failed')
+
+        np.testing.assert_array_equal(np.load(path), np.arange(3))
+        self.assertEqual(os.listdir(TEST_DATA_DIR), ['array.npy'])
+
+    def test_numbered_file_ids(self):
+        for name in ('00002.lms', '00000.lms', 'mean.lms', '00001.npy'):
+            open(os.path.join(TEST_DATA_DIR, name), 'w').close()
+
+        self.assertEqual(numbered_file_ids(TEST_DATA_DIR, '.lms', consecutive=False), [0, 2])
+        self.assertEqual(numbered_file_ids(TEST_DATA_DIR, '.npy', consecutive=False), [1])
+        self.assertEqual(numbered_file_ids(TEST_DATA_DIR, '.png'), [])
+        with self.assertRaises(ValueError):
+            numbered_file_ids(TEST_DATA_DIR, '.lms')
+
+    def test_pack_landmark_dir(self):
+        lms_dir = os.path.join(TEST_DATA_DIR, 'landmarks')
+        os.makedirs(lms_dir)
+
+        # Frame 1 has no landmarks
+        landmarks = np.random.default_rng(0).uniform(0, 512, (3, 68, 2)).astype(np.float32)
+        for idx in (0, 2):
+            np.savetxt(os.path.join(lms_dir, '%05d.lms' % idx), landmarks[idx])
+
+        path = os.path.join(TEST_DATA_DIR, 'landmarks.npy')
+        self.assertEqual(pack_landmark_dir(lms_dir, path), 2)
+
+        store = LandmarkStore(path)
+        self.assertEqual(store.valid_ids(), [0, 2])
+        np.testing.assert_allclose(store.read([0, 2]), landmarks[[0, 2]], rtol=1e-6)
+
+    def test_pack_body_pose_dir(self):
+        pose_dir = os.path.join(TEST_DATA_DIR, 'body_pose')
+        os.makedirs(pose_dir)
+
+        poses = np.random.default_rng(0).standard_normal((3, NUM_BODY_LANDMARKS, 4)).astype(np.float32)
+        for idx, pose in enumerate(poses):
+            np.save(os.path.join(pose_dir, '%05d.npy' % idx), pose)
+
+        path = os.path.join(TEST_DATA_DIR, 'body_pose.npy')
+        self.assertEqual(pack_body_pose_dir(pose_dir, path), 3)
+        np.testing.assert_array_equal(load_body_poses(path), poses)
+
+    def test_pack_flo_dir(self):
+        flo_dir = os.path.join(TEST_DATA_DIR, 'opticalflow')
+        os.makedirs(flo_dir)
+
+        flows = np.random.default_rng(0).uniform(-8, 8, (2, 3, 4, 2)).astype(np.float32)
+        for idx, flow in enumerate(flows):
+            with open(os.path.join(flo_dir, '%05d.flo' % idx), 'wb') as f:
+                np.array([FLO_MAGIC], dtype=np.float32).tofile(f)
+                np.array([4, 3], dtype=np.int32).tofile(f)
+                flow.tofile(f)
+
+        path = os.path.join(TEST_DATA_DIR, 'opticalflow.npy')
+        self.assertEqual(pack_flo_dir(flo_dir, path), 2)
+
+        # Stored as float16, precise to 1/128 pixel below 8 pixels
+        np.testing.assert_allclose(load_optical_flow(path), flows, atol=1 / 128)
+
+
+if __name__ == '__main__':
+    unittest.main()
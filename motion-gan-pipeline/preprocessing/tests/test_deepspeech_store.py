@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+import shutil
+import sys
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+PREPROCESSING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PREPROCESSING_DIR)
+sys.path.append(os.path.join(PREPROCESSING_DIR, 'third', 'Audio2ExpressionNet'))
+
+from deepspeech_store import DEEPSPEECH_FEATURES, load_deepspeech_features, pack_feature_dir
+from data.audio_dataset import deepspeech_sequence
+
+TEST_DATA_DIR = '/tmp/test-deepspeech-store'
+NUM_FRAMES = 7
+
+
+def per_file_sequence(feature_dir, index, seq_len, look_ahead, max_idx):
+    """ The sequence as assembled by the datasets from the per-frame %05d.deepspeech.npy files, before the feature store """
+    def load(idx):
+        # np.resize to 16 x 29 x 1, then ToTensor to 1 x 16 x 29
+        return np.resize(np.load(os.path.join(feature_dir, '%05d.deepspeech.npy' % idx)), (16, 29, 1)).astype(np.float32).transpose(2, 0, 1)
+
+    dsf = load(index)
+    if look_ahead:
+        r = seq_len // 2
+        for i in range(1, r):
+            dsf = np.concatenate([load(max(index - i, 0)), dsf])
+
+        for i in range(1, seq_len - r + 1):
+            dsf = np.concatenate([dsf, load(min(index + i, max_idx))])
+
+    else:
+        for i in range(1, seq_len):
+            dsf = np.concatenate([load(max(index - i, 0)), dsf])
+
+    return dsf
+
+
+class TestDeepSpeechStore(TestCase):
+
+    def setUp(self):
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+        self.feature_dir = os.path.join(TEST_DATA_DIR, 'audio_feature')
+        os.makedirs(self.feature_dir)
+
+        rng = np.random.default_rng(0)
+        for idx in range(NUM_FRAMES):
+            np.save(os.path.join(self.feature_dir, '%05d.deepspeech.npy' % idx), rng.standard_normal((16, 29)).astype(np.float32))
+
+        self.path = os.path.join(TEST_DATA_DIR, DEEPSPEECH_FEATURES)
+        self.assertEqual(pack_feature_dir(self.feature_dir, self.path), NUM_FRAMES)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+    def test_pack_feature_dir(self):
+        features = load_deepspeech_features(self.path)
+
+        self.assertEqual(features.shape, (NUM_FRAMES, 16, 29))
+        for idx in range(NUM_FRAMES):
+            np.testing.assert_array_equal(features[idx], np.load(os.path.join(self.feature_dir, '%05d.deepspeech.npy' % idx)))
+
+    def test_sequence_matches_per_file_layout(self):
+        features = load_deepspeech_features(self.path)
+
+        # The datasets clamp to the last frame shared with the expressions, which may end before the audio
+        for max_idx in (NUM_FRAMES - 1, NUM_FRAMES - 3):
+            for seq_len in (1, 2, 5, 8):
+                for look_ahead in (False, True):
+                    for index in range(max_idx + 1):
+                        expected = per_file_sequence(self.feature_dir, index, seq_len, look_ahead, max_idx)
+                        actual = deepspeech_sequence(features, index, seq_len, look_ahead, max_idx).numpy()
+
+                        np.testing.assert_array_equal(actual, expected, err_msg='seq_len %d, look_ahead %s, index %d' % (seq_len, look_ahead, index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: MIT
+# © 2020-2022 ETH Zurich and other contributors, see AUTHORS.txt for details
+
+import os
+import sys
+import unittest
+from unittest import TestCase
+
+import torch
+
+PREPROCESSING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PREPROCESSING_DIR)
+sys.path.append(os.path.dirname(PREPROCESSING_DIR))
+
+from face_tracking.face_tracker_deca import fit_rigid_pose
+from face_tracking.util import cal_lan_loss, forward_rott, proj_pts
+
+FOCALS = (700, 800, 900)
+TRUE_FOCAL = 800
+NUM_FRAMES = 6
+NUM_LANDMARKS = 68
+
+
+def sequential_focal_search(landmarks, lms, cxy):
+    """ The focal search of the tracker before fit_rigid_pose: every candidate fitted on its own for a fixed 4500 iterations.
+    Returns the final loss and the fitted euler angles of every candidate
+    """
+    losses, euler_angles = [], []
+    for focal in FOCALS:
+        euler_angle = landmarks.new_zeros((len(landmarks), 3), requires_grad=True)
+        trans = landmarks.new_zeros((len(landmarks), 3))
+        trans[:, 2] -= 1
+        trans.requires_grad = True
+        focal_length = landmarks.new_tensor([focal])
+
+        optimizer = torch.optim.Adam([euler_angle, trans], lr=.1)
+        for iter in range(4500):
+            proj_geo = proj_pts(forward_rott(landmarks, euler_angle, trans), focal_length, cxy)
+            loss_lan = cal_lan_loss(proj_geo[:, :, :2], lms)
+            optimizer.zero_grad()
+            loss_lan.backward()
+            optimizer.step()
+
+            if iter == 3500:
+                for param_group in optimizer.param_groups:
+                    param_group['lr'] *= 0.2
+
+        losses.append(loss_lan.item())
+        euler_angles.append(euler_angle.detach())
+
+    return torch.tensor(losses, dtype=torch.double), torch.stack(euler_angles)
+
+
+class TestFitRigidPose(TestCase):
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+
+        def uniform(shape, low, high):
+            return low + (high - low) * torch.rand(shape, generator=generator, dtype=torch.double)
+
+        # A face sized point cloud, observed by a camera of TRUE_FOCAL in a few poses, with a pixel of detection noise
+        self.landmarks = torch.cat([uniform((NUM_FRAMES, NUM_LANDMARKS, 2), -0.08, 0.08), uniform((NUM_FRAMES, NUM_LANDMARKS, 1), -0.05, 0.05)], dim=2)
+        self.landmarks[1:] = self.landmarks[0]
+
+        euler_angle = uniform((NUM_FRAMES, 3), -15, 15)
+        trans = torch.cat([uniform((NUM_FRAMES, 2), -0.03, 0.03), uniform((NUM_FRAMES, 1), -1.1, -0.9)], dim=1)
+
+        self.cxy = torch.tensor([256., 256.], dtype=torch.double)
+        proj_geo = proj_pts(forward_rott(self.landmarks, euler_angle, trans), self.landmarks.new_tensor([TRUE_FOCAL]), self.cxy)
+        self.lms = proj_geo[:, :, :2] + uniform((NUM_FRAMES, NUM_LANDMARKS, 2), -1, 1)
+
+    def test_matches_sequential_focal_search(self):
+        expected_losses, expected_euler_angles = sequential_focal_search(self.landmarks, self.lms, self.cxy)
+
+        # As called by track_face_DECA
+        euler_angle = self.landmarks.new_zeros((len(FOCALS), NUM_FRAMES, 3))
+        trans = self.landmarks.new_zeros((len(FOCALS), NUM_FRAMES, 3))
+        trans[:, :, 2] -= 1
+        losses = fit_rigid_pose(self.landmarks, self.lms, euler_angle, trans, torch.tensor(FOCALS, dtype=torch.double), self.cxy,
+                                lr=.1, num_iters=4500, lr_steps=[(3500, 0.2)])
+
+        self.assertEqual(FOCALS[int(torch.argmin(losses))], FOCALS[int(torch.argmin(expected_losses))])
+        self.assertEqual(FOCALS[int(torch.argmin(losses))], TRUE_FOCAL)
+
+        # The early steps stop within the tolerance of the fixed schedule
+        torch.testing.assert_close(losses, expected_losses, rtol=1e-3, atol=1e-4)
+        torch.testing.assert_close(euler_angle, expected_euler_angles, rtol=0, atol=1e-2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,5 @@
 import os.path
 import random
-import torchvision.transforms as transforms
 import torch
 import numpy as np
 from .base_dataset import BaseDataset
@@ -39,6 +38,25 @@ def make_ids(paths, root_dir):
         ids.append(i)
     return ids
 
+def load_audio_features(dataroot):
+    """ Memory-maps the (N, 16, 29) DeepSpeech features of the sequence, see preprocessing/deepspeech_store.py """
+    return np.load(os.path.join(dataroot, 'audio_feature.npy'), mmap_mode='r')
+
+def load_expressions(dataroot):
+    """ Memory-maps the (N, 53) DECA expressions of the tracked frames, see preprocessing/deca_store.py """
+    return np.load(os.path.join(dataroot, 'deca_codes', 'expr.npy'), mmap_mode='r')
+
+def deepspeech_sequence(features, index, seq_len, look_ahead, max_idx):
+    """ Returns the seq_len x 16 x 29 features ending at frame index, or centered on it with look_ahead. Frames are clamped to [0, max_idx] """
+    if look_ahead: # use prev and following frame infos
+        r = seq_len//2
+        ids = np.arange(index - max(r - 1, 0), index + seq_len - r + 1) # note the ordering [old ... current ... future]
+    else:
+        ids = np.arange(index - seq_len + 1, index + 1) # note the ordering [old ... current]
+
+    ids = np.clip(ids, 0, max_idx)
+    return torch.from_numpy(np.asarray(features[ids], dtype=np.float32))
+
 class AudioDataset(BaseDataset):
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -47,11 +65,9 @@ class AudioDataset(BaseDataset):
     def initialize(self, opt):
         self.opt = opt
         self.root = opt.dataroot
-        self.audiofeat_path = os.path.join(opt.dataroot, 'audio_feature')
-
-        self.audiofeat_list = sorted(os.listdir(self.audiofeat_path))
+        self.audio_features = load_audio_features(opt.dataroot)
 
-        print('\taudio_feat_path:', self.audiofeat_path)
+        print('\taudio_features:', os.path.join(opt.dataroot, 'audio_feature.npy'))
 
         opt.nObjects = 1
         opt.nTrainObjects = 116 # TODO
@@ -73,55 +89,10 @@ class AudioDataset(BaseDataset):
     def getAudioFeatureFilename(self, idx):
         return self.frame_paths[idx % len(self.frame_paths)]
 
-    def load_npy(self, index):
-
-        file_path = os.path.join(self.audiofeat_path, "%05d.deepspeech.npy" % index)
-
-        feature_array = np.load(file_path)
-
-        return feature_array
-
     def __getitem__(self, index):
 
-        # load deepspeech feature
-        feature_array = self.load_npy(index)
-        dsf_np = np.resize(feature_array,  (16,29,1))
-        dsf = transforms.ToTensor()(dsf_np.astype(np.float32))
-
-        # load sequence data if necessary
-        if self.opt.look_ahead:# use prev and following frame infos
-            r = self.opt.seq_len//2
-            for i in range(1,r): # prev frames
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-
-                feature_array = self.load_npy(index_seq)
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
-            
-            for i in range(1,self.opt.seq_len - r + 1): # following frames
-                index_seq = index + i
-                max_idx = len(self.audiofeat_list)-1
-                if index_seq > max_idx: index_seq = max_idx
-
-                feature_array = self.load_npy(index_seq)
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf, dsf_seq], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current ... future]
-        else:
-            for i in range(1, self.opt.seq_len):
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-
-                feature_array = self.load_npy(index_seq)
-
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
+        # load deepspeech feature sequence
+        dsf = deepspeech_sequence(self.audio_features, index, self.opt.seq_len, self.opt.look_ahead, len(self.audio_features) - 1)
 
 
         #################################
@@ -144,7 +115,7 @@ class AudioDataset(BaseDataset):
                 'weight': np.array([weight]).astype(np.float32)}
 
     def __len__(self):
-        return len(self.audiofeat_list)
+        return len(self.audio_features)
 
     def name(self):
         return 'AudioDataset'
@@ -1,13 +1,12 @@
 import os.path
 import random
-import torchvision.transforms as transforms
 import torch
 import numpy as np
 from data.base_dataset import BaseDataset
 from data.audio import Audio
+from data.audio_dataset import deepspeech_sequence, load_audio_features
 #from data.image_folder import make_dataset
 from PIL import Image
-import progressbar
 
 #def make_dataset(dir):
 #    images = []
@@ -19,36 +18,6 @@ import progressbar
 #                images.append(path)
 #    return sorted(images)
 
-def make_dataset(dir):
-    images = []
-    ids = []
-    assert os.path.isdir(dir), '%s is not a valid directory' % dir
-    for root, _, fnames in sorted(os.walk(dir)):
-        for fname in fnames:
-            if any(fname.endswith(extension) for extension in ['.npy', '.NPY']):
-                #.deepspeech.npy
-                id_str = fname[:-15] #4]
-                i = int(id_str)
-                ids.append(i)
-    ids = sorted(ids)
-
-    for id in ids:
-        fname=str(id)+'.deepspeech.npy'
-        path = os.path.join(root, fname)
-        images.append(path)
-    return images
-
-def make_ids(paths, root_dir):
-    ids = []
-    
-    for fname in paths:
-        l = fname.rfind('/')
-        id_str = fname[l+1:-15]#4]
-        i = int(id_str)
-        #print(fname, ': ', i)
-        ids.append(i)
-    return ids
-
 def make_dataset_ids_png(dir):
     images = []
     ids = []
@@ -184,7 +153,8 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
         ################################################
 
         # prepare dataloader paths / data
-        self.audio_feature_dir = []
+        self.audio_feature_path = []
+        self.audio_features = []
         self.image_dir = []
         self.uvs_dir = []
         self.audio_ids = []
@@ -200,16 +170,17 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
             self.sequence_names = self.train_sequence_names
             for i in range(0,len(self.train_sequence_names)):
                 dataroot          = os.path.join(opt.dataroot, self.train_sequence_names[i])
-                audio_feature_dir = os.path.join(opt.dataroot, self.train_sequence_names[i], 'audio_feature')
+                audio_feature_path = os.path.join(opt.dataroot, self.train_sequence_names[i], 'audio_feature.npy')
                 image_dir         = os.path.join(opt.dataroot, self.train_sequence_names[i], 'images')
                 uvs_dir           = os.path.join(opt.dataroot, self.train_sequence_names[i], 'uvs')
                 print('load train sequence:', self.train_sequence_names[i])
                 print('\tidentity_dir:', dataroot)
-                print('\taudio_feature_dir:', audio_feature_dir)
+                print('\taudio_features:', audio_feature_path)
                 print('\timage_dir:', image_dir)
                 print('\tuvs_dir:', uvs_dir)
 
-                audio_ids = make_ids(make_dataset(audio_feature_dir), dataroot)
+                audio_features = load_audio_features(os.path.dirname(audio_feature_path))
+                audio_ids = list(range(len(audio_features)))
                 image_ids = make_dataset_ids_png(image_dir) # [-1] * len(audio_ids) #make_ids(make_dataset(image_dir), dataroot)
                 intrinsics = load_intrinsics(dataroot)
                 extrinsics = load_rigids(dataroot)
@@ -218,7 +189,8 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
 
                 min_len = min(len(audio_ids), len(image_ids), len(extrinsics), len(expressions))
 
-                self.audio_feature_dir.append(audio_feature_dir)
+                self.audio_feature_path.append(audio_feature_path)
+                self.audio_features.append(audio_features)
                 self.image_dir.append(image_dir)
                 self.uvs_dir.append(uvs_dir)
                 self.audio_ids.append(audio_ids[:min_len])
@@ -234,15 +206,16 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
             for i in range(0,len(self.val_sequence_names)):
                 target_id = self.val_sequence_targets[i]
                 dataroot          = os.path.join(opt.dataroot, self.train_sequence_names[target_id])
-                audio_feature_dir = os.path.join(opt.dataroot, self.val_sequence_names[i][0], 'audio_feature')
+                audio_feature_path = os.path.join(opt.dataroot, self.val_sequence_names[i][0], 'audio_feature.npy')
                 image_dir         = os.path.join(opt.dataroot, self.train_sequence_names[target_id], 'images')
                 uvs_dir           = os.path.join(opt.dataroot, self.train_sequence_names[target_id], 'uvs')
                 print('load val sequence:', self.val_sequence_names[i])
                 print('\tidentity_dir:', dataroot)
-                print('\taudio_feature_dir:', audio_feature_dir)
+                print('\taudio_features:', audio_feature_path)
                 print('\timage_dir:', image_dir)
                 print('\tuvs_dir:', uvs_dir)
-                audio_ids = make_ids(make_dataset(audio_feature_dir), os.path.join(opt.dataroot, self.val_sequence_names[i][0]))
+                audio_features = load_audio_features(os.path.dirname(audio_feature_path))
+                audio_ids = list(range(len(audio_features)))
                 image_ids = make_dataset_ids_png(image_dir) # [-1] * len(audio_ids) #make_ids(make_dataset(image_dir), dataroot)
                 intrinsics = load_intrinsics(dataroot)
                 extrinsics = load_rigids(dataroot)
@@ -251,7 +224,8 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
 
                 min_len = min(len(audio_ids), len(image_ids), len(extrinsics), len(expressions))
 
-                self.audio_feature_dir.append(audio_feature_dir)
+                self.audio_feature_path.append(audio_feature_path)
+                self.audio_features.append(audio_features)
                 self.image_dir.append(image_dir)
                 self.uvs_dir.append(uvs_dir)
                 self.audio_ids.append(audio_ids[:min_len])
@@ -267,15 +241,16 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
             for i in range(0,len(self.test_sequence_names)):
                 target_id = self.test_sequence_targets[i]
                 dataroot          = os.path.join(opt.dataroot, self.train_sequence_names[target_id])
-                audio_feature_dir = os.path.join(opt.dataroot, self.test_sequence_names[i][0], 'audio_feature')
+                audio_feature_path = os.path.join(opt.dataroot, self.test_sequence_names[i][0], 'audio_feature.npy')
                 image_dir         = os.path.join(opt.dataroot, self.train_sequence_names[target_id], 'images')
                 uvs_dir           = os.path.join(opt.dataroot, self.train_sequence_names[target_id], 'uvs')
                 print('load test sequence:', self.test_sequence_names[i])
                 print('\tidentity_dir:', dataroot)
-                print('\taudio_feature_dir:', audio_feature_dir)
+                print('\taudio_features:', audio_feature_path)
                 print('\timage_dir:', image_dir)
                 print('\tuvs_dir:', uvs_dir)
-                audio_ids = make_ids(make_dataset(audio_feature_dir), os.path.join(opt.dataroot, self.test_sequence_names[i][0]))
+                audio_features = load_audio_features(os.path.dirname(audio_feature_path))
+                audio_ids = list(range(len(audio_features)))
                 image_ids = make_dataset_ids_png(image_dir) # [-1] * len(audio_ids) #make_ids(make_dataset(image_dir), dataroot)
                 intrinsics = load_intrinsics(dataroot)
                 extrinsics = load_rigids(dataroot)
@@ -284,7 +259,8 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
 
                 min_len = min(len(audio_ids), len(image_ids), len(extrinsics), len(expressions))
 
-                self.audio_feature_dir.append(audio_feature_dir)
+                self.audio_feature_path.append(audio_feature_path)
+                self.audio_features.append(audio_features)
                 self.image_dir.append(image_dir)
                 self.uvs_dir.append(uvs_dir)
                 self.audio_ids.append(audio_ids[:min_len])
@@ -319,22 +295,12 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
         # mapping global to internal
         self.mapping_global2internal = []
         self.mapping_global2internal_offset = []
-        self.dsf = []
         offset = 0
-        with progressbar.ProgressBar(max_value=self.n_frames_total) as bar:          
-            for i in range(0,len(self.audio_ids)):
-                l = len(self.audio_ids[i])
-                dsf_seq = []
-                for k in range(0,l):
-                    self.mapping_global2internal.append(i)
-                    self.mapping_global2internal_offset.append(offset)
-                    dsf_fname = os.path.join(self.audio_feature_dir[i], str(self.audio_ids[i][k]) + '.deepspeech.npy')
-                    feature_array = np.load(dsf_fname)
-                    dsf_np = np.resize(feature_array,  (16,29,1))
-                    dsf_seq.append(dsf_np.astype(np.float32))
-                    bar.update(offset + k)
-                self.dsf.append(dsf_seq)
-                offset += l
+        for i in range(0,len(self.audio_ids)):
+            l = len(self.audio_ids[i])
+            self.mapping_global2internal += [i] * l
+            self.mapping_global2internal_offset += [offset] * l
+            offset += l
 
 
     def getSampleWeights(self):
@@ -372,42 +338,12 @@ class MultiFaceAudioEQTmpCachedDataset(BaseDataset):
         identity = torch.tensor(self.identities[internal_sequence_id][image_id])
         target_id = self.target_id[internal_sequence_id] # sequence id refers to the target sequence (of the training corpus)
 
-        # load deepspeech feature
-        #print('audio_id', audio_id)
-        dsf_fname = os.path.join(self.audio_feature_dir[internal_sequence_id], str(audio_id) + '.deepspeech.npy')
-            
-        dsf_np = self.dsf[internal_sequence_id][index]
-        dsf = transforms.ToTensor()(dsf_np)
-
-        # load sequence data if necessary
-        if self.opt.look_ahead:# use prev and following frame infos
-            r = self.opt.seq_len//2
-            for i in range(1,r): # prev frames
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-                dsf_np = self.dsf[internal_sequence_id][index_seq]
-                dsf_seq = transforms.ToTensor()(dsf_np) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
-
-            for i in range(1,self.opt.seq_len - r + 1): # following frames
-                index_seq = index + i
-                max_idx = len(self.audio_ids[internal_sequence_id])-1
-                if index_seq > max_idx: index_seq = max_idx
-                dsf_np = self.dsf[internal_sequence_id][index_seq]
-                dsf_seq = transforms.ToTensor()(dsf_np) # 1 x 16 x 29
-                dsf = torch.cat([dsf, dsf_seq], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current ... future]
-        else:
-            for i in range(1,self.opt.seq_len):
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-                dsf_np = self.dsf[internal_sequence_id][index_seq]
-                dsf_seq = transforms.ToTensor()(dsf_np) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
-
-        #weight = 1.0 / len(self.audio_feature_dir[internal_sequence_id])
+        # load deepspeech feature sequence, the features are memory-mapped from the store of the sequence
+        dsf_fname = self.audio_feature_path[internal_sequence_id]
+        max_idx = len(self.audio_ids[internal_sequence_id])-1
+        dsf = deepspeech_sequence(self.audio_features[internal_sequence_id], index, self.opt.seq_len, self.opt.look_ahead, max_idx)
+
+        #weight = 1.0 / len(self.audio_ids[internal_sequence_id])
         weight = self.weights[global_index]
 
         return {'paths': dsf_fname, #img_path,
@@ -1,13 +1,12 @@
 import sys
 import os
 import random
-import torchvision.transforms as transforms
 import argparse
 
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-from data.audio_dataset import AudioDataset
+from data.audio_dataset import AudioDataset, deepspeech_sequence, load_audio_features, load_expressions
 from data.base_dataset import BaseDataset
 
 from models import create_model
@@ -16,6 +15,9 @@ import numpy as np
 import copy
 from tqdm import tqdm
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from pipeline_runner.model_registry import load_cached
+
 class FaceDataset(BaseDataset):
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -26,13 +28,13 @@ class FaceDataset(BaseDataset):
 
         # directories
         self.dataroot = opt.dataroot
-        self.expr_path = os.path.join(opt.dataroot, 'deca_expr')
-        self.audio_feature_path = os.path.join(opt.dataroot, 'audio_feature')
+        self.expressions = load_expressions(opt.dataroot)
+        self.audio_features = load_audio_features(opt.dataroot)
 
         # debug print
         print('load sequence:', self.dataroot)
 
-        self.n_frames_total = len(os.listdir(self.expr_path)) - 1
+        self.n_frames_total = len(self.expressions) - 1
 
         opt.nTrainObjects = 1
         opt.nValObjects = 1
@@ -50,7 +52,7 @@ class FaceDataset(BaseDataset):
         return os.path.join(self.dataroot, 'audio.wav')
 
     def getAudioFeatureFilename(self, idx):
-        return os.path.join(self.audio_feature_path, str(idx) + '.deepspeech.npy')
+        return os.path.join(self.dataroot, 'audio_feature.npy')
 
 
     def __getitem__(self, global_index):
@@ -58,52 +60,13 @@ class FaceDataset(BaseDataset):
         index = global_index
 
         # expressions
-        expressions = np.load(os.path.join(self.expr_path, '%05d.npy' % index))
-        expressions = torch.from_numpy(expressions)[0]
+        expressions = torch.from_numpy(np.array(self.expressions[index]))
 
         # identity
         identity = torch.zeros(100) # not used
 
-        # load deepspeech feature
-        feature_array = np.load(os.path.join(self.audio_feature_path, '%05d.deepspeech.npy' % index))
-        dsf_np = np.resize(feature_array,  (16,29,1))
-        dsf = transforms.ToTensor()(dsf_np.astype(np.float32))
-
-
-        # load sequence data if necessary
-        if self.opt.look_ahead:# use prev and following frame infos
-            r = self.opt.seq_len//2
-            for i in range(1,r): # prev frames
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-
-                feature_array = np.load(os.path.join(self.audio_feature_path, '%05d.deepspeech.npy' % index_seq))
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
-            
-            for i in range(1,self.opt.seq_len - r + 1): # following frames
-                index_seq = index + i
-                max_idx = self.n_frames_total-1
-                if index_seq > max_idx: index_seq = max_idx
-
-                feature_array = np.load(os.path.join(self.audio_feature_path, '%05d.deepspeech.npy' % index_seq))
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf, dsf_seq], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current ... future]
-        else:
-            last_valid_idx = audio_id
-            for i in range(1,self.opt.seq_len):
-                index_seq = index - i
-                if index_seq < 0: index_seq = 0
-
-                feature_array = np.load(os.path.join(self.audio_feature_path, '%05d.deepspeech.npy' % index_seq))
-                dsf_np = np.resize(feature_array,  (16,29,1))
-                dsf_seq = transforms.ToTensor()(dsf_np.astype(np.float32)) # 1 x 16 x 29
-                dsf = torch.cat([dsf_seq, dsf], 0)  # seq_len x 16 x 29
-                # note the ordering [old ... current]
+        # load deepspeech feature sequence
+        dsf = deepspeech_sequence(self.audio_features, index, self.opt.seq_len, self.opt.look_ahead, self.n_frames_total - 1)
 
 
         #################################
@@ -272,8 +235,8 @@ def get_audioexpr(name, dataset_base, out_dir, mapping_path=None):
     opt.display_id = -1  # no visdom display
     opt.source_actor = dataset_base
 
-    # load model
-    model = load_model(opt)
+    # load model, which is shared by all avatars
+    model = load_cached(avatar=None, name='Audio2ExpressionNet', checkpoint_path=os.path.join(opt.checkpoints_dir, opt.name), loader=lambda: load_model(opt))
 
     # Make mapping
     if mapping_path is None:
@@ -63,9 +63,13 @@ def video2sequence_lossless(video_path):
     return imagepath_list
 
 class TestData(Dataset):
-    def __init__(self, testpath, iscrop=True, crop_size=224, scale=1.25, face_detector='mtcnn'):
+    def __init__(self, testpath, iscrop=True, crop_size=224, scale=1.25, face_detector='mtcnn', frames=None, landmarks=None, detector_device='cuda'):
         '''
             testpath: folder, imagepath_list, image path, video path
+            frames: optional sequence of RGB uint8 images aligned with the imagepath_list, read instead of the image files, e.g. a frame store
+            landmarks: optional sequence of 68 x 2 landmarks aligned with the imagepath_list, the face is cropped around them instead of running
+                the face detector. Images without landmarks (None or NaN) are detected
+            detector_device: device of the face detector, which is only loaded once an image needs it. Use cpu within DataLoader workers
         '''
         # print('testpath: ', testpath)
         if isinstance(testpath, list):
@@ -80,18 +84,27 @@ class TestData(Dataset):
             print(f'please check the test path: {testpath}')
             exit()
         print('total {} images'.format(len(self.imagepath_list)))
-        self.imagepath_list = sorted(self.imagepath_list)
+        self.frames = frames
+        self.landmarks = landmarks
+        if frames is None and landmarks is None:
+            self.imagepath_list = sorted(self.imagepath_list)
         self.crop_size = crop_size
         self.scale = scale
         self.iscrop = iscrop
         self.resolution_inp = crop_size
-        if face_detector == 'fan':
-            self.face_detector = detectors.FAN()
-        # elif face_detector == 'mtcnn':
-        #     self.face_detector = detectors.MTCNN()
-        else:
+        if face_detector not in ['fan']:
             print(f'please check the detector: {face_detector}')
             exit()
+        self.detector_device = detector_device
+        self._face_detector = None
+
+    @property
+    def face_detector(self):
+        if self._face_detector is None:
+            self._face_detector = detectors.FAN(device=self.detector_device)
+        # elif face_detector == 'mtcnn':
+        #     self._face_detector = detectors.MTCNN()
+        return self._face_detector
 
     def __len__(self):
         return len(self.imagepath_list)
@@ -113,7 +126,7 @@ class TestData(Dataset):
         imagepath = self.imagepath_list[index]
         imagename = imagepath.split('/')[-1].split('.')[0]
 
-        image = np.array(imread(imagepath))
+        image = np.array(imread(imagepath) if self.frames is None else self.frames[index])
         if len(image.shape) == 2:
             image = image[:,:,None].repeat(1,1,3)
         if len(image.shape) == 3 and image.shape[2] > 3:
@@ -124,7 +137,12 @@ class TestData(Dataset):
             # provide kpt as txt file, or mat file (for AFLW2000)
             kpt_matpath = imagepath.replace('.jpg', '.mat').replace('.png', '.mat')
             kpt_txtpath = imagepath.replace('.jpg', '.txt').replace('.png', '.txt')
-            if os.path.exists(kpt_matpath):
+            kpt = None if self.landmarks is None else self.landmarks[index]
+            if kpt is not None and not np.isnan(kpt).any():
+                left = np.min(kpt[:,0]); right = np.max(kpt[:,0]); 
+                top = np.min(kpt[:,1]); bottom = np.max(kpt[:,1])
+                old_size, center = self.bbox2point(left, right, top, bottom, type='kpt68')
+            elif os.path.exists(kpt_matpath):
                 kpt = scipy.io.loadmat(kpt_matpath)['pt3d_68'].T        
                 left = np.min(kpt[:,0]); right = np.max(kpt[:,0]); 
                 top = np.min(kpt[:,1]); bottom = np.max(kpt[:,1])
@@ -17,9 +17,9 @@ import numpy as np
 import torch
 
 class FAN(object):
-    def __init__(self):
+    def __init__(self, device='cuda'):
         import face_alignment
-        self.model = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False)
+        self.model = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, flip_input=False, device=device)
 
     def run(self, image):
         '''
@@ -22,7 +22,7 @@ from tqdm.auto import tqdm
 from .inference_utils import *
 
 def convert_video(model,
-                  input_source: str,
+                  input_source,
                   input_resize: Optional[Tuple[int, int]] = None,
                   downsample_ratio: Optional[float] = None,
                   output_type: str = 'video',
@@ -34,11 +34,13 @@ def convert_video(model,
                   num_workers: int = 0,
                   progress: bool = True,
                   device: Optional[str] = None,
-                  dtype: Optional[torch.dtype] = None):
+                  dtype: Optional[torch.dtype] = None,
+                  image_writer=None):
     
     """
     Args:
         input_source:A video file, or an image sequence directory. Images must be sorted in accending order, support png and jpg.
+            Alternatively an indexable sequence of RGB uint8 frames, e.g. a frame store.
         input_resize: If provided, the input are first resized to (w, h).
         downsample_ratio: The model's downsample_ratio hyperparameter. If not provided, model automatically set one.
         output_type: Options: ["video", "png_sequence"].
@@ -53,6 +55,7 @@ def convert_video(model,
         progress: Show progress bar.
         device: Only need to manually provide if model is a TorchScript freezed model.
         dtype: Only need to manually provide if model is a TorchScript freezed model.
+        image_writer: Writes the png sequences on its pool of threads if provided, see pipeline_runner.image_writer. Only used if output_type == 'png_sequence'.
     """
     
     assert downsample_ratio is None or (downsample_ratio > 0 and downsample_ratio <= 1), 'Downsample ratio must be between 0 (exclusive) and 1 (inclusive).'
@@ -71,7 +74,9 @@ def convert_video(model,
         transform = transforms.ToTensor()
 
     # Initialize reader
-    if os.path.isfile(input_source):
+    if not isinstance(input_source, str):
+        source = FrameSequenceReader(input_source, transform)
+    elif os.path.isfile(input_source):
         source = VideoReader(input_source, transform)
     else:
         source = ImageSequenceReader(input_source, transform)
@@ -98,11 +103,11 @@ def convert_video(model,
                 bit_rate=int(output_video_mbps * 1000000))
     else:
         if output_composition is not None:
-            writer_com = ImageSequenceWriter(output_composition, 'png')
+            writer_com = ImageSequenceWriter(output_composition, 'png', image_writer)
         if output_alpha is not None:
-            writer_pha = ImageSequenceWriter(output_alpha, 'png')
+            writer_pha = ImageSequenceWriter(output_alpha, 'png', image_writer)
         if output_foreground is not None:
-            writer_fgr = ImageSequenceWriter(output_foreground, 'png')
+            writer_fgr = ImageSequenceWriter(output_foreground, 'png', image_writer)
 
     # Inference
     model = model.eval()
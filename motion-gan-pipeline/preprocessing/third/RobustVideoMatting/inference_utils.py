@@ -69,18 +69,43 @@ class ImageSequenceReader(Dataset):
         return img
 
 
+class FrameSequenceReader(Dataset):
+    """ Reads RGB uint8 frames from an indexable sequence, e.g. a frame store """
+    def __init__(self, frames, transform=None):
+        self.frames = frames
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, idx):
+        img = Image.fromarray(np.asarray(self.frames[idx]))
+        if self.transform is not None:
+            return self.transform(img)
+        return img
+
+
+def save_frame(frame, path):
+    to_pil_image(frame).save(path)
+
+
 class ImageSequenceWriter:
-    def __init__(self, path, extension='jpg'):
+    def __init__(self, path, extension='jpg', image_writer=None):
         self.path = path
         self.extension = extension
         self.counter = 0
+        self.image_writer = image_writer
         os.makedirs(path, exist_ok=True)
     
     def write(self, frames):
         # frames: [T, C, H, W]
+        frames = frames.cpu()
         for t in range(frames.shape[0]):
-            to_pil_image(frames[t]).save(os.path.join(
-                self.path, '%05d' % self.counter + '.' + self.extension))
+            path = os.path.join(self.path, '%05d' % self.counter + '.' + self.extension)
+            if self.image_writer is not None:
+                self.image_writer.submit(save_frame, frames[t], path)
+            else:
+                save_frame(frames[t], path)
             self.counter += 1
             
     def close(self):